@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+
+"""date-taken range queries and per-day photo counts
+
+datetaken is stored as ISO text ('YYYY-MM-DD HH:MM:SS'), which sorts
+chronologically, so a date prefix like '2019-07' is turned into a half-open
+range on an index over photo(datetaken) rather than a LIKE.
+
+photodaycount keeps the number of photos per day (YYYYMMDD) and privacy level,
+maintained by triggers on photo, so year/month/day totals and the archive
+calendars come from a few hundred rows instead of an aggregate over photo.
+"""
+
+import datetime, logging, re
+from peewee import *
+
+from db import *
+
+# set up logging
+logger = logging.getLogger('cigarbox')
+
+# day key for a datetaken expression, e.g. 2019-07-04 12:00:00 -> 20190704
+DAY_KEY_SQL = "CAST(strftime('%Y%m%d', {col}) AS INTEGER)"
+# whether a datetaken expression has a day key; NULL and non-ISO text such as '01/02/2020' don't
+DAY_VALID_SQL = "strftime('%Y%m%d', {col}) IS NOT NULL"
+
+# datetaken formats accepted from forms, stored as the first
+DATETAKEN_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+DATE_PREFIX = re.compile(r'^(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?$')
+
+
+def install_day_counts(database=None):
+  """Create the datetaken index, photodaycount table and triggers, backfilling on first install (idempotent)"""
+  database = database or Photo._meta.database
+  # Counts are only trustworthy if the triggers were already maintaining them
+  installed = database.execute_sql(
+    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'photodaycount_photo_insert'").fetchone()
+  database.execute_sql('CREATE INDEX IF NOT EXISTS idx_photo_datetaken ON photo(datetaken)')
+  PhotoDayCount.create_table(safe=True)
+
+  new_day = DAY_KEY_SQL.format(col='new.datetaken')
+  old_day = DAY_KEY_SQL.format(col='old.datetaken')
+  # Photos whose datetaken has no day key aren't counted (day is NOT NULL)
+  add = (f"INSERT INTO photodaycount (day, privacy, count) "
+         f"SELECT {new_day}, COALESCE(new.privacy, 0), 1 WHERE {DAY_VALID_SQL.format(col='new.datetaken')} "
+         f"ON CONFLICT(day, privacy) DO UPDATE SET count = count + 1;")
+  remove = (f"UPDATE photodaycount SET count = count - 1 "
+            f"WHERE {DAY_VALID_SQL.format(col='old.datetaken')} AND day = {old_day} AND privacy = COALESCE(old.privacy, 0);")
+  # Triggers are recreated so installs with older trigger bodies pick up the current ones
+  with database.atomic():
+    for name, body in (('insert', f'AFTER INSERT ON photo BEGIN {add} END'),
+                       ('update', f'AFTER UPDATE OF datetaken, privacy ON photo BEGIN {remove} {add} END'),
+                       ('delete', f'AFTER DELETE ON photo BEGIN {remove} END')):
+      database.execute_sql(f'DROP TRIGGER IF EXISTS photodaycount_photo_{name}')
+      database.execute_sql(f'CREATE TRIGGER photodaycount_photo_{name} {body}')
+
+  if not installed:
+    rebuild_day_counts(database)
+
+
+def rebuild_day_counts(database=None):
+  """Recompute photodaycount from photo"""
+  database = database or Photo._meta.database
+  with database.atomic():
+    database.execute_sql('DELETE FROM photodaycount')
+    database.execute_sql(f"""
+      INSERT INTO photodaycount (day, privacy, count)
+      SELECT {DAY_KEY_SQL.format(col='datetaken')}, COALESCE(privacy, 0), COUNT(*)
+      FROM photo WHERE {DAY_VALID_SQL.format(col='datetaken')}
+      GROUP BY 1, 2
+    """)
+
+
+def parse_datetaken(text):
+  """datetime for a datetaken typed as one of DATETAKEN_FORMATS, else None"""
+  text = (text or '').strip()
+  for fmt in DATETAKEN_FORMATS:
+    try:
+      return datetime.datetime.strptime(text, fmt)
+    except ValueError:
+      continue
+  return None
+
+
+def prefix_range(prefix):
+  """Half-open [start, end) text range matching every datetaken that starts with prefix (non-empty)
+
+  The datetaken column has NUMERIC affinity, so an all-digit bound such as
+  '2019' would be compared as the number 2019 (which sorts before all text).
+  Such bounds get a trailing '!', which keeps them text and sorts below '-'
+  (a trailing space doesn't work: SQLite still reads '2019 ' as a number).
+  """
+  start, end = prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+  return tuple(bound + '!' if bound.isdigit() else bound for bound in (start, end))
+
+
+def datetaken_startswith(prefix):
+  """Indexable replacement for Photo.datetaken.startswith(prefix)"""
+  if not prefix:
+    # LIKE '%' matched every photo with a datetaken; there is no range to bound
+    return Photo.datetaken.is_null(False)
+  start, end = prefix_range(prefix)
+  # converter=False: DateTimeField would otherwise parse '2019-07-4' into a datetime
+  return ((Photo.datetaken >= Value(start, converter=False)) &
+          (Photo.datetaken < Value(end, converter=False)))
+
+
+def _day_range(prefix):
+  """[start, end) day keys for a YYYY, YYYY-MM or YYYY-MM-DD prefix, else None"""
+  match = DATE_PREFIX.match(prefix)
+  if not match:
+    return None
+  year, month, day = match.groups()
+  if day:
+    start = int(f'{year}{month}{day}')
+    return start, start + 1
+  if month:
+    start = int(f'{year}{month}00')
+    return start, start + 100
+  return int(year) * 10000, (int(year) + 1) * 10000
+
+
+def day_counts(start_day, end_day, visible_levels):
+  """{day key: photo count} for days in [start_day, end_day) the viewer can see"""
+  levels = sorted(set(visible_levels))
+  query = (PhotoDayCount
+           .select(PhotoDayCount.day, fn.SUM(PhotoDayCount.count))
+           .where((PhotoDayCount.day >= start_day) & (PhotoDayCount.day < end_day) &
+                  (PhotoDayCount.privacy.in_(levels)))
+           .group_by(PhotoDayCount.day)
+           .having(fn.SUM(PhotoDayCount.count) > 0)
+           .tuples())
+  return dict(query)
+
+
+def count_for_prefix(prefix, visible_levels):
+  """Photo count for a date prefix from photodaycount, or None if it can't answer"""
+  days = _day_range(prefix)
+  if days is None:
+    return None
+  try:
+    return sum(day_counts(days[0], days[1], visible_levels).values())
+  except OperationalError as e:
+    logger.warning('Day counts unavailable: %s', e)
+    return None
+
+
+def year_counts(visible_levels):
+  """[(year, count)] newest first"""
+  counts = {}
+  for day, count in day_counts(0, 100000000, visible_levels).items():
+    counts[day // 10000] = counts.get(day // 10000, 0) + count
+  return sorted(counts.items(), reverse=True)
+
+
+def month_counts(year, visible_levels):
+  """({month: count}, {day key: count}) for a year, from one query"""
+  days = day_counts(year * 10000, (year + 1) * 10000, visible_levels)
+  months = {}
+  for day, count in days.items():
+    month = day // 100 % 100
+    months[month] = months.get(month, 0) + count
+  return months, days
+
+
+def day_key(date):
+  """YYYYMMDD int for a date"""
+  return date.year * 10000 + date.month * 100 + date.day
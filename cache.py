@@ -0,0 +1,410 @@
+#! /usr/bin/env python
+
+"""shared caches invalidated by the global content generation
+
+Every write to photo, tag, phototag, photoset or photophotoset bumps a single
+generation counter in photos.db (via triggers, so the API and CLI tools are
+covered too). Cached values are stored in a separate SQLite file
+(CACHE_DATABASE) so all gunicorn workers share them without taking write locks
+on the main database, and an entry is only valid for the generation it was
+computed under.
+
+Two caches live here: pagination counts (cached_count) and whole rendered
+pages for anonymous visitors (cached_page). The generation also makes up the
+weak ETags that let browsers revalidate gallery pages (conditional_page).
+"""
+
+import collections, glob, hashlib, logging, os, threading, time
+from functools import wraps
+from flask import g, has_app_context, request, session, make_response
+from flask_security import current_user
+from peewee import *
+
+from app import app
+from db import Photo
+
+# set up logging
+logger = logging.getLogger('cigarbox')
+
+# Tables whose writes change what any listing shows
+GENERATION_TABLES = ['photo', 'tag', 'phototag', 'photoset', 'photophotoset']
+
+cache_db = SqliteDatabase(app.config.get('CACHE_DATABASE', 'cache.db'),
+                          pragmas={'journal_mode': 'wal', 'synchronous': 0})
+
+class CacheModel(Model):
+  class Meta:
+    database = cache_db
+
+class CountCache(CacheModel):
+  key          = CharField(primary_key=True)  # query signature + visible levels
+  generation   = IntegerField()
+  count        = IntegerField(null=True)  # NULL while a worker is computing it
+  started_at   = FloatField()
+
+class PageCache(CacheModel):
+  key          = CharField(primary_key=True)  # endpoint + URL + visible levels
+  generation   = IntegerField(index=True)
+  body         = BlobField(null=True)  # NULL while a worker is rendering it
+  content_type = CharField(null=True)
+  started_at   = FloatField()
+
+class PageCacheStat(CacheModel):
+  name         = CharField(primary_key=True)  # hit, wait, miss, bypass
+  count        = IntegerField(default=0)
+
+# Session keys that make an anonymous page differ from the shared copy
+PAGE_CACHE_SESSION_KEYS = ('_flashes', 'pow_required', 'share_link')
+
+_cache_tables_ready = False
+
+# page cache counts not yet added to pagecachestat, and when the oldest was counted
+_page_stats = collections.Counter()
+_page_stats_since = None
+_page_stats_lock = threading.Lock()
+
+
+def install_generation_triggers(database=None):
+  """Create the contentgeneration table and the triggers that bump it (idempotent)"""
+  database = database or Photo._meta.database
+  database.execute_sql("""
+    CREATE TABLE IF NOT EXISTS contentgeneration (
+      id INTEGER PRIMARY KEY,
+      generation INTEGER NOT NULL DEFAULT 0
+    )
+  """)
+  database.execute_sql('INSERT OR IGNORE INTO contentgeneration (id, generation) VALUES (1, 0)')
+  for table in GENERATION_TABLES:
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+      database.execute_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS bump_generation_{table}_{event.lower()}
+        AFTER {event} ON {table}
+        BEGIN
+          UPDATE contentgeneration SET generation = generation + 1 WHERE id = 1;
+        END
+      """)
+
+
+def current_generation():
+  """Return the global content generation, or None if the triggers aren't installed
+
+  Memoized on flask.g so a request reads it at most once.
+  """
+  if has_app_context() and 'content_generation' in g:
+    return g.content_generation
+  try:
+    row = Photo._meta.database.execute_sql(
+      'SELECT generation FROM contentgeneration WHERE id = 1').fetchone()
+    generation = row[0] if row else None
+  except OperationalError:
+    generation = None
+  if has_app_context():
+    g.content_generation = generation
+  return generation
+
+
+def _ensure_cache_tables():
+  global _cache_tables_ready
+  if not _cache_tables_ready:
+    for model in (CountCache, PageCache, PageCacheStat):
+      model.create_table(safe=True)
+    _cache_tables_ready = True
+
+
+def query_signature(query, visible_levels=None):
+  """Normalized cache key for a query: ordering is dropped since it can't change a count"""
+  sql, params = query.order_by().sql()
+  levels = ','.join(str(level) for level in sorted(visible_levels)) if visible_levels is not None else '*'
+  return hashlib.sha1(f'{sql}|{params!r}|{levels}'.encode('utf-8')).hexdigest()
+
+
+def _approximate_count(query, floor=0):
+  """Count at most max(COUNT_CACHE_APPROX_THRESHOLD, floor) rows
+
+  Returns (count, exact). When the result is capped the count is a lower bound.
+  """
+  cap = max(app.config.get('COUNT_CACHE_APPROX_THRESHOLD', 1000), floor)
+  count = query.order_by().limit(cap + 1).count()
+  if count > cap:
+    return cap, False
+  return count, True
+
+
+def cached_count(query, visible_levels=None, floor=0):
+  """Return (count, exact) for a query, shared across workers for the current generation
+
+  On a miss this worker claims the entry and computes the exact count. If another
+  worker already claimed it, a capped count is returned instead so the page can
+  render "1,000+" rather than wait on a second full aggregate.
+
+  Args:
+    query: Peewee SelectQuery (ordering is ignored)
+    visible_levels: privacy levels the viewer can see, part of the cache key
+    floor: the capped count always covers at least this many rows (page * per_page)
+  """
+  if not app.config.get('COUNT_CACHE_ENABLED', True):
+    return query.count(), True
+  generation = current_generation()
+  if generation is None:
+    return query.count(), True
+
+  key = query_signature(query, visible_levels)
+  timeout = app.config.get('COUNT_CACHE_COMPUTE_TIMEOUT', 30)
+  now = time.time()
+  try:
+    _ensure_cache_tables()
+    row = CountCache.get_or_none(CountCache.key == key)
+    if row and row.generation == generation and row.count is not None:
+      return row.count, True
+
+    # Claim the entry unless another worker is already computing this generation
+    cursor = CountCache._meta.database.execute_sql("""
+      INSERT INTO countcache (key, generation, count, started_at) VALUES (?, ?, NULL, ?)
+      ON CONFLICT(key) DO UPDATE SET generation = excluded.generation, count = NULL,
+                                     started_at = excluded.started_at
+      WHERE countcache.generation != excluded.generation
+         OR (countcache.count IS NULL AND countcache.started_at < ?)
+    """, (key, generation, now, now - timeout))
+    claimed = cursor.rowcount > 0
+  except OperationalError as e:
+    logger.warning('Count cache unavailable: %s', e)
+    return query.count(), True
+
+  if not claimed:
+    return _approximate_count(query, floor)
+
+  try:
+    count = query.count()
+  except Exception:
+    CountCache.delete().where((CountCache.key == key) & (CountCache.generation == generation)).execute()
+    raise
+  (CountCache.update(count=count)
+   .where((CountCache.key == key) & (CountCache.generation == generation))
+   .execute())
+  return count, True
+
+
+def _count_page(name, now=None):
+  """Bump a page cache counter
+
+  Counts are kept in the worker and added to the shared counters on a miss
+  (which writes cache.db anyway) or once the oldest pending count is
+  PAGE_CACHE_STATS_FLUSH seconds old, so hits and bypasses don't write.
+  """
+  global _page_stats_since
+  now = now if now is not None else time.time()
+  with _page_stats_lock:
+    _page_stats[name] += 1
+    if _page_stats_since is None:
+      _page_stats_since = now
+    if name != 'miss' and now - _page_stats_since < app.config.get('PAGE_CACHE_STATS_FLUSH', 10):
+      return
+    counts = list(_page_stats.items())
+    _page_stats.clear()
+    _page_stats_since = None
+  try:
+    _ensure_cache_tables()
+    with PageCacheStat._meta.database.atomic():
+      for name, count in counts:
+        PageCacheStat._meta.database.execute_sql("""
+          INSERT INTO pagecachestat (name, count) VALUES (?, ?)
+          ON CONFLICT(name) DO UPDATE SET count = count + excluded.count
+        """, (name, count))
+  except OperationalError as e:
+    logger.warning('Page cache stats unavailable: %s', e)
+
+
+def page_cache_stats():
+  """{counter name: count} for the page cache, shared across workers (plus this worker's pending counts)"""
+  with _page_stats_lock:
+    counts = collections.Counter(_page_stats)
+  try:
+    _ensure_cache_tables()
+    counts.update(dict(PageCacheStat.select(PageCacheStat.name, PageCacheStat.count).tuples()))
+  except OperationalError:
+    pass
+  return dict(counts)
+
+
+def _cacheable():
+  """Only plain anonymous GETs without per-visitor session state share a page"""
+  return (app.config.get('PAGE_CACHE_ENABLED', True)
+          and request.method == 'GET'
+          and not request.query_string
+          and not current_user.is_authenticated
+          and not any(key in session for key in PAGE_CACHE_SESSION_KEYS))
+
+
+def _page_response(row, state):
+  response = make_response(row.body)
+  response.headers['Content-Type'] = row.content_type
+  response.headers['X-Cigarbox-Cache'] = state
+  return response
+
+
+def cached_page(f):
+  """Serve a view's rendered HTML to anonymous visitors from the shared page cache
+
+  Apply inside require_access so PoW challenges are answered (and tokens
+  counted) before the cache is consulted. Entries are keyed by (endpoint, URL,
+  visible levels) and valid for one content generation, at most
+  PAGE_CACHE_TTL seconds. On a miss one worker renders while others wait up to
+  PAGE_CACHE_WAIT seconds for its copy rather than rendering the same page.
+  """
+  from security import get_visible_privacy_levels
+
+  @wraps(f)
+  def decorated_function(*args, **kwargs):
+    if not _cacheable():
+      _count_page('bypass')
+      return f(*args, **kwargs)
+    generation = current_generation()
+    if generation is None:
+      return f(*args, **kwargs)
+
+    levels = ','.join(str(level) for level in sorted(get_visible_privacy_levels(current_user)))
+    key = hashlib.sha1(f'{request.endpoint}|{request.url}|{levels}'.encode('utf-8')).hexdigest()
+    timeout = app.config.get('PAGE_CACHE_WAIT', 2)
+    now = time.time()
+    fresh_after = now - app.config.get('PAGE_CACHE_TTL', 300)
+    try:
+      _ensure_cache_tables()
+      row = PageCache.get_or_none(PageCache.key == key)
+      if row and row.generation == generation and row.body is not None and row.started_at > fresh_after:
+        _count_page('hit')
+        return _page_response(row, 'HIT')
+
+      # Claim the render unless another worker is already on it
+      cursor = PageCache._meta.database.execute_sql("""
+        INSERT INTO pagecache (key, generation, body, content_type, started_at) VALUES (?, ?, NULL, NULL, ?)
+        ON CONFLICT(key) DO UPDATE SET generation = excluded.generation, body = NULL,
+                                       started_at = excluded.started_at
+        WHERE pagecache.generation != excluded.generation
+           OR pagecache.started_at < ?
+           OR (pagecache.body IS NULL AND pagecache.started_at < ?)
+      """, (key, generation, now, fresh_after, now - timeout))
+      claimed = cursor.rowcount > 0
+    except OperationalError as e:
+      logger.warning('Page cache unavailable: %s', e)
+      return f(*args, **kwargs)
+
+    if not claimed:
+      # Single flight: wait for the claiming worker's copy
+      deadline = now + timeout
+      while time.time() < deadline:
+        time.sleep(0.05)
+        row = PageCache.get_or_none((PageCache.key == key) & (PageCache.generation == generation))
+        if row is None:
+          break
+        if row.body is not None:
+          _count_page('wait')
+          return _page_response(row, 'WAIT')
+      _count_page('miss')
+      return f(*args, **kwargs)
+
+    _count_page('miss')
+    try:
+      response = make_response(f(*args, **kwargs))
+    except Exception:
+      PageCache.delete().where((PageCache.key == key) & (PageCache.generation == generation)).execute()
+      raise
+    if response.status_code == 200 and not response.direct_passthrough:
+      (PageCache
+       .update(body=response.get_data(), content_type=response.headers.get('Content-Type'))
+       .where((PageCache.key == key) & (PageCache.generation == generation))
+       .execute())
+      # Pages from earlier generations can never be served again
+      PageCache.delete().where(PageCache.generation < generation).execute()
+    else:
+      PageCache.delete().where((PageCache.key == key) & (PageCache.generation == generation)).execute()
+    response.headers['X-Cigarbox-Cache'] = 'MISS'
+    return response
+
+  return decorated_function
+
+
+_code_version = None
+
+
+def code_version():
+  """Latest mtime of the app's code and templates, so a deploy retires old validators"""
+  global _code_version
+  if _code_version is None:
+    paths = glob.glob(os.path.join(app.root_path, '*.py'))
+    for dirpath, _, filenames in os.walk(os.path.join(app.root_path, 'templates')):
+      paths.extend(os.path.join(dirpath, filename) for filename in filenames)
+    _code_version = '%d' % max([os.path.getmtime(path) for path in paths] or [0])
+  return _code_version
+
+
+def viewer_class():
+  """Everything about the viewer that changes how a page renders"""
+  from security import get_visible_privacy_levels
+
+  levels = ','.join(str(level) for level in sorted(get_visible_privacy_levels(current_user)))
+  if not current_user.is_authenticated:
+    return f'anonymous:{levels}'
+  roles = ','.join(sorted(role.name for role in current_user.roles))
+  return f'user:{current_user.id}:{current_user.email}:{roles}:{levels}'
+
+
+def page_etag(*extra):
+  """Weak ETag for the requested page, or None if it can't be revalidated
+
+  Built from the content generation, the viewer class, the URL and any extra
+  parts the view adds (e.g. the split-brain access mode), so it is known
+  before any listing query runs.
+  """
+  if not app.config.get('CONDITIONAL_GET_ENABLED', True) or request.method != 'GET':
+    return None
+  # Flashes and share links render once; those pages must not be revalidated
+  if any(key in session for key in PAGE_CACHE_SESSION_KEYS):
+    return None
+  generation = current_generation()
+  if generation is None:
+    return None
+  parts = [code_version(), generation, viewer_class(), request.endpoint, request.url] + list(extra)
+  return hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def signed_url_period(now=None):
+  """Index of the S3_SIGNED_URL_EXPIRY window now falls in
+
+  Pages that embed presigned URLs add it to their ETag: a URL signed during
+  a window stays valid until the window ends, so a 304 never hands back one
+  that has expired.
+  """
+  expiry = app.config.get('S3_SIGNED_URL_EXPIRY', 3600)
+  return int((now if now is not None else time.time()) // expiry)
+
+
+def set_validators(response, etag):
+  """Attach etag to a 200 or 304 response; browsers must revalidate, shared caches must not store it"""
+  if etag and response.status_code in (200, 304):
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+  return response
+
+
+def not_modified(etag):
+  """304 response if the request's If-None-Match already has etag, else None"""
+  if etag and request.if_none_match.contains_weak(etag):
+    return set_validators(make_response('', 304), etag)
+  return None
+
+
+def conditional_page(f):
+  """Answer If-None-Match with 304 Not Modified before the view runs any query
+
+  Apply inside require_access, so PoW challenges are still issued (and
+  tokens counted) for revalidations, and outside cached_page.
+  """
+  @wraps(f)
+  def decorated_function(*args, **kwargs):
+    etag = page_etag()
+    response = not_modified(etag)
+    if response is not None:
+      return response
+    return set_validators(make_response(f(*args, **kwargs)), etag)
+
+  return decorated_function
@@ -0,0 +1,36 @@
+#! /usr/bin/env python
+
+"""lean photo rows for gallery and listing pages
+
+Listing views used to hydrate a full Photo model per row (every column, plus
+peewee's per-instance dicts) and then set photo.uri on it from getSha1Path.
+The gallery, photoset, shared and admin templates only read the id, the
+sha1-derived uri, datetaken and privacy, so listings select just those
+columns as tuples and wrap each in a PhotoCard with the uri computed once.
+"""
+
+from db import *
+from util import getSha1Path
+
+# columns a PhotoCard is built from, in constructor order
+CARD_FIELDS = (Photo.id, Photo.sha1, Photo.datetaken, Photo.privacy)
+
+
+class PhotoCard(object):
+  """Stands in for a Photo on listing pages: id, uri, datetaken, privacy
+
+  tag_list is set by web.attach_tag_lists on the admin photo list.
+  """
+  __slots__ = ('id', 'uri', 'datetaken', 'privacy', 'tag_list')
+
+  def __init__(self, photo_id, sha1, datetaken, privacy):
+    self.id = photo_id
+    (sha1Path, filename) = getSha1Path(sha1)
+    self.uri = sha1Path + '/' + filename
+    self.datetaken = datetaken
+    self.privacy = privacy
+
+
+def photo_cards(query):
+  """[PhotoCard] for the rows of a Photo query (its filters, joins, order and page are kept)"""
+  return [PhotoCard(*row) for row in query.select(*CARD_FIELDS).tuples()]
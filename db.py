@@ -2,6 +2,7 @@
 
 import datetime
 from peewee import *
+from playhouse.sqlite_ext import FTS5Model, SearchField, RowIDField
 
 from flask_security import Security, PeeweeUserDatastore, UserMixin, RoleMixin, login_required
 
@@ -50,6 +51,9 @@ class PhotoPhotoset(BaseModel):
   photoset     = ForeignKeyField(Photoset, null=False, on_delete='CASCADE')
   ts           = DateTimeField(default=lambda: datetime.datetime.now())
 
+  class Meta:
+    indexes = ((('photo', 'photoset'), True),)
+
 class PhotosetGallery(BaseModel):
   gallery      = ForeignKeyField(Gallery,null=False)
   photoset     = ForeignKeyField(Photoset,null=False)
@@ -60,6 +64,9 @@ class PhotoTag(BaseModel):
   tag          = ForeignKeyField(Tag, null=False)
   ts           = DateTimeField(default=lambda: datetime.datetime.now())
 
+  class Meta:
+    indexes = ((('photo', 'tag'), True),)
+
 class ImportMeta(BaseModel):
   sha1         = TextField(null=False,unique=True)
   photo        = ForeignKeyField(Photo, backref='import_meta', on_delete='CASCADE')
@@ -82,6 +89,80 @@ class ShareToken(BaseModel):
   expires_at     = DateTimeField(null=True)
   views          = IntegerField(default=0)
 
+class Selection(BaseModel):
+  """Bulk-edit selections - a listing's query spec or a packed id set under a short token"""
+  token          = CharField(unique=True, index=True)
+  spec           = TextField(null=False)  # JSON: tags/photoset/date/privacy and/or packed ids
+  created_by_id  = IntegerField(null=True)  # Foreign key to User.id
+  created_at     = DateTimeField(default=lambda: datetime.datetime.now(), index=True)
+
+class PhotoDayCount(BaseModel):
+  """Photos per day taken and privacy level (maintained by triggers on photo)"""
+  day          = IntegerField()  # YYYYMMDD
+  privacy      = IntegerField()  # NULL privacy counted as 0
+  count        = IntegerField(default=0)
+
+  class Meta:
+    primary_key = CompositeKey('day', 'privacy')
+
+class TagStats(BaseModel):
+  """Photos per tag and privacy level (maintained by triggers, see stats.py)
+
+  tag_id 0 counts photos that carry at least one tag.
+  """
+  tag_id       = IntegerField()
+  privacy      = IntegerField()  # NULL privacy counted as 0
+  count        = IntegerField(default=0)
+
+  class Meta:
+    table_name = 'tag_stats'
+    primary_key = CompositeKey('tag_id', 'privacy')
+
+class TagCooccurrence(BaseModel):
+  """Photos carrying both tags, per privacy level (maintained by triggers, see stats.py)
+
+  Every pair is stored in both directions, so a tag's related tags are the
+  rows with its tag_id.
+  """
+  tag_id       = IntegerField()
+  other_id     = IntegerField()
+  privacy      = IntegerField()  # NULL privacy counted as 0
+  count        = IntegerField(default=0)
+
+  class Meta:
+    table_name = 'tag_cooccurrence'
+    primary_key = CompositeKey('tag_id', 'other_id', 'privacy')
+
+class PhotosetStats(BaseModel):
+  """Photos per photoset and privacy level with their date range and cover (maintained by triggers, see stats.py)"""
+  photoset_id    = IntegerField()
+  privacy        = IntegerField()  # NULL privacy counted as 0
+  count          = IntegerField(default=0)
+  min_datetaken  = DateTimeField(null=True)
+  max_datetaken  = DateTimeField(null=True)
+  cover_id       = IntegerField(null=True)  # first photo by (datetaken, id) at this level
+
+  class Meta:
+    table_name = 'photoset_stats'
+    primary_key = CompositeKey('photoset_id', 'privacy')
+
+class SearchIndex(FTS5Model):
+  """Full-text index over tags, photosets, import paths and users (kept in sync by triggers)
+
+  rowid is the source row id * 8 + a per-kind code so triggers can replace
+  entries by rowid; ref_id is the tag, photoset, photo or user id.
+  """
+  rowid        = RowIDField()
+  kind         = SearchField(unindexed=True)  # 'tag', 'photoset', 'photo' or 'user'
+  ref_id       = SearchField(unindexed=True)
+  name         = SearchField()  # tag name, photoset title, import path, email
+  body         = SearchField()  # photoset description
+
+  class Meta:
+    database = db
+    table_name = 'searchindex'
+    options = {'tokenize': 'unicode61 remove_diacritics 2', 'prefix': '2 3'}
+
 class Role(BaseModel, RoleMixin):
   name         = CharField(unique=True)
   description  = TextField(null=True)
@@ -104,7 +185,7 @@ class User(BaseModel, UserMixin):
   def roles(self):
     """Return actual Role objects (Flask-Security compatibility)
     Override the Peewee backref to return Role objects instead of UserRoles objects"""
-    return [ur.role for ur in UserRoles.select().where(UserRoles.user == self)]
+    return list(Role.select().join(UserRoles).where(UserRoles.user == self).order_by(UserRoles.id))
 
   def has_role(self, role_name):
     """Override to check role by name (Flask-Security compatibility)"""
@@ -120,13 +201,21 @@ class UserRoles(BaseModel):
   description  = property(lambda self: self.role.description)
 
 class PowChallenge(BaseModel):
-  """Proof-of-Work challenges - active puzzles awaiting solution"""
+  """Proof-of-Work challenges - active puzzles awaiting solution
+
+  No longer written: challenges are signed strings and spent ones are kept in
+  a shared Bloom filter (powauth.py). Kept so /pow/cleanup can clear old rows.
+  """
   challenge    = CharField(unique=True, index=True)  # Random hex string
   created_at   = DateTimeField(default=lambda: datetime.datetime.now())
   expires_at   = DateTimeField(index=True)  # Typically 5 minutes from creation
 
 class PowToken(BaseModel):
-  """Proof-of-Work tokens - verified solutions with request/time limits"""
+  """Proof-of-Work tokens - verified solutions with request/time limits
+
+  No longer written: tokens are signed cookies and their budgets live in a
+  shared memory-mapped table (powauth.py). Kept so /pow/cleanup can clear old rows.
+  """
   token            = CharField(unique=True, index=True)  # Random token for cookie
   ip_address       = CharField(null=True)  # Track IP for binding
   created_at       = DateTimeField(default=lambda: datetime.datetime.now())
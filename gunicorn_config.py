@@ -52,6 +52,15 @@ def worker_int(worker):
     """Called just after a worker exited on SIGINT or SIGQUIT."""
     worker.log.info("Worker received INT or QUIT signal")
 
+def worker_exit(server, worker):
+    """Called just after a worker has been exited, in the worker process."""
+    # Write share link views counted since the last flush
+    try:
+        import shareviews
+        shareviews.flush()
+    except Exception as e:
+        worker.log.error("Share view flush on exit failed: %s", e)
+
 def worker_abort(worker):
     """Called when a worker receives the SIGABRT signal."""
     worker.log.info("Worker received SIGABRT signal")
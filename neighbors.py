@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+
+"""ordered photo id arrays for prev/next navigation
+
+Every photo view with an in= context used to run two ORDER BY ... LIMIT 1
+queries (GROUP BY/HAVING ones for multi-tag contexts), and shared photosets
+two more COUNTs for "photo N of M". Instead each worker keeps, per (context,
+visible levels), the context's photo ids in display order as an array('q').
+Previous, next, position and total are then a bisect away.
+
+An array is only served for the content generation it was built under (see
+cache.py); the first view after a write rebuilds it with a single query.
+"""
+
+import array, bisect, collections, threading
+from peewee import fn
+
+from app import app
+from db import *
+import archive
+import cache
+import tagindex
+
+# prev and next are PhotoRef (or None); position is 1-based
+Neighbors = collections.namedtuple('Neighbors', 'prev next position total')
+
+
+class PhotoRef(object):
+  """Stands in for a Photo where only the id is used (navigation links)"""
+  __slots__ = ('id',)
+
+  def __init__(self, photo_id):
+    self.id = photo_id
+
+
+class OrderedIds(object):
+  """A context's photo ids in display order, with position lookup by id"""
+  __slots__ = ('generation', 'order', 'sorted_ids', 'positions')
+
+  def __init__(self, generation, ids):
+    self.generation = generation
+    # Duplicate membership rows would repeat an id; keep its first position
+    self.order = array.array('q', dict.fromkeys(ids))
+    order = self.order
+    if all(order[i] > order[i + 1] for i in range(len(order) - 1)):
+      # Id-descending contexts: the reversed order is already sorted
+      self.sorted_ids = array.array('q', reversed(order))
+      self.positions = None
+    else:
+      pairs = sorted((photo_id, position) for position, photo_id in enumerate(order))
+      self.sorted_ids = array.array('q', (photo_id for photo_id, _ in pairs))
+      self.positions = array.array('q', (position for _, position in pairs))
+
+  def __len__(self):
+    return len(self.order)
+
+  def position(self, photo_id):
+    """0-based position of photo_id in display order, or None if it isn't in the context"""
+    i = bisect.bisect_left(self.sorted_ids, photo_id)
+    if i == len(self.sorted_ids) or self.sorted_ids[i] != photo_id:
+      return None
+    if self.positions is None:
+      return len(self.order) - 1 - i
+    return self.positions[i]
+
+  def neighbors(self, photo_id):
+    """Neighbors of photo_id, or None if it isn't in the context"""
+    position = self.position(photo_id)
+    if position is None:
+      return None
+    prev_photo = PhotoRef(self.order[position - 1]) if position > 0 else None
+    next_photo = PhotoRef(self.order[position + 1]) if position + 1 < len(self.order) else None
+    return Neighbors(prev_photo, next_photo, position + 1, len(self.order))
+
+
+_arrays = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def _visible(query, visible_levels):
+  if visible_levels is None:
+    return query
+  return query.where((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))
+
+
+def _get(context, visible_levels, load_ids):
+  """Cached OrderedIds for (context, visible_levels), rebuilt when the generation moves on
+
+  Returns None when there is no content generation to validate against.
+  """
+  generation = cache.current_generation()
+  if generation is None:
+    return None
+  key = (context, tuple(sorted(set(visible_levels))) if visible_levels is not None else None)
+  with _lock:
+    ordered = _arrays.get(key)
+    if ordered is not None and ordered.generation == generation:
+      _arrays.move_to_end(key)
+      return ordered
+
+  # Read the generation before the ids, so a racing write labels the array stale
+  ordered = OrderedIds(generation, load_ids())
+  with _lock:
+    _arrays[key] = ordered
+    _arrays.move_to_end(key)
+    while len(_arrays) > app.config.get('NEIGHBOR_CACHE_SIZE', 256):
+      _arrays.popitem(last=False)
+  return ordered
+
+
+def photostream(visible_levels):
+  """All visible photos, newest (highest id) first"""
+  def load_ids():
+    query = _visible(Photo.select(Photo.id), visible_levels).order_by(Photo.id.desc())
+    return [photo_id for (photo_id,) in query.tuples()]
+  return _get('photostream', visible_levels, load_ids)
+
+
+def photoset(photoset_id, visible_levels=None):
+  """A photoset's photos by datetaken then id (all of them if visible_levels is None)"""
+  def load_ids():
+    query = _visible(Photo.select(Photo.id).join(PhotoPhotoset)
+                     .where(PhotoPhotoset.photoset == photoset_id), visible_levels)
+    query = query.order_by(Photo.datetaken.asc(), Photo.id.asc())
+    return [photo_id for (photo_id,) in query.tuples()]
+  return _get(('photoset', photoset_id), visible_levels, load_ids)
+
+
+def tags(tags_list, visible_levels):
+  """Photos carrying every tag in tags_list, highest id first"""
+  tags_list = sorted(set(tags_list))
+  def load_ids():
+    index = tagindex.get_index()
+    if index:
+      matches = index.match(tags_list, visible_levels)
+      return matches.page(1, len(matches))
+    query = (_visible(Photo.select(Photo.id).join(PhotoTag).join(Tag)
+                      .where(Tag.name.in_(tags_list)), visible_levels)
+             .group_by(Photo.id)
+             .having(fn.COUNT(fn.DISTINCT(Tag.id)) == len(tags_list))
+             .order_by(Photo.id.desc()))
+    return [photo_id for (photo_id,) in query.tuples()]
+  return _get(('tags', tuple(tags_list)), visible_levels, load_ids)
+
+
+def date(prefix, visible_levels):
+  """Photos taken on a date prefix, newest datetaken (then id) first"""
+  def load_ids():
+    query = (_visible(Photo.select(Photo.id).where(archive.datetaken_startswith(prefix)), visible_levels)
+             .order_by(Photo.datetaken.desc(), Photo.id.desc()))
+    return [photo_id for (photo_id,) in query.tuples()]
+  return _get(('date', prefix), visible_levels, load_ids)
+
+
+def find(ordered, photo_id):
+  """ordered.neighbors(photo_id), or None if there is no array or the photo isn't in it"""
+  if ordered is None:
+    return None
+  return ordered.neighbors(photo_id)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Benchmark the tag bitmap index against the SQL intersection it replaces
+
+Usage:
+    python perf/perf_bitmap_index.py [--levels 0,1,2,3] [--repeat 20]
+
+Runs against the configured DATABASE. For the most-used tags, alone and in
+pairs/triples, it times count, first page, a deep page and prev/next via the
+GROUP BY/HAVING query used by show_taged_photos and via tagindex.
+"""
+import sys
+import os
+import time
+import argparse
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peewee import fn
+from db import db, Photo, PhotoTag, Tag
+import tagindex
+
+PER_PAGE = 50
+
+def time_call(func, repeat):
+    """Best-of-N wall time for func() in milliseconds, plus its result"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def sql_query(tags_list, visible_levels):
+    """The show_taged_photos query"""
+    return (Photo.select()
+            .join(PhotoTag)
+            .join(Tag)
+            .where((Tag.name.in_(tags_list)) &
+                   ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels))))
+            .group_by(Photo.id)
+            .having(fn.COUNT(fn.DISTINCT(Tag.id)) == len(tags_list))
+            .order_by(Photo.id.desc()))
+
+def bench(index, tags_list, visible_levels, repeat):
+    query = sql_query(tags_list, visible_levels)
+    sql_count_ms, count = time_call(query.count, repeat)
+    if not count:
+        return
+    deep_page = max(1, (count // PER_PAGE) // 2 + 1)
+    middle_id = [p.id for p in query.paginate(deep_page, PER_PAGE)][0]
+
+    sql_page_ms, _ = time_call(lambda: [p.id for p in query.paginate(1, PER_PAGE)], repeat)
+    sql_deep_ms, _ = time_call(lambda: [p.id for p in query.paginate(deep_page, PER_PAGE)], repeat)
+    sql_nav_ms, _ = time_call(lambda: (
+        query.where(Photo.id < middle_id).order_by(Photo.id.desc()).limit(1).first(),
+        query.where(Photo.id > middle_id).order_by(Photo.id.asc()).limit(1).first()), repeat)
+
+    def index_count():
+        return len(index.match(tags_list, visible_levels))
+    idx_count_ms, idx_count = time_call(index_count, repeat)
+    idx_page_ms, _ = time_call(lambda: index.match(tags_list, visible_levels).page(1, PER_PAGE), repeat)
+    idx_deep_ms, _ = time_call(lambda: index.match(tags_list, visible_levels).page(deep_page, PER_PAGE), repeat)
+    def index_nav():
+        matches = index.match(tags_list, visible_levels)
+        return matches.next_id(middle_id), matches.prev_id(middle_id)
+    idx_nav_ms, _ = time_call(index_nav, repeat)
+
+    assert idx_count == count, f'{tags_list}: index {idx_count} != sql {count}'
+    label = ','.join(tags_list)
+    print(f"\n{label} ({count:,} photos)")
+    for name, sql_ms, idx_ms in (('count', sql_count_ms, idx_count_ms),
+                                 ('page 1', sql_page_ms, idx_page_ms),
+                                 (f'page {deep_page}', sql_deep_ms, idx_deep_ms),
+                                 ('prev/next', sql_nav_ms, idx_nav_ms)):
+        speedup = sql_ms / idx_ms if idx_ms else float('inf')
+        print(f"  {name:<12} sql {sql_ms:9.3f}ms   index {idx_ms*1000:9.1f}us   {speedup:8.0f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description='Tag bitmap index benchmark')
+    parser.add_argument('--levels', default='0', help='visible privacy levels (default: 0, anonymous)')
+    parser.add_argument('--repeat', type=int, default=20, help='runs per measurement (best is reported)')
+    args = parser.parse_args()
+    visible_levels = [int(level) for level in args.levels.split(',')]
+
+    print("\n" + "#"*60)
+    print("# CIGARBOX TAG BITMAP INDEX BENCHMARK")
+    print("#"*60)
+
+    if db.is_closed():
+        db.connect()
+
+    try:
+        print(f"\nDatabase: {db.database}")
+        print(f"Total photos: {Photo.select().count():,}, phototag rows: {PhotoTag.select().count():,}")
+
+        start = time.perf_counter()
+        index = tagindex.TagIndex.build(generation=0)
+        print(f"Index build: {(time.perf_counter() - start)*1000:.0f}ms, {len(index.tag_sets):,} tags "
+              f"({sum(isinstance(s, int) for s in index.tag_sets.values()):,} dense)")
+
+        top_tags = [name for (name,) in (Tag.select(Tag.name)
+                                         .join(PhotoTag)
+                                         .group_by(Tag.id)
+                                         .order_by(fn.COUNT(PhotoTag.id).desc())
+                                         .limit(3)
+                                         .tuples())]
+        if not top_tags:
+            print("No tagged photos to benchmark")
+            return
+        for size in range(1, len(top_tags) + 1):
+            bench(index, top_tags[:size], visible_levels, args.repeat)
+
+        print("\n" + "#"*60)
+        print("# BENCHMARK COMPLETE")
+        print("#"*60)
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Benchmark listing rows: full Photo models plus uri vs PhotoCard projections
+
+Usage:
+    python perf/perf_photo_cards.py [--per-page 100] [--pages 20] [--repeat 5]
+    python perf/perf_photo_cards.py --synthetic 20000
+
+Runs against the configured DATABASE, loading the first --pages photostream
+pages both ways and reporting time and allocated memory per page. --synthetic N
+builds a throwaway database with N photos instead.
+"""
+import sys
+import os
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peewee import SqliteDatabase
+from db import db, Photo
+from util import getSha1Path
+from cards import photo_cards
+
+def model_page(page, per_page):
+    """The previous listing approach: hydrate Photo models and set photo.uri on each"""
+    photos = list(Photo.select().order_by(Photo.id.desc()).paginate(page, per_page))
+    for photo in photos:
+        (sha1Path, filename) = getSha1Path(photo.sha1)
+        photo.uri = sha1Path + '/' + filename
+    return photos
+
+def card_page(page, per_page):
+    """Only the card columns, as tuples wrapped in PhotoCard"""
+    return photo_cards(Photo.select().order_by(Photo.id.desc()).paginate(page, per_page))
+
+def measure(load, pages, per_page, repeat):
+    """Best-of-N milliseconds per page and peak bytes allocated while holding one page"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in range(1, pages + 1):
+            load(page, per_page)
+        elapsed = (time.perf_counter() - start) * 1000 / pages
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    rows = load(1, per_page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, rows
+
+def build_synthetic(count):
+    """Bind Photo to a temporary database holding count photos"""
+    path = os.path.join(tempfile.mkdtemp(), 'cards.db')
+    database = SqliteDatabase(path)
+    database.bind([Photo], bind_refs=False, bind_backrefs=False)
+    database.connect()
+    database.create_tables([Photo])
+    random.seed(1)
+    start = datetime.datetime(2015, 1, 1)
+    rows = [{'sha1': '%040x' % random.getrandbits(160), 'filetype': 'jpg',
+             'privacy': random.choice([None, 0, 0, 1, 2, 3]),
+             'datetaken': start + datetime.timedelta(minutes=random.randint(0, 5000000))}
+            for _ in range(count)]
+    with database.atomic():
+        for batch in range(0, len(rows), 500):
+            Photo.insert_many(rows[batch:batch + 500]).execute()
+    return database
+
+def main():
+    parser = argparse.ArgumentParser(description='Photo listing row benchmark')
+    parser.add_argument('--per-page', type=int, default=100, help='photos per page (default: 100)')
+    parser.add_argument('--pages', type=int, default=20, help='pages loaded per run (default: 20)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement (best is reported)')
+    parser.add_argument('--synthetic', type=int, metavar='N', help='benchmark a generated database of N photos instead')
+    args = parser.parse_args()
+
+    print("\n" + "#"*60)
+    print("# CIGARBOX PHOTO CARD BENCHMARK")
+    print("#"*60)
+
+    database = build_synthetic(args.synthetic) if args.synthetic else db
+    if database.is_closed():
+        database.connect()
+
+    try:
+        print(f"\nDatabase: {database.database}")
+        print(f"{args.pages} pages of {args.per_page} photos")
+
+        model_ms, model_bytes, models = measure(model_page, args.pages, args.per_page, args.repeat)
+        card_ms, card_bytes, cards = measure(card_page, args.pages, args.per_page, args.repeat)
+
+        for model, card in zip(models, cards):
+            assert (model.id, model.uri, model.datetaken, model.privacy) == \
+                   (card.id, card.uri, card.datetaken, card.privacy), f'photo {model.id} differs'
+
+        speedup = model_ms / card_ms if card_ms else float('inf')
+        print(f"\n  {'':18} {'time/page':>10} {'allocated/page':>15}")
+        print(f"  Photo models + uri {model_ms:8.2f}ms {model_bytes / 1024:12.1f} KiB")
+        print(f"  PhotoCard tuples   {card_ms:8.2f}ms {card_bytes / 1024:12.1f} KiB   {speedup:4.1f}x faster")
+
+        print("\n" + "#"*60)
+        print("# BENCHMARK COMPLETE")
+        print("#"*60)
+    finally:
+        database.close()
+
+if __name__ == '__main__':
+    main()
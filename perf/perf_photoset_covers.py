@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""Benchmark photoset cover selection: every visible photo trimmed in Python vs ROW_NUMBER()
+
+Usage:
+    python perf/perf_photoset_covers.py [--levels 0,1,2,3] [--per-set 2] [--repeat 10]
+    python perf/perf_photoset_covers.py --synthetic 100x2000
+
+Runs against the configured DATABASE, timing a page of the largest photosets.
+--synthetic SETSxPHOTOS builds a throwaway database with that many photosets of
+that many photos each instead.
+"""
+import sys
+import os
+import time
+import random
+import argparse
+import datetime
+import tempfile
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peewee import fn, SqliteDatabase
+from db import db, Photo, Photoset, PhotoPhotoset
+import stats
+
+PER_PAGE = 100
+
+def time_call(func, repeat):
+    """Best-of-N wall time for func() in milliseconds, plus its result"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def python_covers(photoset_ids, visible_levels, per_set):
+    """The previous show_photosets approach: load every visible photo, keep the first per_set"""
+    all_thumbs = (
+        Photo.select(Photo, PhotoPhotoset.photoset)
+        .join(PhotoPhotoset)
+        .where(
+            (PhotoPhotoset.photoset.in_(photoset_ids)) &
+            ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))
+        )
+        .order_by(Photo.datetaken.asc(), Photo.id.asc())
+    )
+    covers = {}
+    for thumb in all_thumbs:
+        thumbs = covers.setdefault(thumb.photophotoset.photoset_id, [])
+        if len(thumbs) < per_set:
+            thumbs.append(thumb)
+    return covers
+
+def build_synthetic(spec):
+    """Bind the models to a temporary database holding SETS photosets of PHOTOS photos"""
+    sets, photos = (int(n) for n in spec.lower().split('x'))
+    path = os.path.join(tempfile.mkdtemp(), 'covers.db')
+    database = SqliteDatabase(path)
+    database.bind([Photo, Photoset, PhotoPhotoset], bind_refs=False, bind_backrefs=False)
+    database.connect()
+    database.create_tables([Photo, Photoset, PhotoPhotoset])
+    random.seed(1)
+    start = datetime.datetime(2015, 1, 1)
+    with database.atomic():
+        for set_number in range(sets):
+            photoset = Photoset.create(title=f'Set {set_number}')
+            rows = [{'sha1': '%040x' % random.getrandbits(160), 'filetype': 'jpg',
+                     'privacy': random.choice([None, 0, 0, 1, 2, 3]),
+                     'datetaken': start + datetime.timedelta(minutes=random.randint(0, 5000000))}
+                    for _ in range(photos)]
+            for batch in range(0, len(rows), 500):
+                Photo.insert_many(rows[batch:batch + 500]).execute()
+            ids = [photo_id for (photo_id,) in Photo.select(Photo.id).order_by(Photo.id.desc())
+                   .limit(photos).tuples()]
+            PhotoPhotoset.insert_many([{'photo': photo_id, 'photoset': photoset.id} for photo_id in ids]).execute()
+    return database
+
+def main():
+    parser = argparse.ArgumentParser(description='Photoset cover benchmark')
+    parser.add_argument('--levels', default='0', help='visible privacy levels (default: 0, anonymous)')
+    parser.add_argument('--per-set', type=int, default=2, help='covers per photoset (show_photosets uses 2)')
+    parser.add_argument('--repeat', type=int, default=10, help='runs per measurement (best is reported)')
+    parser.add_argument('--synthetic', metavar='SETSxPHOTOS', help='benchmark a generated database instead')
+    args = parser.parse_args()
+    visible_levels = [int(level) for level in args.levels.split(',')]
+
+    print("\n" + "#"*60)
+    print("# CIGARBOX PHOTOSET COVER BENCHMARK")
+    print("#"*60)
+
+    database = build_synthetic(args.synthetic) if args.synthetic else db
+    if database.is_closed():
+        database.connect()
+
+    try:
+        print(f"\nDatabase: {database.database}")
+        largest = [photoset_id for (photoset_id,) in (PhotoPhotoset
+                                                      .select(PhotoPhotoset.photoset)
+                                                      .group_by(PhotoPhotoset.photoset)
+                                                      .order_by(fn.COUNT(PhotoPhotoset.id).desc())
+                                                      .limit(PER_PAGE)
+                                                      .tuples())]
+        if not largest:
+            print("No photosets to benchmark")
+            return
+        members = PhotoPhotoset.select().where(PhotoPhotoset.photoset.in_(largest)).count()
+        print(f"Page of {len(largest)} largest photosets: {members:,} memberships")
+
+        old_ms, old = time_call(lambda: python_covers(largest, visible_levels, args.per_set), args.repeat)
+        new_ms, new = time_call(lambda: stats.photoset_covers(largest, visible_levels, args.per_set), args.repeat)
+
+        for photoset_id in largest:
+            old_ids = [photo.id for photo in old.get(photoset_id, [])]
+            new_ids = [photo.id for photo in new.get(photoset_id, [])]
+            assert old_ids == new_ids, f'photoset {photoset_id}: {old_ids} != {new_ids}'
+
+        speedup = old_ms / new_ms if new_ms else float('inf')
+        print(f"\n  load all + trim   {old_ms:9.1f}ms")
+        print(f"  ROW_NUMBER() <= {args.per_set} {new_ms:9.1f}ms   {speedup:6.1f}x")
+
+        print("\n" + "#"*60)
+        print("# BENCHMARK COMPLETE")
+        print("#"*60)
+    finally:
+        database.close()
+
+if __name__ == '__main__':
+    main()
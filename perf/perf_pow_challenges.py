@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""Benchmark PoW challenge issuance and verification per worker
+
+Usage:
+    python perf/perf_pow_challenges.py [--count 5000] [--workers 4]
+
+Compares the stored challenges (PowChallenge insert on issue, get + delete on
+verify, in a throwaway SQLite database) with signed challenges and the shared
+replay filter. Solutions are found before timing, at difficulty 1, so only the
+server's work is measured. --workers N also runs N processes verifying at the
+same time against one replay filter and reports each one's throughput.
+"""
+import sys
+import os
+import time
+import hashlib
+import argparse
+import datetime
+import tempfile
+import multiprocessing
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peewee import SqliteDatabase
+from app import app
+from db import PowChallenge
+import powauth
+
+def solve(challenge, difficulty=1):
+    """A nonce whose sha256(challenge + nonce) starts with difficulty zeros"""
+    nonce = 0
+    while not hashlib.sha256((challenge + str(nonce)).encode()).hexdigest().startswith('0' * difficulty):
+        nonce += 1
+    return nonce
+
+def rate(count, seconds):
+    return count / seconds if seconds else float('inf')
+
+def stored_challenges(count):
+    """The previous approach: one row per challenge, read and deleted on verify"""
+    path = os.path.join(tempfile.mkdtemp(), 'pow.db')
+    database = SqliteDatabase(path)
+    database.bind([PowChallenge])
+    database.connect()
+    database.create_tables([PowChallenge])
+
+    start = time.perf_counter()
+    challenges = []
+    for _ in range(count):
+        challenge = os.urandom(16).hex()
+        PowChallenge.create(challenge=challenge,
+                            expires_at=datetime.datetime.now() + datetime.timedelta(seconds=300))
+        challenges.append(challenge)
+    issue_seconds = time.perf_counter() - start
+
+    solutions = [(challenge, solve(challenge)) for challenge in challenges]
+    start = time.perf_counter()
+    for challenge, nonce in solutions:
+        row = PowChallenge.get(PowChallenge.challenge == challenge)
+        assert row.expires_at > datetime.datetime.now()
+        assert hashlib.sha256((challenge + str(nonce)).encode()).hexdigest().startswith('0')
+        PowChallenge.delete().where(PowChallenge.challenge == challenge).execute()
+    verify_seconds = time.perf_counter() - start
+    database.close()
+    return rate(count, issue_seconds), rate(count, verify_seconds)
+
+def signed_challenges(count):
+    """Signed challenges: no storage on issue, one replay filter update on verify"""
+    start = time.perf_counter()
+    challenges = [powauth.issue_challenge(1) for _ in range(count)]
+    issue_seconds = time.perf_counter() - start
+
+    solutions = [(challenge, solve(challenge)) for challenge in challenges]
+    start = time.perf_counter()
+    for challenge, nonce in solutions:
+        assert powauth.verify_solution(challenge, nonce)[1] == 'ok'
+    verify_seconds = time.perf_counter() - start
+    return rate(count, issue_seconds), rate(count, verify_seconds)
+
+def verify_worker(solutions, results):
+    """One worker process verifying its share of solutions"""
+    start = time.perf_counter()
+    for challenge, nonce in solutions:
+        assert powauth.verify_solution(challenge, nonce)[1] == 'ok'
+    results.put(rate(len(solutions), time.perf_counter() - start))
+
+def concurrent_verify(count, workers):
+    """Per-worker verify throughput with workers sharing one replay filter"""
+    challenges = [powauth.issue_challenge(1) for _ in range(count * workers)]
+    solutions = [(challenge, solve(challenge)) for challenge in challenges]
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=verify_worker, args=(solutions[i::workers], results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    rates = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return rates
+
+def main():
+    parser = argparse.ArgumentParser(description='PoW challenge throughput benchmark')
+    parser.add_argument('--count', type=int, default=5000, help='challenges issued and verified (default: 5000)')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent verifying processes (default: 4, 0 to skip)')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    app.config.update(POW_REPLAY_FILTER_PATH=os.path.join(work_dir, 'replay.bin'), POW_CHALLENGE_EXPIRY=300)
+
+    print("\n" + "#"*60)
+    print("# CIGARBOX POW CHALLENGE BENCHMARK")
+    print("#"*60)
+    print(f"\n{args.count} challenges, replay filter {app.config.get('POW_REPLAY_FILTER_BITS', 1 << 22)} bits")
+
+    stored_issue, stored_verify = stored_challenges(args.count)
+    signed_issue, signed_verify = signed_challenges(args.count)
+
+    print(f"\n  {'':20} {'issue/s':>10} {'verify/s':>10}")
+    print(f"  Stored (SQLite)      {stored_issue:10.0f} {stored_verify:10.0f}")
+    print(f"  Signed + filter      {signed_issue:10.0f} {signed_verify:10.0f}")
+
+    if args.workers:
+        rates = concurrent_verify(args.count // args.workers or 1, args.workers)
+        print(f"\n  {args.workers} workers verifying at once: " +
+              ', '.join(f'{worker_rate:.0f}' for worker_rate in rates) + ' verify/s each')
+
+    print("\n" + "#"*60)
+    print("# BENCHMARK COMPLETE")
+    print("#"*60)
+
+if __name__ == '__main__':
+    main()
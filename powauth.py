@@ -0,0 +1,531 @@
+#! /usr/bin/env python
+
+"""stateless proof-of-work tokens and challenges, with load-adaptive difficulty
+
+A solved challenge used to become a PowToken row, and every protected page
+view read it back and saved request_count + 1, so anonymous browsing was a
+database write per page. The token is now a signed cookie:
+
+  base64(token id | ip | issued at | expires at) . base64(HMAC-SHA256)
+
+so checking signature, expiry and IP binding needs no lookup at all. The only
+state left is how many requests each token has spent, kept in a small table
+of fixed-size slots in a memory-mapped file (POW_BUDGET_PATH) that every
+gunicorn worker on the host maps. Slots are claimed by open addressing on the
+random token id, updates are serialized with flock, and expired tokens are
+compacted out every POW_BUDGET_COMPACT_SECONDS.
+
+check_request() is the single validator used by require_access, the login
+guard and show_photo.
+
+Challenges are stateless the same way: random.issued_at.difficulty plus an
+HMAC, so /pow/challenge writes nothing and a bot that never solves them costs
+no storage. A solved challenge is recorded in a shared Bloom filter of spent
+challenges (POW_REPLAY_FILTER_PATH) so it cannot be redeemed twice; the filter
+has two generations that rotate every POW_CHALLENGE_EXPIRY seconds, which is
+as long as a challenge stays redeemable anyway.
+
+The difficulty of new challenges adapts to load: a per-second window of
+challenges issued, solutions verified and PoW-gated requests, shared by all
+workers (POW_ADAPTIVE_PATH), steps it between POW_DIFFICULTY_MIN and
+POW_DIFFICULTY_MAX. Challenges carry their own difficulty, so a change never
+invalidates one already being solved.
+"""
+
+import base64, binascii, hashlib, hmac, logging, secrets, struct, time
+from collections import namedtuple
+from flask import request
+
+from app import app
+import sharedfile
+from sharedfile import SharedFile
+
+# set up logging
+logger = logging.getLogger('cigarbox')
+
+COOKIE_NAME = 'pow_token'
+
+# Decoded cookie contents; issued_at and expires_at are unix seconds
+Token = namedtuple('Token', 'token_id ip issued_at expires_at')
+
+# Result of validating a request's cookie. reason is one of ok, missing, invalid,
+# expired, ip_mismatch, exhausted; used is the number of requests spent (when consumed)
+Check = namedtuple('Check', 'valid reason token used')
+
+# Decoded challenge string; the client solves sha256(challenge string + nonce)
+Challenge = namedtuple('Challenge', 'nonce_seed issued_at difficulty')
+
+
+def _b64encode(data):
+  return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+  return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _secret():
+  return app.config.get('POW_TOKEN_SECRET') or app.config.get('SECRET_KEY')
+
+
+def _signing_key(purpose):
+  """HMAC key for purpose (token or challenge): POW_TOKEN_SECRET, or one derived from SECRET_KEY
+
+  Without either there is nothing to sign with, so nothing is issued (this
+  raises) and nothing is accepted (parse_token and parse_challenge refuse).
+  """
+  secret = _secret()
+  if not secret:
+    raise RuntimeError('PoW tokens need POW_TOKEN_SECRET or SECRET_KEY to be set')
+  if isinstance(secret, str):
+    secret = secret.encode('utf-8')
+  return hashlib.sha256(b'cigarbox-pow-' + purpose + b'\x00' + secret).digest()
+
+
+def _sign(payload, purpose=b'token'):
+  return _b64encode(hmac.new(_signing_key(purpose), payload.encode('ascii'), hashlib.sha256).digest())
+
+
+def issue_token(ip, now=None):
+  """(cookie value, Token) for a client that just solved a challenge"""
+  issued_at = int(now if now is not None else time.time())
+  expires_at = issued_at + app.config.get('POW_TOKEN_EXPIRY_MINUTES', 15) * 60
+  token = Token(secrets.token_hex(16), ip or '', issued_at, expires_at)
+  payload = _b64encode('|'.join(str(field) for field in token).encode('utf-8'))
+  return payload + '.' + _sign(payload), token
+
+
+def parse_token(value):
+  """The Token in a cookie value, or None if it is malformed or the signature is wrong"""
+  if not _secret():
+    return None
+  try:
+    payload, signature = value.split('.')
+    if not hmac.compare_digest(signature, _sign(payload)):
+      return None
+    token_id, ip, issued_at, expires_at = _b64decode(payload).decode('utf-8').split('|')
+    if len(token_id) != 32:
+      return None
+    bytes.fromhex(token_id)
+    return Token(token_id, ip, int(issued_at), int(expires_at))
+  except (ValueError, UnicodeError, binascii.Error):
+    return None
+
+
+def ip_allowed(token_ip, remote_addr):
+  """Whether a token bound to token_ip may be used from remote_addr
+
+  Privacy proxies (iCloud Private Relay, etc) rotate egress addresses, so either
+  side being in POW_PRIVACY_PROXY_RANGES skips the binding when allowed.
+  """
+  if not app.config.get('POW_BIND_TO_IP', True) or token_ip == remote_addr:
+    return True
+  if app.config.get('POW_ALLOW_PRIVACY_PROXIES', True):
+    for prefix in app.config.get('POW_PRIVACY_PROXY_RANGES', []):
+      if token_ip.startswith(prefix) or (remote_addr or '').startswith(prefix):
+        return True
+  return False
+
+
+def check_token(value, remote_addr, consume=True, now=None):
+  """Validate a cookie value for remote_addr; consume spends one request of its budget"""
+  if not value:
+    return Check(False, 'missing', None, None)
+  token = parse_token(value)
+  if token is None:
+    return Check(False, 'invalid', None, None)
+
+  now = int(now if now is not None else time.time())
+  # Tokens carry their own expiry; the configured lifetime also applies if it was lowered since
+  expiry_seconds = app.config.get('POW_TOKEN_EXPIRY_MINUTES', 15) * 60
+  if now >= token.expires_at or now - token.issued_at > expiry_seconds:
+    return Check(False, 'expired', token, None)
+
+  if not ip_allowed(token.ip, remote_addr):
+    logger.warning(f'PoW token IP mismatch: expected={token.ip} got={remote_addr}')
+    return Check(False, 'ip_mismatch', token, None)
+
+  if not consume:
+    return Check(True, 'ok', token, None)
+
+  max_requests = app.config.get('POW_TOKEN_MAX_REQUESTS', 50)
+  used = budgets().consume(bytes.fromhex(token.token_id), token.expires_at, max_requests, now)
+  if used is None:
+    logger.info(f'PoW token request limit reached: {max_requests}/{max_requests}')
+    return Check(False, 'exhausted', token, max_requests)
+  return Check(True, 'ok', token, used)
+
+
+def check_request(consume=True):
+  """check_token for the current request's cookie and address
+
+  A consuming check is a PoW-gated page view, so with PoW enabled it also
+  counts towards the adaptive difficulty.
+  """
+  if consume and app.config.get('POW_ENABLED', False):
+    record_load('requests')
+  return check_token(request.cookies.get(COOKIE_NAME), request.remote_addr, consume)
+
+
+def issue_challenge(difficulty, now=None):
+  """A signed challenge string: random.issued_at.difficulty.signature"""
+  issued_at = int(now if now is not None else time.time())
+  payload = f'{secrets.token_hex(16)}.{issued_at}.{int(difficulty)}'
+  return payload + '.' + _sign(payload, b'challenge')
+
+
+def parse_challenge(value):
+  """The Challenge in a challenge string, or None if it is malformed or not signed by us"""
+  if not _secret():
+    return None
+  try:
+    nonce_seed, issued_at, difficulty, signature = value.split('.')
+    if not hmac.compare_digest(signature, _sign(f'{nonce_seed}.{issued_at}.{difficulty}', b'challenge')):
+      return None
+    return Challenge(nonce_seed, int(issued_at), int(difficulty))
+  except (ValueError, AttributeError, UnicodeError):
+    return None
+
+
+def verify_solution(value, nonce, now=None):
+  """Check a solved challenge and mark it spent: (Challenge or None, reason)
+
+  reason is one of ok, invalid, expired, wrong, replayed.
+  """
+  challenge = parse_challenge(value)
+  if challenge is None:
+    return None, 'invalid'
+  now = now if now is not None else time.time()
+  if not 0 <= now - challenge.issued_at <= app.config.get('POW_CHALLENGE_EXPIRY', 300):
+    return challenge, 'expired'
+  if not hashlib.sha256((value + str(nonce)).encode('utf-8')).hexdigest().startswith('0' * challenge.difficulty):
+    return challenge, 'wrong'
+  # Only a correct solution is recorded, so wrong guesses cannot burn someone else's challenge
+  if not replay_filter().spend(value, now):
+    return challenge, 'replayed'
+  return challenge, 'ok'
+
+
+class BudgetTable(SharedFile):
+  """Requests spent per token, in an open-addressing table shared across processes
+
+  The file is a header (magic, slot count, last compaction time) followed by
+  fixed-size slots of (token id, expires at, requests used). An all-zero id is
+  an empty slot. Probing only stops at empty slots, so expired slots stay in
+  place (and are reused for new tokens) until compaction rebuilds the table.
+  """
+  MAGIC = b'CBPB'
+  HEADER = struct.Struct('<4sId')
+  SLOT = struct.Struct('<16sII')
+  EMPTY = bytes(16)
+
+  def __init__(self, path, slots=65536, compact_seconds=60):
+    self.slots = slots
+    self.compact_seconds = compact_seconds
+    super().__init__(path, self.HEADER.size + slots * self.SLOT.size)
+
+  def _identity(self):
+    return (self.MAGIC, self.slots)
+
+  def _reset(self, table):
+    self.HEADER.pack_into(table, 0, self.MAGIC, self.slots, time.time())
+
+  def _offset(self, index):
+    return self.HEADER.size + index * self.SLOT.size
+
+  def _find(self, table, key, now):
+    """(slot holding key or None, first slot a new key could take or None)"""
+    start = int.from_bytes(key[:8], 'little') % self.slots
+    reusable = None
+    for step in range(self.slots):
+      index = (start + step) % self.slots
+      slot_key, expires_at, _ = self.SLOT.unpack_from(table, self._offset(index))
+      if slot_key == key:
+        return index, reusable
+      if slot_key == self.EMPTY:
+        return None, index if reusable is None else reusable
+      if reusable is None and expires_at <= now:
+        reusable = index
+    return None, reusable
+
+  def _entries(self, table):
+    for index in range(self.slots):
+      entry = self.SLOT.unpack_from(table, self._offset(index))
+      if entry[0] != self.EMPTY:
+        yield entry
+
+  def _compact(self, table, now):
+    """Rebuild the table from unexpired entries; returns the number dropped"""
+    entries = list(self._entries(table))
+    live = [entry for entry in entries if entry[1] > now]
+    table[self.HEADER.size:] = bytes(self.size - self.HEADER.size)
+    for entry in live:
+      _, free = self._find(table, entry[0], now)
+      self.SLOT.pack_into(table, self._offset(free), *entry)
+    self.HEADER.pack_into(table, 0, self.MAGIC, self.slots, now)
+    return len(entries) - len(live)
+
+  def consume(self, key, expires_at, limit, now=None):
+    """Spend one request of key's budget: the new count, or None if limit is already used up"""
+    now = int(now if now is not None else time.time())
+    with self._locked() as table:
+      _, _, compacted_at = self.HEADER.unpack_from(table, 0)
+      if now - compacted_at >= self.compact_seconds:
+        self._compact(table, now)
+
+      index, free = self._find(table, key, now)
+      if index is not None:
+        _, _, used = self.SLOT.unpack_from(table, self._offset(index))
+        if used >= limit:
+          return None
+        self.SLOT.pack_into(table, self._offset(index), key, expires_at, used + 1)
+        return used + 1
+
+      if limit < 1:
+        return None
+      if free is None:
+        self._compact(table, now)
+        _, free = self._find(table, key, now)
+        if free is None:
+          logger.error(f'PoW budget table full ({self.slots} live tokens), raise POW_BUDGET_SLOTS')
+          return None
+      self.SLOT.pack_into(table, self._offset(free), key, expires_at, 1)
+      return 1
+
+  def used(self, key, now=None):
+    """Requests key has spent (0 if unknown or expired)"""
+    now = int(now if now is not None else time.time())
+    with self._locked() as table:
+      index, _ = self._find(table, key, now)
+      if index is None:
+        return 0
+      _, expires_at, used = self.SLOT.unpack_from(table, self._offset(index))
+      return used if expires_at > now else 0
+
+  def compact(self, now=None):
+    """Drop expired tokens now; returns how many were removed"""
+    with self._locked() as table:
+      return self._compact(table, int(now if now is not None else time.time()))
+
+  def stats(self, now=None):
+    """Slot usage for /pow/debug"""
+    now = int(now if now is not None else time.time())
+    with self._locked() as table:
+      entries = list(self._entries(table))
+      compacted_at = self.HEADER.unpack_from(table, 0)[2]
+    live = sum(1 for entry in entries if entry[1] > now)
+    return {'slots': self.slots, 'live': live, 'expired': len(entries) - live,
+            'last_compaction_age_sec': int(now - compacted_at)}
+
+
+
+class ReplayFilter(SharedFile):
+  """Spent challenges, as a Bloom filter with two generations shared across processes
+
+  The file is a header (magic, bit count, current generation, each
+  generation's start time) followed by the two bit arrays. New entries go in
+  the current generation and lookups check both; once the current one is
+  window seconds old the other is cleared and becomes current, so an entry is
+  remembered for at least window seconds. A false positive rejects a fresh
+  solution as spent, so size bits well above the challenges solved per window.
+  """
+  MAGIC = b'CBRF'
+  HEADER = struct.Struct('<4sIIdd')
+  HASHES = 7
+
+  def __init__(self, path, bits=1 << 22, window=300):
+    self.bits = bits
+    self.window = window
+    self.generation_size = (bits + 7) // 8
+    super().__init__(path, self.HEADER.size + 2 * self.generation_size)
+
+  def _identity(self):
+    return (self.MAGIC, self.bits)
+
+  def _reset(self, table):
+    now = time.time()
+    self.HEADER.pack_into(table, 0, self.MAGIC, self.bits, 0, now, now)
+
+  def _positions(self, item):
+    digest = hashlib.sha256(item.encode('utf-8')).digest()
+    return [int.from_bytes(digest[4 * i:4 * i + 4], 'little') % self.bits for i in range(self.HASHES)]
+
+  def _current(self, table, now):
+    """The current generation, rotating first if it has covered its window"""
+    _, _, current, *started = self.HEADER.unpack_from(table, 0)
+    if now - started[current] >= self.window:
+      current = 1 - current
+      offset = self.HEADER.size + current * self.generation_size
+      table[offset:offset + self.generation_size] = bytes(self.generation_size)
+      started[current] = now
+      self.HEADER.pack_into(table, 0, self.MAGIC, self.bits, current, *started)
+    return current
+
+  def _contains(self, table, generation, positions):
+    offset = self.HEADER.size + generation * self.generation_size
+    return all(table[offset + (position >> 3)] & (1 << (position & 7)) for position in positions)
+
+  def spend(self, item, now=None):
+    """Record item as spent: True the first time, False if it (probably) was already"""
+    now = now if now is not None else time.time()
+    positions = self._positions(item)
+    with self._locked() as table:
+      current = self._current(table, now)
+      if self._contains(table, 0, positions) or self._contains(table, 1, positions):
+        return False
+      offset = self.HEADER.size + current * self.generation_size
+      for position in positions:
+        table[offset + (position >> 3)] |= 1 << (position & 7)
+      return True
+
+  def stats(self, now=None):
+    """Fill of each generation for /pow/debug"""
+    now = now if now is not None else time.time()
+    with self._locked() as table:
+      _, _, current, *started = self.HEADER.unpack_from(table, 0)
+      generations = []
+      for generation in (current, 1 - current):
+        offset = self.HEADER.size + generation * self.generation_size
+        bits_set = bin(int.from_bytes(table[offset:offset + self.generation_size], 'little')).count('1')
+        generations.append({'age_sec': int(now - started[generation]),
+                            'fill_ratio': round(bits_set / self.bits, 6)})
+    return {'bits': self.bits, 'hashes': self.HASHES, 'window_sec': self.window, 'generations': generations}
+
+
+class LoadMeter(SharedFile):
+  """Sliding-window PoW load shared across processes, and the difficulty it drives
+
+  The file is a header (magic, window seconds, current difficulty, last
+  adjustment time) followed by one bucket per second of the window, each
+  (second, challenges issued, solutions verified, PoW-gated requests). A
+  bucket whose second is stale is reset when next written, so the window
+  slides without any sweeping.
+  """
+  MAGIC = b'CBPL'
+  HEADER = struct.Struct('<4sIId')
+  BUCKET = struct.Struct('<qIII')
+  EVENTS = ('issued', 'verified', 'requests')
+
+  def __init__(self, path, window=60):
+    self.window = window
+    super().__init__(path, self.HEADER.size + window * self.BUCKET.size)
+
+  def _identity(self):
+    return (self.MAGIC, self.window)
+
+  def _reset(self, table):
+    self.HEADER.pack_into(table, 0, self.MAGIC, self.window, 0, time.time())
+
+  def record(self, event, now=None):
+    """Count one event (one of EVENTS) in the current second"""
+    second = int(now if now is not None else time.time())
+    offset = self.HEADER.size + (second % self.window) * self.BUCKET.size
+    with self._locked() as table:
+      bucket_second, *counts = self.BUCKET.unpack_from(table, offset)
+      if bucket_second != second:
+        counts = [0] * len(self.EVENTS)
+      counts[self.EVENTS.index(event)] += 1
+      self.BUCKET.pack_into(table, offset, second, *counts)
+
+  def _totals(self, table, now):
+    totals = dict.fromkeys(self.EVENTS, 0)
+    for index in range(self.window):
+      bucket_second, *counts = self.BUCKET.unpack_from(table, self.HEADER.size + index * self.BUCKET.size)
+      if now - self.window < bucket_second <= now:
+        for event, count in zip(self.EVENTS, counts):
+          totals[event] += count
+    return totals
+
+  @staticmethod
+  def load(totals, targets):
+    """The busiest event relative to its target (1.0 = at target)"""
+    return max([totals[event] / targets[event] for event in totals if targets.get(event)] or [0.0])
+
+  def difficulty(self, bounds, targets, interval, now=None):
+    """The difficulty for new challenges, first stepping it once per interval:
+    up while load is over target, down once it is under half"""
+    now = now if now is not None else time.time()
+    low, high = bounds
+    with self._locked() as table:
+      _, _, difficulty, adjusted_at = self.HEADER.unpack_from(table, 0)
+      current = min(max(difficulty or low, low), high)
+      if now - adjusted_at >= interval:
+        load = self.load(self._totals(table, int(now)), targets)
+        if load > 1:
+          current = min(current + 1, high)
+        elif load < 0.5:
+          current = max(current - 1, low)
+        if current != difficulty:
+          logger.info(f'PoW difficulty {difficulty or low} -> {current} (load {load:.2f})')
+        adjusted_at = now
+      self.HEADER.pack_into(table, 0, self.MAGIC, self.window, current, adjusted_at)
+      return current
+
+  def state(self, bounds, targets, now=None):
+    """Difficulty, window totals and load for /pow/debug"""
+    now = now if now is not None else time.time()
+    with self._locked() as table:
+      _, _, difficulty, adjusted_at = self.HEADER.unpack_from(table, 0)
+      totals = self._totals(table, int(now))
+    return {'difficulty': min(max(difficulty or bounds[0], bounds[0]), bounds[1]),
+            'bounds': list(bounds), 'window_sec': self.window, 'counts': totals, 'targets': targets,
+            'load': round(self.load(totals, targets), 3), 'last_adjustment_age_sec': int(now - adjusted_at)}
+
+
+def budgets():
+  """The process's BudgetTable for the configured path and size"""
+  path = sharedfile.resolve(app.root_path, app.config.get('POW_BUDGET_PATH', 'pow_budgets.bin'))
+  return sharedfile.instance(BudgetTable, path,
+                      app.config.get('POW_BUDGET_SLOTS', 65536),
+                      app.config.get('POW_BUDGET_COMPACT_SECONDS', 60))
+
+
+def replay_filter():
+  """The process's ReplayFilter for the configured path and size"""
+  path = sharedfile.resolve(app.root_path, app.config.get('POW_REPLAY_FILTER_PATH', 'pow_replay.bin'))
+  return sharedfile.instance(ReplayFilter, path,
+                      app.config.get('POW_REPLAY_FILTER_BITS', 1 << 22),
+                      app.config.get('POW_CHALLENGE_EXPIRY', 300))
+
+
+def load_meter():
+  """The process's LoadMeter for the configured path and window"""
+  path = sharedfile.resolve(app.root_path, app.config.get('POW_ADAPTIVE_PATH', 'pow_load.bin'))
+  return sharedfile.instance(LoadMeter, path,
+                      app.config.get('POW_ADAPTIVE_WINDOW', 60))
+
+
+def adaptive():
+  return app.config.get('POW_ADAPTIVE_DIFFICULTY', True)
+
+
+def difficulty_bounds():
+  """(lowest, highest) difficulty; the lowest defaults to POW_DIFFICULTY"""
+  low = app.config.get('POW_DIFFICULTY_MIN') or app.config.get('POW_DIFFICULTY', 4)
+  return low, max(low, app.config.get('POW_DIFFICULTY_MAX') or low + 1)
+
+
+def difficulty_targets():
+  """Events per window regarded as normal load"""
+  return app.config.get('POW_ADAPTIVE_TARGETS', {'issued': 120, 'verified': 60, 'requests': 2000})
+
+
+def record_load(event):
+  """Count a PoW event towards the adaptive difficulty"""
+  if adaptive():
+    load_meter().record(event)
+
+
+def challenge_difficulty():
+  """Difficulty for a new challenge: POW_DIFFICULTY, or the adaptive one"""
+  if not adaptive():
+    return app.config.get('POW_DIFFICULTY', 4)
+  return load_meter().difficulty(difficulty_bounds(), difficulty_targets(),
+                                 app.config.get('POW_ADAPTIVE_INTERVAL', 30))
+
+
+def difficulty_state():
+  """The adaptive controller's state for /pow/debug"""
+  if not adaptive():
+    return {'adaptive': False, 'difficulty': app.config.get('POW_DIFFICULTY', 4)}
+  return dict(load_meter().state(difficulty_bounds(), difficulty_targets()), adaptive=True)
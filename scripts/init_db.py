@@ -11,6 +11,10 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app import *
 from db import *
 import util, aws
+import archive
+import cache
+import search
+import stats
 
 logger = util.setup_custom_logger('cigarbox')
 
@@ -43,7 +47,19 @@ def create_tables(models):
 def main():
   """Main program"""
   logger.info('Creating Tables')
-  create_tables([Photo,Comment,Gallery,Photoset,Tag,PhotoPhotoset,PhotosetGallery,PhotoTag,ImportMeta,Role,User,UserRoles])
+  create_tables([Photo,Comment,Gallery,Photoset,Tag,PhotoPhotoset,PhotosetGallery,PhotoTag,ImportMeta,Role,User,UserRoles,Selection])
+  logger.info('Installing content generation triggers')
+  cache.install_generation_triggers(db)
+  logger.info('Installing search index')
+  search.install_search_index(db)
+  logger.info('Installing per-day photo counts')
+  archive.install_day_counts(db)
+  logger.info('Installing tag statistics')
+  stats.install_tag_stats(db)
+  logger.info('Installing tag co-occurrence')
+  stats.install_tag_cooccurrence(db)
+  logger.info('Installing photoset statistics')
+  stats.install_photoset_stats(db)
 
 
 
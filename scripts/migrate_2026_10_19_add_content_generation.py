@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Database migration script to add the content generation counter
+
+Supports the shared count cache used for pagination totals.
+
+Changes:
+- Add contentgeneration table (single row holding the global write generation)
+- Add AFTER INSERT/UPDATE/DELETE triggers on photo, tag, phototag, photoset and
+  photophotoset that bump the generation, so cached counts computed under an
+  older generation are never served
+
+Safe to run multiple times - uses IF NOT EXISTS for the table and triggers.
+"""
+
+import sys
+import os
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from db import *
+import cache
+
+def migrate():
+    """Run the migration"""
+    print("Starting content generation migration...")
+
+    cache.install_generation_triggers(db)
+
+    cursor = db.execute_sql("""
+        SELECT name FROM sqlite_master
+        WHERE type='trigger' AND name LIKE 'bump_generation_%'
+    """)
+    triggers = [row[0] for row in cursor.fetchall()]
+    print(f"✓ {len(triggers)} generation triggers installed:")
+    for name in sorted(triggers):
+        print(f"  • {name}")
+
+    generation = cache.current_generation()
+    print(f"\n✓ Current content generation: {generation}")
+
+    print("\n✓ Migration complete!")
+    print("\nOptional config.py settings:")
+    print("  CACHE_DATABASE = 'cache.db'")
+    print("  COUNT_CACHE_APPROX_THRESHOLD = 1000")
+
+def main():
+    """Main entry point"""
+    print("="*60)
+    print("Migration: Add content generation counter for count cache")
+    print("="*60)
+    print()
+
+    try:
+        migrate()
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
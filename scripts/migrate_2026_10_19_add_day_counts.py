@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Database migration script to add date indexing and per-day photo counts
+
+Date pages and date navigation used datetaken LIKE 'YYYY-MM%', which can't use
+an index. They now use a range on an index over datetaken, and totals and the
+/archive calendars come from a per-day count table.
+
+Changes:
+- Add index idx_photo_datetaken on photo(datetaken)
+- Add photodaycount table (day YYYYMMDD, privacy, count)
+- Add AFTER INSERT/UPDATE/DELETE triggers on photo that maintain it
+- Backfill photodaycount from existing photos
+
+Safe to run multiple times - recreates the triggers and only backfills on first install.
+Pass --rebuild to recompute the counts from scratch.
+"""
+
+import sys
+import os
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from db import *
+import archive
+
+def migrate(rebuild=False):
+    """Run the migration"""
+    print("Starting day counts migration...")
+
+    archive.install_day_counts(db)
+    if rebuild:
+        print("Rebuilding photodaycount from photo...")
+        archive.rebuild_day_counts(db)
+
+    cursor = db.execute_sql("""
+        SELECT name FROM sqlite_master
+        WHERE (type='trigger' AND name LIKE 'photodaycount_%') OR name = 'idx_photo_datetaken'
+    """)
+    for (name,) in cursor.fetchall():
+        print(f"  • {name}")
+
+    cursor = db.execute_sql("SELECT COUNT(*), COALESCE(SUM(count), 0) FROM photodaycount")
+    days, photos = cursor.fetchone()
+    print(f"\n✓ {days:,} day/privacy rows covering {photos:,} photos")
+
+    print("\n✓ Migration complete!")
+
+def main():
+    """Main entry point"""
+    print("="*60)
+    print("Migration: Add datetaken index and per-day photo counts")
+    print("="*60)
+    print()
+
+    try:
+        migrate(rebuild='--rebuild' in sys.argv)
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
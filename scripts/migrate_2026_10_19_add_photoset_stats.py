@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Database migration script to add per-photoset statistics
+
+Photoset listings counted photos, looked up a cover and computed the date range
+per photoset on every view (two queries per set on the admin page). They now
+read photoset_stats, which triggers keep up to date.
+
+Changes:
+- Add photoset_stats table (photoset_id, privacy, count, min/max datetaken, cover_id)
+- Add triggers on photophotoset, photo and photoset that maintain it
+- Backfill photoset_stats from existing photosets
+
+Safe to run multiple times - uses IF NOT EXISTS and only backfills on first install.
+Pass --check to compare photoset_stats with a fresh aggregate, or --rebuild to
+recompute it from scratch.
+"""
+
+import sys
+import os
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from db import *
+import stats
+
+def migrate(rebuild=False, check=False):
+    """Run the migration"""
+    print("Starting photoset stats migration...")
+
+    stats.install_photoset_stats(db)
+    if rebuild:
+        print("Rebuilding photoset_stats from photophotoset...")
+        stats.rebuild_photoset_stats(db)
+
+    cursor = db.execute_sql("""
+        SELECT name FROM sqlite_master
+        WHERE type='trigger' AND name LIKE 'photoset_stats_%'
+    """)
+    for (name,) in cursor.fetchall():
+        print(f"  • {name}")
+
+    cursor = db.execute_sql("SELECT COUNT(DISTINCT photoset_id), COALESCE(SUM(count), 0) FROM photoset_stats")
+    photosets, photos = cursor.fetchone()
+    print(f"\n✓ {photosets:,} photosets holding {photos:,} photos")
+
+    if check:
+        mismatches = stats.check_photoset_stats(db)
+        for photoset_id, privacy, stored, actual in mismatches[:20]:
+            print(f"  ✗ photoset {photoset_id} privacy {privacy}: stored {stored}, actual {actual}")
+        if mismatches:
+            print(f"\n✗ {len(mismatches):,} photoset_stats rows out of date - run with --rebuild")
+            sys.exit(1)
+        print("✓ photoset_stats consistent with photophotoset")
+
+    print("\n✓ Migration complete!")
+
+def main():
+    """Main entry point"""
+    print("="*60)
+    print("Migration: Add photoset statistics")
+    print("="*60)
+    print()
+
+    try:
+        migrate(rebuild='--rebuild' in sys.argv, check='--check' in sys.argv)
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
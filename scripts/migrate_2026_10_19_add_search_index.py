@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Database migration script to add the full-text search index
+
+Backs /search and the admin search boxes with SQLite FTS5 instead of
+LIKE '%x%' table scans.
+
+Changes:
+- Add searchindex FTS5 virtual table (tag names, photoset titles and
+  descriptions, import paths, user emails)
+- Add AFTER INSERT/UPDATE/DELETE triggers on tag, photoset, importmeta and
+  user that keep it in sync
+- Backfill the index from existing rows
+
+Safe to run multiple times - uses IF NOT EXISTS and only backfills a new table.
+Pass --rebuild to repopulate the index from scratch.
+"""
+
+import sys
+import os
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from db import *
+import search
+
+def migrate(rebuild=False):
+    """Run the migration"""
+    print("Starting search index migration...")
+
+    search.install_search_index(db)
+    if rebuild:
+        print("Rebuilding search index from source tables...")
+        search.rebuild_search_index(db)
+
+    cursor = db.execute_sql("""
+        SELECT name FROM sqlite_master
+        WHERE type='trigger' AND name LIKE 'searchindex_%'
+    """)
+    triggers = [row[0] for row in cursor.fetchall()]
+    print(f"✓ {len(triggers)} search index triggers installed")
+
+    cursor = db.execute_sql("SELECT kind, COUNT(*) FROM searchindex GROUP BY kind ORDER BY kind")
+    for kind, count in cursor.fetchall():
+        print(f"  • {kind}: {count:,} documents")
+
+    print("\n✓ Migration complete!")
+
+def main():
+    """Main entry point"""
+    print("="*60)
+    print("Migration: Add FTS5 full-text search index")
+    print("="*60)
+    print()
+
+    try:
+        migrate(rebuild='--rebuild' in sys.argv)
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Database migration script to add bulk-edit selections
+
+List views no longer enumerate every photo id into the bulk-edit link; they
+link to /photos/bulk-edit/select, which stores the listing's query spec (or a
+compressed id set) under a short token.
+
+Changes:
+- Add selection table (token, spec, created_by_id, created_at)
+
+Safe to run multiple times - checks if the table already exists.
+"""
+
+import sys
+import os
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from db import *
+
+def migrate():
+    """Run the migration"""
+    print("Starting selection table migration...")
+
+    cursor = db.execute_sql("""
+        SELECT name FROM sqlite_master
+        WHERE type='table' AND name = 'selection'
+    """)
+    if cursor.fetchone():
+        print("✓ selection table already exists, skipping")
+        return
+
+    print("Creating selection table...")
+    db.create_tables([Selection], safe=True)
+    print("✓ selection table created")
+
+    print("\n✓ Migration complete!")
+    print("\nOptional config.py setting:")
+    print("  SELECTION_EXPIRY_DAYS = 30")
+
+def main():
+    """Main entry point"""
+    print("="*60)
+    print("Migration: Add bulk-edit selection table")
+    print("="*60)
+    print()
+
+    try:
+        migrate()
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
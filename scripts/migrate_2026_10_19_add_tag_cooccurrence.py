@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Database migration script to add the tag co-occurrence table
+
+Tag pages listed related tags by aggregating phototag over every photo that
+matched the page, on every page view. They now read tag_cooccurrence, which
+triggers keep up to date.
+
+Changes:
+- Add tag_cooccurrence table (tag_id, other_id, privacy, count; both directions)
+- Add triggers on phototag, photo and tag that maintain it
+- Backfill tag_cooccurrence from existing tags
+
+Safe to run multiple times - uses IF NOT EXISTS and only backfills on first install.
+Pass --check to compare tag_cooccurrence with a fresh aggregate, or --rebuild to
+recompute it from scratch (which also drops pairs counted down to 0).
+"""
+
+import sys
+import os
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from db import *
+import stats
+
+def migrate(rebuild=False, check=False):
+    """Run the migration"""
+    print("Starting tag co-occurrence migration...")
+
+    stats.install_tag_cooccurrence(db)
+    if rebuild:
+        print("Rebuilding tag_cooccurrence from phototag...")
+        stats.rebuild_tag_cooccurrence(db)
+
+    cursor = db.execute_sql("""
+        SELECT name FROM sqlite_master
+        WHERE type='trigger' AND name LIKE 'tag_cooccurrence_%'
+    """)
+    for (name,) in cursor.fetchall():
+        print(f"  • {name}")
+
+    cursor = db.execute_sql("SELECT COUNT(*) FROM tag_cooccurrence WHERE tag_id < other_id AND count > 0")
+    pairs = cursor.fetchone()[0]
+    print(f"\n✓ {pairs:,} tag pairs by privacy level")
+
+    if check:
+        mismatches = stats.check_tag_cooccurrence(db)
+        for tag_id, other_id, privacy, stored, actual in mismatches[:20]:
+            print(f"  ✗ tags {tag_id}/{other_id} privacy {privacy}: stored {stored}, actual {actual}")
+        if mismatches:
+            print(f"\n✗ {len(mismatches):,} tag_cooccurrence rows out of date - run with --rebuild")
+            sys.exit(1)
+        print("✓ tag_cooccurrence consistent with phototag")
+
+    print("\n✓ Migration complete!")
+
+def main():
+    """Main entry point"""
+    print("="*60)
+    print("Migration: Add tag co-occurrence table")
+    print("="*60)
+    print()
+
+    try:
+        migrate(rebuild='--rebuild' in sys.argv, check='--check' in sys.argv)
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
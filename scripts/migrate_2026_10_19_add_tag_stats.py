@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Database migration script to add materialized per-tag photo counts
+
+The /tags cloud counted distinct photos per tag across every phototag and photo
+row on each request, and admin tags did the same over a LEFT JOIN. Both now
+read tag_stats, which triggers keep up to date.
+
+Changes:
+- Add tag_stats table (tag_id, privacy, count; tag_id 0 = photos with any tag)
+- Add triggers on phototag, photo and tag that maintain it
+- Backfill tag_stats from existing tags
+
+Safe to run multiple times - uses IF NOT EXISTS and only backfills on first install.
+Pass --check to compare tag_stats with a fresh aggregate, or --rebuild to
+recompute it from scratch.
+"""
+
+import sys
+import os
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from db import *
+import stats
+
+def migrate(rebuild=False, check=False):
+    """Run the migration"""
+    print("Starting tag stats migration...")
+
+    stats.install_tag_stats(db)
+    if rebuild:
+        print("Rebuilding tag_stats from phototag...")
+        stats.rebuild_tag_stats(db)
+
+    cursor = db.execute_sql("""
+        SELECT name FROM sqlite_master
+        WHERE type='trigger' AND name LIKE 'tag_stats_%'
+    """)
+    for (name,) in cursor.fetchall():
+        print(f"  • {name}")
+
+    cursor = db.execute_sql("SELECT COUNT(DISTINCT tag_id) FROM tag_stats WHERE tag_id != 0 AND count > 0")
+    tags = cursor.fetchone()[0]
+    print(f"\n✓ {tags:,} tags with photos")
+
+    if check:
+        mismatches = stats.check_tag_stats(db)
+        for tag_id, privacy, stored, actual in mismatches[:20]:
+            print(f"  ✗ tag {tag_id} privacy {privacy}: stored {stored}, actual {actual}")
+        if mismatches:
+            print(f"\n✗ {len(mismatches):,} tag_stats rows out of date - run with --rebuild")
+            sys.exit(1)
+        print("✓ tag_stats consistent with phototag")
+
+    print("\n✓ Migration complete!")
+
+def main():
+    """Main entry point"""
+    print("="*60)
+    print("Migration: Add materialized tag statistics")
+    print("="*60)
+    print()
+
+    try:
+        migrate(rebuild='--rebuild' in sys.argv, check='--check' in sys.argv)
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Database migration script to add unique (photo, tag) and (photo, photoset) indexes
+
+Bulk edits add tags and photoset members with INSERT ... ON CONFLICT IGNORE,
+which relies on these indexes to skip pairs a photo already has. Without them
+repeated edits and tag merges could leave duplicate phototag/photophotoset rows.
+
+Changes:
+- Delete duplicate phototag and photophotoset rows, keeping the oldest of each pair
+- Add unique index phototag_photo_id_tag_id on phototag(photo_id, tag_id)
+- Add unique index photophotoset_photo_id_photoset_id on photophotoset(photo_id, photoset_id)
+
+Safe to run multiple times - uses IF NOT EXISTS. Duplicates are removed before
+the indexes are created; the statistics triggers ignore rows that aren't the
+last of their pair, so tag_stats and photoset_stats stay correct.
+"""
+
+import sys
+import os
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from db import *
+
+PAIRS = [
+    ('phototag', 'tag_id', 'phototag_photo_id_tag_id'),
+    ('photophotoset', 'photoset_id', 'photophotoset_photo_id_photoset_id'),
+]
+
+def migrate():
+    """Run the migration"""
+    print("Starting unique photo pair migration...")
+
+    with db.atomic():
+        for table, column, index in PAIRS:
+            cursor = db.execute_sql(f"""
+                DELETE FROM {table} WHERE id NOT IN (
+                  SELECT MIN(id) FROM {table} GROUP BY photo_id, {column}
+                )
+            """)
+            print(f"  • {table}: removed {cursor.rowcount:,} duplicate rows")
+            db.execute_sql(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table} (photo_id, {column})")
+            print(f"  • {index}")
+
+    cursor = db.execute_sql("""
+        SELECT name FROM sqlite_master
+        WHERE type='index' AND name IN ('phototag_photo_id_tag_id', 'photophotoset_photo_id_photoset_id')
+    """)
+    created = [name for (name,) in cursor.fetchall()]
+    print(f"\n✓ {len(created)} unique indexes present")
+
+    print("\n✓ Migration complete!")
+
+def main():
+    """Main entry point"""
+    print("="*60)
+    print("Migration: Add unique photo pair indexes")
+    print("="*60)
+    print()
+
+    try:
+        migrate()
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+
+"""full-text search over tags, photosets, import paths and users
+
+A single FTS5 table (SearchIndex in db.py) holds one document per tag,
+photoset, imported file and user. Triggers on the source tables keep it in
+sync, so writes from the web UI, the API and the CLI tools are all covered.
+
+Photos are found through their documents: a photo matches when one of its
+tags, one of its photosets or its import path matches, and documents that
+match better (bm25, names weighted over descriptions) rank it higher.
+"""
+
+import re
+
+from db import *
+
+# rowid = source id * 8 + code, so a trigger can replace an entry by rowid
+KIND_CODES = {'tag': 1, 'photoset': 2, 'photo': 3, 'user': 4}
+
+# (table, kind, ref_id, name, body, columns whose update refreshes the entry)
+# Expressions use {row}, which is "new" in triggers and the table in a rebuild.
+SOURCES = [
+  ('tag', 'tag', '{row}.id', '{row}.name', "''", 'name'),
+  ('photoset', 'photoset', '{row}.id', '{row}.title', "COALESCE({row}.description, '')", 'title, description'),
+  ('importmeta', 'photo', '{row}.photo_id', "COALESCE({row}.importpath, '')", "''", 'importpath, photo_id'),
+  ('user', 'user', '{row}.id', '{row}.email', "''", 'email'),
+]
+
+# admin photo search treats this many or more hex digits as a sha1 prefix
+SHA1_PREFIX_MIN = 4
+SHA1_PREFIX = re.compile(r'^[0-9a-f]+$')
+
+# bm25 weights for (kind, ref_id, name, body)
+WEIGHTS = (0.0, 0.0, 10.0, 1.0)
+
+PHOTO_MATCHES_SQL = """
+  WITH hits AS (
+    SELECT kind, ref_id, bm25(searchindex, {weights}) AS score
+    FROM searchindex
+    WHERE searchindex MATCH ? AND kind IN ('tag', 'photoset', 'photo')
+  ),
+  matches AS (
+    SELECT phototag.photo_id AS photo_id, hits.score AS score
+    FROM hits JOIN phototag ON hits.kind = 'tag' AND phototag.tag_id = hits.ref_id
+    UNION ALL
+    SELECT photophotoset.photo_id, hits.score
+    FROM hits JOIN photophotoset ON hits.kind = 'photoset' AND photophotoset.photoset_id = hits.ref_id
+    UNION ALL
+    SELECT hits.ref_id, hits.score FROM hits WHERE hits.kind = 'photo'
+  )
+  SELECT matches.photo_id AS photo_id, SUM(matches.score) AS score
+  FROM matches JOIN photo ON photo.id = matches.photo_id
+  WHERE photo.privacy IS NULL OR photo.privacy IN ({levels})
+  GROUP BY matches.photo_id
+"""
+
+
+def _quote(table):
+  return f'"{table}"'
+
+
+def install_search_index(database=None):
+  """Create the FTS5 table and its sync triggers, backfilling on first install (idempotent)"""
+  database = database or SearchIndex._meta.database
+  # The index is only trustworthy if the triggers were already maintaining it
+  installed = database.execute_sql(
+    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'searchindex_tag_insert'").fetchone()
+  SearchIndex.create_table(safe=True)
+
+  for table, kind, ref_id, name, body, columns in SOURCES:
+    code = KIND_CODES[kind]
+    values = ', '.join(expr.format(row='new') for expr in (ref_id, name, body))
+    insert = (f"INSERT INTO searchindex (rowid, kind, ref_id, name, body) "
+              f"VALUES (new.id * 8 + {code}, '{kind}', {values});")
+    delete = f"DELETE FROM searchindex WHERE rowid = old.id * 8 + {code};"
+    database.execute_sql(f"""
+      CREATE TRIGGER IF NOT EXISTS searchindex_{table}_insert AFTER INSERT ON {_quote(table)}
+      BEGIN {insert} END
+    """)
+    database.execute_sql(f"""
+      CREATE TRIGGER IF NOT EXISTS searchindex_{table}_update AFTER UPDATE OF {columns} ON {_quote(table)}
+      BEGIN {delete} {insert} END
+    """)
+    database.execute_sql(f"""
+      CREATE TRIGGER IF NOT EXISTS searchindex_{table}_delete AFTER DELETE ON {_quote(table)}
+      BEGIN {delete} END
+    """)
+
+  if not installed:
+    rebuild_search_index(database)
+
+
+def rebuild_search_index(database=None):
+  """Repopulate the index from the source tables"""
+  database = database or SearchIndex._meta.database
+  with database.atomic():
+    database.execute_sql('DELETE FROM searchindex')
+    for table, kind, ref_id, name, body, columns in SOURCES:
+      row = _quote(table)
+      values = ', '.join(expr.format(row=row) for expr in (ref_id, name, body))
+      database.execute_sql(f"""
+        INSERT INTO searchindex (rowid, kind, ref_id, name, body)
+        SELECT {row}.id * 8 + {KIND_CODES[kind]}, '{kind}', {values} FROM {row}
+      """)
+
+
+def fts_query(text):
+  """Turn free text into an FTS5 query, or None if it has no searchable words
+
+  Every word must match (as a prefix); punctuation inside a word such as
+  IMG_0042.JPG becomes a phrase so it matches the tokenized file name.
+  """
+  terms = []
+  for word in (text or '').split():
+    tokens = re.findall(r'[^\W_]+', word.lower())
+    if tokens:
+      terms.append('"%s"*' % ' '.join(tokens))
+  return ' '.join(terms) if terms else None
+
+
+def matching_ids(kind, text):
+  """Subquery of ref_ids of kind whose documents match text (use with .in_())"""
+  query = fts_query(text)
+  if query is None:
+    return []
+  return (SearchIndex
+          .select(SearchIndex.ref_id)
+          .where((SearchIndex.kind == kind) & SearchIndex.match(query)))
+
+
+def matching_photo_ids(text):
+  """Subquery of photo ids reached from any matching tag, photoset or import path"""
+  query = fts_query(text)
+  if query is None:
+    return []
+  return (PhotoTag.select(PhotoTag.photo).where(PhotoTag.tag.in_(matching_ids('tag', text)))
+          | PhotoPhotoset.select(PhotoPhotoset.photo).where(PhotoPhotoset.photoset.in_(matching_ids('photoset', text)))
+          | SearchIndex.select(SearchIndex.ref_id).where((SearchIndex.kind == 'photo') & SearchIndex.match(query)))
+
+
+def admin_photo_filter(text):
+  """Condition for the admin photo search box: photo id, sha1 prefix or full-text match
+
+  The sha1 prefix is a range scan on the sha1 index, only tried for at least
+  SHA1_PREFIX_MIN hex digits (an empty prefix would match every photo).
+  """
+  text = text.strip()
+  condition = Photo.id.in_(matching_photo_ids(text))
+  if text.isdigit():
+    condition |= (Photo.id == int(text))
+  prefix = text.lower()
+  if len(prefix) >= SHA1_PREFIX_MIN and SHA1_PREFIX.match(prefix):
+    condition |= (Photo.sha1 >= prefix) & (Photo.sha1 < prefix + '~')
+  return condition
+
+
+def search_photos(text, visible_levels, page, per_page):
+  """Ranked photo search
+
+  Returns:
+    (total, photos) where photos is the requested page in rank order
+  """
+  query = fts_query(text)
+  if query is None:
+    return 0, []
+  database = SearchIndex._meta.database
+  sql = PHOTO_MATCHES_SQL.format(weights=', '.join(str(w) for w in WEIGHTS),
+                                 levels=', '.join('?' for _ in visible_levels))
+  params = [query] + list(visible_levels)
+
+  total = database.execute_sql(f'SELECT COUNT(*) FROM ({sql})', params).fetchone()[0]
+  rows = database.execute_sql(f'{sql} ORDER BY score, photo_id DESC LIMIT ? OFFSET ?',
+                              params + [per_page, (page - 1) * per_page]).fetchall()
+  ids = [row[0] for row in rows]
+  photos = dict((photo.id, photo) for photo in Photo.select().where(Photo.id.in_(ids)))
+  return total, [photos[photo_id] for photo_id in ids if photo_id in photos]
@@ -105,20 +105,30 @@ def can_edit_photo(user, photo):
     - Contributor role: can edit only their own uploads
     - All others: cannot edit
     """
+    return photo_edit_checker(user)(photo)
+
+
+def photo_edit_checker(user):
+    """
+    Return a function photo -> bool applying can_edit_photo's rules for user.
+
+    The user's roles are looked up once, so checking a page of photos doesn't
+    query them per photo.
+    """
     if not user or not user.is_authenticated:
-        return False
+        return lambda photo: False
+
+    role_names = set(role.name for role in user.roles)
 
     # Admins can edit everything
-    if user.has_role('admin'):
-        return True
+    if 'admin' in role_names:
+        return lambda photo: True
 
     # Contributors can edit their own uploads
-    if user.has_role('contributor'):
-        # Check if this photo was uploaded by this user
-        if photo.uploaded_by_id and photo.uploaded_by_id == user.id:
-            return True
+    if 'contributor' in role_names:
+        return lambda photo: bool(photo.uploaded_by_id) and photo.uploaded_by_id == user.id
 
-    return False
+    return lambda photo: False
 
 
 def can_manage_tags(user):
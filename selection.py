@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+
+"""server-side photo selections for bulk edit
+
+List views used to enumerate every matching photo id into the bulk-edit link.
+Instead a selection stores either the query spec that produced the listing
+(tags, photoset, date, privacy) or a compressed id set, under a short token.
+The bulk editor resolves the token back into a query and pages through it in
+SQL, so nothing ever materializes the full id list in a URL or a template.
+"""
+
+import base64, datetime, hashlib, json, zlib
+from peewee import fn
+
+from app import app
+from db import *
+import archive
+import util
+
+SPEC_KEYS = ('tags', 'photoset', 'date', 'privacy', 'ids')
+
+
+def pack_ids(ids):
+  """Encode photo ids as sorted varint deltas, zlib compressed, urlsafe base64"""
+  out = bytearray()
+  prev = 0
+  for photo_id in sorted(set(int(i) for i in ids)):
+    delta = photo_id - prev
+    prev = photo_id
+    while delta >= 0x80:
+      out.append((delta & 0x7f) | 0x80)
+      delta >>= 7
+    out.append(delta)
+  return base64.urlsafe_b64encode(zlib.compress(bytes(out))).decode('ascii')
+
+
+def unpack_ids(packed):
+  """Inverse of pack_ids, returns a sorted list of ints"""
+  data = zlib.decompress(base64.urlsafe_b64decode(packed.encode('ascii')))
+  ids = []
+  current = shift = delta = 0
+  for byte in data:
+    delta |= (byte & 0x7f) << shift
+    if byte & 0x80:
+      shift += 7
+      continue
+    current += delta
+    ids.append(current)
+    delta = shift = 0
+  return ids
+
+
+def normalize_spec(spec):
+  """Drop unknown/empty keys and canonicalize values so equal specs serialize equally"""
+  clean = {}
+  if spec.get('tags'):
+    tags = spec['tags']
+    if isinstance(tags, str):
+      tags = tags.split(',')
+    tags = sorted(set(t.strip() for t in tags if t and t.strip()))
+    if tags:
+      clean['tags'] = tags
+  if spec.get('photoset') not in (None, ''):
+    clean['photoset'] = int(spec['photoset'])
+  if spec.get('date'):
+    clean['date'] = str(spec['date'])
+  if spec.get('privacy') not in (None, ''):
+    clean['privacy'] = int(spec['privacy'])
+  if spec.get('ids'):
+    ids = spec['ids']
+    clean['ids'] = ids if isinstance(ids, str) else pack_ids(ids)
+  return clean
+
+
+def spec_from_args(args):
+  """Build a spec from request args (tags, photoset, date, privacy)"""
+  return normalize_spec({key: args.get(key) for key in SPEC_KEYS if key != 'ids'})
+
+
+def selection_token(spec, user_id):
+  """Deterministic short token so re-selecting the same listing reuses its row"""
+  payload = json.dumps(spec, sort_keys=True, separators=(',', ':'))
+  digest = hashlib.sha1(f'{user_id}|{payload}'.encode('utf-8')).digest()
+  return util.b58encode(int.from_bytes(digest[:10], 'big'))
+
+
+def create_selection(spec, user_id):
+  """Persist a selection for this user and return its token
+
+  Selections older than SELECTION_EXPIRY_DAYS are pruned on the way in.
+  """
+  spec = normalize_spec(spec)
+  if not spec:
+    raise ValueError('Empty selection')
+  token = selection_token(spec, user_id)
+  now = datetime.datetime.now()
+  cutoff = now - datetime.timedelta(days=app.config.get('SELECTION_EXPIRY_DAYS', 30))
+  Selection.delete().where(Selection.created_at < cutoff).execute()
+  (Selection
+   .insert(token=token, spec=json.dumps(spec, sort_keys=True), created_by_id=user_id, created_at=now)
+   .on_conflict(conflict_target=[Selection.token], update={Selection.created_at: now})
+   .execute())
+  return token
+
+
+def get_selection_spec(token, user_id):
+  """Return the spec stored under token if it belongs to user_id, else None"""
+  selection = Selection.get_or_none((Selection.token == token) & (Selection.created_by_id == user_id))
+  if selection is None:
+    return None
+  return json.loads(selection.spec)
+
+
+def selection_query(spec):
+  """Unordered Photo query for a spec; callers add visibility filters and ordering"""
+  query = Photo.select()
+  if 'ids' in spec:
+    query = query.where(Photo.id.in_(unpack_ids(spec['ids'])))
+  if 'photoset' in spec:
+    query = query.where(Photo.id.in_(
+      PhotoPhotoset.select(PhotoPhotoset.photo).where(PhotoPhotoset.photoset == spec['photoset'])))
+  if 'tags' in spec:
+    tags = spec['tags']
+    tagged = (PhotoTag.select(PhotoTag.photo)
+              .join(Tag)
+              .where(Tag.name.in_(tags))
+              .group_by(PhotoTag.photo)
+              .having(fn.COUNT(fn.DISTINCT(Tag.id)) == len(tags)))
+    query = query.where(Photo.id.in_(tagged))
+  if 'date' in spec:
+    # The same indexed range as the date listing, so both select the same photos
+    query = query.where(archive.datetaken_startswith(spec['date']))
+  if 'privacy' in spec:
+    if spec['privacy'] == 0:
+      query = query.where(Photo.privacy.is_null() | (Photo.privacy == 0))
+    else:
+      query = query.where(Photo.privacy == spec['privacy'])
+  return query
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+
+"""fixed-size memory-mapped files shared by every worker on the host
+
+Counters that every gunicorn worker must agree on, and that change on nearly
+every request (PoW budgets and load, share link views), are too hot for a
+database row. Each lives in a small file that all workers map; updates take
+an exclusive flock on the file (plus a thread lock, as flock does not
+exclude threads sharing a descriptor) and are plain struct reads and writes.
+"""
+
+import fcntl, mmap, os, struct, threading
+from contextlib import contextmanager
+
+
+class SharedFile(object):
+  """A fixed-size file mapped by every worker on the host, with updates serialized by flock
+
+  Subclasses define HEADER, which starts with a magic and one size parameter
+  (_identity); a file with any other layout is zeroed and given a fresh
+  header (_reset) when first mapped.
+  """
+  IDENTITY = struct.Struct('<4sI')
+
+  def __init__(self, path, size):
+    self.path = path
+    self.size = size
+    self._lock = threading.Lock()
+    self._pid = None
+    self._fd = None
+    self._map = None
+
+  def _identity(self):
+    raise NotImplementedError
+
+  def _reset(self, table):
+    raise NotImplementedError
+
+  def _attach(self):
+    """Open and map the file once per process; a forked worker must not share its parent's
+    descriptor, since flock on a shared descriptor would not exclude the parent"""
+    if self._pid == os.getpid():
+      return
+    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+      if os.fstat(fd).st_size != self.size:
+        os.ftruncate(fd, 0)
+        os.ftruncate(fd, self.size)
+      table = mmap.mmap(fd, self.size)
+      if self.IDENTITY.unpack_from(table, 0) != self._identity():
+        table[:] = bytes(self.size)
+        self._reset(table)
+    finally:
+      fcntl.flock(fd, fcntl.LOCK_UN)
+    self._fd, self._map, self._pid = fd, table, os.getpid()
+
+  @contextmanager
+  def _locked(self):
+    with self._lock:
+      self._attach()
+      fcntl.flock(self._fd, fcntl.LOCK_EX)
+      try:
+        yield self._map
+      finally:
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+def resolve(root, path):
+  """path, if relative, under root, so every worker maps the same file whatever its working directory"""
+  return os.path.join(root, path)
+
+
+_instances = {}
+
+
+def instance(cls, *args):
+  """One instance per process for each class and configuration"""
+  key = (cls,) + args
+  if key not in _instances:
+    _instances[key] = cls(*args)
+  return _instances[key]
@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+
+"""cursor pages and batched signed URLs for shared photosets
+
+The shared photoset page used to list every photo in the set and presign an
+S3 URL for each one while rendering, so a 1,500-photo set meant 1,500
+presign calls and a huge document before the first byte. It now renders
+SHARED_PHOTOSET_PAGE_SIZE photos at a time, with ?after=<last photo id> as
+the cursor (only the page without one counts as a view), and the grid's
+images carry only their photo id: lazy-loading.js asks
+/shared/photoset/<token>/urls for signed URLs in batches as they near the
+viewport.
+
+Pages and URL batches both walk the set's ordered id array from neighbors.py
+(datetaken, then id; privacy is bypassed, the share grants access), so a
+cursor is a bisect away and membership checks need no query.
+
+Later pages and URL batches are part of the view the first page counted, so
+that page hands out a view ticket (share id and expiry under an HMAC keyed
+from SECRET_KEY) which they carry; with a valid ticket they are served even
+when that view was the link's last one.
+"""
+
+import base64, collections, hashlib, hmac, time
+
+from app import app
+from db import *
+import aws
+from cards import photo_cards
+import neighbors
+
+# photos are PhotoCards in display order; start is the 0-based position of the first one;
+# next_after is the cursor of the next page (None on the last); prev_after that of the
+# previous page (0 for the first page, None when this is the first page). ?after=0 is the
+# first page again without counting another view
+Page = collections.namedtuple('Page', 'photos start total next_after prev_after')
+
+# the grid thumbnail size; the only one the URL endpoint signs
+GRID_SIZE = '_c'
+
+
+def _ticket_key():
+  """HMAC key for view tickets, or None without a SECRET_KEY to derive it from"""
+  secret = app.config.get('SECRET_KEY')
+  if not secret:
+    return None
+  if isinstance(secret, str):
+    secret = secret.encode('utf-8')
+  return hashlib.sha256(b'cigarbox-share-view\x00' + secret).digest()
+
+
+def _ticket_signature(key, payload):
+  digest = hmac.new(key, payload.encode('ascii'), hashlib.sha256).digest()
+  return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+def issue_ticket(share_id, now=None):
+  """A view ticket for share_id, valid SHARE_VIEW_TICKET_SECONDS (None without a SECRET_KEY)"""
+  key = _ticket_key()
+  if key is None:
+    return None
+  expires_at = int(now if now is not None else time.time()) + app.config.get('SHARE_VIEW_TICKET_SECONDS', 1800)
+  payload = f'{share_id}.{expires_at}'
+  return f'{payload}.{_ticket_signature(key, payload)}'
+
+
+def ticket_valid(ticket, share_id, now=None):
+  """Whether ticket was issued for share_id and hasn't expired"""
+  key = _ticket_key()
+  if key is None or not ticket:
+    return False
+  try:
+    ticket_share, expires_at, signature = ticket.split('.')
+    payload = f'{int(ticket_share)}.{int(expires_at)}'
+  except ValueError:
+    return False
+  if not hmac.compare_digest(signature.encode('utf-8'), _ticket_signature(key, payload).encode('ascii')):
+    return False
+  return int(ticket_share) == share_id and int(expires_at) > (now if now is not None else time.time())
+
+
+def ordered_ids(photoset_id):
+  """The photoset's OrderedIds, from neighbors' per-worker arrays or, without a generation, a query"""
+  ordered = neighbors.photoset(photoset_id)
+  if ordered is not None:
+    return ordered
+  query = (Photo.select(Photo.id).join(PhotoPhotoset)
+           .where(PhotoPhotoset.photoset == photoset_id)
+           .order_by(Photo.datetaken.asc(), Photo.id.asc()))
+  return neighbors.OrderedIds(None, [photo_id for (photo_id,) in query.tuples()])
+
+
+def page_size():
+  return app.config.get('SHARED_PHOTOSET_PAGE_SIZE', app.config.get('PER_PAGE', 100))
+
+
+def page(photoset_id, after=None, size=None):
+  """The Page following the photo id after (from the start if after is None, 0 or no longer in the set)"""
+  size = size or page_size()
+  ordered = ordered_ids(photoset_id)
+  start = 0
+  if after:
+    position = ordered.position(after)
+    if position is not None:
+      start = position + 1
+
+  ids = ordered.order[start:start + size]
+  cards = {card.id: card for card in photo_cards(Photo.select().where(Photo.id.in_(list(ids))))} if ids else {}
+  photos = [cards[photo_id] for photo_id in ids if photo_id in cards]
+
+  next_after = ids[-1] if ids and start + size < len(ordered) else None
+  if start == 0:
+    prev_after = None
+  else:
+    prev_after = ordered.order[start - size - 1] if start > size else 0
+  return Page(photos, start, len(ordered), next_after, prev_after)
+
+
+def batch_limit():
+  return app.config.get('SHARED_URL_BATCH', 100)
+
+
+def signed_urls(photoset_id, photo_ids):
+  """{photo id: signed grid thumbnail URL} for the photo_ids that are in the photoset"""
+  ordered = ordered_ids(photoset_id)
+  wanted = [photo_id for photo_id in dict.fromkeys(photo_ids) if ordered.position(photo_id) is not None]
+  if not wanted:
+    return {}
+  expiry = app.config.get('S3_SIGNED_URL_EXPIRY', 3600)
+  urls = {}
+  for card in photo_cards(Photo.select().where(Photo.id.in_(wanted))):
+    url = aws.getPrivateURL(app.config, f'{card.uri}{GRID_SIZE}.jpg', expiry)
+    if url:
+      urls[card.id] = url
+  return urls
@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+
+"""write-behind view counts for share links
+
+Every view of a share link used to do share_token.views += 1 and save(), so
+a link that went viral became a write storm on one sharetoken row. Views are
+now counted in a table that all workers map (SHARE_VIEW_PATH, see
+sharedfile.py) and written to ShareToken.views in one transaction every
+SHARE_VIEW_FLUSH_SECONDS.
+
+max_views stays exact: each slot holds the persisted count the table last
+knew of and the views pending since, and record_view reserves a view under
+the table's lock only if persisted + pending is below the limit. A flush
+writes the pending views and moves them into the persisted count in the same
+locked step, so no worker ever sees a count that is behind.
+"""
+
+import logging, struct, time
+
+from app import app
+from db import ShareToken
+import sharedfile
+from sharedfile import SharedFile
+
+# set up logging
+logger = logging.getLogger('cigarbox')
+
+
+def _load_views(share_id):
+  """The persisted view count (a share not in the table yet, or revoked: 0)"""
+  row = ShareToken.select(ShareToken.views).where(ShareToken.id == share_id).tuples().first()
+  return row[0] if row else 0
+
+
+def _persist(pending):
+  """Add {share id: views} to ShareToken.views in one transaction"""
+  with ShareToken._meta.database.atomic():
+    for share_id, count in pending.items():
+      ShareToken.update(views=ShareToken.views + count).where(ShareToken.id == share_id).execute()
+
+
+class ViewTable(SharedFile):
+  """Views per share link, persisted and pending, shared across processes
+
+  The file is a header (magic, slot count, last flush time) followed by
+  fixed-size slots of (share id, persisted views, pending views, last used).
+  Share id 0 is an empty slot. Each flush rebuilds the table without links
+  idle for SHARE_VIEW_IDLE_SECONDS; their next view reads the database again.
+  """
+  MAGIC = b'CBSV'
+  HEADER = struct.Struct('<4sId')
+  SLOT = struct.Struct('<QqId')
+
+  def __init__(self, path, slots=4096, flush_seconds=10, idle_seconds=600):
+    self.slots = slots
+    self.flush_seconds = flush_seconds
+    self.idle_seconds = idle_seconds
+    super().__init__(path, self.HEADER.size + slots * self.SLOT.size)
+
+  def _identity(self):
+    return (self.MAGIC, self.slots)
+
+  def _reset(self, table):
+    self.HEADER.pack_into(table, 0, self.MAGIC, self.slots, time.time())
+
+  def _offset(self, index):
+    return self.HEADER.size + index * self.SLOT.size
+
+  def _find(self, table, share_id):
+    """(slot holding share_id or None, the empty slot it would go in or None if full)"""
+    start = (share_id * 2654435761) % self.slots
+    for step in range(self.slots):
+      index = (start + step) % self.slots
+      slot_id = self.SLOT.unpack_from(table, self._offset(index))[0]
+      if slot_id == share_id:
+        return index, None
+      if slot_id == 0:
+        return None, index
+    return None, None
+
+  def _flush(self, table, now, keep_idle=True):
+    """Persist pending views, then rebuild the table without idle links (or without any,
+    if not keep_idle); returns views written"""
+    entries = [entry for entry in (self.SLOT.unpack_from(table, self._offset(index)) for index in range(self.slots))
+               if entry[0]]
+    pending = {share_id: count for share_id, _, count, _ in entries if count}
+    if pending:
+      try:
+        _persist(pending)
+      except Exception as e:
+        # Keep the views pending and retry at the next flush
+        logger.error(f'Share view flush failed ({sum(pending.values())} views pending): {e}')
+        self.HEADER.pack_into(table, 0, self.MAGIC, self.slots, now)
+        return 0
+
+    keep = [(share_id, persisted + count, 0, used) for share_id, persisted, count, used in entries
+            if keep_idle and now - used < self.idle_seconds]
+    table[self.HEADER.size:] = bytes(self.size - self.HEADER.size)
+    for entry in keep:
+      _, free = self._find(table, entry[0])
+      self.SLOT.pack_into(table, self._offset(free), *entry)
+    self.HEADER.pack_into(table, 0, self.MAGIC, self.slots, now)
+    return sum(pending.values())
+
+  def reserve(self, share_id, max_views, now=None):
+    """Count one view unless max_views is reached: the view's number, or None at the limit"""
+    now = now if now is not None else time.time()
+    with self._locked() as table:
+      flushed_at = self.HEADER.unpack_from(table, 0)[2]
+      if now - flushed_at >= self.flush_seconds:
+        self._flush(table, now)
+
+      index, free = self._find(table, share_id)
+      if index is None and free is None:
+        # Every slot holds a link viewed within the idle time: drop them all to make room
+        self._flush(table, now, keep_idle=False)
+        index, free = self._find(table, share_id)
+      if index is None:
+        if free is None:
+          return self._reserve_in_database(share_id, max_views)
+        index, entry = free, (share_id, _load_views(share_id), 0, now)
+      else:
+        entry = self.SLOT.unpack_from(table, self._offset(index))
+
+      _, persisted, pending, _ = entry
+      if max_views and persisted + pending >= max_views:
+        return None
+      self.SLOT.pack_into(table, self._offset(index), share_id, persisted, pending + 1, now)
+      return persisted + pending + 1
+
+  def _reserve_in_database(self, share_id, max_views):
+    """Write-through fallback when the table can't take another link"""
+    logger.error(f'Share view table full ({self.slots} slots), raise SHARE_VIEW_SLOTS')
+    query = ShareToken.update(views=ShareToken.views + 1).where(ShareToken.id == share_id)
+    if max_views:
+      query = query.where(ShareToken.views < max_views)
+    if not query.execute():
+      return None
+    return _load_views(share_id)
+
+  def views(self, share_id, persisted):
+    """Current views of share_id; persisted is its ShareToken.views, used if it isn't in the table"""
+    with self._locked() as table:
+      index, _ = self._find(table, share_id)
+      if index is None:
+        return persisted
+      _, table_persisted, pending, _ = self.SLOT.unpack_from(table, self._offset(index))
+      return table_persisted + pending
+
+  def flush(self, now=None):
+    """Persist pending views now; returns how many were written"""
+    with self._locked() as table:
+      return self._flush(table, now if now is not None else time.time())
+
+
+def table():
+  """The process's ViewTable for the configured path and size"""
+  path = sharedfile.resolve(app.root_path, app.config.get('SHARE_VIEW_PATH', 'share_views.bin'))
+  return sharedfile.instance(ViewTable, path,
+                             app.config.get('SHARE_VIEW_SLOTS', 4096),
+                             app.config.get('SHARE_VIEW_FLUSH_SECONDS', 10),
+                             app.config.get('SHARE_VIEW_IDLE_SECONDS', 600))
+
+
+def record_view(share_token):
+  """Count a view of share_token if its max_views allows; False at the limit
+
+  share_token.views is set to the count including this view.
+  """
+  views = table().reserve(share_token.id, share_token.max_views)
+  if views is None:
+    return False
+  share_token.views = views
+  return True
+
+
+def current_views(share_token):
+  """share_token's views including those not flushed yet"""
+  return table().views(share_token.id, share_token.views)
+
+
+def limit_reached(share_token):
+  """Whether share_token has used up its max_views"""
+  return bool(share_token.max_views) and current_views(share_token) >= share_token.max_views
+
+
+def flush():
+  """Write pending views to ShareToken.views (admin listings, worker exit)"""
+  return table().flush()
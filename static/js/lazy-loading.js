@@ -1,13 +1,21 @@
 /**
  * Lazy Loading for Images
  * Uses IntersectionObserver to load images as they enter viewport
+ *
+ * Images with data-src load that URL. Images with data-photo-id inside a
+ * container with data-url-endpoint (shared photosets) have no URL yet: the ids
+ * of images nearing the viewport are collected and their signed URLs fetched
+ * from the endpoint (?ids=1,2,3), at most data-url-batch per request, passing
+ * the page's data-url-ticket along.
  */
 
 (function() {
   'use strict';
 
+  var BATCH_DELAY = 50;  // ms to collect ids scrolling into view before a request
+
   function initLazyLoading() {
-    var lazyImages = document.querySelectorAll('img.lazy');
+    var lazyImages = document.querySelectorAll('img.lazy[data-src]');
 
     if ('IntersectionObserver' in window) {
       var imageObserver = new IntersectionObserver(function(entries, observer) {
@@ -32,6 +40,91 @@
         img.src = img.dataset.src;
       });
     }
+
+    document.querySelectorAll('[data-url-endpoint]').forEach(initSignedUrls);
+  }
+
+  function initSignedUrls(container) {
+    var endpoint = container.dataset.urlEndpoint;
+    var batchSize = parseInt(container.dataset.urlBatch, 10) || 100;
+    var ticket = container.dataset.urlTicket;
+    var images = {};    // photo id -> img still waiting for a URL
+    var queued = [];    // ids near the viewport, not requested yet
+    var timer = null;
+    var stopped = false;
+
+    container.querySelectorAll('img.lazy[data-photo-id]').forEach(function(img) {
+      images[img.dataset.photoId] = img;
+    });
+
+    function request() {
+      timer = null;
+      if (stopped || queued.length === 0) {
+        return;
+      }
+      var ids = queued.splice(0, batchSize);
+      var url = endpoint + '?ids=' + ids.join(',');
+      if (ticket) {
+        url += '&ticket=' + encodeURIComponent(ticket);
+      }
+      fetch(url, {credentials: 'same-origin'})
+        .then(function(response) {
+          if (response.status === 410) {
+            // Link expired or out of views: leave the placeholders
+            stopped = true;
+          }
+          return response.ok ? response.json() : {urls: {}};
+        })
+        .then(function(data) {
+          ids.forEach(function(id) {
+            var img = images[id];
+            if (img && data.urls[id]) {
+              img.src = data.urls[id];
+              img.classList.remove('lazy');
+              delete images[id];
+            }
+          });
+        })
+        .catch(function(error) {
+          console.error('Signed URL request failed:', error);
+        });
+      if (queued.length > 0) {
+        schedule();
+      }
+    }
+
+    function schedule() {
+      if (timer === null) {
+        timer = setTimeout(request, BATCH_DELAY);
+      }
+    }
+
+    function enqueue(id) {
+      if (images[id] && queued.indexOf(id) === -1) {
+        queued.push(id);
+        schedule();
+      }
+    }
+
+    if ('IntersectionObserver' in window) {
+      var urlObserver = new IntersectionObserver(function(entries) {
+        entries.forEach(function(entry) {
+          if (entry.isIntersecting) {
+            urlObserver.unobserve(entry.target);
+            enqueue(entry.target.dataset.photoId);
+          }
+        });
+      }, {
+        rootMargin: '400px'
+      });
+
+      Object.keys(images).forEach(function(id) {
+        urlObserver.observe(images[id]);
+      });
+    } else {
+      // Fallback for older browsers: request every URL, batch by batch
+      Object.keys(images).forEach(enqueue);
+    }
   }
 
   // Auto-initialize on DOM ready
@@ -2,20 +2,34 @@
  * CigarBox Proof-of-Work (POW) Challenge Solver
  *
  * Unified module for solving POW challenges across the application.
- * Uses main thread SHA-256 hashing with periodic UI updates.
- * Supports both secure (crypto.subtle) and non-secure (fallback) contexts.
+ * The nonce search runs in one Web Worker per core (navigator.hardwareConcurrency),
+ * worker i trying nonces i, i + N, i + 2N, ... so no two workers repeat work.
+ * Falls back to searching in short slices on the main thread when workers
+ * are unavailable. Works in secure and non-secure (HTTP) contexts alike.
  */
 
 (function() {
   'use strict';
 
-  // Check if crypto.subtle is available (HTTPS or localhost only)
-  const hasCryptoSubtle = typeof crypto !== 'undefined' &&
-                          typeof crypto.subtle !== 'undefined';
-
-  // Fallback SHA-256 implementation for non-secure contexts (HTTP)
-  // Based on js-sha256 by Chen, Yi-Cyuan (MIT License)
-  function sha256Fallback(message) {
+  // Nonces tried between progress reports (and between UI yields on the main thread)
+  const BATCH_SIZE = 20000;
+
+  // Largest number of workers started, however many cores are reported
+  const MAX_WORKERS = 16;
+
+  /**
+   * Build search(start, stride, count) for one challenge: tries count nonces
+   * start, start + stride, ... and returns the first whose
+   * sha256(challenge + nonce) hex digest starts with difficulty zeros, or -1.
+   *
+   * A tight SHA-256 (based on js-sha256 by Chen, Yi-Cyuan, MIT License) that
+   * allocates nothing per attempt: the full 64-byte blocks of the challenge are
+   * hashed once up front, each attempt compresses only the last block or two,
+   * and leading zeros are checked on the state words instead of a hex string.
+   *
+   * Self-contained so its source can be shipped to a worker with toString().
+   */
+  function createSearch(challenge, difficulty) {
     var K = [
       0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
       0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
@@ -26,94 +40,197 @@
       0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
       0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
     ];
-
-    function sha256_asm(message) {
-      var h = [0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19];
-      var w = new Array(64);
-
-      var blocks = [];
-      var bytes = new TextEncoder().encode(message);
-      var len = bytes.length;
-      var bitLen = len * 8;
-
-      // Padding
-      var msgLen = len + 1 + 8;
-      var blockCount = Math.ceil(msgLen / 64);
-      var totalLen = blockCount * 64;
-      var padding = new Uint8Array(totalLen);
-      padding.set(bytes);
-      padding[len] = 0x80;
-
-      // Length in bits as big-endian 64-bit integer
-      for (var i = 0; i < 8; i++) {
-        padding[totalLen - 1 - i] = bitLen & 0xff;
-        bitLen >>>= 8;
+    var w = new Int32Array(64);
+    var h = new Int32Array(8);
+
+    // Compress the 64-byte block at offset of bytes into state h
+    function compress(bytes, offset) {
+      var j, s0, s1;
+      for (j = 0; j < 16; j++) {
+        var p = offset + j * 4;
+        w[j] = (bytes[p] << 24) | (bytes[p + 1] << 16) | (bytes[p + 2] << 8) | bytes[p + 3];
+      }
+      for (j = 16; j < 64; j++) {
+        s0 = ((w[j-15] >>> 7) | (w[j-15] << 25)) ^ ((w[j-15] >>> 18) | (w[j-15] << 14)) ^ (w[j-15] >>> 3);
+        s1 = ((w[j-2] >>> 17) | (w[j-2] << 15)) ^ ((w[j-2] >>> 19) | (w[j-2] << 13)) ^ (w[j-2] >>> 10);
+        w[j] = (w[j-16] + s0 + w[j-7] + s1) | 0;
       }
 
-      // Process blocks
-      for (var i = 0; i < blockCount; i++) {
-        var offset = i * 64;
+      var a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], hh = h[7];
+      for (j = 0; j < 64; j++) {
+        var S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+        var ch = (e & f) ^ (~e & g);
+        var temp1 = (hh + S1 + ch + K[j] + w[j]) | 0;
+        var S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+        var maj = (a & b) ^ (a & c) ^ (b & c);
+        hh = g;
+        g = f;
+        f = e;
+        e = (d + temp1) | 0;
+        d = c;
+        c = b;
+        b = a;
+        a = (temp1 + S0 + maj) | 0;
+      }
+      h[0] = (h[0] + a) | 0;
+      h[1] = (h[1] + b) | 0;
+      h[2] = (h[2] + c) | 0;
+      h[3] = (h[3] + d) | 0;
+      h[4] = (h[4] + e) | 0;
+      h[5] = (h[5] + f) | 0;
+      h[6] = (h[6] + g) | 0;
+      h[7] = (h[7] + hh) | 0;
+    }
 
-        // Prepare message schedule
-        for (var j = 0; j < 16; j++) {
-          w[j] = (padding[offset + j * 4] << 24) | (padding[offset + j * 4 + 1] << 16) |
-                 (padding[offset + j * 4 + 2] << 8) | padding[offset + j * 4 + 3];
+    // Midstate after every full block of the challenge
+    var prefix = new TextEncoder().encode(challenge);
+    var fullBlocks = Math.floor(prefix.length / 64);
+    h.set([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]);
+    for (var block = 0; block < fullBlocks; block++) {
+      compress(prefix, block * 64);
+    }
+    var midstate = new Int32Array(h);
+
+    // Remaining challenge bytes, nonce digits, padding and length: at most two blocks
+    var tail = prefix.subarray(fullBlocks * 64);
+    var buffer = new Uint8Array(128);
+    buffer.set(tail);
+    var zeroBits = difficulty * 4;
+
+    function hasLeadingZeros() {
+      var bits = zeroBits;
+      for (var i = 0; bits > 0 && i < 8; i++) {
+        if (bits < 32) {
+          return (h[i] >>> (32 - bits)) === 0;
         }
+        if (h[i] !== 0) {
+          return false;
+        }
+        bits -= 32;
+      }
+      return true;
+    }
 
-        for (var j = 16; j < 64; j++) {
-          var s0 = ((w[j-15] >>> 7) | (w[j-15] << 25)) ^ ((w[j-15] >>> 18) | (w[j-15] << 14)) ^ (w[j-15] >>> 3);
-          var s1 = ((w[j-2] >>> 17) | (w[j-2] << 15)) ^ ((w[j-2] >>> 19) | (w[j-2] << 13)) ^ (w[j-2] >>> 10);
-          w[j] = (w[j-16] + s0 + w[j-7] + s1) >>> 0;
+    return function search(start, stride, count) {
+      var nonce = start;
+      for (var n = 0; n < count; n++, nonce += stride) {
+        var digits = String(nonce);
+        var length = tail.length;
+        for (var i = 0; i < digits.length; i++) {
+          buffer[length++] = digits.charCodeAt(i);
+        }
+        var bitLength = (prefix.length + digits.length) * 8;
+        buffer[length++] = 0x80;
+        var end = length + 8 <= 64 ? 64 : 128;
+        buffer.fill(0, length, end - 4);
+        buffer[end - 4] = bitLength >>> 24;
+        buffer[end - 3] = (bitLength >>> 16) & 0xff;
+        buffer[end - 2] = (bitLength >>> 8) & 0xff;
+        buffer[end - 1] = bitLength & 0xff;
+
+        h.set(midstate);
+        compress(buffer, 0);
+        if (end === 128) {
+          compress(buffer, 64);
         }
+        if (hasLeadingZeros()) {
+          return nonce;
+        }
+      }
+      return -1;
+    };
+  }
 
-        var a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], hh = h[7];
-
-        for (var j = 0; j < 64; j++) {
-          var S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
-          var ch = (e & f) ^ (~e & g);
-          var temp1 = (hh + S1 + ch + K[j] + w[j]) >>> 0;
-          var S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
-          var maj = (a & b) ^ (a & c) ^ (b & c);
-          var temp2 = (S0 + maj) >>> 0;
-
-          hh = g;
-          g = f;
-          f = e;
-          e = (d + temp1) >>> 0;
-          d = c;
-          c = b;
-          b = a;
-          a = (temp1 + temp2) >>> 0;
+  // Worker body: search its stride in batches, reporting progress after each
+  function workerMain(createSearch, batchSize) {
+    self.onmessage = function(event) {
+      var job = event.data;
+      var search = createSearch(job.challenge, job.difficulty);
+      for (var nonce = job.start; ; nonce += job.stride * batchSize) {
+        var found = search(nonce, job.stride, batchSize);
+        if (found >= 0) {
+          self.postMessage({attempts: (found - nonce) / job.stride + 1, nonce: found});
+          return;
         }
+        self.postMessage({attempts: batchSize});
+      }
+    };
+  }
+
+  const workerSource = '(' + workerMain.toString() + ')(' + createSearch.toString() + ', ' + BATCH_SIZE + ');';
 
-        h[0] = (h[0] + a) >>> 0;
-        h[1] = (h[1] + b) >>> 0;
-        h[2] = (h[2] + c) >>> 0;
-        h[3] = (h[3] + d) >>> 0;
-        h[4] = (h[4] + e) >>> 0;
-        h[5] = (h[5] + f) >>> 0;
-        h[6] = (h[6] + g) >>> 0;
-        h[7] = (h[7] + hh) >>> 0;
+  // Solve with one worker per core; rejects if workers can't be started or fail
+  function solveWithWorkers(challenge, difficulty, onProgress) {
+    const threads = Math.max(1, Math.min(navigator.hardwareConcurrency || 1, MAX_WORKERS));
+    const url = URL.createObjectURL(new Blob([workerSource], {type: 'application/javascript'}));
+    const workers = [];
+
+    return new Promise((resolve, reject) => {
+      let attempts = 0;
+      let done = false;
+
+      function finish() {
+        done = true;
+        workers.forEach(worker => worker.terminate());
+        URL.revokeObjectURL(url);
       }
 
-      return h.map(n => n.toString(16).padStart(8, '0')).join('');
-    }
+      try {
+        for (let i = 0; i < threads; i++) {
+          const worker = new Worker(url);
+          worker.onmessage = function(event) {
+            if (done) return;
+            attempts += event.data.attempts;
+            if (event.data.nonce !== undefined) {
+              finish();
+              resolve({nonce: event.data.nonce, attempts: attempts, threads: threads});
+            } else {
+              onProgress(attempts, threads);
+            }
+          };
+          worker.onerror = function(error) {
+            if (done) return;
+            finish();
+            reject(error);
+          };
+          workers.push(worker);
+        }
+      } catch (error) {
+        finish();
+        reject(error);
+        return;
+      }
+
+      workers.forEach((worker, i) => worker.postMessage({
+        challenge: challenge, difficulty: difficulty, start: i, stride: threads
+      }));
+    });
+  }
 
-    return sha256_asm(message);
+  // Single-threaded fallback: search in batches, yielding to the UI between them
+  async function solveOnMainThread(challenge, difficulty, onProgress) {
+    const search = createSearch(challenge, difficulty);
+    let attempts = 0;
+    for (let nonce = 0; ; nonce += BATCH_SIZE) {
+      const found = search(nonce, 1, BATCH_SIZE);
+      if (found >= 0) {
+        return {nonce: found, attempts: attempts + found - nonce + 1, threads: 1};
+      }
+      attempts += BATCH_SIZE;
+      onProgress(attempts, 1);
+      await new Promise(resolve => setTimeout(resolve, 0));
+    }
   }
 
-  // SHA-256 hash function - uses Web Crypto API or fallback
-  async function sha256(message) {
-    if (hasCryptoSubtle) {
-      // Secure context - use Web Crypto API
-      const msgBuffer = new TextEncoder().encode(message);
-      const hashBuffer = await crypto.subtle.digest('SHA-256', msgBuffer);
-      const hashArray = Array.from(new Uint8Array(hashBuffer));
-      return hashArray.map(b => b.toString(16).padStart(2, '0')).join('');
-    } else {
-      // Non-secure context (HTTP) - use fallback
-      return sha256Fallback(message);
+  async function solve(challenge, difficulty, onProgress) {
+    if (typeof Worker !== 'undefined' && typeof Blob !== 'undefined' && typeof URL !== 'undefined') {
+      try {
+        return await solveWithWorkers(challenge, difficulty, onProgress);
+      } catch (error) {
+        console.warn('[POW] Web Workers unavailable, solving on the main thread:', error);
+      }
     }
+    return solveOnMainThread(challenge, difficulty, onProgress);
   }
 
   // Validate return URL is relative (security)
@@ -164,33 +281,25 @@
 
       // Step 2: Solve POW puzzle
       statusText.textContent = 'Solving puzzle...';
-      let nonce = 0;
-      let hash;
-      let attempts = 0;
       const startTime = Date.now();
+      let lastUpdate = 0;
 
-      while (true) {
-        const input = data.challenge + nonce;
-        hash = await sha256(input);
-        attempts++;
-
-        // Update UI every 1000 attempts
-        if (attempts % 1000 === 0) {
-          const elapsed = (Date.now() - startTime) / 1000;
-          if (attemptsText) {
-            attemptsText.textContent = attempts + ' attempts (' + elapsed.toFixed(1) + 's)';
-          }
-          // Allow UI update (prevent browser freeze)
-          await new Promise(resolve => setTimeout(resolve, 0));
-        }
+      function describe(attempts, threads) {
+        const elapsed = (Date.now() - startTime) / 1000;
+        const rate = elapsed > 0 ? Math.round(attempts / elapsed / 1000) : 0;
+        return attempts + ' attempts (' + elapsed.toFixed(1) + 's, ' + rate + 'k/s, ' +
+               threads + (threads === 1 ? ' thread)' : ' threads)');
+      }
 
-        // Check if solution found
-        if (hash.startsWith('0'.repeat(data.difficulty))) {
-          console.log('[POW] Solution found! nonce=' + nonce + ' attempts=' + attempts);
-          break;
+      const solution = await solve(data.challenge, data.difficulty, (attempts, threads) => {
+        // Progress arrives per batch from every worker; redraw at most 4 times a second
+        if (attemptsText && Date.now() - lastUpdate > 250) {
+          lastUpdate = Date.now();
+          attemptsText.textContent = describe(attempts, threads);
         }
-        nonce++;
-      }
+      });
+      console.log('[POW] Solution found! nonce=' + solution.nonce + ' attempts=' + solution.attempts +
+                  ' threads=' + solution.threads);
 
       // Step 3: Submit solution to server
       statusText.textContent = 'Verifying solution...';
@@ -199,7 +308,7 @@
         headers: {'Content-Type': 'application/json'},
         body: JSON.stringify({
           challenge: data.challenge,
-          nonce: nonce,
+          nonce: solution.nonce,
           return_url: returnUrl
         })
       });
@@ -213,8 +322,7 @@
       if (result.success) {
         statusText.textContent = 'Verified! ✓';
         if (attemptsText) {
-          const elapsed = (Date.now() - startTime) / 1000;
-          attemptsText.textContent = attempts + ' attempts (' + elapsed.toFixed(1) + 's) - Success!';
+          attemptsText.textContent = describe(solution.attempts, solution.threads) + ' - Success!';
         }
 
         // Redirect to original page
@@ -8,12 +8,17 @@
  * - Backspace to remove last pill
  * - Paste support (splits on comma/space)
  * - Automatic lowercase conversion
+ * - Suggestions from /api/tags/suggest (debounced, most used tags first)
  *
  * Usage:
- *   initTagAutocomplete('#tags', ['vacation', 'beach', 'summer']);
+ *   initTagAutocomplete('#tags', SITEURL + '/api/tags/suggest');
+ *   initTagAutocomplete('#tags', ['vacation', 'beach', 'summer']);  // fixed list
  */
 
-function initTagAutocomplete(inputSelector, allTags) {
+// Wait this long after the last keystroke before asking the server
+var TAG_SUGGEST_DELAY_MS = 150;
+
+function initTagAutocomplete(inputSelector, tagSource) {
   // Accept either a CSS selector string or a DOM element
   var originalInput = typeof inputSelector === 'string' ? document.querySelector(inputSelector) : inputSelector;
   if (!originalInput) return;
@@ -135,43 +140,93 @@ function initTagAutocomplete(inputSelector, allTags) {
     pillContainer.insertBefore(pill, wrapper);
   });
 
+  // Suggestions: filter a fixed array, or ask the suggest endpoint (debounced, cached per prefix)
+  var suggestCache = {};
+  var suggestTimer = null;
+  var latestQuery = null;
+
+  function fetchSuggestions(value, callback) {
+    if (Array.isArray(tagSource)) {
+      callback(tagSource);
+      return;
+    }
+    if (Object.prototype.hasOwnProperty.call(suggestCache, value)) {
+      callback(suggestCache[value]);
+      return;
+    }
+    latestQuery = value;
+    clearTimeout(suggestTimer);
+    suggestTimer = setTimeout(function() {
+      fetch(tagSource + '?q=' + encodeURIComponent(value), {
+        credentials: 'same-origin',
+        headers: { 'Accept': 'application/json' }
+      })
+        .then(function(response) { return response.ok ? response.json() : { tags: [] }; })
+        .then(function(data) {
+          var names = (data.tags || []).map(function(tag) { return tag.name; });
+          suggestCache[value] = names;
+          // Drop answers to prefixes the user has typed past
+          if (value === latestQuery) {
+            callback(names);
+          }
+        })
+        .catch(function() {});
+    }, TAG_SUGGEST_DELAY_MS);
+  }
+
+  function hideSuggestion() {
+    currentSuggestion = null;
+    dropdown.style.display = 'none';
+  }
+
+  function showSuggestion(value, suggestion) {
+    currentSuggestion = suggestion;
+    dropdown.innerHTML = '<div class="dropdown-item" style="padding: 4px 8px; cursor: pointer;"><strong>' +
+                         value + '</strong>' +
+                         suggestion.substring(value.length) +
+                         ' <span class="text-muted">(tap or space)</span></div>';
+    dropdown.style.display = 'block';
+
+    // Make dropdown clickable for mobile
+    var dropdownItem = dropdown.querySelector('.dropdown-item');
+    dropdownItem.onclick = function(e) {
+      e.preventDefault();
+      e.stopPropagation();
+      addPill(currentSuggestion);
+      inlineInput.value = '';
+      hideSuggestion();
+      inlineInput.focus();
+    };
+  }
+
   // Update autocomplete suggestion
   function updateSuggestion() {
     var value = inlineInput.value.trim();
 
-    if (value.length > 0) {
+    if (value.length === 0) {
+      hideSuggestion();
+      return;
+    }
+
+    // Keep showing the previous suggestion only while it still fits
+    if (currentSuggestion && !currentSuggestion.startsWith(value.toLowerCase())) {
+      hideSuggestion();
+    }
+
+    fetchSuggestions(value.toLowerCase(), function(names) {
+      if (inlineInput.value.trim() !== value) return;
+
       // Find matching tags
-      var matches = allTags.filter(function(tag) {
+      var matches = names.filter(function(tag) {
         return tag.toLowerCase().startsWith(value.toLowerCase()) && tags.indexOf(tag) === -1;
       });
 
       if (matches.length > 0) {
-        currentSuggestion = matches[0];
-        dropdown.innerHTML = '<div class="dropdown-item" style="padding: 4px 8px; cursor: pointer;"><strong>' +
-                             value + '</strong>' +
-                             matches[0].substring(value.length) +
-                             ' <span class="text-muted">(tap or space)</span></div>';
-        dropdown.style.display = 'block';
-
-        // Make dropdown clickable for mobile
-        var dropdownItem = dropdown.querySelector('.dropdown-item');
-        dropdownItem.onclick = function(e) {
-          e.preventDefault();
-          e.stopPropagation();
-          addPill(currentSuggestion);
-          inlineInput.value = '';
-          currentSuggestion = null;
-          dropdown.style.display = 'none';
-          inlineInput.focus();
-        };
+        showSuggestion(value, matches[0]);
       } else {
-        currentSuggestion = null;
-        dropdown.style.display = 'none';
+        hideSuggestion();
       }
-    } else {
-      currentSuggestion = null;
-      dropdown.style.display = 'none';
-    }
+    });
   }
 
   // Accept current input as pill
@@ -0,0 +1,585 @@
+#! /usr/bin/env python
+
+"""materialized per-tag and per-photoset statistics
+
+tag_stats holds the number of distinct photos per tag and privacy level,
+maintained by triggers on phototag, photo and tag, so the tag cloud and the
+admin tag list read a few thousand small rows instead of aggregating every
+phototag row. tag_id 0 counts photos that have at least one tag (the cloud's
+"organizing N photos" total).
+
+tag_cooccurrence holds, per pair of tags and privacy level, the number of
+photos carrying both (stored in both directions), maintained by the same
+events. Related tags on a tag page are read from it instead of aggregating
+phototag over every photo that matches the page.
+
+photoset_stats holds, per photoset and privacy level, the photo count, the
+datetaken range and the cover (first photo by datetaken, then id), maintained
+by triggers on photophotoset, photo and photoset. Counts and range extensions
+are incremental; a set's range and cover are only recomputed when the photo
+that defined them leaves.
+
+Databases from before the unique (photo, tag) and (photo, photoset) indexes
+may still hold duplicate pairs, so the triggers only count a pair when its
+first row arrives and uncount it when its last row goes.
+"""
+
+import logging
+from peewee import *
+
+from db import *
+
+# set up logging
+logger = logging.getLogger('cigarbox')
+
+# Distinct tag ids of a photo plus the "any tag" row 0, if the photo has tags
+PHOTO_TAGS_SQL = ("SELECT tag_id FROM phototag WHERE photo_id = {photo} "
+                  "UNION SELECT 0 FROM phototag WHERE photo_id = {photo}")
+
+TAG_STATS_SQL = """
+  SELECT phototag.tag_id, COALESCE(photo.privacy, 0), COUNT(DISTINCT phototag.photo_id)
+  FROM phototag JOIN photo ON photo.id = phototag.photo_id
+  GROUP BY 1, 2
+  UNION ALL
+  SELECT 0, COALESCE(photo.privacy, 0), COUNT(DISTINCT phototag.photo_id)
+  FROM phototag JOIN photo ON photo.id = phototag.photo_id
+  GROUP BY 2
+"""
+
+
+def _add_pair(row, same_photo=''):
+  """Count row's (photo, tag) pair, and its photo under tag 0, unless already counted"""
+  add = ("INSERT INTO tag_stats (tag_id, privacy, count) "
+         "SELECT {tag}, COALESCE(photo.privacy, 0), 1 FROM photo "
+         "WHERE photo.id = {row}.photo_id AND NOT EXISTS ("
+         "SELECT 1 FROM phototag WHERE photo_id = {row}.photo_id{pair} AND id != {row}.id) {extra}"
+         "ON CONFLICT(tag_id, privacy) DO UPDATE SET count = count + 1;")
+  return (add.format(row=row, tag=f'{row}.tag_id', pair=f' AND tag_id = {row}.tag_id', extra='') +
+          add.format(row=row, tag='0', pair='', extra=same_photo))
+
+
+def _remove_pair(row, same_photo=''):
+  """Uncount row's (photo, tag) pair, and its photo under tag 0, once no rows remain"""
+  remove = ("UPDATE tag_stats SET count = count - 1 "
+            "WHERE tag_id = {tag} AND privacy = (SELECT COALESCE(privacy, 0) FROM photo WHERE id = {row}.photo_id) "
+            "AND NOT EXISTS (SELECT 1 FROM phototag WHERE photo_id = {row}.photo_id{pair}) {extra};")
+  return (remove.format(row=row, tag=f'{row}.tag_id', pair=f' AND tag_id = {row}.tag_id', extra='') +
+          remove.format(row=row, tag='0', pair='', extra=same_photo))
+
+
+def install_tag_stats(database=None):
+  """Create the tag_stats table and triggers, backfilling on first install (idempotent)"""
+  database = database or TagStats._meta.database
+  # Counts are only trustworthy if the triggers were already maintaining them
+  installed = database.execute_sql(
+    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'tag_stats_phototag_insert'").fetchone()
+  TagStats.create_table(safe=True)
+
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS tag_stats_phototag_insert AFTER INSERT ON phototag
+    BEGIN {_add_pair('new')} END
+  """)
+  # Moving a row to another tag leaves its photo's tag 0 count alone
+  moved = 'AND old.photo_id != new.photo_id '
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS tag_stats_phototag_update AFTER UPDATE OF photo_id, tag_id ON phototag
+    WHEN old.photo_id != new.photo_id OR old.tag_id != new.tag_id
+    BEGIN {_remove_pair('old', moved)} {_add_pair('new', moved)} END
+  """)
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS tag_stats_phototag_delete AFTER DELETE ON phototag
+    BEGIN {_remove_pair('old')} END
+  """)
+
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS tag_stats_photo_update AFTER UPDATE OF privacy ON photo
+    WHEN COALESCE(old.privacy, 0) != COALESCE(new.privacy, 0)
+    BEGIN
+      UPDATE tag_stats SET count = count - 1
+      WHERE privacy = COALESCE(old.privacy, 0) AND tag_id IN ({PHOTO_TAGS_SQL.format(photo='new.id')});
+      INSERT INTO tag_stats (tag_id, privacy, count)
+      SELECT tag_id, COALESCE(new.privacy, 0), 1 FROM ({PHOTO_TAGS_SQL.format(photo='new.id')}) WHERE 1
+      ON CONFLICT(tag_id, privacy) DO UPDATE SET count = count + 1;
+    END
+  """)
+  # BEFORE: the photo's phototag rows are still there to say which tags to uncount.
+  # Their own delete triggers then find no photo and leave the counts alone.
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS tag_stats_photo_delete BEFORE DELETE ON photo
+    BEGIN
+      UPDATE tag_stats SET count = count - 1
+      WHERE privacy = COALESCE(old.privacy, 0) AND tag_id IN ({PHOTO_TAGS_SQL.format(photo='old.id')});
+    END
+  """)
+  database.execute_sql("""
+    CREATE TRIGGER IF NOT EXISTS tag_stats_tag_delete AFTER DELETE ON tag
+    BEGIN DELETE FROM tag_stats WHERE tag_id = old.id; END
+  """)
+
+  if not installed:
+    rebuild_tag_stats(database)
+
+
+def rebuild_tag_stats(database=None):
+  """Recompute tag_stats from phototag and photo"""
+  database = database or TagStats._meta.database
+  with database.atomic():
+    database.execute_sql('DELETE FROM tag_stats')
+    database.execute_sql(f'INSERT INTO tag_stats (tag_id, privacy, count) {TAG_STATS_SQL}')
+
+
+def check_tag_stats(database=None):
+  """Compare tag_stats with a fresh aggregate
+
+  Returns:
+    [(tag_id, privacy, stored, actual)] for every row that differs (empty if consistent)
+  """
+  database = database or TagStats._meta.database
+  actual = dict(((tag_id, privacy), count) for tag_id, privacy, count
+                in database.execute_sql(TAG_STATS_SQL).fetchall())
+  stored = dict(((tag_id, privacy), count) for tag_id, privacy, count
+                in database.execute_sql('SELECT tag_id, privacy, count FROM tag_stats').fetchall())
+  mismatches = []
+  for key in sorted(set(actual) | set(stored)):
+    if stored.get(key, 0) != actual.get(key, 0):
+      mismatches.append((key[0], key[1], stored.get(key, 0), actual.get(key, 0)))
+  return mismatches
+
+
+def tag_counts(visible_levels):
+  """Tags with at least one visible photo, each with a .count"""
+  levels = sorted(set(visible_levels))
+  count = fn.SUM(TagStats.count)
+  return (Tag
+          .select(Tag, count.alias('count'))
+          .join(TagStats, on=(TagStats.tag_id == Tag.id))
+          .where(TagStats.privacy.in_(levels))
+          .group_by(Tag)
+          .having(count > 0))
+
+
+def all_tag_counts():
+  """Every tag with its photo count across all privacy levels (0 for unused tags)"""
+  count = fn.COALESCE(fn.SUM(TagStats.count), 0)
+  return (Tag
+          .select(Tag, count.alias('count'))
+          .join(TagStats, JOIN.LEFT_OUTER, on=(TagStats.tag_id == Tag.id))
+          .group_by(Tag)
+          .order_by(count.desc()))
+
+
+def tagged_photo_count(visible_levels):
+  """Number of visible photos with at least one tag"""
+  levels = sorted(set(visible_levels))
+  return (TagStats
+          .select(fn.COALESCE(fn.SUM(TagStats.count), 0))
+          .where((TagStats.tag_id == 0) & (TagStats.privacy.in_(levels)))
+          .scalar())
+
+
+# Distinct tags on row's photo other than row's own tag, ignoring row itself
+OTHER_TAGS_SQL = ("SELECT DISTINCT tag_id FROM phototag "
+                  "WHERE photo_id = {row}.photo_id AND tag_id != {row}.tag_id AND id != {row}.id")
+
+# Distinct tags of a photo (without the tag 0 row)
+PHOTO_TAG_IDS_SQL = "SELECT DISTINCT tag_id FROM phototag WHERE photo_id = {photo}"
+
+COOCCURRENCE_SQL = """
+  WITH pairs AS (SELECT DISTINCT photo_id, tag_id FROM phototag)
+  SELECT a.tag_id, b.tag_id, COALESCE(photo.privacy, 0), COUNT(*)
+  FROM pairs a
+  JOIN pairs b ON b.photo_id = a.photo_id AND b.tag_id != a.tag_id
+  JOIN photo ON photo.id = a.photo_id
+  GROUP BY 1, 2, 3
+"""
+
+
+def _cooccurrence_add(row):
+  """Count row's tag with each other tag on its photo (both directions) unless already counted"""
+  add = ("INSERT INTO tag_cooccurrence (tag_id, other_id, privacy, count) "
+         "SELECT {first}, {second}, COALESCE(photo.privacy, 0), 1 "
+         "FROM photo, ({others}) AS other "
+         "WHERE photo.id = {row}.photo_id AND NOT EXISTS ("
+         "SELECT 1 FROM phototag WHERE photo_id = {row}.photo_id AND tag_id = {row}.tag_id AND id != {row}.id) "
+         "ON CONFLICT(tag_id, other_id, privacy) DO UPDATE SET count = count + 1;")
+  others = OTHER_TAGS_SQL.format(row=row)
+  return (add.format(row=row, others=others, first=f'{row}.tag_id', second='other.tag_id') +
+          add.format(row=row, others=others, first='other.tag_id', second=f'{row}.tag_id'))
+
+
+def _cooccurrence_remove(row):
+  """Uncount row's tag with each other tag on its photo once no rows of its pair remain"""
+  remove = ("UPDATE tag_cooccurrence SET count = count - 1 "
+            "WHERE {first} = {row}.tag_id AND {second} IN ({others}) "
+            "AND privacy = (SELECT COALESCE(privacy, 0) FROM photo WHERE id = {row}.photo_id) "
+            "AND NOT EXISTS (SELECT 1 FROM phototag WHERE photo_id = {row}.photo_id AND tag_id = {row}.tag_id);")
+  others = OTHER_TAGS_SQL.format(row=row)
+  return (remove.format(row=row, others=others, first='tag_id', second='other_id') +
+          remove.format(row=row, others=others, first='other_id', second='tag_id'))
+
+
+def install_tag_cooccurrence(database=None):
+  """Create the tag_cooccurrence table and triggers, backfilling on first install (idempotent)"""
+  database = database or TagCooccurrence._meta.database
+  # Counts are only trustworthy if the triggers were already maintaining them
+  installed = database.execute_sql(
+    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'tag_cooccurrence_phototag_insert'").fetchone()
+  TagCooccurrence.create_table(safe=True)
+
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS tag_cooccurrence_phototag_insert AFTER INSERT ON phototag
+    BEGIN {_cooccurrence_add('new')} END
+  """)
+  # The other tags exclude the changed row, so a tag it only just took isn't uncounted
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS tag_cooccurrence_phototag_update AFTER UPDATE OF photo_id, tag_id ON phototag
+    WHEN old.photo_id != new.photo_id OR old.tag_id != new.tag_id
+    BEGIN {_cooccurrence_remove('old')} {_cooccurrence_add('new')} END
+  """)
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS tag_cooccurrence_phototag_delete AFTER DELETE ON phototag
+    BEGIN {_cooccurrence_remove('old')} END
+  """)
+
+  tags = PHOTO_TAG_IDS_SQL.format(photo='new.id')
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS tag_cooccurrence_photo_update AFTER UPDATE OF privacy ON photo
+    WHEN COALESCE(old.privacy, 0) != COALESCE(new.privacy, 0)
+    BEGIN
+      UPDATE tag_cooccurrence SET count = count - 1
+      WHERE privacy = COALESCE(old.privacy, 0) AND tag_id IN ({tags}) AND other_id IN ({tags})
+        AND tag_id != other_id;
+      INSERT INTO tag_cooccurrence (tag_id, other_id, privacy, count)
+      SELECT a.tag_id, b.tag_id, COALESCE(new.privacy, 0), 1 FROM ({tags}) AS a, ({tags}) AS b
+      WHERE a.tag_id != b.tag_id
+      ON CONFLICT(tag_id, other_id, privacy) DO UPDATE SET count = count + 1;
+    END
+  """)
+  # BEFORE, as for tag_stats: the phototag rows still say which pairs to uncount
+  tags = PHOTO_TAG_IDS_SQL.format(photo='old.id')
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS tag_cooccurrence_photo_delete BEFORE DELETE ON photo
+    BEGIN
+      UPDATE tag_cooccurrence SET count = count - 1
+      WHERE privacy = COALESCE(old.privacy, 0) AND tag_id IN ({tags}) AND other_id IN ({tags})
+        AND tag_id != other_id;
+    END
+  """)
+  database.execute_sql("""
+    CREATE TRIGGER IF NOT EXISTS tag_cooccurrence_tag_delete AFTER DELETE ON tag
+    BEGIN DELETE FROM tag_cooccurrence WHERE tag_id = old.id OR other_id = old.id; END
+  """)
+
+  if not installed:
+    rebuild_tag_cooccurrence(database)
+
+
+def rebuild_tag_cooccurrence(database=None):
+  """Recompute tag_cooccurrence from phototag and photo (also drops pairs counted down to 0)"""
+  database = database or TagCooccurrence._meta.database
+  with database.atomic():
+    database.execute_sql('DELETE FROM tag_cooccurrence')
+    database.execute_sql(f'INSERT INTO tag_cooccurrence (tag_id, other_id, privacy, count) {COOCCURRENCE_SQL}')
+
+
+def check_tag_cooccurrence(database=None):
+  """Compare tag_cooccurrence with a fresh aggregate
+
+  Returns:
+    [(tag_id, other_id, privacy, stored, actual)] for every row that differs (empty if consistent)
+  """
+  database = database or TagCooccurrence._meta.database
+  actual = dict(((tag_id, other_id, privacy), count) for tag_id, other_id, privacy, count
+                in database.execute_sql(COOCCURRENCE_SQL).fetchall())
+  stored = dict(((tag_id, other_id, privacy), count) for tag_id, other_id, privacy, count
+                in database.execute_sql('SELECT tag_id, other_id, privacy, count FROM tag_cooccurrence').fetchall())
+  mismatches = []
+  for key in sorted(set(actual) | set(stored)):
+    if stored.get(key, 0) != actual.get(key, 0):
+      mismatches.append(key + (stored.get(key, 0), actual.get(key, 0)))
+  return mismatches
+
+
+def cooccurring_tags(tag_ids, visible_levels):
+  """[(tag_id, count)] of tags sharing a visible photo with every tag in tag_ids, highest first
+
+  With several tags the count is the smallest pairwise count: an upper bound on
+  the photos carrying all of them, exact for a single tag.
+  """
+  tag_ids = sorted(set(tag_ids))
+  levels = sorted(set(visible_levels))
+  shared = fn.SUM(TagCooccurrence.count)
+  pairs = (TagCooccurrence
+           .select(TagCooccurrence.tag_id, TagCooccurrence.other_id, shared.alias('shared'))
+           .where(TagCooccurrence.tag_id.in_(tag_ids) & TagCooccurrence.privacy.in_(levels) &
+                  TagCooccurrence.other_id.not_in(tag_ids))
+           .group_by(TagCooccurrence.tag_id, TagCooccurrence.other_id)
+           .having(shared > 0))
+  bound = fn.MIN(pairs.c.shared)
+  query = (TagCooccurrence
+           .select(pairs.c.other_id, bound)
+           .from_(pairs)
+           .group_by(pairs.c.other_id)
+           .having(fn.COUNT(pairs.c.tag_id) == len(tag_ids))
+           .order_by(bound.desc(), pairs.c.other_id))
+  return list(query.tuples())
+
+
+def related_tags(tag_ids, visible_levels, limit=15, count_with=None):
+  """Tags most often found on the visible photos carrying every tag in tag_ids
+
+  Returns Tag rows with .co_occurrence (photos carrying tag_ids and the tag),
+  most shared first, or None if the counts can't be answered exactly: several
+  tags and no count_with(tag_id) (e.g. from the tag bitmap index) to turn the
+  pairwise upper bounds into exact counts.
+  """
+  tag_ids = sorted(set(tag_ids))
+  candidates = cooccurring_tags(tag_ids, visible_levels)
+  if len(tag_ids) == 1:
+    counts = candidates[:limit]
+  elif count_with is None:
+    return None
+  else:
+    # Exact counts in bound order, stopping once no bound can beat the current top limit
+    counts = []
+    for tag_id, bound in candidates:
+      if len(counts) >= limit and bound < counts[limit - 1][1]:
+        break
+      count = count_with(tag_id)
+      if count:
+        counts.append((tag_id, count))
+        counts.sort(key=lambda pair: -pair[1])
+  counts = dict(counts[:limit])
+  tags = list(Tag.select().where(Tag.id.in_(list(counts))))
+  for tag in tags:
+    tag.co_occurrence = counts[tag.id]
+  return sorted(tags, key=lambda tag: (-tag.co_occurrence, tag.name))
+
+
+# Photos of the photoset_stats row being updated
+PHOTOSET_MEMBERS_SQL = ("FROM photophotoset JOIN photo ON photo.id = photophotoset.photo_id "
+                        "WHERE photophotoset.photoset_id = photoset_stats.photoset_id "
+                        "AND COALESCE(photo.privacy, 0) = photoset_stats.privacy")
+
+# Fold one more photo (as excluded.*) into an existing photoset_stats row.
+# Covers sort NULL datetaken first, as ORDER BY datetaken does.
+PHOTOSET_MERGE_SQL = """
+  count = count + 1,
+  min_datetaken = CASE WHEN min_datetaken IS NULL OR excluded.min_datetaken < min_datetaken
+                  THEN excluded.min_datetaken ELSE min_datetaken END,
+  max_datetaken = CASE WHEN max_datetaken IS NULL OR excluded.max_datetaken > max_datetaken
+                  THEN excluded.max_datetaken ELSE max_datetaken END,
+  cover_id = CASE WHEN (COALESCE(excluded.min_datetaken, ''), excluded.cover_id) <
+                       (COALESCE((SELECT datetaken FROM photo WHERE id = photoset_stats.cover_id), ''), photoset_stats.cover_id)
+             THEN excluded.cover_id ELSE cover_id END
+"""
+
+PHOTOSET_STATS_SQL = """
+  SELECT photophotoset.photoset_id, COALESCE(photo.privacy, 0), COUNT(DISTINCT photo.id),
+         MIN(photo.datetaken), MAX(photo.datetaken),
+         (SELECT cover.id FROM photophotoset AS member JOIN photo AS cover ON cover.id = member.photo_id
+          WHERE member.photoset_id = photophotoset.photoset_id
+          AND COALESCE(cover.privacy, 0) = COALESCE(photo.privacy, 0)
+          ORDER BY cover.datetaken, cover.id LIMIT 1)
+  FROM photophotoset JOIN photo ON photo.id = photophotoset.photo_id
+  GROUP BY 1, 2
+"""
+
+PHOTOSET_COLUMNS = 'photoset_id, privacy, count, min_datetaken, max_datetaken, cover_id'
+
+
+def _photoset_add(source):
+  """Count the photos selected by source, as rows of PHOTOSET_COLUMNS with count 1"""
+  return (f"INSERT INTO photoset_stats ({PHOTOSET_COLUMNS}) {source} "
+          f"ON CONFLICT(photoset_id, privacy) DO UPDATE SET {PHOTOSET_MERGE_SQL};")
+
+
+def _photoset_remove(sets, privacy, photo, datetaken, guard='1'):
+  """Uncount a photo from sets at privacy, recomputing range and cover if it defined them"""
+  where = f"photoset_id IN ({sets}) AND privacy = {privacy} AND {guard}"
+  return f"""
+    UPDATE photoset_stats SET count = count - 1 WHERE {where};
+    DELETE FROM photoset_stats WHERE {where} AND count <= 0;
+    UPDATE photoset_stats SET
+      min_datetaken = (SELECT MIN(photo.datetaken) {PHOTOSET_MEMBERS_SQL}),
+      max_datetaken = (SELECT MAX(photo.datetaken) {PHOTOSET_MEMBERS_SQL}),
+      cover_id = (SELECT photo.id {PHOTOSET_MEMBERS_SQL} ORDER BY photo.datetaken, photo.id LIMIT 1)
+    WHERE {where} AND (cover_id = {photo} OR min_datetaken = {datetaken} OR max_datetaken = {datetaken});
+  """
+
+
+def _photoset_member_add(row, extra=''):
+  """Count a photophotoset row unless its (photo, photoset) pair is already counted"""
+  return _photoset_add(
+    f"SELECT {row}.photoset_id, COALESCE(photo.privacy, 0), 1, photo.datetaken, photo.datetaken, photo.id "
+    f"FROM photo WHERE photo.id = {row}.photo_id AND NOT EXISTS ("
+    f"SELECT 1 FROM photophotoset WHERE photo_id = {row}.photo_id AND photoset_id = {row}.photoset_id "
+    f"AND id != {row}.id)")
+
+
+def _photoset_member_remove(row):
+  """Uncount a photophotoset row once no rows remain for its (photo, photoset) pair"""
+  return _photoset_remove(
+    f'{row}.photoset_id',
+    f'(SELECT COALESCE(privacy, 0) FROM photo WHERE id = {row}.photo_id)',
+    f'{row}.photo_id',
+    f'(SELECT datetaken FROM photo WHERE id = {row}.photo_id)',
+    guard=(f'NOT EXISTS (SELECT 1 FROM photophotoset '
+           f'WHERE photo_id = {row}.photo_id AND photoset_id = {row}.photoset_id)'))
+
+
+def install_photoset_stats(database=None):
+  """Create the photoset_stats table and triggers, backfilling on first install (idempotent)"""
+  database = database or PhotosetStats._meta.database
+  # Stats are only trustworthy if the triggers were already maintaining them
+  installed = database.execute_sql(
+    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'photoset_stats_member_insert'").fetchone()
+  PhotosetStats.create_table(safe=True)
+
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS photoset_stats_member_insert AFTER INSERT ON photophotoset
+    BEGIN {_photoset_member_add('new')} END
+  """)
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS photoset_stats_member_update AFTER UPDATE OF photo_id, photoset_id ON photophotoset
+    WHEN old.photo_id != new.photo_id OR old.photoset_id != new.photoset_id
+    BEGIN {_photoset_member_remove('old')} {_photoset_member_add('new')} END
+  """)
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS photoset_stats_member_delete AFTER DELETE ON photophotoset
+    BEGIN {_photoset_member_remove('old')} END
+  """)
+
+  sets = 'SELECT photoset_id FROM photophotoset WHERE photo_id = new.id'
+  database.execute_sql(f"""
+    CREATE TRIGGER IF NOT EXISTS photoset_stats_photo_update AFTER UPDATE OF privacy, datetaken ON photo
+    WHEN COALESCE(old.privacy, 0) != COALESCE(new.privacy, 0) OR old.datetaken IS NOT new.datetaken
+    BEGIN
+      {_photoset_remove(sets, 'COALESCE(old.privacy, 0)', 'old.id', 'old.datetaken')}
+      {_photoset_add(f"SELECT DISTINCT photoset_id, COALESCE(new.privacy, 0), 1, new.datetaken, new.datetaken, new.id "
+                     f"FROM photophotoset WHERE photo_id = new.id")}
+    END
+  """)
+  # A cascading delete only reaches photophotoset after the photo row is gone, when its
+  # privacy and datetaken can no longer be read, so remove the memberships first
+  database.execute_sql("""
+    CREATE TRIGGER IF NOT EXISTS photoset_stats_photo_delete BEFORE DELETE ON photo
+    BEGIN DELETE FROM photophotoset WHERE photo_id = old.id; END
+  """)
+  database.execute_sql("""
+    CREATE TRIGGER IF NOT EXISTS photoset_stats_photoset_delete AFTER DELETE ON photoset
+    BEGIN DELETE FROM photoset_stats WHERE photoset_id = old.id; END
+  """)
+
+  if not installed:
+    rebuild_photoset_stats(database)
+
+
+def rebuild_photoset_stats(database=None):
+  """Recompute photoset_stats from photophotoset and photo"""
+  database = database or PhotosetStats._meta.database
+  with database.atomic():
+    database.execute_sql('DELETE FROM photoset_stats')
+    database.execute_sql(f'INSERT INTO photoset_stats ({PHOTOSET_COLUMNS}) {PHOTOSET_STATS_SQL}')
+
+
+def check_photoset_stats(database=None):
+  """Compare photoset_stats with a fresh aggregate
+
+  Returns:
+    [(photoset_id, privacy, stored, actual)] where stored/actual are
+    (count, min_datetaken, max_datetaken, cover_id) tuples, or None for a missing row
+  """
+  database = database or PhotosetStats._meta.database
+  actual = dict(((row[0], row[1]), tuple(row[2:])) for row
+                in database.execute_sql(PHOTOSET_STATS_SQL).fetchall())
+  stored = dict(((row[0], row[1]), tuple(row[2:])) for row
+                in database.execute_sql(f'SELECT {PHOTOSET_COLUMNS} FROM photoset_stats').fetchall())
+  mismatches = []
+  for key in sorted(set(actual) | set(stored)):
+    if stored.get(key) != actual.get(key):
+      mismatches.append((key[0], key[1], stored.get(key), actual.get(key)))
+  return mismatches
+
+
+def visible_photoset_ids(visible_levels):
+  """Subquery of photoset ids with at least one visible photo (use with .in_())"""
+  levels = sorted(set(visible_levels))
+  return (PhotosetStats
+          .select(PhotosetStats.photoset_id)
+          .where(PhotosetStats.privacy.in_(levels))
+          .distinct())
+
+
+def photoset_summaries(photoset_ids, visible_levels=None):
+  """Counts, date range and cover for photosets from photoset_stats
+
+  Args:
+    photoset_ids: photosets to summarize
+    visible_levels: privacy levels to include, or None for all
+
+  Returns:
+    {photoset_id: {'count', 'privacy_counts', 'min_datetaken', 'max_datetaken', 'cover_id'}};
+    photosets without (visible) photos are missing
+  """
+  query = PhotosetStats.select().where(PhotosetStats.photoset_id.in_(list(photoset_ids)))
+  if visible_levels is not None:
+    query = query.where(PhotosetStats.privacy.in_(sorted(set(visible_levels))))
+  rows = list(query)
+
+  # Covers are compared across levels by the cover photo's own datetaken
+  cover_dates = dict(Photo
+                     .select(Photo.id, Photo.datetaken)
+                     .where(Photo.id.in_([row.cover_id for row in rows if row.cover_id]))
+                     .tuples())
+  def cover_key(row):
+    taken = cover_dates.get(row.cover_id)
+    return (taken is not None, str(taken) if taken is not None else '', row.cover_id or 0)
+
+  summaries = {}
+  for row in rows:
+    summary = summaries.setdefault(row.photoset_id, {
+      'count': 0, 'privacy_counts': {}, 'min_datetaken': None, 'max_datetaken': None,
+      'cover_id': None, '_cover': None})
+    summary['count'] += row.count
+    summary['privacy_counts'][row.privacy] = row.count
+    if row.min_datetaken is not None and (summary['min_datetaken'] is None or row.min_datetaken < summary['min_datetaken']):
+      summary['min_datetaken'] = row.min_datetaken
+    if row.max_datetaken is not None and (summary['max_datetaken'] is None or row.max_datetaken > summary['max_datetaken']):
+      summary['max_datetaken'] = row.max_datetaken
+    if summary['_cover'] is None or cover_key(row) < cover_key(summary['_cover']):
+      summary['_cover'] = row
+      summary['cover_id'] = row.cover_id
+  for summary in summaries.values():
+    del summary['_cover']
+  return summaries
+
+
+def photoset_covers(photoset_ids, visible_levels, per_set):
+  """First per_set visible photos (by datetaken, then id) of each photoset, in one query
+
+  ROW_NUMBER() numbers each set's photos so only per_set rows per set leave
+  SQLite, however large the sets are.
+
+  Returns:
+    {photoset_id: [Photo]} with id, sha1 and datetaken loaded
+  """
+  position = fn.ROW_NUMBER().over(partition_by=[PhotoPhotoset.photoset],
+                                  order_by=[Photo.datetaken, Photo.id])
+  ranked = (PhotoPhotoset
+            .select(PhotoPhotoset.photoset, PhotoPhotoset.photo, position.alias('position'))
+            .join(Photo)
+            .where((PhotoPhotoset.photoset.in_(list(photoset_ids))) &
+                   ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels))))
+            .cte('ranked'))
+  query = (Photo
+           .select(Photo.id, Photo.sha1, Photo.datetaken, ranked.c.photoset_id.alias('cover_of'))
+           .join(ranked, on=(ranked.c.photo_id == Photo.id))
+           .where(ranked.c.position <= per_set)
+           .order_by(ranked.c.photoset_id, ranked.c.position)
+           .with_cte(ranked)
+           .objects())
+  covers = {}
+  for photo in query:
+    covers.setdefault(photo.cover_of, []).append(photo)
+  return covers
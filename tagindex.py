@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+
+"""per-worker bitmap index of tag and privacy membership
+
+Multi-tag pages intersect tags with `GROUP BY photo HAVING COUNT(DISTINCT tag)`,
+which aggregates every phototag row for those tags on each request. This keeps
+an in-memory snapshot instead: one bitmap (a Python int, bit n = photo id n) per
+privacy level and per tag, so an intersection is a handful of big-int ANDs and
+counts, pages and prev/next are bit scans.
+
+Sparse tags are stored as sorted id arrays and only expanded into a bitmap when
+queried, so memory stays proportional to the number of phototag rows rather
+than tags * max photo id.
+
+A snapshot is only served for the content generation it was built under (see
+cache.py). When the generation moves on, callers get None and fall back to SQL
+while a background thread rebuilds the snapshot.
+"""
+
+import array, logging, threading, time
+
+from app import app
+from db import *
+import cache
+
+# set up logging
+logger = logging.getLogger('cigarbox')
+
+PRIVACY_LEVELS = (0, 1, 2, 3)
+
+
+def _bitmap_from_ids(ids, nbytes):
+  """Build an int bitmap from photo ids"""
+  buf = bytearray(nbytes)
+  for photo_id in ids:
+    buf[photo_id >> 3] |= 1 << (photo_id & 7)
+  return int.from_bytes(buf, 'little')
+
+
+class PhotoIdSet(object):
+  """A set of photo ids held as an int bitmap, ordered newest (highest id) first"""
+  __slots__ = ('bits', '_count', '_binary')
+
+  def __init__(self, bits):
+    self.bits = bits
+    self._count = None
+    self._binary = None
+
+  def __len__(self):
+    if self._count is None:
+      self._count = bin(self.bits).count('1')
+    return self._count
+
+  def __contains__(self, photo_id):
+    return photo_id >= 0 and (self.bits >> photo_id) & 1 == 1
+
+  def page(self, page, per_page):
+    """Return the photo ids on a 1-indexed page, highest id first"""
+    offset = (page - 1) * per_page
+    if offset >= len(self) or per_page <= 0:
+      return []
+    if self._binary is None:
+      self._binary = bin(self.bits)[2:]  # most significant (highest id) bit first
+    binary = self._binary
+    width = len(binary)
+
+    # Binary search for the position of the offset-th set bit
+    lo, hi = 0, width - 1
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if binary.count('1', 0, mid + 1) > offset:
+        hi = mid
+      else:
+        lo = mid + 1
+
+    ids = []
+    pos = lo
+    while pos != -1 and len(ids) < per_page:
+      ids.append(width - 1 - pos)
+      pos = binary.find('1', pos + 1)
+    return ids
+
+  def next_id(self, photo_id):
+    """Next photo in descending order (highest id below photo_id), or None"""
+    if photo_id <= 0:
+      return None
+    lower = self.bits & ((1 << photo_id) - 1)
+    return lower.bit_length() - 1 if lower else None
+
+  def prev_id(self, photo_id):
+    """Previous photo in descending order (lowest id above photo_id), or None"""
+    higher = self.bits >> (photo_id + 1)
+    if not higher:
+      return None
+    return (higher & -higher).bit_length() + photo_id
+
+
+class TagIndex(object):
+  """Snapshot of tag and privacy membership for one content generation"""
+
+  def __init__(self, generation, tag_ids, tag_sets, privacy_bitmaps, nbytes):
+    self.generation = generation
+    self.tag_ids = tag_ids  # tag name -> tag id
+    self.tag_sets = tag_sets  # tag id -> int bitmap (dense) or array('q') (sparse)
+    self.privacy_bitmaps = privacy_bitmaps  # privacy level -> int bitmap, NULL counted as 0
+    self.nbytes = nbytes
+    self._visible = {}
+
+  @classmethod
+  def build(cls, generation=None):
+    """Load membership from the database
+
+    The generation is read before the data, so a write racing the build leaves
+    the snapshot labelled with an older generation and it is rebuilt again.
+    """
+    if generation is None:
+      generation = cache.current_generation()
+
+    levels = {level: [] for level in PRIVACY_LEVELS}
+    max_id = 0
+    for photo_id, privacy in Photo.select(Photo.id, Photo.privacy).tuples().iterator():
+      levels.setdefault(privacy or 0, []).append(photo_id)
+      if photo_id > max_id:
+        max_id = photo_id
+
+    postings = {}
+    for tag_id, photo_id in PhotoTag.select(PhotoTag.tag, PhotoTag.photo).tuples().iterator():
+      postings.setdefault(tag_id, []).append(photo_id)
+      if photo_id > max_id:  # photos inserted since the first read
+        max_id = photo_id
+    nbytes = (max_id >> 3) + 1
+
+    tag_sets = {}
+    for tag_id, ids in postings.items():
+      # A bitmap costs max_id / 8 bytes; an array 8 bytes per photo
+      if len(ids) * 64 >= max_id:
+        tag_sets[tag_id] = _bitmap_from_ids(ids, nbytes)
+      else:
+        tag_sets[tag_id] = array.array('q', sorted(set(ids)))
+
+    tag_ids = dict((name, tag_id) for tag_id, name in Tag.select(Tag.id, Tag.name).tuples())
+    privacy_bitmaps = dict((level, _bitmap_from_ids(ids, nbytes)) for level, ids in levels.items())
+    return cls(generation, tag_ids, tag_sets, privacy_bitmaps, nbytes)
+
+  def _tag_bitmap(self, tag_id):
+    members = self.tag_sets.get(tag_id, 0)
+    if isinstance(members, int):
+      return members
+    return _bitmap_from_ids(members, self.nbytes)
+
+  def visible_bitmap(self, visible_levels):
+    """Union of the privacy bitmaps a viewer can see"""
+    key = tuple(sorted(visible_levels))
+    bits = self._visible.get(key)
+    if bits is None:
+      bits = 0
+      for level in key:
+        bits |= self.privacy_bitmaps.get(level, 0)
+      self._visible[key] = bits
+    return bits
+
+  def match(self, tag_names, visible_levels):
+    """Photos carrying every tag in tag_names that the viewer can see"""
+    tag_ids = []
+    for name in set(tag_names):
+      if name not in self.tag_ids:
+        return PhotoIdSet(0)
+      tag_ids.append(self.tag_ids[name])
+    if not tag_ids:
+      return PhotoIdSet(0)
+
+    # Sparse (array) tags first so the ANDs shrink as early as possible
+    tag_ids.sort(key=lambda tag_id: isinstance(self.tag_sets.get(tag_id, 0), int))
+    bits = self.visible_bitmap(visible_levels)
+    for tag_id in tag_ids:
+      bits &= self._tag_bitmap(tag_id)
+      if not bits:
+        break
+    return PhotoIdSet(bits)
+
+  def count_in(self, matches, tag_id):
+    """Number of photos in matches (a PhotoIdSet) that also carry tag_id"""
+    members = self.tag_sets.get(tag_id, 0)
+    if isinstance(members, int):
+      return bin(matches.bits & members).count('1')
+    return sum(1 for photo_id in members if photo_id in matches)
+
+
+_index = None
+_building = False
+_lock = threading.Lock()
+
+
+def rebuild():
+  """Build a fresh snapshot for the current generation and install it"""
+  global _index
+  start = time.time()
+  index = TagIndex.build()
+  _index = index
+  logger.info('Tag index built for generation %s: %d tags in %.0fms',
+              index.generation, len(index.tag_sets), (time.time() - start) * 1000)
+  return index
+
+
+def _rebuild_in_background():
+  global _building
+  database = Photo._meta.database
+  try:
+    database.connect(reuse_if_open=True)
+    rebuild()
+  except Exception as e:
+    logger.warning('Tag index rebuild failed: %s', e)
+  finally:
+    if not database.is_closed():
+      database.close()
+    _building = False
+
+
+def get_index():
+  """Return the snapshot for the current generation, or None if it is cold or stale
+
+  A stale or missing snapshot starts a background rebuild; the caller should
+  answer from SQL in the meantime.
+  """
+  global _building
+  if not app.config.get('TAG_INDEX_ENABLED', True):
+    return None
+  generation = cache.current_generation()
+  if generation is None:
+    return None
+  index = _index
+  if index is not None and index.generation == generation:
+    return index
+
+  with _lock:
+    if _building:
+      return None
+    _building = True
+  threading.Thread(target=_rebuild_in_background, name='tagindex-rebuild', daemon=True).start()
+  return None
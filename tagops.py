@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+
+"""set-based tag rename, merge and delete
+
+Merges used to move phototag rows one at a time (a SELECT for an existing
+target pair, a create, a delete_instance per row, each autocommitted), so a
+5,000-photo tag was ~15k statements and a failure halfway left the tag split.
+Here a merge is one INSERT OR IGNORE ... SELECT and one DELETE, and every
+operation runs in a single transaction. tag_stats, tag_cooccurrence, the
+search index and the content generation are all maintained by triggers, so
+they change in the same commit.
+
+merge() and delete() take dry_run=True to report the affected counts without
+writing anything.
+"""
+
+import collections
+from peewee import Case, Value, fn
+
+from db import *
+import bulk
+
+# photos carrying the source tag, how many gain the target (the rest already
+# had it), phototag rows removed, and whether the target tag is new
+MergeCounts = collections.namedtuple('MergeCounts', 'photos moved already_tagged rows target_created')
+
+# photos losing the tag and phototag rows removed
+DeleteCounts = collections.namedtuple('DeleteCounts', 'photos rows')
+
+
+def merge_counts(source, target):
+  """MergeCounts for merging source into target (a Tag, or None if it doesn't exist yet)"""
+  if target is None:
+    photos, rows = (PhotoTag.select(fn.COUNT(fn.DISTINCT(PhotoTag.photo)), fn.COUNT(PhotoTag.id))
+                    .where(PhotoTag.tag == source.id)
+                    .scalar(as_tuple=True))
+    return MergeCounts(photos, photos, 0, rows, True)
+  tagged = PhotoTag.alias()
+  already = PhotoTag.photo.in_(tagged.select(tagged.photo).where(tagged.tag == target.id))
+  photos, already_tagged, rows = (PhotoTag
+                                  .select(fn.COUNT(fn.DISTINCT(PhotoTag.photo)),
+                                          fn.COUNT(fn.DISTINCT(Case(None, [(already, PhotoTag.photo)]))),
+                                          fn.COUNT(PhotoTag.id))
+                                  .where(PhotoTag.tag == source.id)
+                                  .scalar(as_tuple=True))
+  return MergeCounts(photos, photos - already_tagged, already_tagged, rows, False)
+
+
+def merge(source, target_name, dry_run=False):
+  """Move every photo tagged source to the tag named target_name and delete source
+
+  A target that doesn't exist yet is just source renamed. Returns MergeCounts.
+  """
+  with bulk.transaction():
+    target = Tag.select().where(Tag.name == target_name).first()
+    counts = merge_counts(source, target)
+    if dry_run:
+      return counts
+    if target is None:
+      Tag.update(name=target_name).where(Tag.id == source.id).execute()
+      return counts
+    pairs = (PhotoTag.select(PhotoTag.photo, Value(target.id), PhotoTag.ts)
+             .where(PhotoTag.tag == source.id))
+    (PhotoTag.insert_from(pairs, [PhotoTag.photo, PhotoTag.tag, PhotoTag.ts])
+     .on_conflict_ignore()
+     .execute())
+    PhotoTag.delete().where(PhotoTag.tag == source.id).execute()
+    Tag.delete().where(Tag.id == source.id).execute()
+  return counts
+
+
+def rename(tag, new_name):
+  """Rename tag; False (and nothing changed) if another tag already has new_name"""
+  with bulk.transaction():
+    if Tag.select().where((Tag.name == new_name) & (Tag.id != tag.id)).exists():
+      return False
+    Tag.update(name=new_name).where(Tag.id == tag.id).execute()
+  tag.name = new_name
+  return True
+
+
+def delete(tag, dry_run=False):
+  """Remove tag from every photo and delete it. Returns DeleteCounts."""
+  with bulk.transaction():
+    photos, rows = (PhotoTag.select(fn.COUNT(fn.DISTINCT(PhotoTag.photo)), fn.COUNT(PhotoTag.id))
+                    .where(PhotoTag.tag == tag.id)
+                    .scalar(as_tuple=True))
+    if not dry_run:
+      PhotoTag.delete().where(PhotoTag.tag == tag.id).execute()
+      Tag.delete().where(Tag.id == tag.id).execute()
+  return DeleteCounts(photos, rows)
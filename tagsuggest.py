@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+
+"""tag name prefix index for autocomplete
+
+The photo, bulk edit and admin edit pages used to inline every tag name as a
+JS array. Tag inputs now ask /api/tags/suggest?q= instead, which is answered
+from a per-worker snapshot: tag names sorted case-insensitively next to their
+photo counts (from tag_stats), so a prefix is a bisected slice ranked by
+popularity.
+
+A snapshot is only served for the content generation it was built under (see
+cache.py); the first suggestion after a write rebuilds it with one query.
+"""
+
+import array, bisect, heapq, threading
+from peewee import OperationalError, fn
+
+from db import *
+import cache
+import stats
+
+# sorts after every character a tag name can contain
+PREFIX_END = '\U0010ffff'
+
+
+class TagSuggestIndex(object):
+  """Tag names sorted by lowercased name, with photo counts for ranking"""
+  __slots__ = ('generation', 'keys', 'names', 'counts')
+
+  def __init__(self, generation, rows):
+    rows = sorted((name.lower(), name, count) for name, count in rows)
+    self.generation = generation
+    self.keys = [key for key, _, _ in rows]
+    self.names = [name for _, name, _ in rows]
+    self.counts = array.array('q', (count for _, _, count in rows))
+
+  def __len__(self):
+    return len(self.names)
+
+  def suggest(self, prefix, limit):
+    """[(name, count)] of up to limit tags starting with prefix, most used first"""
+    prefix = prefix.lower()
+    lo = bisect.bisect_left(self.keys, prefix)
+    hi = bisect.bisect_right(self.keys, prefix + PREFIX_END, lo)
+    best = heapq.nsmallest(limit, range(lo, hi), key=lambda i: (-self.counts[i], self.keys[i]))
+    return [(self.names[i], self.counts[i]) for i in best]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def _load_rows():
+  """(name, photo count) for every tag; counts are 0 until tag_stats is installed"""
+  try:
+    return [(tag.name, tag.count) for tag in stats.all_tag_counts()]
+  except OperationalError:
+    return [(name, 0) for (name,) in Tag.select(Tag.name).tuples()]
+
+
+def get_index():
+  """The snapshot for the current generation, or None without a content generation"""
+  global _index
+  generation = cache.current_generation()
+  if generation is None:
+    return None
+  with _lock:
+    if _index is not None and _index.generation == generation:
+      return _index
+  # Read the generation before the rows, so a racing write labels the snapshot stale
+  index = TagSuggestIndex(generation, _load_rows())
+  with _lock:
+    _index = index
+  return index
+
+
+def suggest(prefix, limit=10):
+  """[(name, count)] of tags starting with prefix, most used first"""
+  prefix = prefix.strip()
+  if not prefix or limit <= 0:
+    return []
+  index = get_index()
+  if index is not None:
+    return index.suggest(prefix, limit)
+  # No generation to validate a snapshot against: ask SQL (alphabetical, uncounted)
+  query = (Tag.select(Tag.name)
+           .where(Tag.name.startswith(prefix))
+           .order_by(fn.LOWER(Tag.name))
+           .limit(limit))
+  return [(name, 0) for (name,) in query.tuples()]
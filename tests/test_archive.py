@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for date ranges and per-day photo counts
+"""
+
+import unittest
+import tempfile
+import datetime
+import os
+from peewee import SqliteDatabase
+
+from app import app
+import archive
+from db import Photo, PhotoDayCount
+
+
+class TestArchive(unittest.TestCase):
+    """Test datetaken prefix ranges and trigger-maintained day counts"""
+
+    def setUp(self):
+        """Create temporary test database"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, PhotoDayCount]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables([Photo])
+
+        # Existing photos are backfilled on install
+        self.add(datetime.datetime(2019, 7, 4, 12, 0), None)
+        self.add(datetime.datetime(2019, 12, 31, 23, 59), 2)
+        archive.install_day_counts(self.test_db)
+
+    def tearDown(self):
+        """Close and remove test database"""
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def add(self, datetaken, privacy=0):
+        return Photo.create(sha1=f'archive{Photo.select().count():033d}', filetype='jpg',
+                            datetaken=datetaken, privacy=privacy)
+
+    def like_count(self, prefix):
+        return self.test_db.execute_sql('SELECT COUNT(*) FROM photo WHERE datetaken LIKE ?',
+                                        (prefix + '%',)).fetchone()[0]
+
+    def test_prefix_range_matches_like(self):
+        """Test that the indexed range selects what LIKE 'prefix%' did"""
+        self.add(datetime.datetime(2019, 7, 14, 8, 0))
+        self.add(datetime.datetime(2020, 1, 1, 0, 0))
+        self.add(None)
+        for prefix in ('2019', '2019-07', '2019-07-04', '2019-07-1', '2019-1', '2', '2020-01-01 00', 'x', ''):
+            count = Photo.select().where(archive.datetaken_startswith(prefix)).count()
+            self.assertEqual(count, self.like_count(prefix), prefix)
+
+    def test_range_uses_index(self):
+        """Test that the date range is an index search"""
+        sql, params = Photo.select().where(archive.datetaken_startswith('2019-07')).sql()
+        plan = ' '.join(str(row) for row in self.test_db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params))
+        self.assertIn('idx_photo_datetaken', plan)
+
+    def test_counts_follow_writes(self):
+        """Test that inserts, updates and deletes keep photodaycount exact"""
+        self.assertEqual(archive.count_for_prefix('2019', [0]), 1)
+        self.assertEqual(archive.count_for_prefix('2019', [0, 1, 2, 3]), 2)
+
+        photo = self.add(datetime.datetime(2019, 7, 4, 18, 0), 1)
+        self.assertEqual(archive.count_for_prefix('2019-07-04', [0, 1]), 2)
+
+        photo.datetaken = datetime.datetime(2019, 8, 1)
+        photo.privacy = 0
+        photo.save()
+        self.assertEqual(archive.count_for_prefix('2019-07', [0, 1]), 1)
+        self.assertEqual(archive.count_for_prefix('2019-08', [0]), 1)
+
+        photo.delete_instance()
+        self.assertEqual(archive.count_for_prefix('2019-08', [0]), 0)
+        self.assertIsNone(archive.count_for_prefix('2019-0', [0]))
+
+    def test_non_iso_datetaken_not_counted(self):
+        """Test that a datetaken without a day key is written but not counted"""
+        photo = self.add('01/02/2020', 0)
+        self.assertEqual(archive.count_for_prefix('2020', [0]), 0)
+
+        photo.datetaken = datetime.datetime(2020, 1, 2)
+        photo.save()
+        self.assertEqual(archive.count_for_prefix('2020-01-02', [0]), 1)
+
+        photo.datetaken = '01/02/2020'
+        photo.save()
+        self.assertEqual(archive.count_for_prefix('2020', [0]), 0)
+        photo.delete_instance()
+
+        self.add('someday', 0)
+        archive.rebuild_day_counts(self.test_db)
+        self.assertEqual(archive.count_for_prefix('2019', [0, 1, 2, 3]), 2)
+
+    def test_reinstall_keeps_counts(self):
+        """Test that installing again replaces the triggers without recounting"""
+        archive.install_day_counts(self.test_db)
+        self.add(datetime.datetime(2019, 7, 5), 0)
+        self.assertEqual(archive.count_for_prefix('2019', [0]), 2)
+        triggers = self.test_db.execute_sql(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'photodaycount_%'").fetchone()[0]
+        self.assertEqual(triggers, 3)
+
+    def test_parse_datetaken(self):
+        """Test that form dates are parsed as ISO and anything else is refused"""
+        self.assertEqual(archive.parse_datetaken(' 2020-01-02 03:04:05 '), datetime.datetime(2020, 1, 2, 3, 4, 5))
+        self.assertEqual(archive.parse_datetaken('2020-01-02'), datetime.datetime(2020, 1, 2))
+        for text in ('01/02/2020', '2020-13-01', 'yesterday', '', None):
+            self.assertIsNone(archive.parse_datetaken(text))
+
+    def test_month_and_year_counts(self):
+        """Test the calendar rollups"""
+        self.add(datetime.datetime(2020, 2, 29, 10, 0))
+        months, days = archive.month_counts(2019, [0, 1, 2, 3])
+        self.assertEqual(months, {7: 1, 12: 1})
+        self.assertEqual(days, {20190704: 1, 20191231: 1})
+        self.assertEqual(archive.year_counts([0]), [(2020, 1), (2019, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
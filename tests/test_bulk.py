@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for set-based bulk photo edits
+"""
+
+import unittest
+import tempfile
+import os
+from peewee import SqliteDatabase
+
+import bulk
+import stats
+from db import Photo, Tag, PhotoTag, Photoset, PhotoPhotoset, TagStats, User, Role, UserRoles
+
+
+class TestBulkEdits(unittest.TestCase):
+    """Test permission resolution and set statements for tags, privacy and photosets"""
+
+    def setUp(self):
+        """Create a temporary database with photos from two uploaders"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path, pragmas={'foreign_keys': 1})
+
+        models = [Photo, Tag, PhotoTag, Photoset, PhotoPhotoset, TagStats, User, Role, UserRoles]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+        stats.install_tag_stats(self.test_db)
+
+        admin, contributor = Role.create(name='admin'), Role.create(name='contributor')
+        self.admin, self.contributor, self.viewer = [
+            User.create(email=f'bulk{i}@example.com', password='x', fs_uniquifier=f'bulk{i}')
+            for i in range(3)]
+        UserRoles.create(user=self.admin, role=admin)
+        UserRoles.create(user=self.contributor, role=contributor)
+
+        self.photos = [Photo.create(sha1=f'bulk{i:036d}', filetype='jpg', privacy=0,
+                                    uploaded_by_id=self.contributor.id if i % 2 else self.admin.id)
+                       for i in range(6)]
+        self.ids = [photo.id for photo in self.photos]
+
+    def tearDown(self):
+        """Close and remove the test database"""
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def tag_names(self, photo):
+        return sorted(tag.name for tag in Tag.select().join(PhotoTag).where(PhotoTag.photo == photo))
+
+    def test_parse(self):
+        """Test id and tag parsing drops blanks and repeats"""
+        self.assertEqual(bulk.parse_ids(['3', '', '1', '3']), [3, 1])
+        self.assertEqual(bulk.parse_tags(' Beach, dog  beach,,sun '), ['beach', 'dog', 'sun'])
+        self.assertEqual(bulk.parse_tags(''), [])
+        with self.assertRaises(ValueError):
+            bulk.parse_ids(['1', 'x'])
+
+    def test_editable_ids(self):
+        """Test that admins get every existing photo and contributors only their uploads"""
+        requested = list(reversed(self.ids)) + [9999]
+        self.assertEqual(bulk.editable_ids(self.admin, requested), list(reversed(self.ids)))
+        self.assertEqual(bulk.editable_ids(self.contributor, requested),
+                         [photo_id for photo_id in reversed(self.ids) if photo_id % 2 == 0])
+        self.assertEqual(bulk.editable_ids(self.viewer, requested), [])
+        self.assertEqual(bulk.editable_ids(None, requested), [])
+
+    def test_add_tags(self):
+        """Test that tags are created once and pairs a photo already has are skipped"""
+        Tag.create(name='beach')
+        PhotoTag.create(photo=self.photos[0], tag=Tag.get(Tag.name == 'beach'))
+        with bulk.transaction():
+            bulk.add_tags(self.ids[:3], ['beach', 'dog'])
+            bulk.add_tags(self.ids[:3], ['dog'])
+        self.assertEqual(Tag.select().count(), 2)
+        self.assertEqual(PhotoTag.select().count(), 6)
+        for photo in self.photos[:3]:
+            self.assertEqual(self.tag_names(photo), ['beach', 'dog'])
+        self.assertEqual(self.tag_names(self.photos[3]), [])
+        self.assertEqual(stats.check_tag_stats(self.test_db), [])
+
+    def test_replace_tags(self):
+        """Test that only changed pairs are written, so kept tags keep their rows"""
+        bulk.add_tags(self.ids[:2], ['beach', 'dog'])
+        kept = PhotoTag.get((PhotoTag.photo == self.photos[0]) & (PhotoTag.tag == Tag.get(Tag.name == 'beach')))
+        with bulk.transaction():
+            bulk.replace_tags({self.ids[0]: ['beach', 'sun'], self.ids[1]: []})
+        self.assertEqual(self.tag_names(self.photos[0]), ['beach', 'sun'])
+        self.assertEqual(self.tag_names(self.photos[1]), [])
+        self.assertTrue(PhotoTag.select().where(PhotoTag.id == kept.id).exists())
+        self.assertEqual(stats.check_tag_stats(self.test_db), [])
+
+    def test_privacy(self):
+        """Test one level for a set and per-photo levels including NULL"""
+        bulk.set_privacy(self.ids[:3], 2)
+        bulk.set_privacies({self.ids[0]: None, self.ids[3]: 1})
+        self.assertEqual([photo.privacy for photo in Photo.select().order_by(Photo.id)],
+                         [None, 2, 2, 1, 0, 0])
+
+    def test_add_to_photoset(self):
+        """Test that repeated adds leave one membership per photo"""
+        photoset = Photoset.create(title='Bulk')
+        bulk.add_to_photoset(self.ids[:4], photoset.id)
+        bulk.add_to_photoset(self.ids[2:], photoset.id)
+        members = [row.photo_id for row in PhotoPhotoset.select().order_by(PhotoPhotoset.photo)]
+        self.assertEqual(members, self.ids)
+
+    def test_transaction_rolls_back(self):
+        """Test that a failing action leaves no partial writes"""
+        with self.assertRaises(RuntimeError):
+            with bulk.transaction():
+                bulk.add_tags(self.ids, ['beach'])
+                bulk.set_privacy(self.ids, 3)
+                raise RuntimeError('boom')
+        self.assertEqual(PhotoTag.select().count(), 0)
+        self.assertEqual(Photo.select().where(Photo.privacy == 3).count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the shared count cache
+"""
+
+import unittest
+import tempfile
+import time
+import os
+from peewee import SqliteDatabase
+
+from app import app
+import cache
+from db import Photo, Tag, PhotoTag, Photoset, PhotoPhotoset
+
+
+class TestCountCache(unittest.TestCase):
+    """Test count caching keyed by the content generation"""
+
+    def setUp(self):
+        """Create temporary main and cache databases"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.cache_db_fd, self.cache_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+        self.cache_db = SqliteDatabase(self.cache_db_path)
+
+        models = [Photo, Tag, PhotoTag, Photoset, PhotoPhotoset]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+        cache.install_generation_triggers(self.test_db)
+
+        # Every cache model, so nothing reaches cache.db in the working directory
+        cache_models = [cache.CountCache, cache.PageCache, cache.PageCacheStat]
+        self.cache_db.bind(cache_models)
+        self.cache_db.connect()
+        self.cache_db.create_tables(cache_models)
+
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+
+        for i in range(5):
+            Photo.create(sha1=f'cachetest{i:031d}', filetype='jpg', privacy=0)
+
+    def tearDown(self):
+        """Close and remove test databases"""
+        self.ctx.pop()
+        self.test_db.close()
+        self.cache_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+        os.close(self.cache_db_fd)
+        os.unlink(self.cache_db_path)
+
+    def visible_query(self, levels):
+        return Photo.select().where(Photo.privacy.in_(levels)).order_by(Photo.id.desc())
+
+    def test_generation_bumped_by_writes(self):
+        """Test that photo writes bump the content generation"""
+        before = cache.current_generation()
+        Photo.create(sha1='cachetest-generation' + '0' * 20, filetype='jpg')
+        cache.g.pop('content_generation', None)
+        self.assertGreater(cache.current_generation(), before)
+
+    def test_count_is_cached_per_generation(self):
+        """Test that a count is stored and served for the same generation"""
+        count, exact = cache.cached_count(self.visible_query([0]), [0])
+        self.assertEqual((count, exact), (5, True))
+
+        row = cache.CountCache.get()
+        self.assertEqual(row.count, 5)
+        self.assertEqual(row.generation, cache.current_generation())
+
+        # A stale value for the same generation proves the cached row is served
+        cache.CountCache.update(count=42).execute()
+        self.assertEqual(cache.cached_count(self.visible_query([0]), [0]), (42, True))
+
+    def test_write_invalidates_count(self):
+        """Test that a new generation recomputes the count"""
+        cache.cached_count(self.visible_query([0]), [0])
+        Photo.create(sha1='cachetest-invalidate' + '0' * 20, filetype='jpg', privacy=0)
+        cache.g.pop('content_generation', None)
+        self.assertEqual(cache.cached_count(self.visible_query([0]), [0]), (6, True))
+
+    def test_visible_levels_in_key(self):
+        """Test that different privacy levels get different cache entries"""
+        self.assertNotEqual(cache.query_signature(self.visible_query([0]), [0]),
+                            cache.query_signature(self.visible_query([0]), [0, 1]))
+        # Ordering does not change the signature
+        self.assertEqual(cache.query_signature(self.visible_query([0]), [0]),
+                         cache.query_signature(self.visible_query([0]).order_by(Photo.id), [0]))
+
+    def test_approximate_while_computing(self):
+        """Test that a claimed entry yields a capped count"""
+        query = self.visible_query([0])
+        cache.CountCache.create(key=cache.query_signature(query, [0]),
+                                generation=cache.current_generation(),
+                                count=None, started_at=time.time())
+        app.config['COUNT_CACHE_APPROX_THRESHOLD'] = 3
+        try:
+            self.assertEqual(cache.cached_count(query, [0]), (3, False))
+            # The floor keeps the requested page covered
+            self.assertEqual(cache.cached_count(query, [0], floor=10), (5, True))
+        finally:
+            del app.config['COUNT_CACHE_APPROX_THRESHOLD']
+
+    def test_no_generation_table(self):
+        """Test that counting still works before the migration has run"""
+        self.test_db.execute_sql('DROP TABLE contentgeneration')
+        cache.g.pop('content_generation', None)
+        self.assertEqual(cache.cached_count(self.visible_query([0]), [0]), (5, True))
+        self.assertEqual(cache.CountCache.select().count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
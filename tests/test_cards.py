@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for lean PhotoCard listing rows
+"""
+
+import unittest
+import tempfile
+import datetime
+import os
+from peewee import SqliteDatabase
+
+from cards import PhotoCard, photo_cards
+from db import Photo, Photoset, PhotoPhotoset
+from util import getSha1Path
+
+
+class TestPhotoCards(unittest.TestCase):
+    """Test that cards carry what listing templates read, for any Photo query"""
+
+    def setUp(self):
+        """Create a temporary database with a small photoset"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, Photoset, PhotoPhotoset]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+
+        self.photoset = Photoset.create(title='Cards')
+        self.photos = []
+        for i in range(5):
+            photo = Photo.create(sha1=f'{i:02d}cards{i:033d}', filetype='jpg', privacy=[None, 0, 1, 2, 3][i],
+                                 datetaken=datetime.datetime(2020, 1, 5 - i))
+            if i % 2 == 0:
+                PhotoPhotoset.create(photo=photo, photoset=self.photoset)
+            self.photos.append(photo)
+
+    def tearDown(self):
+        """Close and remove the test database"""
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def test_card_fields(self):
+        """Test that a card has the model's id, datetaken, privacy and sha1 uri"""
+        cards = photo_cards(Photo.select().order_by(Photo.id))
+        for photo, card in zip(self.photos, cards):
+            self.assertIsInstance(card, PhotoCard)
+            (sha1Path, filename) = getSha1Path(photo.sha1)
+            self.assertEqual((card.id, card.uri, card.datetaken, card.privacy),
+                             (photo.id, sha1Path + '/' + filename, photo.datetaken, photo.privacy))
+        with self.assertRaises(AttributeError):
+            cards[0].sha1 = 'no such slot'
+
+    def test_query_shape_kept(self):
+        """Test that joins, filters, order and pagination of the query are kept"""
+        query = (Photo.select()
+                 .join(PhotoPhotoset)
+                 .where(PhotoPhotoset.photoset == self.photoset)
+                 .order_by(Photo.datetaken.asc()))
+        self.assertEqual([card.id for card in photo_cards(query)],
+                         [self.photos[4].id, self.photos[2].id, self.photos[0].id])
+        self.assertEqual([card.id for card in photo_cards(query.paginate(2, 2))], [self.photos[0].id])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the ordered id arrays behind prev/next navigation
+"""
+
+import unittest
+import tempfile
+import random
+import datetime
+import os
+from flask import g
+from peewee import SqliteDatabase
+
+from app import app
+import cache
+import neighbors
+from db import Photo, Tag, PhotoTag, Photoset, PhotoPhotoset
+
+
+class TestOrderedIds(unittest.TestCase):
+    """Test position lookups on the arrays themselves"""
+
+    def test_sorted_and_unsorted_orders(self):
+        """Test neighbors for id-descending and datetaken orders"""
+        for ids in ([9, 7, 4, 2], [4, 9, 2, 7]):
+            ordered = neighbors.OrderedIds(1, ids)
+            for position, photo_id in enumerate(ids):
+                found = ordered.neighbors(photo_id)
+                self.assertEqual(found.position, position + 1)
+                self.assertEqual(found.total, 4)
+                self.assertEqual(found.prev.id if found.prev else None, ids[position - 1] if position else None)
+                self.assertEqual(found.next.id if found.next else None, ids[position + 1] if position < 3 else None)
+            self.assertIsNone(ordered.neighbors(5))
+            self.assertIsNone(ordered.neighbors(10))
+
+    def test_duplicates_keep_first_position(self):
+        """Test that a repeated membership row doesn't shift positions"""
+        ordered = neighbors.OrderedIds(1, [3, 8, 3, 5])
+        self.assertEqual(list(ordered.order), [3, 8, 5])
+        self.assertEqual(ordered.neighbors(5).position, 3)
+
+
+class TestNeighborCache(unittest.TestCase):
+    """Test cached context arrays against the database"""
+
+    def setUp(self):
+        """Create temporary test database"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, Tag, PhotoTag, Photoset, PhotoPhotoset]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+        cache.install_generation_triggers(self.test_db)
+
+        rng = random.Random(3)
+        self.photoset = Photoset.create(title='Trip')
+        self.tag = Tag.create(name='cat')
+        start = datetime.datetime(2020, 5, 1)
+        with self.test_db.atomic():
+            for i in range(60):
+                photo = Photo.create(sha1=f'nav{i:037d}', filetype='jpg',
+                                     privacy=rng.choice([None, 0, 2]),
+                                     datetaken=start + datetime.timedelta(hours=rng.randint(0, 100)))
+                if i % 2:
+                    PhotoPhotoset.create(photo=photo, photoset=self.photoset)
+                if i % 3:
+                    PhotoTag.create(photo=photo, tag=self.tag)
+
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+        neighbors._arrays.clear()
+        # Tag contexts load from SQL rather than a background-built index
+        app.config['TAG_INDEX_ENABLED'] = False
+
+    def tearDown(self):
+        """Close and remove test database"""
+        app.config.pop('TAG_INDEX_ENABLED', None)
+        neighbors._arrays.clear()
+        self.ctx.pop()
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def new_request(self):
+        """Forget the memoized generation, as a new request would"""
+        g.pop('content_generation', None)
+
+    def test_photoset_order_matches_sql(self):
+        """Test that the photoset array follows datetaken, then id"""
+        expected = [photo.id for photo in (Photo.select()
+                                           .join(PhotoPhotoset)
+                                           .where((PhotoPhotoset.photoset == self.photoset) &
+                                                  (Photo.privacy.is_null() | Photo.privacy.in_([0])))
+                                           .order_by(Photo.datetaken, Photo.id))]
+        ordered = neighbors.photoset(self.photoset.id, [0])
+        self.assertEqual(list(ordered.order), expected)
+        middle = ordered.neighbors(expected[5])
+        self.assertEqual((middle.prev.id, middle.next.id), (expected[4], expected[6]))
+
+    def test_tags_and_photostream_are_id_descending(self):
+        """Test the id-ordered contexts"""
+        tagged = neighbors.tags(['cat'], [0, 1, 2, 3])
+        self.assertEqual(len(tagged), PhotoTag.select().count())
+        self.assertEqual(list(tagged.order), sorted(tagged.order, reverse=True))
+        stream = neighbors.photostream([0])
+        self.assertEqual(len(stream), Photo.select().where(Photo.privacy.is_null() | (Photo.privacy == 0)).count())
+
+    def test_rebuilt_after_write(self):
+        """Test that an array is reused until the content generation changes"""
+        first = neighbors.date('2020-05', [0, 2])
+        self.new_request()
+        self.assertIs(neighbors.date('2020-05', [2, 0]), first)
+
+        photo = Photo.create(sha1='n' * 40, filetype='jpg', datetaken=datetime.datetime(2020, 5, 9))
+        self.new_request()
+        second = neighbors.date('2020-05', [0, 2])
+        self.assertIsNot(second, first)
+        self.assertEqual(second.neighbors(photo.id).position, 1)
+
+    def test_cache_is_bounded(self):
+        """Test that the least recently used contexts are evicted"""
+        app.config['NEIGHBOR_CACHE_SIZE'] = 2
+        try:
+            neighbors.photostream([0])
+            neighbors.photostream([0, 1])
+            neighbors.photostream([0, 1, 2])
+            self.assertEqual(len(neighbors._arrays), 2)
+            self.assertNotIn(('photostream', (0,)), neighbors._arrays)
+        finally:
+            del app.config['NEIGHBOR_CACHE_SIZE']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the shared rendered-page cache and conditional GET
+"""
+
+import unittest
+import tempfile
+import threading
+import time
+import os
+from peewee import SqliteDatabase
+
+from app import app
+import web  # sets up Flask-Security, which current_user needs
+import cache
+from db import Photo, Tag, PhotoTag, Photoset, PhotoPhotoset
+
+
+class TestPageCache(unittest.TestCase):
+    """Test page caching keyed by URL, visible levels and content generation"""
+
+    def setUp(self):
+        """Create temporary main and cache databases and a counting view"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.cache_db_fd, self.cache_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+        self.cache_db = SqliteDatabase(self.cache_db_path)
+
+        models = [Photo, Tag, PhotoTag, Photoset, PhotoPhotoset]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+        cache.install_generation_triggers(self.test_db)
+
+        cache_models = [cache.CountCache, cache.PageCache, cache.PageCacheStat]
+        self.cache_db.bind(cache_models)
+        self.cache_db.connect()
+        self.cache_db.create_tables(cache_models)
+        cache._page_stats.clear()
+        cache._page_stats_since = None
+
+        self.renders = 0
+
+        @cache.cached_page
+        def view():
+            self.renders += 1
+            return f'<p>render {self.renders}</p>'
+        self.view = view
+
+    def tearDown(self):
+        """Close and remove test databases"""
+        self.test_db.close()
+        self.cache_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+        os.close(self.cache_db_fd)
+        os.unlink(self.cache_db_path)
+
+    def get(self, path='/photostream/'):
+        """Call the view in a fresh request, returning (body, cache header)"""
+        with app.test_request_context(path):
+            response = app.make_response(self.view())
+            return response.get_data(as_text=True), response.headers.get('X-Cigarbox-Cache')
+
+    def test_miss_then_hit(self):
+        """Test that the second anonymous request is served from the cache"""
+        self.assertEqual(self.get(), ('<p>render 1</p>', 'MISS'))
+        self.assertEqual(self.get(), ('<p>render 1</p>', 'HIT'))
+        self.assertEqual(self.renders, 1)
+        self.assertEqual(cache.page_cache_stats(), {'miss': 1, 'hit': 1})
+
+    def test_hits_counted_without_writes(self):
+        """Test that hit counts reach pagecachestat with the next miss or once stale"""
+        self.get()
+        for _ in range(3):
+            self.get()
+        stored = dict(cache.PageCacheStat.select(cache.PageCacheStat.name, cache.PageCacheStat.count).tuples())
+        self.assertEqual(stored, {'miss': 1})
+        self.assertEqual(cache.page_cache_stats(), {'miss': 1, 'hit': 3})
+
+        self.get('/photostream/2')
+        stored = dict(cache.PageCacheStat.select(cache.PageCacheStat.name, cache.PageCacheStat.count).tuples())
+        self.assertEqual(stored, {'miss': 2, 'hit': 3})
+
+        cache._count_page('hit', now=1000)
+        cache._count_page('hit', now=1000 + app.config.get('PAGE_CACHE_STATS_FLUSH', 10))
+        self.assertEqual(cache.PageCacheStat.get(cache.PageCacheStat.name == 'hit').count, 5)
+
+    def test_urls_cached_separately(self):
+        """Test that different URLs get their own entries"""
+        self.get('/photostream/')
+        self.assertEqual(self.get('/photostream/2'), ('<p>render 2</p>', 'MISS'))
+        self.assertEqual(self.get('/photostream/')[1], 'HIT')
+
+    def test_write_invalidates(self):
+        """Test that a content write makes cached pages stale and prunes them"""
+        self.get()
+        Photo.create(sha1='pagecache' + '0' * 31, filetype='jpg')
+        self.assertEqual(self.get(), ('<p>render 2</p>', 'MISS'))
+        self.assertEqual(self.get()[1], 'HIT')
+        self.assertEqual(cache.PageCache.select().count(), 1)
+
+    def test_ttl_expiry(self):
+        """Test that an entry older than PAGE_CACHE_TTL is rendered again"""
+        self.get()
+        cache.PageCache.update(started_at=time.time() - 3600).execute()
+        self.assertEqual(self.get(), ('<p>render 2</p>', 'MISS'))
+
+    def test_query_string_bypasses(self):
+        """Test that requests with a query string are never cached"""
+        self.assertEqual(self.get('/photostream/?sort=old'), ('<p>render 1</p>', None))
+        self.assertEqual(self.get('/photostream/?sort=old'), ('<p>render 2</p>', None))
+        self.assertEqual(cache.PageCache.select().count(), 0)
+        self.assertEqual(cache.page_cache_stats(), {'bypass': 2})
+
+    def test_disabled(self):
+        """Test that PAGE_CACHE_ENABLED = False renders every time"""
+        app.config['PAGE_CACHE_ENABLED'] = False
+        try:
+            self.get()
+            self.assertEqual(self.get(), ('<p>render 2</p>', None))
+        finally:
+            del app.config['PAGE_CACHE_ENABLED']
+
+    def test_waits_for_claiming_worker(self):
+        """Test that a request waits for the worker already rendering the page"""
+        self.get()
+        Photo.create(sha1='pagecache' + '1' * 31, filetype='jpg')
+        with app.test_request_context('/photostream/'):
+            generation = cache.current_generation()
+        # Another worker claimed the new generation and finishes shortly
+        cache.PageCache.update(generation=generation, body=None, started_at=time.time()).execute()
+
+        def finish():
+            time.sleep(0.2)
+            cache.PageCache.update(body=b'<p>other worker</p>').execute()
+        worker = threading.Thread(target=finish)
+        worker.start()
+        try:
+            self.assertEqual(self.get(), ('<p>other worker</p>', 'WAIT'))
+        finally:
+            worker.join()
+        self.assertEqual(self.renders, 1)
+
+    def test_abandoned_claim(self):
+        """Test that a claim older than PAGE_CACHE_WAIT is taken over"""
+        self.get()
+        cache.PageCache.update(body=None, started_at=time.time() - 60).execute()
+        self.assertEqual(self.get(), ('<p>render 2</p>', 'MISS'))
+
+    def test_error_response_not_stored(self):
+        """Test that non-200 responses are not cached"""
+        @cache.cached_page
+        def missing():
+            return 'gone', 404
+        with app.test_request_context('/photosets/99'):
+            self.assertEqual(app.make_response(missing()).status_code, 404)
+        self.assertEqual(cache.PageCache.select().count(), 0)
+
+
+class TestConditionalGet(unittest.TestCase):
+    """Test weak ETags from the content generation, viewer class and URL"""
+
+    def setUp(self):
+        """Create a temporary main database and a counting view"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, Tag, PhotoTag, Photoset, PhotoPhotoset]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+        cache.install_generation_triggers(self.test_db)
+
+        self.renders = 0
+
+        @cache.conditional_page
+        def view():
+            self.renders += 1
+            return 'page'
+        self.view = view
+
+    def tearDown(self):
+        """Close and remove the test database"""
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def get(self, path='/tags', etag=None):
+        """Call the view in a fresh request, returning the response"""
+        headers = {'If-None-Match': etag} if etag else {}
+        with app.test_request_context(path, headers=headers):
+            return app.make_response(self.view())
+
+    def test_revalidation(self):
+        """Test that a matching If-None-Match gets a 304 without running the view"""
+        response = self.get()
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+
+        response = self.get(etag=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.renders, 1)
+
+    def test_write_changes_etag(self):
+        """Test that a content write makes old validators stale"""
+        etag = self.get().headers['ETag']
+        Tag.create(name='conditional')
+        response = self.get(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_page_args_change_etag(self):
+        """Test that different URLs don't share validators"""
+        etag = self.get('/tags/cat').headers['ETag']
+        self.assertEqual(self.get('/tags/cat/page/2', etag=etag).status_code, 200)
+        self.assertEqual(self.get('/tags/cat?in=x', etag=etag).status_code, 200)
+
+    def test_extra_parts(self):
+        """Test that view-supplied parts such as the access mode split validators"""
+        with app.test_request_context('/photos/1'):
+            self.assertNotEqual(cache.page_etag('full'), cache.page_etag('preview'))
+
+    def test_signed_url_period(self):
+        """Test that the signing window changes only once per S3_SIGNED_URL_EXPIRY"""
+        original = app.config.get('S3_SIGNED_URL_EXPIRY')
+        app.config['S3_SIGNED_URL_EXPIRY'] = 300
+        try:
+            self.assertEqual(cache.signed_url_period(now=600), cache.signed_url_period(now=899))
+            self.assertNotEqual(cache.signed_url_period(now=899), cache.signed_url_period(now=900))
+            with app.test_request_context('/photos/1'):
+                self.assertNotEqual(cache.page_etag('full', cache.signed_url_period(now=899)),
+                                    cache.page_etag('full', cache.signed_url_period(now=900)))
+        finally:
+            if original is None:
+                del app.config['S3_SIGNED_URL_EXPIRY']
+            else:
+                app.config['S3_SIGNED_URL_EXPIRY'] = original
+
+    def test_flash_skips_validators(self):
+        """Test that one-off session content is never revalidated"""
+        with app.test_request_context('/tags'):
+            cache.session['_flashes'] = [('message', 'Saved')]
+            self.assertIsNone(cache.page_etag())
+
+    def test_disabled(self):
+        """Test that CONDITIONAL_GET_ENABLED = False sends no validators"""
+        app.config['CONDITIONAL_GET_ENABLED'] = False
+        try:
+            self.assertNotIn('ETag', self.get().headers)
+        finally:
+            del app.config['CONDITIONAL_GET_ENABLED']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for signed PoW tokens and challenges, the shared request budget
+table and the replay filter
+"""
+
+import unittest
+import tempfile
+import multiprocessing
+import hashlib
+import hmac
+import time
+import os
+
+from app import app
+import web  # sets up Flask-Security, which current_user needs
+import powauth
+import sharedfile
+
+
+def spend(path, key, limit, attempts, results):
+    """Consume from a separately attached table (one process of the concurrency test)"""
+    table = powauth.BudgetTable(path, 64)
+    results.put(sum(1 for _ in range(attempts) if table.consume(key, 2000000000, limit, 1000) is not None))
+
+
+def solve(challenge, difficulty):
+    """Brute-force a nonce the way static/js/pow.js does"""
+    nonce = 0
+    while not hashlib.sha256((challenge + str(nonce)).encode()).hexdigest().startswith('0' * difficulty):
+        nonce += 1
+    return nonce
+
+
+class TestPowTokens(unittest.TestCase):
+    """Test signing, expiry, IP binding and the unified validator"""
+
+    def setUp(self):
+        """Point the budget table at a temporary file and set PoW limits"""
+        self.budget_dir = tempfile.TemporaryDirectory()
+        self.saved_config = dict(app.config)
+        app.config.update(POW_ENABLED=True, POW_BUDGET_PATH=os.path.join(self.budget_dir.name, 'budgets.bin'),
+                          POW_REPLAY_FILTER_PATH=os.path.join(self.budget_dir.name, 'replay.bin'),
+                          POW_REPLAY_FILTER_BITS=4096, POW_CHALLENGE_EXPIRY=300,
+                          POW_ADAPTIVE_PATH=os.path.join(self.budget_dir.name, 'load.bin'),
+                          POW_ADAPTIVE_DIFFICULTY=True, POW_DIFFICULTY=1, POW_DIFFICULTY_MIN=None,
+                          POW_DIFFICULTY_MAX=None, POW_ADAPTIVE_INTERVAL=30,
+                          POW_BUDGET_SLOTS=64, POW_TOKEN_MAX_REQUESTS=3, POW_TOKEN_EXPIRY_MINUTES=15,
+                          POW_BIND_TO_IP=True, POW_ALLOW_PRIVACY_PROXIES=True,
+                          POW_PRIVACY_PROXY_RANGES=['104.28.'], POW_TOKEN_SECRET='test-secret')
+
+    def tearDown(self):
+        """Restore config and remove the budget table"""
+        app.config.clear()
+        app.config.update(self.saved_config)
+        self.budget_dir.cleanup()
+
+    def test_signature(self):
+        """Test that a token round-trips and any change to it is rejected"""
+        value, token = powauth.issue_token('10.0.0.1', now=1000)
+        self.assertEqual(powauth.parse_token(value), token)
+        self.assertEqual(token.expires_at, 1000 + 15 * 60)
+
+        payload, signature = value.split('.')
+        forged = powauth._b64encode(f'{token.token_id}|10.0.0.2|1000|9999999999'.encode())
+        for bad in (forged + '.' + signature, payload + '.' + signature[:-2] + 'AA', payload, '', 'a.b.c'):
+            self.assertIsNone(powauth.parse_token(bad), bad)
+
+        app.config['POW_TOKEN_SECRET'] = 'rotated'
+        self.assertIsNone(powauth.parse_token(value))
+
+    def test_no_secret(self):
+        """Test that without POW_TOKEN_SECRET or SECRET_KEY nothing is issued or accepted"""
+        value, _ = powauth.issue_token('10.0.0.1')
+        challenge = powauth.issue_challenge(1)
+        app.config.update(POW_TOKEN_SECRET=None, SECRET_KEY=None)
+        with self.assertRaises(RuntimeError):
+            powauth.issue_token('10.0.0.1')
+        with self.assertRaises(RuntimeError):
+            powauth.issue_challenge(1)
+        self.assertIsNone(powauth.parse_token(value))
+        self.assertIsNone(powauth.parse_challenge(challenge))
+        self.assertEqual(powauth.check_token(value, '10.0.0.1').reason, 'invalid')
+
+        # Tokens signed with an empty key must not be forgeable either
+        forged = value.split('.')[0] + '.' + powauth._b64encode(
+            hmac.new(hashlib.sha256(b'cigarbox-pow-token\x00').digest(),
+                     value.split('.')[0].encode('ascii'), hashlib.sha256).digest())
+        self.assertEqual(powauth.check_token(forged, '10.0.0.1').reason, 'invalid')
+
+    def test_check_token(self):
+        """Test expiry, IP binding, the privacy proxy exemption and consume=False"""
+        value, _ = powauth.issue_token('10.0.0.1', now=1000)
+        self.assertEqual(powauth.check_token(None, '10.0.0.1').reason, 'missing')
+        self.assertEqual(powauth.check_token('junk', '10.0.0.1').reason, 'invalid')
+        self.assertEqual(powauth.check_token(value, '10.0.0.1', now=1000 + 15 * 60).reason, 'expired')
+        self.assertEqual(powauth.check_token(value, '10.0.0.2', now=1001).reason, 'ip_mismatch')
+        self.assertTrue(powauth.check_token(value, '104.28.5.5', now=1001).valid)
+
+        app.config['POW_TOKEN_EXPIRY_MINUTES'] = 5
+        self.assertEqual(powauth.check_token(value, '10.0.0.1', now=1000 + 6 * 60).reason, 'expired')
+
+        app.config['POW_BIND_TO_IP'] = False
+        check = powauth.check_token(value, '10.0.0.2', consume=False, now=1001)
+        self.assertEqual((check.valid, check.used), (True, None))
+
+    def test_budget(self):
+        """Test that each token gets POW_TOKEN_MAX_REQUESTS requests of its own"""
+        first, _ = powauth.issue_token('10.0.0.1', now=1000)
+        second, _ = powauth.issue_token('10.0.0.1', now=1000)
+        self.assertEqual([powauth.check_token(first, '10.0.0.1', now=1001).used for _ in range(3)], [1, 2, 3])
+        self.assertEqual(powauth.check_token(first, '10.0.0.1', now=1001).reason, 'exhausted')
+        self.assertTrue(powauth.check_token(first, '10.0.0.1', consume=False, now=1001).valid)
+        self.assertEqual(powauth.check_token(second, '10.0.0.1', now=1001).used, 1)
+
+    def test_require_access(self):
+        """Test that a protected view runs only while the cookie has budget left"""
+        value, _ = powauth.issue_token('10.0.0.1')
+        view = web.require_access(pow=True)(lambda: 'photo')
+        statuses = []
+        for _ in range(4):
+            with app.test_request_context('/photos/1', environ_base={'REMOTE_ADDR': '10.0.0.1'},
+                                          headers={'Cookie': f'{powauth.COOKIE_NAME}={value}'}):
+                result = view()
+                statuses.append(200 if result == 'photo' else result[1])
+        self.assertEqual(statuses, [200, 200, 200, 403])
+
+    def test_request_load_only_with_pow_enabled(self):
+        """Test that consuming checks count as load only while PoW is enabled"""
+        def requests_counted():
+            return powauth.difficulty_state()['counts']['requests']
+
+        for enabled, expected in ((True, 1), (False, 1)):
+            app.config['POW_ENABLED'] = enabled
+            with app.test_request_context('/photos/1', environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+                powauth.check_request()
+                powauth.check_request(consume=False)
+            self.assertEqual(requests_counted(), expected)
+
+    def test_relative_paths_under_app_root(self):
+        """Test that shared files don't depend on the working directory"""
+        self.assertEqual(sharedfile.resolve('/srv/cigarbox', 'pow_load.bin'), '/srv/cigarbox/pow_load.bin')
+        self.assertEqual(sharedfile.resolve('/srv/cigarbox', '/var/run/load.bin'), '/var/run/load.bin')
+
+    def test_challenge(self):
+        """Test that a challenge verifies once, within its expiry, at its signed difficulty"""
+        challenge = powauth.issue_challenge(2, now=1000)
+        nonce = solve(challenge, 2)
+        self.assertEqual(powauth.parse_challenge(challenge).difficulty, 2)
+        self.assertEqual(powauth.verify_solution(challenge, nonce, now=1000 + 301)[1], 'expired')
+        self.assertEqual(powauth.verify_solution(challenge, nonce, now=999)[1], 'expired')
+        wrong = next(n for n in range(nonce + 1, nonce + 10 ** 6)
+                     if not hashlib.sha256((challenge + str(n)).encode()).hexdigest().startswith('00'))
+        self.assertEqual(powauth.verify_solution(challenge, wrong, now=1010)[1], 'wrong')
+        self.assertEqual(powauth.verify_solution(challenge, nonce, now=1010)[1], 'ok')
+        self.assertEqual(powauth.verify_solution(challenge, nonce, now=1011)[1], 'replayed')
+
+        seed, issued_at, _, signature = challenge.split('.')
+        for bad in (f'{seed}.{issued_at}.0.{signature}', f'{seed}.{issued_at}.2', 'junk', ''):
+            self.assertEqual(powauth.verify_solution(bad, 0, now=1010)[1], 'invalid', bad)
+
+    def test_verify_route(self):
+        """Test /pow/challenge and /pow/verify end to end, including a replayed solution"""
+        client = app.test_client()
+        data = client.get('/pow/challenge').get_json()
+        self.assertEqual(data['difficulty'], 1)
+        solution = {'challenge': data['challenge'], 'nonce': solve(data['challenge'], 1)}
+        response = client.post('/pow/verify', json=solution)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(powauth.COOKIE_NAME, response.headers.get('Set-Cookie'))
+        response = client.post('/pow/verify', json=solution)
+        self.assertEqual((response.status_code, response.get_json()['error']), (400, 'Challenge already used'))
+
+        state = client.get('/pow/debug').get_json()['difficulty']
+        self.assertEqual((state['counts']['issued'], state['counts']['verified']), (1, 1))
+
+    def test_adaptive_difficulty(self):
+        """Test that a burst of challenges raises the difficulty /pow/challenge hands out, within bounds"""
+        app.config.update(POW_DIFFICULTY_MAX=2, POW_ADAPTIVE_INTERVAL=0,
+                          POW_ADAPTIVE_TARGETS={'issued': 3, 'verified': 0, 'requests': 0})
+        client = app.test_client()
+        difficulties = [client.get('/pow/challenge').get_json()['difficulty'] for _ in range(8)]
+        self.assertEqual(difficulties[:4], [1, 1, 1, 1])
+        self.assertEqual(difficulties[4:], [2, 2, 2, 2])
+        self.assertEqual(powauth.parse_challenge(client.get('/pow/challenge').get_json()['challenge']).difficulty, 2)
+
+        app.config['POW_ADAPTIVE_DIFFICULTY'] = False
+        self.assertEqual(client.get('/pow/challenge').get_json()['difficulty'], 1)
+
+
+class TestReplayFilter(unittest.TestCase):
+    """Test the rotating Bloom filter of spent challenges"""
+
+    def setUp(self):
+        """Create a filter in a temporary directory"""
+        self.filter_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.filter_dir.name, 'replay.bin')
+
+    def tearDown(self):
+        """Remove the filter"""
+        self.filter_dir.cleanup()
+
+    def test_rotation(self):
+        """Test that entries are remembered for at least one window and forgotten after two"""
+        replay = powauth.ReplayFilter(self.path, 1 << 16, window=100)
+        now = time.time() + 1
+        self.assertTrue(replay.spend('first', now))
+        self.assertFalse(replay.spend('first', now + 50))
+        self.assertTrue(replay.spend('second', now + 150))  # rotates: 'first' is in the older generation
+        self.assertFalse(replay.spend('first', now + 150))
+        self.assertFalse(powauth.ReplayFilter(self.path, 1 << 16, window=100).spend('second', now + 160))
+        self.assertTrue(replay.spend('first', now + 260))  # rotated again: 'first' is gone
+        self.assertFalse(replay.spend('second', now + 260))
+
+    def test_false_positive_rate(self):
+        """Test that 2,000 spent challenges in 64 Kibit leave fresh ones (nearly) always accepted"""
+        replay = powauth.ReplayFilter(self.path, 1 << 16, window=10 ** 9)
+        for i in range(2000):
+            self.assertTrue(replay.spend(f'spent-{i}', 1))
+        false_positives = sum(1 for i in range(1000) if not replay.spend(f'fresh-{i}', 1))
+        self.assertLessEqual(false_positives, 1)
+
+
+class TestLoadMeter(unittest.TestCase):
+    """Test the sliding load window and difficulty steps directly"""
+
+    def setUp(self):
+        """Create a meter in a temporary directory"""
+        self.meter_dir = tempfile.TemporaryDirectory()
+        self.meter = powauth.LoadMeter(os.path.join(self.meter_dir.name, 'load.bin'), window=10)
+
+    def tearDown(self):
+        """Remove the meter"""
+        self.meter_dir.cleanup()
+
+    def test_window_slides(self):
+        """Test that only events from the last window seconds are counted"""
+        for second in range(1000, 1020):
+            self.meter.record('requests', second)
+        self.meter.record('issued', 1019)
+        counts = self.meter.state((4, 6), {}, now=1019)['counts']
+        self.assertEqual(counts, {'issued': 1, 'verified': 0, 'requests': 10})
+        self.assertEqual(self.meter.state((4, 6), {}, now=1035)['counts']['requests'], 0)
+
+    def test_steps(self):
+        """Test one step per interval, up over target, down under half, held in between"""
+        targets = {'issued': 10, 'verified': 0, 'requests': 0}
+        now = time.time() + 100
+        for _ in range(25):
+            self.meter.record('issued', now)
+        steps = [self.meter.difficulty((4, 6), targets, 3, now + offset) for offset in (0, 1, 3, 6)]
+        self.assertEqual(steps, [5, 5, 6, 6])  # 2.5x target, capped at the maximum
+        self.assertEqual(self.meter.difficulty((4, 6), targets, 3, now + 20), 5)  # window is empty again
+        for _ in range(7):
+            self.meter.record('issued', now + 30)
+        self.assertEqual(self.meter.difficulty((4, 6), targets, 3, now + 31), 5)  # between half and target
+        self.assertEqual(self.meter.difficulty((5, 6), targets, 3, now + 100), 5)  # never below the minimum
+
+
+class TestBudgetTable(unittest.TestCase):
+    """Test the memory-mapped budget table directly"""
+
+    def setUp(self):
+        """Create a small table in a temporary directory"""
+        self.budget_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.budget_dir.name, 'budgets.bin')
+
+    def tearDown(self):
+        """Remove the table"""
+        self.budget_dir.cleanup()
+
+    def test_compaction_and_reuse(self):
+        """Test that expired slots are reused when full and dropped by compaction"""
+        table = powauth.BudgetTable(self.path, 8, compact_seconds=10 ** 9)
+        keys = [bytes([i + 1]) * 16 for i in range(9)]
+        for key in keys[:8]:
+            self.assertEqual(table.consume(key, 1100, 5, 1000), 1)
+        self.assertIsNone(table.consume(keys[8], 1100, 5, 1000))  # full of live tokens
+        self.assertEqual(table.consume(keys[8], 1300, 5, 1200), 1)  # the others have expired
+        self.assertEqual(table.used(keys[0], 1200), 0)
+        self.assertEqual(table.compact(1200), 7)
+        self.assertEqual(table.stats(1200)['live'], 1)
+        self.assertEqual(table.consume(keys[8], 1300, 5, 1200), 2)
+
+        reopened = powauth.BudgetTable(self.path, 8)
+        self.assertEqual(reopened.used(keys[8], 1200), 2)
+        resized = powauth.BudgetTable(self.path, 16)
+        self.assertEqual(resized.used(keys[8], 1200), 0)
+
+    def test_processes_share_budget(self):
+        """Test that concurrent processes never spend more than the limit between them"""
+        key = os.urandom(16)
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        workers = [context.Process(target=spend, args=(self.path, key, 150, 100, results)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        granted = sum(results.get(timeout=30) for _ in workers)
+        for worker in workers:
+            worker.join()
+        self.assertEqual(granted, 150)
+        self.assertEqual(powauth.BudgetTable(self.path, 64).used(key, 1000), 150)
+
+
+if __name__ == '__main__':
+    unittest.main()
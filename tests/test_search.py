@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the FTS5 search index
+"""
+
+import unittest
+import tempfile
+import os
+from peewee import SqliteDatabase
+
+from app import app
+import search
+from db import Photo, Tag, PhotoTag, Photoset, PhotoPhotoset, ImportMeta, User, SearchIndex
+
+
+class TestSearch(unittest.TestCase):
+    """Test trigger sync, query parsing and ranked photo search"""
+
+    def setUp(self):
+        """Create temporary test database"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, Tag, PhotoTag, Photoset, PhotoPhotoset, ImportMeta, User, SearchIndex]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables([m for m in models if m is not SearchIndex])
+
+        # Existing rows are backfilled when the index is installed
+        self.public = Photo.create(sha1='a' * 40, filetype='jpg', privacy=None)
+        self.private = Photo.create(sha1='b' * 40, filetype='jpg', privacy=3)
+        self.beach = Tag.create(name='beach')
+        PhotoTag.create(photo=self.public, tag=self.beach)
+        PhotoTag.create(photo=self.private, tag=self.beach)
+        search.install_search_index(self.test_db)
+
+    def tearDown(self):
+        """Close and remove test database"""
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def ids(self, kind, text):
+        return sorted(int(row.ref_id) for row in search.matching_ids(kind, text))
+
+    def test_fts_query(self):
+        """Test that free text becomes a safe prefix query"""
+        self.assertEqual(search.fts_query('Beach sun'), '"beach"* "sun"*')
+        self.assertEqual(search.fts_query('IMG_0042.JPG'), '"img 0042 jpg"*')
+        self.assertEqual(search.fts_query('"OR (NEAR'), '"or"* "near"*')
+        self.assertIsNone(search.fts_query(' *** '))
+
+    def test_backfill_and_triggers(self):
+        """Test that inserts, updates and deletes keep the index in sync"""
+        self.assertEqual(self.ids('tag', 'bea'), [self.beach.id])
+
+        tag = Tag.create(name='sunset')
+        self.assertEqual(self.ids('tag', 'sunset'), [tag.id])
+        tag.name = 'dusk'
+        tag.save()
+        self.assertEqual(self.ids('tag', 'sunset'), [])
+        self.assertEqual(self.ids('tag', 'dusk'), [tag.id])
+        tag.delete_instance()
+        self.assertEqual(self.ids('tag', 'dusk'), [])
+
+        photoset = Photoset.create(title='Iceland', description='Glaciers and waterfalls')
+        self.assertEqual(self.ids('photoset', 'glacier'), [photoset.id])
+
+        user = User.create(email='someone@example.com', password='x')
+        self.assertEqual(self.ids('user', 'example'), [user.id])
+
+    def test_search_photos_respects_privacy(self):
+        """Test that ranked photo search filters by visible levels"""
+        total, photos = search.search_photos('beach', [0], 1, 10)
+        self.assertEqual((total, [p.id for p in photos]), (1, [self.public.id]))
+        total, photos = search.search_photos('beach', [0, 1, 2, 3], 1, 10)
+        self.assertEqual(total, 2)
+
+    def test_search_photos_ranking_and_sources(self):
+        """Test that photos are reached through photosets and import paths"""
+        other = Photo.create(sha1='c' * 40, filetype='jpg', privacy=0)
+        ImportMeta.create(photo=other, sha1=other.sha1, importpath='/Users/me/Beach/IMG_0042.JPG')
+        photoset = Photoset.create(title='Summer', description='beach trip')
+        PhotoPhotoset.create(photo=self.public, photoset=photoset)
+
+        total, photos = search.search_photos('img_0042', [0], 1, 10)
+        self.assertEqual([p.id for p in photos], [other.id])
+
+        # The public photo matches through both its tag and its photoset
+        total, photos = search.search_photos('beach', [0], 1, 10)
+        self.assertEqual(total, 2)
+        self.assertEqual(photos[0].id, self.public.id)
+
+        # The admin filter reaches all three regardless of privacy
+        matched = {int(row[0]) for row in search.matching_photo_ids('beach').tuples()}
+        self.assertEqual(matched, {self.public.id, self.private.id, other.id})
+
+    def test_admin_photo_filter(self):
+        """Test id, sha1 prefix and full-text matches, and that blank or short prefixes match nothing extra"""
+        def matched(text):
+            return sorted(photo.id for photo in Photo.select().where(search.admin_photo_filter(text)))
+
+        self.assertEqual(matched(' BBBB '), [self.private.id])
+        self.assertEqual(matched(str(self.public.id)), [self.public.id])
+        self.assertEqual(matched('beach'), [self.public.id, self.private.id])
+        for text in ('', '   ', 'aaa', 'zzzz'):
+            self.assertEqual(matched(text), [], repr(text))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for bulk-edit selections
+"""
+
+import unittest
+import tempfile
+import datetime
+import os
+from peewee import SqliteDatabase
+
+from app import app
+import archive
+import selection
+from db import Photo, Tag, PhotoTag, Photoset, PhotoPhotoset, Selection
+
+
+class TestSelection(unittest.TestCase):
+    """Test selection specs, id packing and token resolution"""
+
+    def setUp(self):
+        """Create temporary test database"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, Tag, PhotoTag, Photoset, PhotoPhotoset, Selection]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+
+        self.photos = [Photo.create(sha1=f'seltest{i:033d}', filetype='jpg',
+                                    privacy=i % 2, datetaken=datetime.datetime(2024, 1 + i % 2, 1))
+                       for i in range(6)]
+        beach, sunset = Tag.create(name='beach'), Tag.create(name='sunset')
+        for photo in self.photos[:4]:
+            PhotoTag.create(photo=photo, tag=beach)
+        for photo in self.photos[2:]:
+            PhotoTag.create(photo=photo, tag=sunset)
+        self.photoset = Photoset.create(title='Trip')
+        for photo in self.photos[:3]:
+            PhotoPhotoset.create(photo=photo, photoset=self.photoset)
+
+    def tearDown(self):
+        """Close and remove test database"""
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def ids(self, spec):
+        return sorted(p.id for p in selection.selection_query(selection.normalize_spec(spec)))
+
+    def test_pack_ids_roundtrip(self):
+        """Test that packed id sets decode to the sorted unique ids"""
+        ids = [5, 3, 100000, 3, 1, 70000000]
+        self.assertEqual(selection.unpack_ids(selection.pack_ids(ids)), [1, 3, 5, 100000, 70000000])
+        self.assertEqual(selection.unpack_ids(selection.pack_ids([])), [])
+        # Dense ranges compress far below the comma-joined form
+        dense = list(range(1, 20001))
+        self.assertLess(len(selection.pack_ids(dense)), len(','.join(map(str, dense))) // 50)
+
+    def test_spec_queries(self):
+        """Test that each spec key filters like the listing it came from"""
+        p = [photo.id for photo in self.photos]
+        self.assertEqual(self.ids({'tags': 'beach'}), p[:4])
+        self.assertEqual(self.ids({'tags': 'sunset,beach'}), p[2:4])
+        self.assertEqual(self.ids({'photoset': self.photoset.id}), p[:3])
+        self.assertEqual(self.ids({'photoset': self.photoset.id, 'privacy': 1}), [p[1]])
+        self.assertEqual(self.ids({'date': '2024-02'}), [p[1], p[3], p[5]])
+        self.assertEqual(self.ids({'privacy': 0}), [p[0], p[2], p[4]])
+        self.assertEqual(self.ids({'ids': [p[5], p[0]]}), [p[0], p[5]])
+
+    def test_date_spec_matches_date_listing(self):
+        """Test that a date selection holds exactly the photos its date page lists"""
+        # Numeric-affinity and non-ISO values are where LIKE and the listing's range disagree
+        odd = [Photo.create(sha1=f'seldate{i:033d}', filetype='jpg', privacy=0, datetaken=value)
+               for i, value in enumerate(['2024', '20240101', '2024/01/01'])]
+        for prefix in ('2024', '2024-01', '2024-02-01', '202'):
+            listing = sorted(photo.id for photo in Photo.select().where(archive.datetaken_startswith(prefix)))
+            self.assertEqual(self.ids({'date': prefix}), listing, prefix)
+        self.assertIn(odd[2].id, self.ids({'date': '2024'}))
+        self.assertNotIn(odd[0].id, self.ids({'date': '2024'}))
+
+    def test_token_is_deterministic_per_user(self):
+        """Test that the same spec reuses one row per user"""
+        token = selection.create_selection({'tags': 'beach,sunset'}, 1)
+        self.assertEqual(selection.create_selection({'tags': ['sunset', 'beach']}, 1), token)
+        self.assertNotEqual(selection.create_selection({'tags': 'beach,sunset'}, 2), token)
+        self.assertEqual(Selection.select().count(), 2)
+
+    def test_selection_bound_to_user(self):
+        """Test that another user can't resolve a selection token"""
+        token = selection.create_selection({'photoset': self.photoset.id}, 1)
+        self.assertEqual(selection.get_selection_spec(token, 1), {'photoset': self.photoset.id})
+        self.assertIsNone(selection.get_selection_spec(token, 2))
+        self.assertIsNone(selection.get_selection_spec('missing', 1))
+
+    def test_empty_selection_rejected(self):
+        """Test that a spec with nothing in it is refused"""
+        with self.assertRaises(ValueError):
+            selection.create_selection({'tags': ' , ', 'ids': []}, 1)
+
+    def test_expired_selections_pruned(self):
+        """Test that old selections are deleted when new ones are created"""
+        Selection.create(token='old', spec='{"privacy": 0}', created_by_id=1,
+                         created_at=datetime.datetime.now() - datetime.timedelta(days=365))
+        selection.create_selection({'privacy': 1}, 1)
+        self.assertIsNone(Selection.get_or_none(Selection.token == 'old'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for shared photoset cursor pages and batched signed URLs
+"""
+
+import unittest
+import tempfile
+import datetime
+import os
+import re
+from unittest.mock import patch
+from peewee import SqliteDatabase
+
+from app import app
+import web  # registers the shared routes
+import cache
+import neighbors
+import sharedsets
+import shareviews
+from db import Photo, Photoset, PhotoPhotoset, ShareToken, Tag, PhotoTag
+
+
+def fake_signed_url(config, key, expiry=3600):
+    return f'https://signed.example/{key}?expires={expiry}'
+
+
+@patch('aws.getPrivateURL', side_effect=fake_signed_url)
+class TestSharedPhotosets(unittest.TestCase):
+    """Test cursor pages, the URL endpoint and view counting on shared photosets"""
+
+    def setUp(self):
+        """Create a temporary database with a 23-photo shared set and a temporary view table"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, Photoset, PhotoPhotoset, ShareToken, Tag, PhotoTag]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+        cache.install_generation_triggers(self.test_db)
+
+        self.photoset = Photoset.create(title='Trip')
+        start = datetime.datetime(2021, 3, 1)
+        with self.test_db.atomic():
+            for i in range(30):
+                # Reverse datetaken order, with ties, so display order isn't id order
+                photo = Photo.create(sha1=f'{i:040x}', filetype='jpg', privacy=2,
+                                     datetaken=start - datetime.timedelta(days=i // 2))
+                if i % 4 != 3:
+                    PhotoPhotoset.create(photo=photo, photoset=self.photoset)
+        self.expected = [photo.id for photo in (Photo.select().join(PhotoPhotoset)
+                                                .where(PhotoPhotoset.photoset == self.photoset)
+                                                .order_by(Photo.datetaken, Photo.id))]
+        self.outside = Photo.select().where(Photo.id.not_in(self.expected)).first().id
+        self.share = ShareToken.create(token='trip', share_type='photoset', photoset=self.photoset,
+                                       max_views=2)
+
+        self.table_dir = tempfile.TemporaryDirectory()
+        self.saved_config = dict(app.config)
+        app.config.update(SHARE_VIEW_PATH=os.path.join(self.table_dir.name, 'views.bin'),
+                          SHARE_VIEW_FLUSH_SECONDS=10 ** 9, SHARED_PHOTOSET_PAGE_SIZE=10,
+                          SHARED_URL_BATCH=5, S3_SIGNED_URL_EXPIRY=300, SECRET_KEY='test-secret',
+                          SHARE_VIEW_TICKET_SECONDS=1800)
+        neighbors._arrays.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Restore config, close and remove the test database and table"""
+        app.config.clear()
+        app.config.update(self.saved_config)
+        neighbors._arrays.clear()
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+        self.table_dir.cleanup()
+
+    def walk(self):
+        """Follow next_after cursors from the first page; returns the pages"""
+        pages = [sharedsets.page(self.photoset.id)]
+        while pages[-1].next_after is not None:
+            pages.append(sharedsets.page(self.photoset.id, pages[-1].next_after))
+        return pages
+
+    def test_cursor_pages(self, signer):
+        """Test that cursors walk the set in display order, forward and back"""
+        with app.test_request_context():
+            pages = self.walk()
+        self.assertEqual(len(self.expected), 23)
+        self.assertEqual([photo.id for page in pages for photo in page.photos], self.expected)
+        self.assertEqual([page.start for page in pages], [0, 10, 20])
+        self.assertEqual({page.total for page in pages}, {23})
+        self.assertEqual([page.prev_after for page in pages], [None, 0, self.expected[9]])
+        with app.test_request_context():
+            back = sharedsets.page(self.photoset.id, pages[2].prev_after)
+            stale = sharedsets.page(self.photoset.id, self.outside)
+        self.assertEqual(back.start, 10)
+        self.assertEqual(stale.start, 0)
+
+    def test_cursor_pages_without_generation(self, signer):
+        """Test the query fallback when there is no content generation to cache arrays under"""
+        with app.test_request_context(), patch('cache.current_generation', return_value=None):
+            pages = self.walk()
+        self.assertEqual([photo.id for page in pages for photo in page.photos], self.expected)
+
+    def test_signed_urls_only_for_the_set(self, signer):
+        """Test that only photos in the shared set are signed"""
+        with app.test_request_context():
+            urls = sharedsets.signed_urls(self.photoset.id, [self.expected[0], self.outside, self.expected[0]])
+        self.assertEqual(list(urls), [self.expected[0]])
+        self.assertTrue(urls[self.expected[0]].endswith('_c.jpg?expires=300'))
+        self.assertEqual(signer.call_count, 1)
+
+    def test_page_signs_nothing(self, signer):
+        """Test that the page renders photo ids and pagination without presigning"""
+        response = self.client.get('/shared/photoset/trip')
+        self.assertEqual(response.status_code, 200)
+        html = response.get_data(as_text=True)
+        self.assertEqual(html.count('data-photo-id='), 10)
+        self.assertIn('/shared/photoset/trip/urls" data-url-batch="5"', html)
+        self.assertIn(f'?after={self.expected[9]}', html)
+        self.assertEqual(signer.call_count, 0)
+
+    def ticket_of(self, response):
+        """The view ticket a first page handed its grid"""
+        return re.search(r'data-url-ticket="([^"]+)"', response.get_data(as_text=True)).group(1)
+
+    def test_only_first_page_counts_a_view(self, signer):
+        """Test that cursor pages and URL batches don't count views, and that the last view still loads"""
+        after = f'/shared/photoset/trip?after={self.expected[9]}'
+        urls = f'/shared/photoset/trip/urls?ids={self.expected[0]}'
+        first = self.client.get('/shared/photoset/trip')
+        self.assertEqual(first.status_code, 200)
+        ticket = self.ticket_of(first)
+        self.assertIn(f'?after={self.expected[9]}&amp;ticket={ticket}', first.get_data(as_text=True))
+        for _ in range(3):
+            self.assertEqual(self.client.get(f'{after}&ticket={ticket}').status_code, 200)
+            self.assertEqual(self.client.get(f'{urls}&ticket={ticket}').status_code, 200)
+        self.assertEqual(shareviews.current_views(ShareToken.get_by_id(self.share.id)), 1)
+
+        # The second view is the last one max_views=2 allows: its own pages and URLs still load
+        last = self.client.get('/shared/photoset/trip')
+        self.assertEqual(last.status_code, 200)
+        ticket = self.ticket_of(last)
+        self.assertEqual(self.client.get(f'{after}&ticket={ticket}').status_code, 200)
+        response = self.client.get(f'{urls}&ticket={ticket}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.get_json()['urls']), [str(self.expected[0])])
+
+        # Without a ticket, or as a fresh view, the link is used up
+        self.assertEqual(self.client.get(after).status_code, 410)
+        self.assertEqual(self.client.get(urls).status_code, 410)
+        self.assertEqual(self.client.get(f'{urls}&ticket=1.99999999999.forged').status_code, 410)
+        self.assertEqual(self.client.get('/shared/photoset/trip').status_code, 410)
+
+    def test_view_tickets(self, signer):
+        """Test that tickets are bound to their share, expire, resist tampering and need a SECRET_KEY"""
+        ticket = sharedsets.issue_ticket(self.share.id, now=1000)
+        self.assertTrue(sharedsets.ticket_valid(ticket, self.share.id, now=1000 + 1799))
+        self.assertFalse(sharedsets.ticket_valid(ticket, self.share.id, now=1000 + 1800))
+        self.assertFalse(sharedsets.ticket_valid(ticket, self.share.id + 1, now=1000))
+        share_id, expires_at, signature = ticket.split('.')
+        self.assertFalse(sharedsets.ticket_valid(f'{share_id}.{int(expires_at) + 10 ** 6}.{signature}',
+                                                 self.share.id, now=1000))
+        for junk in (None, '', 'x', 'a.b.c', f'{share_id}.{expires_at}.\u00e9'):
+            self.assertFalse(sharedsets.ticket_valid(junk, self.share.id, now=1000))
+
+        app.config['SECRET_KEY'] = None
+        self.assertIsNone(sharedsets.issue_ticket(self.share.id))
+        self.assertFalse(sharedsets.ticket_valid(ticket, self.share.id, now=1000))
+
+    def test_url_endpoint(self, signer):
+        """Test the endpoint's membership check, batch limit and input validation"""
+        ids = ','.join(str(photo_id) for photo_id in self.expected[:4] + [self.outside])
+        response = self.client.get(f'/shared/photoset/trip/urls?ids={ids}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-store')
+        data = response.get_json()
+        self.assertEqual(sorted(data['urls']), sorted(str(photo_id) for photo_id in self.expected[:4]))
+        self.assertEqual(data['expires_in'], 300)
+
+        too_many = ','.join(str(photo_id) for photo_id in self.expected[:6])
+        self.assertEqual(self.client.get(f'/shared/photoset/trip/urls?ids={too_many}').status_code, 400)
+        self.assertEqual(self.client.get('/shared/photoset/trip/urls?ids=1,x').status_code, 400)
+        self.assertEqual(self.client.get('/shared/photoset/nope/urls?ids=1').status_code, 404)
+
+        ShareToken.create(token='single', share_type='photo', photo=self.expected[0])
+        self.assertEqual(self.client.get(f'/shared/photoset/single/urls?ids={self.expected[0]}').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for write-behind share link view counts
+"""
+
+import unittest
+import tempfile
+import multiprocessing
+import os
+from peewee import SqliteDatabase
+
+from app import app
+import web  # registers the shared routes
+import shareviews
+from db import Photo, Photoset, ShareToken, Tag, PhotoTag
+
+
+def reserve_views(path, share_id, max_views, attempts, results):
+    """Reserve from a separately attached table (one process of the concurrency test)"""
+    table = shareviews.ViewTable(path, 64, flush_seconds=10 ** 9)
+    results.put(sum(1 for _ in range(attempts) if table.reserve(share_id, max_views) is not None))
+
+
+class TestShareViews(unittest.TestCase):
+    """Test buffered counting, flushing and exact max_views"""
+
+    def setUp(self):
+        """Create a temporary database with two share links and a temporary view table"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, Photoset, ShareToken, Tag, PhotoTag]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+
+        self.photo = Photo.create(sha1='ab' * 20, filetype='jpg', privacy=0)
+        self.share = ShareToken.create(token='viral', share_type='photo', photo=self.photo, views=5)
+        self.limited = ShareToken.create(token='limited', share_type='photo', photo=self.photo, max_views=3)
+
+        self.table_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.table_dir.name, 'views.bin')
+        self.saved_config = dict(app.config)
+        app.config.update(SHARE_VIEW_PATH=self.path, SHARE_VIEW_SLOTS=64, SHARE_VIEW_FLUSH_SECONDS=10 ** 9,
+                          SHARE_VIEW_IDLE_SECONDS=600)
+
+    def tearDown(self):
+        """Restore config, close and remove the test database and table"""
+        app.config.clear()
+        app.config.update(self.saved_config)
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+        self.table_dir.cleanup()
+
+    def persisted(self, share):
+        return ShareToken.get_by_id(share.id).views
+
+    def test_write_behind(self):
+        """Test that views are counted on top of the persisted count and written only on flush"""
+        for expected in (6, 7, 8):
+            self.assertTrue(shareviews.record_view(self.share))
+            self.assertEqual(self.share.views, expected)
+        self.assertEqual(self.persisted(self.share), 5)
+        self.assertEqual(shareviews.current_views(ShareToken.get_by_id(self.share.id)), 8)
+
+        self.assertEqual(shareviews.flush(), 3)
+        self.assertEqual(self.persisted(self.share), 8)
+        self.assertEqual(shareviews.flush(), 0)
+        self.assertTrue(shareviews.record_view(self.share))
+        self.assertEqual(self.share.views, 9)
+
+    def test_periodic_flush_and_idle_links(self):
+        """Test the flush every flush_seconds, and that idle links are reloaded from the database"""
+        table = shareviews.ViewTable(self.path, 64, flush_seconds=10, idle_seconds=60)
+        start = 10 ** 9
+        table.flush(start)
+        self.assertEqual(table.reserve(self.share.id, None, start + 1), 6)
+        self.assertEqual(table.reserve(self.share.id, None, start + 2), 7)
+        self.assertEqual(self.persisted(self.share), 5)
+        self.assertEqual(table.reserve(self.share.id, None, start + 11), 8)  # flushes the first two first
+        self.assertEqual(self.persisted(self.share), 7)
+
+        table.flush(start + 30)
+        self.assertEqual(self.persisted(self.share), 8)
+        self.assertEqual(table.reserve(self.share.id, None, start + 31), 9)  # still in the table
+        table.flush(start + 200)
+        self.assertEqual(self.persisted(self.share), 9)
+        ShareToken.update(views=100).where(ShareToken.id == self.share.id).execute()
+        self.assertEqual(table.reserve(self.share.id, None, start + 201), 101)  # idle, read again
+
+    def test_max_views(self):
+        """Test that max_views counts buffered views and stops exactly at the limit"""
+        results = [shareviews.record_view(self.limited) for _ in range(5)]
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertTrue(shareviews.limit_reached(ShareToken.get_by_id(self.limited.id)))
+        self.assertFalse(shareviews.limit_reached(ShareToken.get_by_id(self.share.id)))
+        shareviews.flush()
+        self.assertEqual(self.persisted(self.limited), 3)
+
+    def test_full_table(self):
+        """Test that a full table drops idle-protected links, then falls back to write-through"""
+        table = shareviews.ViewTable(self.path, 2, flush_seconds=10 ** 9)
+        other = ShareToken.create(token='other', share_type='photo', photo=self.photo)
+        self.assertEqual(table.reserve(self.share.id, None, 1000), 6)
+        self.assertEqual(table.reserve(self.limited.id, 3, 1000), 1)
+        self.assertEqual(table.reserve(other.id, None, 1000), 1)  # flushed the other two to make room
+        self.assertEqual((self.persisted(self.share), self.persisted(self.limited)), (6, 1))
+
+    def test_processes_share_limit(self):
+        """Test that concurrent processes never count more views than max_views between them"""
+        table = shareviews.ViewTable(self.path, 64, flush_seconds=10 ** 9)
+        self.assertEqual(table.reserve(self.share.id, 125), 6)  # loads the persisted count once
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        workers = [context.Process(target=reserve_views, args=(self.path, self.share.id, 125, 50, results))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        granted = sum(results.get(timeout=30) for _ in workers)
+        for worker in workers:
+            worker.join()
+        self.assertEqual(granted, 119)
+        self.assertEqual(table.flush(), 120)
+        self.assertEqual(self.persisted(self.share), 125)
+
+    def test_shared_photo_route(self):
+        """Test that /shared/<token> counts views without saving the row and answers 410 at the limit"""
+        client = app.test_client()
+        statuses = [client.get('/shared/limited').status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 410])
+        self.assertEqual(self.persisted(self.limited), 0)
+        shareviews.flush()
+        self.assertEqual(self.persisted(self.limited), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
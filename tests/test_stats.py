@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for trigger-maintained tag, tag co-occurrence and photoset statistics
+"""
+
+import unittest
+import tempfile
+import datetime
+import random
+import os
+from peewee import SqliteDatabase, fn
+
+from app import app
+import stats
+import tagindex
+from db import Photo, Tag, PhotoTag, TagStats, TagCooccurrence, Photoset, PhotoPhotoset, PhotosetStats
+
+
+class TestTagStats(unittest.TestCase):
+    """Test that tag_stats follows phototag, photo and tag writes"""
+
+    def setUp(self):
+        """Create temporary test database"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path, pragmas={'foreign_keys': 1})
+
+        models = [Photo, Tag, PhotoTag, TagStats]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables([Photo, Tag, PhotoTag])
+        # Databases from before the unique pair migration may hold duplicate rows
+        self.test_db.execute_sql('DROP INDEX phototag_photo_id_tag_id')
+
+        # Existing tags are backfilled on install
+        self.public = self.add_photo(None)
+        self.private = self.add_photo(2)
+        self.beach = Tag.create(name='beach')
+        self.dog = Tag.create(name='dog')
+        PhotoTag.create(photo=self.public, tag=self.beach)
+        PhotoTag.create(photo=self.private, tag=self.beach)
+        stats.install_tag_stats(self.test_db)
+
+    def tearDown(self):
+        """Close and remove test database"""
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def add_photo(self, privacy=0):
+        return Photo.create(sha1=f'stats{Photo.select().count():035d}', filetype='jpg', privacy=privacy)
+
+    def counts(self, levels):
+        return dict((tag.name, tag.count) for tag in stats.tag_counts(levels))
+
+    def test_backfill(self):
+        """Test that install counts existing photos by privacy level"""
+        self.assertEqual(self.counts([0]), {'beach': 1})
+        self.assertEqual(self.counts([0, 1, 2, 3]), {'beach': 2})
+        self.assertEqual(stats.tagged_photo_count([0, 1, 2, 3]), 2)
+        self.assertEqual(stats.check_tag_stats(self.test_db), [])
+
+    def test_duplicate_rows_counted_once(self):
+        """Test that a repeated (photo, tag) row doesn't inflate the count"""
+        PhotoTag.create(photo=self.public, tag=self.beach)
+        self.assertEqual(self.counts([0]), {'beach': 1})
+        PhotoTag.delete().where(PhotoTag.id == PhotoTag.select(fn.MIN(PhotoTag.id))).execute()
+        self.assertEqual(self.counts([0]), {'beach': 1})
+        self.assertEqual(stats.check_tag_stats(self.test_db), [])
+
+    def test_counts_follow_writes(self):
+        """Test tagging, retagging, privacy changes and deletes"""
+        PhotoTag.create(photo=self.public, tag=self.dog)
+        self.assertEqual(self.counts([0]), {'beach': 1, 'dog': 1})
+        self.assertEqual(stats.tagged_photo_count([0]), 1)
+
+        Photo.update(privacy=1).where(Photo.id == self.public.id).execute()
+        self.assertEqual(self.counts([0]), {})
+        self.assertEqual(self.counts([0, 1]), {'beach': 1, 'dog': 1})
+
+        # Merge dog into beach
+        PhotoTag.update(tag=self.beach).where(PhotoTag.tag == self.dog).execute()
+        self.dog.delete_instance()
+        self.assertEqual(self.counts([0, 1, 2]), {'beach': 2})
+        self.assertEqual(stats.tagged_photo_count([0, 1, 2]), 2)
+
+        # Cascade from photo delete
+        self.private.delete_instance()
+        self.assertEqual(self.counts([0, 1, 2]), {'beach': 1})
+        self.assertEqual(stats.check_tag_stats(self.test_db), [])
+
+    def test_check_and_rebuild(self):
+        """Test that drift is reported and repaired"""
+        TagStats.update(count=5).where(TagStats.tag_id == self.beach.id).execute()
+        mismatches = stats.check_tag_stats(self.test_db)
+        self.assertIn((self.beach.id, 0, 5, 1), mismatches)
+        stats.rebuild_tag_stats(self.test_db)
+        self.assertEqual(stats.check_tag_stats(self.test_db), [])
+
+    def test_all_tag_counts_includes_unused(self):
+        """Test the admin list keeps tags without photos"""
+        counts = dict((tag.name, tag.count) for tag in stats.all_tag_counts())
+        self.assertEqual(counts, {'beach': 2, 'dog': 0})
+
+
+class TestTagCooccurrence(unittest.TestCase):
+    """Test that tag_cooccurrence follows writes and answers related tags"""
+
+    def setUp(self):
+        """Create temporary test database with a few tagged photos"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path, pragmas={'foreign_keys': 1})
+
+        models = [Photo, Tag, PhotoTag, TagCooccurrence]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables([Photo, Tag, PhotoTag])
+        # Databases from before the unique pair migration may hold duplicate rows
+        self.test_db.execute_sql('DROP INDEX phototag_photo_id_tag_id')
+
+        self.tags = dict((name, Tag.create(name=name)) for name in ['beach', 'dog', 'sun', 'snow'])
+        self.photos = []
+        for privacy, names in [(0, 'beach dog sun'), (0, 'beach sun'), (None, 'beach dog'), (2, 'beach dog snow')]:
+            photo = Photo.create(sha1=f'cooccur{len(self.photos):033d}', filetype='jpg', privacy=privacy)
+            for name in names.split():
+                PhotoTag.create(photo=photo, tag=self.tags[name])
+            self.photos.append(photo)
+        # Existing tags are backfilled on install
+        stats.install_tag_cooccurrence(self.test_db)
+
+    def tearDown(self):
+        """Close and remove test database"""
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def related(self, names, levels, **kwargs):
+        tag_ids = [self.tags[name].id for name in names]
+        related = stats.related_tags(tag_ids, levels, **kwargs)
+        return None if related is None else [(tag.name, tag.co_occurrence) for tag in related]
+
+    def test_backfill_and_single_tag(self):
+        """Test that a tag's related tags are its pair counts for the visible levels"""
+        self.assertEqual(stats.check_tag_cooccurrence(self.test_db), [])
+        self.assertEqual(self.related(['beach'], [0]), [('dog', 2), ('sun', 2)])
+        self.assertEqual(self.related(['beach'], [0, 1, 2, 3]), [('dog', 3), ('sun', 2), ('snow', 1)])
+        self.assertEqual(self.related(['beach'], [0], limit=1), [('dog', 2)])
+
+    def test_multiple_tags(self):
+        """Test exact counts for several tags from the bitmap index, None without it"""
+        self.assertIsNone(self.related(['beach', 'dog'], [0]))
+        index = tagindex.TagIndex.build(generation=0)
+        matches = index.match(['beach', 'dog'], [0])
+        count_with = lambda tag_id: index.count_in(matches, tag_id)
+        self.assertEqual(self.related(['beach', 'dog'], [0], count_with=count_with), [('sun', 1)])
+        # sun and dog each pair with beach twice, but share only one photo
+        matches = index.match(['beach', 'sun'], [0])
+        self.assertEqual(self.related(['beach', 'sun'], [0], count_with=count_with), [('dog', 1)])
+
+    def test_counts_follow_random_writes(self):
+        """Test tagging, duplicates, retagging, privacy changes and deletes against a fresh aggregate"""
+        rng = random.Random(7)
+        tags = list(self.tags.values()) + [Tag.create(name=f'extra{i}') for i in range(4)]
+        photos = list(self.photos)
+        for step in range(300):
+            action = rng.random()
+            rows = list(PhotoTag.select())
+            if action < 0.35 or not rows:
+                PhotoTag.create(photo=rng.choice(photos), tag=rng.choice(tags))
+            elif action < 0.5:
+                row = rng.choice(rows)
+                PhotoTag.update(tag=rng.choice(tags)).where(PhotoTag.id == row.id).execute()
+            elif action < 0.6:
+                row = rng.choice(rows)
+                PhotoTag.update(photo=rng.choice(photos)).where(PhotoTag.id == row.id).execute()
+            elif action < 0.75:
+                PhotoTag.delete().where(PhotoTag.id == rng.choice(rows).id).execute()
+            elif action < 0.88:
+                Photo.update(privacy=rng.choice([None, 0, 1, 2, 3])).where(
+                    Photo.id == rng.choice(photos).id).execute()
+            elif action < 0.94 and len(photos) > 2:
+                photo = photos.pop(rng.randrange(len(photos)))
+                Photo.delete().where(Photo.id == photo.id).execute()
+                photos.append(Photo.create(sha1=f'cooccur-new{step:029d}', filetype='jpg'))
+            elif len(tags) > 3:
+                tag = tags.pop(rng.randrange(len(tags)))
+                PhotoTag.delete().where(PhotoTag.tag == tag.id).execute()
+                Tag.delete().where(Tag.id == tag.id).execute()
+                tags.append(Tag.create(name=f'new{step}'))
+            if step % 25 == 0:
+                self.assertEqual(stats.check_tag_cooccurrence(self.test_db), [], f'step {step}')
+        self.assertEqual(stats.check_tag_cooccurrence(self.test_db), [])
+
+    def test_check_and_rebuild(self):
+        """Test that drift is reported and repaired"""
+        beach, dog = self.tags['beach'].id, self.tags['dog'].id
+        TagCooccurrence.update(count=9).where(
+            (TagCooccurrence.tag_id == beach) & (TagCooccurrence.other_id == dog)).execute()
+        self.assertIn((beach, dog, 0, 9, 2), stats.check_tag_cooccurrence(self.test_db))
+        stats.rebuild_tag_cooccurrence(self.test_db)
+        self.assertEqual(stats.check_tag_cooccurrence(self.test_db), [])
+
+
+class TestPhotosetStats(unittest.TestCase):
+    """Test that photoset_stats follows photophotoset, photo and photoset writes"""
+
+    def setUp(self):
+        """Create temporary test database"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path, pragmas={'foreign_keys': 1})
+
+        models = [Photo, Photoset, PhotoPhotoset, PhotosetStats]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables([Photo, Photoset, PhotoPhotoset])
+
+        # Existing memberships are backfilled on install
+        self.photoset = Photoset.create(title='Trip')
+        self.first = self.add_photo(datetime.datetime(2019, 7, 4), None)
+        self.last = self.add_photo(datetime.datetime(2019, 7, 9), 2)
+        stats.install_photoset_stats(self.test_db)
+
+    def tearDown(self):
+        """Close and remove test database"""
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def add_photo(self, datetaken, privacy=0, photoset=None):
+        photo = Photo.create(sha1=f'photoset{Photo.select().count():032d}', filetype='jpg',
+                             datetaken=datetaken, privacy=privacy)
+        PhotoPhotoset.create(photo=photo, photoset=photoset or self.photoset)
+        return photo
+
+    def summary(self, levels=None):
+        return stats.photoset_summaries([self.photoset.id], levels).get(self.photoset.id)
+
+    def test_backfill(self):
+        """Test that install records counts, range and cover per privacy level"""
+        public = self.summary([0])
+        self.assertEqual(public['count'], 1)
+        self.assertEqual(public['max_datetaken'], datetime.datetime(2019, 7, 4))
+        everything = self.summary()
+        self.assertEqual(everything['privacy_counts'], {0: 1, 2: 1})
+        self.assertEqual(everything['max_datetaken'], datetime.datetime(2019, 7, 9))
+        self.assertEqual(everything['cover_id'], self.first.id)
+        self.assertEqual(stats.check_photoset_stats(self.test_db), [])
+
+    def test_range_and_cover_follow_writes(self):
+        """Test adds, datetaken and privacy changes, removals and photo deletes"""
+        earlier = self.add_photo(datetime.datetime(2019, 7, 1))
+        self.assertEqual(self.summary([0])['cover_id'], earlier.id)
+        self.assertEqual(self.summary([0])['min_datetaken'], datetime.datetime(2019, 7, 1))
+
+        # Moving the cover later hands the cover back
+        earlier.datetaken = datetime.datetime(2019, 7, 20)
+        earlier.save()
+        self.assertEqual(self.summary([0])['cover_id'], self.first.id)
+        self.assertEqual(self.summary([0])['max_datetaken'], datetime.datetime(2019, 7, 20))
+
+        Photo.update(privacy=3).where(Photo.id == self.first.id).execute()
+        self.assertEqual(self.summary([0])['count'], 1)
+        self.assertEqual(self.summary()['cover_id'], self.first.id)
+
+        PhotoPhotoset.delete().where(PhotoPhotoset.photo == earlier).execute()
+        self.assertIsNone(self.summary([0]))
+
+        self.first.delete_instance()
+        self.assertEqual(self.summary()['privacy_counts'], {2: 1})
+        self.assertEqual(self.summary()['min_datetaken'], datetime.datetime(2019, 7, 9))
+        self.assertEqual(stats.check_photoset_stats(self.test_db), [])
+
+    def test_visible_photoset_ids(self):
+        """Test that only photosets with visible photos are listed"""
+        hidden = Photoset.create(title='Hidden')
+        self.add_photo(datetime.datetime(2020, 1, 1), 3, photoset=hidden)
+        visible = [row.photoset_id for row in stats.visible_photoset_ids([0, 1])]
+        self.assertEqual(visible, [self.photoset.id])
+
+        hidden.delete_instance()
+        self.assertEqual(PhotosetStats.select().where(PhotosetStats.photoset_id == hidden.id).count(), 0)
+
+    def test_photoset_covers(self):
+        """Test that covers are the first visible photos of each set"""
+        other = Photoset.create(title='Other')
+        middle = self.add_photo(datetime.datetime(2019, 7, 6))
+        self.add_photo(datetime.datetime(2019, 7, 8))
+        undated = self.add_photo(None, 0, photoset=other)
+
+        covers = stats.photoset_covers([self.photoset.id, other.id], [0], 2)
+        self.assertEqual([photo.id for photo in covers[self.photoset.id]], [self.first.id, middle.id])
+        self.assertEqual([photo.id for photo in covers[other.id]], [undated.id])
+
+        covers = stats.photoset_covers([self.photoset.id], [0, 2], 4)
+        self.assertEqual(covers[self.photoset.id][-1].id, self.last.id)
+
+    def test_check_and_rebuild(self):
+        """Test that drift is reported and repaired"""
+        PhotosetStats.update(cover_id=self.last.id).execute()
+        self.assertTrue(stats.check_photoset_stats(self.test_db))
+        stats.rebuild_photoset_stats(self.test_db)
+        self.assertEqual(stats.check_photoset_stats(self.test_db), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the per-worker tag bitmap index
+"""
+
+import unittest
+import tempfile
+import random
+import os
+from peewee import SqliteDatabase, fn
+
+from app import app
+import cache
+import tagindex
+from db import Photo, Tag, PhotoTag, Photoset, PhotoPhotoset
+
+
+class TestTagIndex(unittest.TestCase):
+    """Test bitmap intersections against the SQL they replace"""
+
+    def setUp(self):
+        """Create temporary test database with random tagging"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, Tag, PhotoTag, Photoset, PhotoPhotoset]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+        cache.install_generation_triggers(self.test_db)
+
+        rng = random.Random(7)
+        self.tags = [Tag.create(name=name) for name in ('cat', 'dog', 'beach', 'rare')]
+        with self.test_db.atomic():
+            for i in range(300):
+                photo = Photo.create(sha1=f'idxtest{i:033d}', filetype='jpg',
+                                     privacy=rng.choice([None, 0, 1, 2, 3]))
+                for tag in self.tags[:3]:
+                    if rng.random() < 0.4:
+                        PhotoTag.create(photo=photo, tag=tag)
+                if i % 97 == 0:
+                    PhotoTag.create(photo=photo, tag=self.tags[3])
+
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+        tagindex._index = None
+
+    def tearDown(self):
+        """Close and remove test database"""
+        tagindex._index = None
+        self.ctx.pop()
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def sql_ids(self, tags, levels):
+        query = (Photo.select(Photo.id)
+                 .join(PhotoTag)
+                 .join(Tag)
+                 .where((Tag.name.in_(tags)) &
+                        ((Photo.privacy.is_null()) | (Photo.privacy.in_(levels))))
+                 .group_by(Photo.id)
+                 .having(fn.COUNT(fn.DISTINCT(Tag.id)) == len(set(tags)))
+                 .order_by(Photo.id.desc()))
+        return [row[0] for row in query.tuples()]
+
+    def test_matches_sql(self):
+        """Test that intersections, counts and pages agree with SQL"""
+        index = tagindex.TagIndex.build()
+        # 'rare' is sparse and stored as an array, the others as bitmaps
+        self.assertNotIsInstance(index.tag_sets[self.tags[3].id], int)
+        self.assertIsInstance(index.tag_sets[self.tags[0].id], int)
+        for tags in (['cat'], ['cat', 'dog'], ['cat', 'dog', 'beach'], ['rare', 'cat'], ['rare']):
+            for levels in ([0], [0, 1], [0, 1, 2, 3]):
+                expected = self.sql_ids(tags, levels)
+                matches = index.match(tags, levels)
+                self.assertEqual(len(matches), len(expected), (tags, levels))
+                pages = [matches.page(page, 7) for page in range(1, len(expected) // 7 + 3)]
+                self.assertEqual([i for page in pages for i in page], expected, (tags, levels))
+
+    def test_unknown_tag_is_empty(self):
+        """Test that a missing tag matches nothing"""
+        index = tagindex.TagIndex.build()
+        self.assertEqual(len(index.match(['cat', 'nope'], [0, 1, 2, 3])), 0)
+        self.assertEqual(index.match(['nope'], [0]).page(1, 10), [])
+
+    def test_neighbours(self):
+        """Test prev/next against the ordered id list"""
+        index = tagindex.TagIndex.build()
+        expected = self.sql_ids(['cat', 'dog'], [0, 1])
+        matches = index.match(['cat', 'dog'], [0, 1])
+        for pos, photo_id in enumerate(expected):
+            self.assertEqual(matches.prev_id(photo_id), expected[pos - 1] if pos > 0 else None)
+            self.assertEqual(matches.next_id(photo_id), expected[pos + 1] if pos + 1 < len(expected) else None)
+
+    def test_stale_index_not_served(self):
+        """Test that a write makes the snapshot stale until it is rebuilt"""
+        index = tagindex.rebuild()
+        self.assertIs(tagindex.get_index(), index)
+
+        PhotoTag.create(photo=Photo.get_by_id(2), tag=self.tags[3])
+        cache.g.pop('content_generation', None)
+        tagindex._building = True  # pretend a background rebuild is already running
+        try:
+            self.assertIsNone(tagindex.get_index())
+        finally:
+            tagindex._building = False
+
+        fresh = tagindex.rebuild()
+        self.assertIs(tagindex.get_index(), fresh)
+        self.assertIn(1, fresh.match(['rare'], [0, 1, 2, 3]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for set-based tag rename, merge and delete
+"""
+
+import unittest
+import tempfile
+import os
+from peewee import SqliteDatabase
+
+import stats
+import tagops
+from db import Photo, Tag, PhotoTag, TagStats, TagCooccurrence
+
+
+class TestTagOps(unittest.TestCase):
+    """Test merges, renames and deletes with their dry-run counts and statistics"""
+
+    def setUp(self):
+        """Create a temporary database where 'pup' and 'dog' overlap on one photo"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path, pragmas={'foreign_keys': 1})
+
+        models = [Photo, Tag, PhotoTag, TagStats, TagCooccurrence]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables([Photo, Tag, PhotoTag])
+        stats.install_tag_stats(self.test_db)
+        stats.install_tag_cooccurrence(self.test_db)
+
+        self.tags = dict((name, Tag.create(name=name)) for name in ['pup', 'dog', 'beach'])
+        self.photos = []
+        for privacy, names in [(0, 'pup beach'), (0, 'pup dog'), (2, 'pup'), (None, 'dog beach')]:
+            photo = Photo.create(sha1=f'tagops{len(self.photos):034d}', filetype='jpg', privacy=privacy)
+            for name in names.split():
+                PhotoTag.create(photo=photo, tag=self.tags[name])
+            self.photos.append(photo)
+
+    def tearDown(self):
+        """Close and remove the test database"""
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def tagged(self, name):
+        return sorted(photo.id for photo in Photo.select().join(PhotoTag).join(Tag).where(Tag.name == name))
+
+    def assertStatsConsistent(self):
+        self.assertEqual(stats.check_tag_stats(self.test_db), [])
+        self.assertEqual(stats.check_tag_cooccurrence(self.test_db), [])
+
+    def test_merge_dry_run(self):
+        """Test that a dry run reports counts and changes nothing"""
+        counts = tagops.merge(self.tags['pup'], 'dog', dry_run=True)
+        self.assertEqual(counts, tagops.MergeCounts(photos=3, moved=2, already_tagged=1, rows=3, target_created=False))
+        self.assertEqual(PhotoTag.select().count(), 7)
+        self.assertEqual(len(self.tagged('pup')), 3)
+
+    def test_merge_into_existing(self):
+        """Test that photos move to the target once each and the source tag goes"""
+        counts = tagops.merge(self.tags['pup'], 'dog')
+        self.assertEqual(counts.moved, 2)
+        self.assertEqual(self.tagged('dog'), [photo.id for photo in self.photos])
+        self.assertFalse(Tag.select().where(Tag.name == 'pup').exists())
+        self.assertEqual(PhotoTag.select().count(), 6)
+        self.assertStatsConsistent()
+
+    def test_merge_into_new_tag(self):
+        """Test that merging into a name that doesn't exist renames the source"""
+        self.assertTrue(tagops.merge(self.tags['pup'], 'puppy', dry_run=True).target_created)
+        self.assertFalse(Tag.select().where(Tag.name == 'puppy').exists())
+        tagops.merge(self.tags['pup'], 'puppy')
+        self.assertEqual(Tag.get(Tag.name == 'puppy').id, self.tags['pup'].id)
+        self.assertEqual(len(self.tagged('puppy')), 3)
+        self.assertStatsConsistent()
+
+    def test_rename(self):
+        """Test rename, and that an existing name is refused"""
+        self.assertFalse(tagops.rename(self.tags['pup'], 'dog'))
+        self.assertEqual(Tag.get_by_id(self.tags['pup'].id).name, 'pup')
+        self.assertTrue(tagops.rename(self.tags['pup'], 'puppy'))
+        self.assertEqual(Tag.get_by_id(self.tags['pup'].id).name, 'puppy')
+
+    def test_delete(self):
+        """Test delete counts, dry run and statistics"""
+        self.assertEqual(tagops.delete(self.tags['beach'], dry_run=True), tagops.DeleteCounts(photos=2, rows=2))
+        self.assertEqual(len(self.tagged('beach')), 2)
+        tagops.delete(self.tags['beach'])
+        self.assertFalse(Tag.select().where(Tag.name == 'beach').exists())
+        self.assertEqual(PhotoTag.select().count(), 5)
+        self.assertStatsConsistent()
+
+
+if __name__ == '__main__':
+    unittest.main()
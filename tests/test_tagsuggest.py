@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the tag autocomplete prefix index
+"""
+
+import unittest
+import tempfile
+import os
+from peewee import SqliteDatabase
+
+from app import app
+import cache
+import stats
+import tagsuggest
+from db import Photo, Tag, PhotoTag, Photoset, PhotoPhotoset, TagStats
+
+
+class TestTagSuggest(unittest.TestCase):
+    """Test prefix suggestions ranked by tag_stats counts"""
+
+    def setUp(self):
+        """Create a temporary database with tags of varying popularity"""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, Tag, PhotoTag, Photoset, PhotoPhotoset, TagStats]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+        cache.install_generation_triggers(self.test_db)
+        stats.install_tag_stats(self.test_db)
+
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+
+        photos = [Photo.create(sha1=f'suggest{i:033d}', filetype='jpg', privacy=i % 4) for i in range(6)]
+        for name, uses in [('cat', 2), ('cats', 5), ('catalog', 0), ('Cathedral', 3), ('dog', 6)]:
+            tag = Tag.create(name=name)
+            for photo in photos[:uses]:
+                PhotoTag.create(photo=photo, tag=tag)
+
+    def tearDown(self):
+        """Close and remove the test database"""
+        self.ctx.pop()
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def refresh(self):
+        """Start a new request so the content generation is read again"""
+        self.ctx.pop()
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+
+    def test_prefix_ranked_by_popularity(self):
+        """Test that matches are the tags with the prefix, most used first"""
+        self.assertEqual(tagsuggest.suggest('cat'),
+                         [('cats', 5), ('Cathedral', 3), ('cat', 2), ('catalog', 0)])
+        self.assertEqual(tagsuggest.suggest('CATH'), [('Cathedral', 3)])
+        self.assertEqual(tagsuggest.suggest('d'), [('dog', 6)])
+        self.assertEqual(tagsuggest.suggest('x'), [])
+        self.assertEqual(tagsuggest.suggest('  '), [])
+
+    def test_limit(self):
+        """Test that the limit keeps the most used matches"""
+        self.assertEqual(tagsuggest.suggest('cat', limit=2), [('cats', 5), ('Cathedral', 3)])
+
+    def test_rebuilt_after_write(self):
+        """Test that a new tag is suggested once the generation moves on"""
+        index = tagsuggest.get_index()
+        Tag.create(name='catnip')
+        self.refresh()
+        self.assertIsNot(tagsuggest.get_index(), index)
+        self.assertIn(('catnip', 0), tagsuggest.suggest('catn'))
+
+    def test_reused_within_generation(self):
+        """Test that the snapshot is reused while nothing changes"""
+        index = tagsuggest.get_index()
+        self.refresh()
+        self.assertIs(tagsuggest.get_index(), index)
+
+    def test_sql_fallback(self):
+        """Test alphabetical suggestions before the generation table exists"""
+        self.test_db.execute_sql('DROP TABLE contentgeneration')
+        self.refresh()
+        self.assertEqual(tagsuggest.suggest('cat', limit=3),
+                         [('cat', 0), ('catalog', 0), ('Cathedral', 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
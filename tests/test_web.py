@@ -7,6 +7,7 @@ Unit tests for web routes
 import unittest
 from unittest.mock import Mock, patch, MagicMock
 import tempfile
+import datetime
 import os
 from peewee import SqliteDatabase
 
@@ -29,6 +30,13 @@ class TestWebRoutes(unittest.TestCase):
         self.test_db.connect()
         self.test_db.create_tables(models)
 
+        # Keep PoW and share view tables out of the application directory
+        self.shared_dir = tempfile.TemporaryDirectory()
+        self.saved_config = dict(app.config)
+        app.config.update({key: os.path.join(self.shared_dir.name, f'{key.lower()}.bin')
+                           for key in ('POW_BUDGET_PATH', 'POW_REPLAY_FILTER_PATH',
+                                       'POW_ADAPTIVE_PATH', 'SHARE_VIEW_PATH')})
+
         app.config['TESTING'] = True
         app.config['DATABASE'] = {'name': self.test_db_path}
         self.client = app.test_client()
@@ -38,6 +46,9 @@ class TestWebRoutes(unittest.TestCase):
         self.test_db.close()
         os.close(self.test_db_fd)
         os.unlink(self.test_db_path)
+        app.config.clear()
+        app.config.update(self.saved_config)
+        self.shared_dir.cleanup()
 
     def test_index_route(self):
         """Test main index redirects to photostream"""
@@ -133,6 +144,13 @@ class TestPhotoOperations(unittest.TestCase):
         self.test_db.connect()
         self.test_db.create_tables(models)
 
+        # Keep PoW and share view tables out of the application directory
+        self.shared_dir = tempfile.TemporaryDirectory()
+        self.saved_config = dict(app.config)
+        app.config.update({key: os.path.join(self.shared_dir.name, f'{key.lower()}.bin')
+                           for key in ('POW_BUDGET_PATH', 'POW_REPLAY_FILTER_PATH',
+                                       'POW_ADAPTIVE_PATH', 'SHARE_VIEW_PATH')})
+
         app.config['TESTING'] = True
         app.config['DATABASE'] = {'name': self.test_db_path}
         self.client = app.test_client()
@@ -142,6 +160,9 @@ class TestPhotoOperations(unittest.TestCase):
         self.test_db.close()
         os.close(self.test_db_fd)
         os.unlink(self.test_db_path)
+        app.config.clear()
+        app.config.update(self.saved_config)
+        self.shared_dir.cleanup()
 
     def test_show_photo_by_id(self):
         """Test viewing a single photo"""
@@ -153,6 +174,20 @@ class TestPhotoOperations(unittest.TestCase):
             response = self.client.get(f'/photos/{photo.id}')
             self.assertEqual(response.status_code, 200)
 
+    def test_show_photo_in_empty_date_context(self):
+        """Test that ?in=date: navigates among every dated photo instead of failing"""
+        photos = [Photo.create(sha1=f'datecontext{i:029d}', filetype='jpg', privacy=0,
+                               datetaken=datetime.datetime(2020, 1, i + 1)) for i in range(3)]
+
+        with patch('web.getSha1Path') as mock_path:
+            mock_path.return_value = ('ab/c1/23', 'filename')
+
+            response = self.client.get(f'/photos/{photos[1].id}?in=date:')
+            self.assertEqual(response.status_code, 200)
+            body = response.get_data(as_text=True)
+            self.assertIn(f'/photos/{photos[0].id}?in=date:', body)
+            self.assertIn(f'/photos/{photos[2].id}?in=date:', body)
+
     def test_show_photo_by_sha1(self):
         """Test viewing photo by SHA1"""
         sha1 = 'sha1viewtest123' * 3
@@ -164,6 +199,67 @@ class TestPhotoOperations(unittest.TestCase):
             response = self.client.get(f'/sha1/{sha1}')
             self.assertEqual(response.status_code, 200)
 
+class TestBatchedRelations(unittest.TestCase):
+    """Test that listing helpers load tags and roles for a whole page at once"""
+
+    def setUp(self):
+        """Set up test database with tagged photos and users with roles"""
+        from db import User, Role, UserRoles
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, Tag, PhotoTag, User, Role, UserRoles]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+        # Databases from before the unique pair migration may hold duplicate rows
+        self.test_db.execute_sql('DROP INDEX phototag_photo_id_tag_id')
+
+        self.photos = [Photo.create(sha1=f'batch{i:035d}', filetype='jpg') for i in range(3)]
+        beach, dog = Tag.create(name='beach'), Tag.create(name='dog')
+        for photo, tag in [(0, dog), (0, beach), (0, dog), (1, beach)]:
+            PhotoTag.create(photo=self.photos[photo], tag=tag)
+
+        admin, contributor = Role.create(name='admin'), Role.create(name='contributor')
+        self.users = [User.create(email=f'user{i}@example.com', password='x', fs_uniquifier=f'batch{i}')
+                      for i in range(3)]
+        UserRoles.create(user=self.users[0], role=contributor)
+        UserRoles.create(user=self.users[0], role=admin)
+        UserRoles.create(user=self.users[1], role=contributor)
+
+    def tearDown(self):
+        """Clean up"""
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+
+    def test_attach_tag_lists(self):
+        """Test tags in tagging order, duplicates dropped, untagged photos empty"""
+        from web import attach_tag_lists
+        photos = attach_tag_lists(Photo.select().order_by(Photo.id))
+        self.assertEqual([[tag.name for tag in photo.tag_list] for photo in photos],
+                         [['dog', 'beach'], ['beach'], []])
+
+    def test_attach_role_lists(self):
+        """Test role names per user"""
+        from web import attach_role_lists
+        from db import User
+        users = attach_role_lists(User.select().order_by(User.id))
+        self.assertEqual([user.role_list for user in users], [['contributor', 'admin'], ['contributor'], []])
+
+    def test_photo_edit_checker(self):
+        """Test that the batched checker follows can_edit_photo's rules"""
+        from security import can_edit_photo, photo_edit_checker
+        own = Photo.create(sha1='batch-own' + '0' * 31, filetype='jpg', uploaded_by_id=self.users[1].id)
+        for user in self.users:
+            checker = photo_edit_checker(user)
+            for photo in self.photos + [own]:
+                self.assertEqual(checker(photo), can_edit_photo(user, photo))
+        self.assertTrue(photo_edit_checker(self.users[0])(self.photos[0]))
+        self.assertTrue(photo_edit_checker(self.users[1])(own))
+        self.assertFalse(photo_edit_checker(self.users[1])(self.photos[0]))
+        self.assertFalse(photo_edit_checker(self.users[2])(own))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for streamed ZIP64 downloads
+"""
+
+import unittest
+import tempfile
+import datetime
+import random
+import zipfile
+import io
+import os
+from types import SimpleNamespace
+from unittest.mock import patch
+from peewee import SqliteDatabase
+
+from app import app
+import web  # registers the download routes
+import selection
+import zipstream
+from db import Photo, Photoset, PhotoPhotoset, ShareToken, Selection, Tag, PhotoTag
+from util import getSha1Path
+
+
+class FakeBody(object):
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def read(self, size):
+        return self.data.read(size)
+
+    def close(self):
+        pass
+
+
+class FakeS3(object):
+    """get_object over a dict of key -> bytes"""
+    def __init__(self, objects):
+        self.objects = objects
+        self.fetched = []
+
+    def get_object(self, Bucket, Key):
+        self.fetched.append(Key)
+        return {'ContentLength': len(self.objects[Key]), 'Body': FakeBody(self.objects[Key])}
+
+
+class ZipTestCase(unittest.TestCase):
+    """A temporary archive directory with six originals, two of them only on S3"""
+
+    def setUp(self):
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.saved_config = dict(app.config)
+        app.config.update(LOCALARCHIVEPATH=self.archive_dir.name, S3_BUCKET_NAME='bucket',
+                          ZIP_READAHEAD_CHUNKS=2)
+        self.saved_chunk = zipstream.CHUNK_SIZE
+        zipstream.CHUNK_SIZE = 4096
+
+        rng = random.Random(5)
+        self.rows = []
+        self.contents = {}
+        self.s3_objects = {}
+        for photo_id in range(1, 7):
+            sha1 = f'{photo_id:040x}'
+            data = rng.randbytes(rng.randint(0, 50000))
+            (sha1Path, filename) = getSha1Path(sha1)
+            key = f'{sha1Path}/{filename}.jpg'
+            if photo_id in (2, 5):
+                self.s3_objects[key] = data
+            else:
+                os.makedirs(os.path.join(self.archive_dir.name, sha1Path), exist_ok=True)
+                with open(os.path.join(self.archive_dir.name, key), 'wb') as f:
+                    f.write(data)
+            datetaken = datetime.datetime(2022, 7, photo_id, 9, 30, 12) if photo_id % 3 else None
+            self.rows.append((photo_id, sha1, 'jpg', datetaken))
+            self.contents[photo_id] = data
+
+    def tearDown(self):
+        zipstream.CHUNK_SIZE = self.saved_chunk
+        app.config.clear()
+        app.config.update(self.saved_config)
+        self.archive_dir.cleanup()
+
+    def assertArchive(self, data, photo_ids):
+        """Test that data is a valid ZIP holding the originals of photo_ids, stored, in order"""
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        infos = archive.infolist()
+        self.assertEqual([int(info.filename.rsplit('_', 1)[-1].split('.')[0].split('/')[-1]) for info in infos],
+                         photo_ids)
+        for info, photo_id in zip(infos, photo_ids):
+            self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(archive.read(info), self.contents[photo_id])
+
+
+class TestZipStream(ZipTestCase):
+    """Test the archive format, ranges and S3 read-ahead"""
+
+    def local_rows(self):
+        return [row for row in self.rows if row[0] not in (2, 5)]
+
+    def test_local_archive(self):
+        """Test names, dates and contents of an archive of local originals, and its precomputed size"""
+        stream = zipstream.ZipStream(zipstream.photo_entries(self.local_rows(), 'Trip'))
+        data = b''.join(stream.chunks())
+        self.assertEqual(stream.size(), len(data))
+        self.assertArchive(data, [1, 3, 4, 6])
+        names = [info.filename for info in zipfile.ZipFile(io.BytesIO(data)).infolist()]
+        self.assertEqual(names[:2], ['Trip/2022-07-01_093012_1.jpg', 'Trip/3.jpg'])
+        self.assertEqual(zipfile.ZipFile(io.BytesIO(data)).infolist()[0].date_time, (2022, 7, 1, 9, 30, 12))
+
+    def test_zip64_records(self):
+        """Test the ZIP64 extra fields and end records, with the limits lowered to reach them"""
+        with patch('zipstream.LIMIT_32', 20000), patch('zipstream.LIMIT_16', 3):
+            stream = zipstream.ZipStream(zipstream.photo_entries(self.local_rows(), 'Trip'))
+            data = b''.join(stream.chunks())
+            self.assertEqual(stream.size(), len(data))
+        self.assertIn(b'PK\x06\x06', data)
+        self.assertIn(b'PK\x06\x07', data)
+        self.assertArchive(data, [1, 3, 4, 6])
+
+    def test_ranges(self):
+        """Test that any range matches the same slice of the whole archive"""
+        stream = zipstream.ZipStream(zipstream.photo_entries(self.local_rows(), 'Trip'))
+        data = b''.join(stream.chunks())
+        rng = random.Random(9)
+        for _ in range(40):
+            start = rng.randrange(len(data))
+            stop = rng.choice([None, rng.randint(start + 1, len(data))])
+            self.assertEqual(b''.join(stream.chunks(start, stop)), data[start:stop])
+
+    def test_range_skips_earlier_entries(self):
+        """Test that a range before the central directory doesn't read the entries before it"""
+        stream = zipstream.ZipStream(zipstream.photo_entries(self.local_rows(), 'Trip'))
+        data = b''.join(stream.chunks())
+        last = zipfile.ZipFile(io.BytesIO(data)).infolist()[-1]
+        opened = []
+        read_file = zipstream._read_file
+        with patch('zipstream._read_file', side_effect=lambda path: opened.append(path) or read_file(path)):
+            part = b''.join(stream.chunks(last.header_offset, last.header_offset + 100))
+        self.assertEqual(part, data[last.header_offset:last.header_offset + 100])
+        self.assertEqual(opened, [stream.entries[-1].path])
+
+    def test_s3_readahead(self):
+        """Test an archive mixing local and S3 originals, and that S3 ones are fetched in order"""
+        s3 = FakeS3(self.s3_objects)
+        with patch('aws.get_s3_client', return_value=s3):
+            stream = zipstream.ZipStream(zipstream.photo_entries(self.rows, 'Trip'))
+            self.assertIsNone(stream.size())
+            data = b''.join(stream.chunks())
+        self.assertArchive(data, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(s3.fetched, [stream.entries[1].key, stream.entries[4].key])
+
+    def test_readahead_is_bounded_and_stops(self):
+        """Test that the read-ahead queue holds at most depth chunks and its thread ends on close"""
+        s3 = FakeS3({'big': bytes(100 * 4096)})
+        with patch('aws.get_s3_client', return_value=s3):
+            readahead = zipstream.ReadAhead(['big'], depth=2)
+            size, chunks = readahead.next_object()
+            self.assertEqual(size, 100 * 4096)
+            next(chunks)
+            readahead.thread.join(0.2)
+            self.assertTrue(readahead.thread.is_alive())
+            self.assertLessEqual(readahead.queue.qsize(), 2)
+            readahead.close()
+            readahead.thread.join(5)
+            self.assertFalse(readahead.thread.is_alive())
+
+
+class TestZipRoutes(ZipTestCase):
+    """Test the shared photoset and selection download endpoints"""
+
+    def setUp(self):
+        super().setUp()
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        self.test_db = SqliteDatabase(self.test_db_path)
+
+        models = [Photo, Photoset, PhotoPhotoset, ShareToken, Selection, Tag, PhotoTag]
+        self.test_db.bind(models, bind_refs=False, bind_backrefs=False)
+        self.test_db.connect()
+        self.test_db.create_tables(models)
+
+        self.photoset = Photoset.create(title='Summer Trip')
+        for photo_id, sha1, filetype, datetaken in self.rows:
+            photo = Photo.create(id=photo_id, sha1=sha1, filetype=filetype, datetaken=datetaken,
+                                 privacy=8 if photo_id == 4 else 0,
+                                 ts=datetime.datetime(2023, 1, 1) + datetime.timedelta(minutes=photo_id))
+            if photo_id != 2:
+                PhotoPhotoset.create(photo=photo, photoset=self.photoset)
+        self.share = ShareToken.create(token='trip', share_type='photoset', photoset=self.photoset,
+                                       allow_download=True)
+        app.config.update(SHARE_VIEW_PATH=os.path.join(self.archive_dir.name, 'views.bin'))
+        self.client = app.test_client()
+        self.s3 = patch('aws.get_s3_client', return_value=FakeS3(self.s3_objects))
+        self.s3.start()
+
+    def tearDown(self):
+        self.s3.stop()
+        self.test_db.close()
+        os.close(self.test_db_fd)
+        os.unlink(self.test_db_path)
+        super().tearDown()
+
+    def test_shared_photoset_zip(self):
+        """Test the shared photoset archive, in display order (undated photos first)"""
+        response = self.client.get('/shared/photoset/trip/download.zip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        self.assertIn('filename="Summer_Trip.zip"', response.headers['Content-Disposition'])
+        self.assertEqual(response.headers['Accept-Ranges'], 'none')  # photo 5 is only on S3
+        self.assertArchive(response.get_data(), [3, 6, 1, 4, 5])
+
+    def test_share_limits(self):
+        """Test that allow_download, expiry and max_views are respected"""
+        ShareToken.update(allow_download=False).execute()
+        self.assertEqual(self.client.get('/shared/photoset/trip/download.zip').status_code, 403)
+        ShareToken.update(allow_download=True, max_views=3, views=3).execute()
+        self.assertEqual(self.client.get('/shared/photoset/trip/download.zip').status_code, 410)
+        ShareToken.update(max_views=None, expires_at=datetime.datetime(2000, 1, 1)).execute()
+        self.assertEqual(self.client.get('/shared/photoset/trip/download.zip').status_code, 410)
+        self.assertEqual(self.client.get('/shared/photoset/nope/download.zip').status_code, 404)
+
+    def test_range_resume(self):
+        """Test Content-Length, 206 resumes, If-Range and unsatisfiable ranges when all originals are local"""
+        PhotoPhotoset.delete().where(PhotoPhotoset.photo == 5).execute()
+        full = self.client.get('/shared/photoset/trip/download.zip')
+        data = full.get_data()
+        self.assertEqual(full.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(full.headers['Content-Length']), len(data))
+        self.assertArchive(data, [3, 6, 1, 4])
+        etag = full.headers['ETag']
+
+        resumed = self.client.get('/shared/photoset/trip/download.zip',
+                                  headers={'Range': 'bytes=1000-', 'If-Range': etag})
+        self.assertEqual(resumed.status_code, 206)
+        self.assertEqual(resumed.headers['Content-Range'], f'bytes 1000-{len(data) - 1}/{len(data)}')
+        self.assertEqual(resumed.get_data(), data[1000:])
+
+        changed = self.client.get('/shared/photoset/trip/download.zip',
+                                  headers={'Range': 'bytes=1000-', 'If-Range': '"other"'})
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.get_data(), data)
+
+        beyond = self.client.get('/shared/photoset/trip/download.zip', headers={'Range': f'bytes={len(data)}-'})
+        self.assertEqual(beyond.status_code, 416)
+        self.assertEqual(beyond.headers['Content-Range'], f'bytes */{len(data)}')
+
+    def test_selection_zip(self):
+        """Test the selection archive: the user's own selection, filtered to the privacy levels they see"""
+        token = selection.create_selection({'ids': [1, 2, 4, 5]}, 7)
+        user = SimpleNamespace(id=7, email='viewer@example.com')
+        app.config['LOGIN_DISABLED'] = True
+        with patch('web.current_user', user), patch('web.get_visible_privacy_levels', return_value=[0]):
+            response = self.client.get(f'/photos/selection/{token}/download.zip')
+            self.assertEqual(response.status_code, 200)
+            self.assertArchive(response.get_data(), [5, 2, 1])  # newest import first, private 4 left out
+            user.id = 8
+            self.assertEqual(self.client.get(f'/photos/selection/{token}/download.zip').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
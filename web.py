@@ -15,7 +15,7 @@ import sys
 import re
 
 from flask import Flask, request, session, g, redirect, url_for, abort, \
-  render_template, flash, send_from_directory, jsonify, make_response
+  render_template, flash, send_from_directory, jsonify, make_response, Response
 
 from flask_security import Security, PeeweeUserDatastore, UserMixin, RoleMixin, \
   login_required, roles_required, current_user
@@ -24,19 +24,36 @@ from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 import math
+import calendar
 import secrets
 import datetime
 import hashlib
+from urllib.parse import quote
 
 from app import app
 from util import *
 import util
 from db import *
 from security import get_visible_privacy_levels, can_view_photo, can_edit_photo, \
-  can_manage_tags, can_manage_photosets
+  photo_edit_checker, can_manage_tags, can_manage_photosets
 from peewee import IntegrityError
 import process
+import archive
 import aws
+import bulk
+import cache
+from cards import photo_cards
+import neighbors
+import powauth
+import search as fulltext
+import selection
+import sharedsets
+import shareviews
+import stats
+import tagindex
+import tagops
+import tagsuggest
+import zipstream
 import os
 
 # Configure Flask to work behind nginx proxy
@@ -111,57 +128,9 @@ def require_access(auth=None, pow=None):
             if not pow_required:
                 return f(*args, **kwargs)
 
-            # PoW is required - validate token
-            pow_token = request.cookies.get('pow_token')
-
-            if pow_token:
-                try:
-                    token = PowToken.get(PowToken.token == pow_token)
-
-                    # Validate token hasn't expired (time-based)
-                    if token.expires_at <= datetime.datetime.now():
-                        raise PowToken.DoesNotExist()
-
-                    # Validate IP binding (if enabled)
-                    if app.config.get('POW_BIND_TO_IP', True):
-                        # Check if either IP is a privacy proxy (iCloud Private Relay, etc)
-                        is_privacy_proxy = False
-                        if app.config.get('POW_ALLOW_PRIVACY_PROXIES', True):
-                            proxy_ranges = app.config.get('POW_PRIVACY_PROXY_RANGES', [])
-                            for prefix in proxy_ranges:
-                                if token.ip_address.startswith(prefix) or request.remote_addr.startswith(prefix):
-                                    is_privacy_proxy = True
-                                    break
-
-                        # Only enforce IP binding for non-privacy-proxy IPs
-                        if not is_privacy_proxy and token.ip_address != request.remote_addr:
-                            logger.warning(f'PoW token IP mismatch: expected={token.ip_address} got={request.remote_addr}')
-                            raise PowToken.DoesNotExist()
-
-                    # Validate request count limit
-                    max_requests = app.config.get('POW_TOKEN_MAX_REQUESTS', 50)
-                    if token.request_count >= max_requests:
-                        logger.info(f'PoW token request limit reached: {token.request_count}/{max_requests}')
-                        raise PowToken.DoesNotExist()
-
-                    # Validate time-based expiry (minutes since creation)
-                    expiry_minutes = app.config.get('POW_TOKEN_EXPIRY_MINUTES', 15)
-                    age = datetime.datetime.now() - token.created_at
-                    if age.total_seconds() > (expiry_minutes * 60):
-                        logger.info(f'PoW token time limit exceeded: {age.total_seconds()/60:.1f} min > {expiry_minutes} min')
-                        raise PowToken.DoesNotExist()
-
-                    # Token is valid - increment usage counter
-                    token.request_count += 1
-                    token.last_request_at = datetime.datetime.now()
-                    token.save()
-
-                    # Allow access to protected content
-                    return f(*args, **kwargs)
-
-                except PowToken.DoesNotExist:
-                    # Token invalid, expired, or doesn't exist - fall through to challenge
-                    pass
+            # PoW is required - the signed token must validate and have budget left
+            if powauth.check_request().valid:
+                return f(*args, **kwargs)
 
             # No valid token - return challenge page (server-side enforcement)
             # Store the requested URL so we can redirect back after solving
@@ -206,38 +175,9 @@ def protect_login_with_pow():
     if current_user.is_authenticated:
         return None
 
-    # Check for valid POW token
-    pow_token = request.cookies.get('pow_token')
-    if pow_token:
-        try:
-            token = PowToken.get(PowToken.token == pow_token)
-
-            # Validate IP binding
-            if app.config.get('POW_BIND_TO_IP', True):
-                # Check if either IP is a privacy proxy (iCloud Private Relay, etc)
-                is_privacy_proxy = False
-                if app.config.get('POW_ALLOW_PRIVACY_PROXIES', True):
-                    proxy_ranges = app.config.get('POW_PRIVACY_PROXY_RANGES', [])
-                    for prefix in proxy_ranges:
-                        if token.ip_address.startswith(prefix) or request.remote_addr.startswith(prefix):
-                            is_privacy_proxy = True
-                            break
-
-                # Only enforce IP binding for non-privacy-proxy IPs
-                if not is_privacy_proxy and token.ip_address != request.remote_addr:
-                    raise PowToken.DoesNotExist()
-
-            # Validate time-based expiry
-            expiry_minutes = app.config.get('POW_TOKEN_EXPIRY_MINUTES', 15)
-            age = datetime.datetime.now() - token.created_at
-            if age.total_seconds() > (expiry_minutes * 60):
-                raise PowToken.DoesNotExist()
-
-            # Token is valid - allow login page access
-            return None
-
-        except PowToken.DoesNotExist:
-            pass  # Fall through to require POW
+    # Check for valid POW token (viewing the login page does not spend its budget)
+    if powauth.check_request(consume=False).valid:
+        return None
 
     # No valid token - redirect to POW challenge
     return_url = get_return_url()
@@ -340,26 +280,34 @@ def find(lst, key, value):
       return i
   return -1
 
-def get_pagination_data(query, page, per_page):
+def get_pagination_data(query, page, per_page, visible_levels=None, total=None):
   """Calculate pagination metadata for a query
 
   Args:
     query: Peewee SelectQuery object
     page: Current page number (1-indexed)
     per_page: Items per page
+    visible_levels: Viewer's privacy levels (part of the count cache key)
+    total: Exact count if the caller already knows it (skips the count query)
 
   Returns:
-    Dictionary with pagination metadata
+    Dictionary with pagination metadata. total_approximate is True when another
+    worker is still computing the exact count; total_items is then a lower bound.
   """
-  total_items = query.count()
+  if total is not None:
+    total_items, exact = total, True
+  else:
+    total_items, exact = cache.cached_count(query, visible_levels, floor=page * per_page)
   total_pages = math.ceil(total_items / per_page)
   has_prev = page > 1
-  has_next = page < total_pages
+  has_next = page < total_pages or not exact
 
   return {
     'page': page,
     'per_page': per_page,
     'total_items': total_items,
+    'total_approximate': not exact,
+    'total_display': f'{total_items:,}' if exact else f'{total_items:,}+',
     'total_pages': total_pages,
     'has_prev': has_prev,
     'has_next': has_next,
@@ -367,6 +315,62 @@ def get_pagination_data(query, page, per_page):
     'next_page': page + 1 if has_next else None
   }
 
+def attach_tag_lists(photos):
+  """Set photo.tag_list (Tags in tagging order) on each photo with one query for the whole page"""
+  photos = list(photos)
+  tag_lists = dict((photo.id, []) for photo in photos)
+  rows = (PhotoTag
+          .select(PhotoTag.photo, Tag)
+          .join(Tag)
+          .where(PhotoTag.photo.in_(list(tag_lists)))
+          .order_by(PhotoTag.id))
+  for row in rows:
+    tags = tag_lists[row.photo_id]
+    if row.tag not in tags:
+      tags.append(row.tag)
+  for photo in photos:
+    photo.tag_list = tag_lists[photo.id]
+  return photos
+
+def attach_role_lists(users):
+  """Set user.role_list (role names) on each user with one query for the whole page"""
+  users = list(users)
+  role_lists = dict((user.id, []) for user in users)
+  rows = (UserRoles
+          .select(UserRoles.user, Role.name)
+          .join(Role)
+          .where(UserRoles.user.in_(list(role_lists)))
+          .order_by(UserRoles.id)
+          .tuples())
+  for user_id, role_name in rows:
+    role_lists[user_id].append(role_name)
+  for user in users:
+    user.role_list = role_lists[user.id]
+  return users
+
+def form_privacies(photo_ids):
+  """{photo id: privacy} from the bulk editor's privacy_<id> fields ('' is NULL)"""
+  privacies = {}
+  for photo_id in photo_ids:
+    privacy = request.form.get(f'privacy_{photo_id}')
+    if privacy is not None:
+      privacies[photo_id] = int(privacy) if privacy else None
+  return privacies
+
+def form_tag_lists(photo_ids):
+  """{photo id: [tag name]} from the bulk editor's tags_<id> fields"""
+  return dict((photo_id, bulk.parse_tags(request.form[f'tags_{photo_id}']))
+              for photo_id in photo_ids if f'tags_{photo_id}' in request.form)
+
+def merge_preview_message(source_name, target_name, counts):
+  """Flash text for a tag merge dry run (tagops.MergeCounts)"""
+  message = f'Merging "{source_name}" into "{target_name}" would move {counts.photos} photo{"s" if counts.photos != 1 else ""}'
+  if counts.target_created:
+    message += f' to a new tag "{target_name}"'
+  elif counts.already_tagged:
+    message += f' ({counts.already_tagged} already tagged "{target_name}")'
+  return message + '. Nothing was changed.'
+
 # URL Routing
 
 @app.errorhandler(404)
@@ -388,6 +392,8 @@ def robots_txt():
 @app.route('/photostream', defaults={'page': 1})
 @app.route('/photostream/page/<int:page>')
 @require_access(pow=True)
+@cache.conditional_page
+@cache.cached_page
 def photostream(page):
   """the list of the most recently added pictures"""
   baseurl = '%s/photostream' % (get_base_url())
@@ -398,13 +404,10 @@ def photostream(page):
   ).order_by(Photo.id.desc())
 
   # Get pagination metadata
-  pagination = get_pagination_data(photos_query, page, app.config['PER_PAGE'])
+  pagination = get_pagination_data(photos_query, page, app.config['PER_PAGE'], visible_levels)
 
   # Get paginated results
-  photos = photos_query.paginate(page, app.config['PER_PAGE'])
-  for photo in photos:
-    (sha1Path,filename) = getSha1Path(photo.sha1)
-    photo.uri = sha1Path + '/' + filename
+  photos = photo_cards(photos_query.paginate(page, app.config['PER_PAGE']))
 
   # Include page number in context for breadcrumb navigation
   in_context = f'photostream:page:{page}' if page > 1 else 'photostream'
@@ -418,33 +421,8 @@ def show_photo(photo_id):
   if current_user.is_authenticated:
     has_pow = True
   elif app.config.get('POW_ENABLED', False):
-    # Validate POW token manually (same logic as require_access decorator)
-    pow_token = request.cookies.get('pow_token')
-    if pow_token:
-      try:
-        token = PowToken.get(PowToken.token == pow_token)
-        # Validate expiry and IP binding (same as decorator)
-        if token.expires_at > datetime.datetime.now():
-          if app.config.get('POW_BIND_TO_IP', True):
-            is_privacy_proxy = False
-            if app.config.get('POW_ALLOW_PRIVACY_PROXIES', True):
-              proxy_ranges = app.config.get('POW_PRIVACY_PROXY_RANGES', [])
-              for prefix in proxy_ranges:
-                if token.ip_address.startswith(prefix) or request.remote_addr.startswith(prefix):
-                  is_privacy_proxy = True
-                  break
-            if is_privacy_proxy or token.ip_address == request.remote_addr:
-              # Check request count and time limits
-              max_requests = app.config.get('POW_TOKEN_MAX_REQUESTS', 50)
-              expiry_minutes = app.config.get('POW_TOKEN_EXPIRY_MINUTES', 15)
-              age = datetime.datetime.now() - token.created_at
-              if token.request_count < max_requests and age.total_seconds() <= (expiry_minutes * 60):
-                has_pow = True
-                token.request_count += 1
-                token.last_request_at = datetime.datetime.now()
-                token.save()
-      except PowToken.DoesNotExist:
-        pass
+    # Same validator as require_access, so a full view spends one request of the budget
+    has_pow = powauth.check_request().valid
   else:
     # POW not enabled, allow access
     has_pow = True
@@ -465,6 +443,14 @@ def show_photo(photo_id):
     access_mode = 'preview'
     logger.info(f'Photo {photo_id}: Split-brain preview (200, no POW token)')
 
+  # Revalidation is answered before the photo and its navigation are queried; the
+  # page embeds a presigned URL, so validators also expire with its signing window
+  etag = cache.page_etag(access_mode, cache.signed_url_period())
+  response = cache.not_modified(etag)
+  if response is not None:
+    response.headers['X-Cigarbox-Access'] = access_mode
+    return response
+
   photo = Photo.select().where(Photo.id == photo_id).get()
   # Check if user has permission to view this photo
   if not can_view_photo(current_user, photo):
@@ -505,30 +491,35 @@ def show_photo(photo_id):
       context_url = f"{get_base_url()}/photosets/{photoset_id}/page/{page_num}"
       context_name = f"{context_name} : {page_num}"
 
-    # Base query for photos in this photoset
-    base_query = (Photo.select()
-                  .join(PhotoPhotoset)
-                  .where((PhotoPhotoset.photoset == photoset_id) &
-                         ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))))
-
-    # Get current photo's datetaken for comparison
-    current_datetaken = photo.datetaken
-
-    # Next photo: later date, or same date but higher ID
-    next_photo = (base_query
-                  .where((Photo.datetaken > current_datetaken) |
-                         ((Photo.datetaken == current_datetaken) & (Photo.id > photo_id)))
-                  .order_by(Photo.datetaken.asc(), Photo.id.asc())
-                  .limit(1)
-                  .first())
+    # Neighbours from the context's cached id array; SQL if the photo isn't in it
+    found = neighbors.find(neighbors.photoset(photoset_id, visible_levels), photo_id)
+    if found:
+      prev_photo, next_photo = found.prev, found.next
+    else:
+      # Base query for photos in this photoset
+      base_query = (Photo.select()
+                    .join(PhotoPhotoset)
+                    .where((PhotoPhotoset.photoset == photoset_id) &
+                           ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))))
 
-    # Previous photo: earlier date, or same date but lower ID
-    prev_photo = (base_query
-                  .where((Photo.datetaken < current_datetaken) |
-                         ((Photo.datetaken == current_datetaken) & (Photo.id < photo_id)))
-                  .order_by(Photo.datetaken.desc(), Photo.id.desc())
-                  .limit(1)
-                  .first())
+      # Get current photo's datetaken for comparison
+      current_datetaken = photo.datetaken
+
+      # Next photo: later date, or same date but higher ID
+      next_photo = (base_query
+                    .where((Photo.datetaken > current_datetaken) |
+                           ((Photo.datetaken == current_datetaken) & (Photo.id > photo_id)))
+                    .order_by(Photo.datetaken.asc(), Photo.id.asc())
+                    .limit(1)
+                    .first())
+
+      # Previous photo: earlier date, or same date but lower ID
+      prev_photo = (base_query
+                    .where((Photo.datetaken < current_datetaken) |
+                           ((Photo.datetaken == current_datetaken) & (Photo.id < photo_id)))
+                    .order_by(Photo.datetaken.desc(), Photo.id.desc())
+                    .limit(1)
+                    .first())
 
   elif in_context.startswith('tags:'):
     # Navigating within tag(s) (ordered by ID desc)
@@ -551,37 +542,49 @@ def show_photo(photo_id):
       context_url = f"{get_base_url()}/tags/{tags_str}/page/{page_num}"
       context_name = f"{context_name} : {page_num}"
 
-    # Base query for photos with these tag(s)
-    if len(tags_list) == 1:
-      # Single tag: simple query
-      base_query = (Photo.select()
-                    .join(PhotoTag)
-                    .join(Tag)
-                    .where((Tag.name == tags_list[0]) &
-                           ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))))
+    found = neighbors.find(neighbors.tags(tags_list, visible_levels), photo_id)
+    index = tagindex.get_index() if not found else None
+    if found:
+      prev_photo, next_photo = found.prev, found.next
+    elif index:
+      # Neighbours straight from the bitmap index (order is ID DESC)
+      matches = index.match(tags_list, visible_levels)
+      next_id = matches.next_id(photo_id)
+      prev_id = matches.prev_id(photo_id)
+      next_photo = Photo.get_or_none(Photo.id == next_id) if next_id is not None else None
+      prev_photo = Photo.get_or_none(Photo.id == prev_id) if prev_id is not None else None
     else:
-      # Multiple tags: intersection query
-      base_query = (Photo.select()
-                    .join(PhotoTag)
-                    .join(Tag)
-                    .where((Tag.name.in_(tags_list)) &
-                           ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels))))
-                    .group_by(Photo.id)
-                    .having(fn.COUNT(fn.DISTINCT(Tag.id)) == len(tags_list)))
-
-    # Next photo: lower ID (because order is DESC)
-    next_photo = (base_query
-                  .where(Photo.id < photo_id)
-                  .order_by(Photo.id.desc())
-                  .limit(1)
-                  .first())
-
-    # Previous photo: higher ID (because order is DESC)
-    prev_photo = (base_query
-                  .where(Photo.id > photo_id)
-                  .order_by(Photo.id.asc())
-                  .limit(1)
-                  .first())
+      # Base query for photos with these tag(s)
+      if len(tags_list) == 1:
+        # Single tag: simple query
+        base_query = (Photo.select()
+                      .join(PhotoTag)
+                      .join(Tag)
+                      .where((Tag.name == tags_list[0]) &
+                             ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))))
+      else:
+        # Multiple tags: intersection query
+        base_query = (Photo.select()
+                      .join(PhotoTag)
+                      .join(Tag)
+                      .where((Tag.name.in_(tags_list)) &
+                             ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels))))
+                      .group_by(Photo.id)
+                      .having(fn.COUNT(fn.DISTINCT(Tag.id)) == len(tags_list)))
+
+      # Next photo: lower ID (because order is DESC)
+      next_photo = (base_query
+                    .where(Photo.id < photo_id)
+                    .order_by(Photo.id.desc())
+                    .limit(1)
+                    .first())
+
+      # Previous photo: higher ID (because order is DESC)
+      prev_photo = (base_query
+                    .where(Photo.id > photo_id)
+                    .order_by(Photo.id.asc())
+                    .limit(1)
+                    .first())
 
   elif in_context.startswith('date:'):
     # Navigating within a specific date (ordered by datetaken DESC - newest first)
@@ -597,29 +600,33 @@ def show_photo(photo_id):
       context_url = f"{get_base_url()}/date/{date_str}/page/{page_num}"
       context_name = f"Date: {date_str} : {page_num}"
 
-    # Base query for photos on this date (using startswith for flexible date matching)
-    base_query = (Photo.select()
-                  .where((Photo.datetaken.startswith(date_str)) &
-                         ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))))
-
-    # Get current photo's datetaken for comparison
-    current_datetaken = photo.datetaken
-
-    # Next photo: earlier time (DESC order), or same time but lower ID
-    next_photo = (base_query
-                  .where((Photo.datetaken < current_datetaken) |
-                         ((Photo.datetaken == current_datetaken) & (Photo.id < photo_id)))
-                  .order_by(Photo.datetaken.desc(), Photo.id.desc())
-                  .limit(1)
-                  .first())
+    found = neighbors.find(neighbors.date(date_str, visible_levels), photo_id)
+    if found:
+      prev_photo, next_photo = found.prev, found.next
+    else:
+      # Base query for photos on this date (prefix match as an indexed range)
+      base_query = (Photo.select()
+                    .where((archive.datetaken_startswith(date_str)) &
+                           ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))))
 
-    # Previous photo: later time (DESC order), or same time but higher ID
-    prev_photo = (base_query
-                  .where((Photo.datetaken > current_datetaken) |
-                         ((Photo.datetaken == current_datetaken) & (Photo.id > photo_id)))
-                  .order_by(Photo.datetaken.asc(), Photo.id.asc())
-                  .limit(1)
-                  .first())
+      # Get current photo's datetaken for comparison
+      current_datetaken = photo.datetaken
+
+      # Next photo: earlier time (DESC order), or same time but lower ID
+      next_photo = (base_query
+                    .where((Photo.datetaken < current_datetaken) |
+                           ((Photo.datetaken == current_datetaken) & (Photo.id < photo_id)))
+                    .order_by(Photo.datetaken.desc(), Photo.id.desc())
+                    .limit(1)
+                    .first())
+
+      # Previous photo: later time (DESC order), or same time but higher ID
+      prev_photo = (base_query
+                    .where((Photo.datetaken > current_datetaken) |
+                           ((Photo.datetaken == current_datetaken) & (Photo.id > photo_id)))
+                    .order_by(Photo.datetaken.asc(), Photo.id.asc())
+                    .limit(1)
+                    .first())
 
   elif in_context.startswith('photostream') or not in_context:
     # Default: photostream navigation (ordered by ID desc)
@@ -632,43 +639,44 @@ def show_photo(photo_id):
       context_url = f"{get_base_url()}/photostream/page/{page_num}"
       context_name = f"Photostream : {page_num}"
 
-    # Base query for all visible photos
-    base_query = Photo.select().where(
-      (Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels))
-    )
+    found = neighbors.find(neighbors.photostream(visible_levels), photo_id)
+    if found:
+      prev_photo, next_photo = found.prev, found.next
+    else:
+      # Base query for all visible photos
+      base_query = Photo.select().where(
+        (Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels))
+      )
 
-    # Next photo: lower ID (because order is DESC)
-    next_photo = (base_query
-                  .where(Photo.id < photo_id)
-                  .order_by(Photo.id.desc())
-                  .limit(1)
-                  .first())
+      # Next photo: lower ID (because order is DESC)
+      next_photo = (base_query
+                    .where(Photo.id < photo_id)
+                    .order_by(Photo.id.desc())
+                    .limit(1)
+                    .first())
 
-    # Previous photo: higher ID (because order is DESC)
-    prev_photo = (base_query
-                  .where(Photo.id > photo_id)
-                  .order_by(Photo.id.asc())
-                  .limit(1)
-                  .first())
+      # Previous photo: higher ID (because order is DESC)
+      prev_photo = (base_query
+                    .where(Photo.id > photo_id)
+                    .order_by(Photo.id.asc())
+                    .limit(1)
+                    .first())
 
   # Extract context photoset ID if in photoset context
   context_photoset_id = None
   if in_context.startswith('photoset:'):
     context_photoset_id = int(in_context.split(':')[1])
 
-  # Get all tags for autocomplete
-  all_tags = Tag.select().order_by(Tag.name)
-
   # Create response with custom header for nginx logging
   response = make_response(render_template('photos.html', photo=photo, tags=tags,
                         photo_photosets=photo_photosets, can_edit=can_edit,
                         in_context=in_context, context_name=context_name, context_url=context_url,
                         prev_photo=prev_photo, next_photo=next_photo,
-                        context_photoset_id=context_photoset_id, all_tags=all_tags, has_pow=has_pow))
+                        context_photoset_id=context_photoset_id, has_pow=has_pow))
 
   # Add header for nginx to distinguish preview vs full access
   response.headers['X-Cigarbox-Access'] = access_mode
-  return response
+  return cache.set_validators(response, etag)
 
 
 @app.route('/photos/<int:photo_id>/update', methods=['POST'])
@@ -695,16 +703,9 @@ def update_photo_inline(photo_id):
     # Update tags
     tags_input = request.form.get('tags', '')
 
-    # Remove existing tags
-    PhotoTag.delete().where(PhotoTag.photo == photo_id).execute()
-
-    # Add new tags
-    if tags_input:
-      # Split on both comma and space to support CLI and web UI
-      tag_names = [t.strip().lower() for t in re.split(r'[,\s]+', tags_input) if t.strip()]
-      for tag_name in tag_names:
-        tag, created = Tag.get_or_create(name=tag_name)
-        PhotoTag.create(photo=photo, tag=tag)
+    # Replace existing tags
+    with bulk.transaction():
+      bulk.replace_tags({photo.id: bulk.parse_tags(tags_input)})
 
     flash('Tags updated')
 
@@ -742,6 +743,20 @@ def bulk_edit_photos(page):
     action = request.form.get('action')
     is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
 
+    # "Apply to all" actions post the selection token; resolve its ids server-side
+    token = request.form.get('sel', '')
+    if token and action in ('bulk_tags_add', 'bulk_privacy', 'bulk_photoset'):
+      spec = selection.get_selection_spec(token, current_user.id)
+      if spec is None:
+        photo_ids = []
+      else:
+        visible_levels = get_visible_privacy_levels(current_user)
+        photo_ids = [str(row[0]) for row in (selection.selection_query(spec)
+                     .select(Photo.id)
+                     .where((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))
+                     .order_by(Photo.ts.desc())
+                     .tuples())]
+
     # Debug logging
     print(f"[BULK EDIT] Action: {action}, Photo IDs count: {len([p for p in photo_ids if p])}, AJAX: {is_ajax}")
 
@@ -749,148 +764,82 @@ def bulk_edit_photos(page):
     success = True
 
     try:
-      if action == 'bulk_tags_add':
-        # Add tags to all photos
-        tags_input = request.form.get('bulk_tags', '')
-        if tags_input:
-          # Split on both comma and space to support CLI and web UI
-          tag_names = [t.strip().lower() for t in re.split(r'[,\s]+', tags_input) if t.strip()]
-          count = 0
-          for photo_id in photo_ids:
-            if not photo_id:
-              continue
-            photo = Photo.select().where(Photo.id == int(photo_id)).first()
-            if photo and can_edit_photo(current_user, photo):
-              for tag_name in tag_names:
-                tag, created = Tag.get_or_create(name=tag_name)
-                PhotoTag.get_or_create(photo=photo, tag=tag)
-              count += 1
-          message = f'Added tags to {count} photos'
-        else:
-          message = 'No tags provided'
-          success = False
-
-      elif action == 'bulk_privacy':
-        # Set privacy for all photos
-        privacy = request.form.get('bulk_privacy')
-        if privacy:
-          count = 0
-          for photo_id in photo_ids:
-            if not photo_id:
-              continue
-            photo = Photo.select().where(Photo.id == int(photo_id)).first()
-            if photo and can_edit_photo(current_user, photo):
-              photo.privacy = int(privacy) if privacy != 'null' else None
-              photo.save()
-              count += 1
+      # Resolve which of the photos the user may edit with one query, then
+      # apply the action as set statements in a single transaction
+      editable = bulk.editable_ids(current_user, bulk.parse_ids(photo_ids))
+      with bulk.transaction():
+        if action == 'bulk_tags_add':
+          # Add tags to all photos
+          tag_names = bulk.parse_tags(request.form.get('bulk_tags', ''))
+          if tag_names:
+            bulk.add_tags(editable, tag_names)
+            message = f'Added tags to {len(editable)} photos'
+          else:
+            message = 'No tags provided'
+            success = False
+
+        elif action == 'bulk_privacy':
+          # Set privacy for all photos
+          privacy = request.form.get('bulk_privacy')
+          if privacy:
+            bulk.set_privacy(editable, int(privacy) if privacy != 'null' else None)
+            count = len(editable)
+            message = f'Updated privacy for {count} photo{"s" if count != 1 else ""}'
+          else:
+            message = 'No privacy level selected'
+            success = False
+
+        elif action == 'bulk_photoset':
+          # Add all photos to photoset (or create new one)
+          photoset_id = request.form.get('bulk_photoset')
+          new_photoset_title = request.form.get('new_photoset_title', '').strip()
+
+          if photoset_id == '__new__' and new_photoset_title:
+            # Create new photoset (validate title is not blank)
+            title = new_photoset_title.strip()
+            if not title:
+              flash('Photoset title cannot be blank')
+              return redirect(url_for('bulk_edit_photos'))
+            photoset = Photoset.create(
+              title=title,
+              description='',
+              primary_photo_id=photo_ids[0] if photo_ids and photo_ids[0] else None
+            )
+            logger.info('PHOTOSET_CREATED id=%d title=%s user=%s', photoset.id, new_photoset_title, current_user.email)
+          elif photoset_id and photoset_id != '__new__':
+            photoset = Photoset.select().where(Photoset.id == int(photoset_id)).first()
+          else:
+            photoset = None
+
+          if photoset:
+            bulk.add_to_photoset(editable, photoset.id)
+            message = f'Added {len(editable)} photos to photoset "{photoset.title}"'
+          else:
+            message = 'No photoset selected or created'
+            success = False
+
+        elif action == 'individual_privacy':
+          # Update individual photo privacy levels
+          privacies = form_privacies(editable)
+          bulk.set_privacies(privacies)
+          count = len(privacies)
           message = f'Updated privacy for {count} photo{"s" if count != 1 else ""}'
-        else:
-          message = 'No privacy level selected'
-          success = False
-
-      elif action == 'bulk_photoset':
-        # Add all photos to photoset (or create new one)
-        photoset_id = request.form.get('bulk_photoset')
-        new_photoset_title = request.form.get('new_photoset_title', '').strip()
-
-        if photoset_id == '__new__' and new_photoset_title:
-          # Create new photoset (validate title is not blank)
-          title = new_photoset_title.strip()
-          if not title:
-            flash('Photoset title cannot be blank')
-            return redirect(url_for('bulk_edit_photos'))
-          photoset = Photoset.create(
-            title=title,
-            description='',
-            primary_photo_id=photo_ids[0] if photo_ids and photo_ids[0] else None
-          )
-          logger.info('PHOTOSET_CREATED id=%d title=%s user=%s', photoset.id, new_photoset_title, current_user.email)
-        elif photoset_id and photoset_id != '__new__':
-          photoset = Photoset.select().where(Photoset.id == int(photoset_id)).first()
-        else:
-          photoset = None
-
-        if photoset:
-          count = 0
-          for photo_id in photo_ids:
-            if not photo_id:
-              continue
-            photo = Photo.select().where(Photo.id == int(photo_id)).first()
-            if photo and can_edit_photo(current_user, photo):
-              PhotoPhotoset.get_or_create(photo=photo, photoset=photoset)
-              count += 1
-          message = f'Added {count} photos to photoset "{photoset.title}"'
-        else:
-          message = 'No photoset selected or created'
-          success = False
-
-      elif action == 'individual_privacy':
-        # Update individual photo privacy levels
-        count = 0
-        for photo_id in photo_ids:
-          if not photo_id:
-            continue
-          privacy_key = f'privacy_{photo_id}'
-          if privacy_key in request.form:
-            photo = Photo.select().where(Photo.id == int(photo_id)).first()
-            if photo and can_edit_photo(current_user, photo):
-              privacy = request.form.get(privacy_key)
-              photo.privacy = int(privacy) if privacy else None
-              photo.save()
-              count += 1
-        message = f'Updated privacy for {count} photo{"s" if count != 1 else ""}'
-
-      elif action == 'individual_tags':
-        # Update individual photo tags
-        count = 0
-        for photo_id in photo_ids:
-          if not photo_id:
-            continue
-          tags_key = f'tags_{photo_id}'
-          if tags_key in request.form:
-            photo = Photo.select().where(Photo.id == int(photo_id)).first()
-            if photo and can_edit_photo(current_user, photo):
-              # Remove existing tags
-              PhotoTag.delete().where(PhotoTag.photo == photo).execute()
-              # Add new tags
-              tags_input = request.form.get(tags_key, '')
-              if tags_input:
-                # Split on both comma and space to support CLI and web UI
-                tag_names = [t.strip().lower() for t in re.split(r'[,\s]+', tags_input) if t.strip()]
-                for tag_name in tag_names:
-                  tag, created = Tag.get_or_create(name=tag_name)
-                  PhotoTag.create(photo=photo, tag=tag)
-              count += 1
-        message = f'Updated tags for {count} photo{"s" if count != 1 else ""}'
-
-      elif action == 'individual_both':
-        # Update both privacy and tags for photos
-        count = 0
-        for photo_id in photo_ids:
-          if not photo_id:
-            continue
-          photo = Photo.select().where(Photo.id == int(photo_id)).first()
-          if photo and can_edit_photo(current_user, photo):
-            # Update privacy
-            privacy_key = f'privacy_{photo_id}'
-            if privacy_key in request.form:
-              privacy = request.form.get(privacy_key)
-              photo.privacy = int(privacy) if privacy else None
-              photo.save()
-
-            # Update tags
-            tags_key = f'tags_{photo_id}'
-            if tags_key in request.form:
-              tags_input = request.form.get(tags_key, '')
-              PhotoTag.delete().where(PhotoTag.photo == photo).execute()
-              if tags_input:
-                # Split on both comma and space to support CLI and web UI
-                tag_names = [t.strip().lower() for t in re.split(r'[,\s]+', tags_input) if t.strip()]
-                for tag_name in tag_names:
-                  tag, created = Tag.get_or_create(name=tag_name)
-                  PhotoTag.create(photo=photo, tag=tag)
-            count += 1
-        message = f'Saved changes to {count} photo{"s" if count != 1 else ""}'
+
+        elif action == 'individual_tags':
+          # Update individual photo tags
+          tag_lists = form_tag_lists(editable)
+          bulk.replace_tags(tag_lists)
+          count = len(tag_lists)
+          message = f'Updated tags for {count} photo{"s" if count != 1 else ""}'
+
+        elif action == 'individual_both':
+          # Update both privacy and tags for photos
+          privacies = form_privacies(editable)
+          tag_lists = form_tag_lists(editable)
+          bulk.set_privacies(privacies)
+          bulk.replace_tags(tag_lists)
+          count = len(editable)
+          message = f'Saved changes to {count} photo{"s" if count != 1 else ""}'
 
     except Exception as e:
       message = f'Error: {str(e)}'
@@ -902,35 +851,14 @@ def bulk_edit_photos(page):
 
     # Flash message and redirect for normal requests
     flash(message)
+    if token:
+      return redirect(url_for('bulk_edit_photos', page=page, sel=token))
     return redirect(url_for('bulk_edit_photos', ids=','.join(photo_ids)))
 
   # GET request - show bulk edit interface
   try:
-    ids = request.args.get('ids', '')
-    if not ids:
-      flash('No photos selected')
-      return redirect(url_for('photostream'))
-
-    photo_ids = [int(id) for id in ids.split(',') if id.strip().isdigit()]
-    logger.info(f'Bulk edit: {len(photo_ids)} photo IDs requested')
-
-    # Load photos
-    photos = Photo.select().where(Photo.id.in_(photo_ids)).order_by(Photo.ts.desc())
-
-    # Check permissions and prepare photo data
-    editable_photos = []
-    for photo in photos:
-      if can_view_photo(current_user, photo):
-        (sha1Path, filename) = getSha1Path(photo.sha1)
-        photo.uri = sha1Path + '/' + filename
-        photo.can_edit = can_edit_photo(current_user, photo)
-
-        # Get existing tags
-        photo.tag_list = list(Tag.select().join(PhotoTag).where(PhotoTag.photo == photo))
-
-        editable_photos.append(photo)
-
-    # Get grouping preference (sanitize to prevent path injection)
+    # Legacy ?ids= links (upload, "just this group") are saved as a selection first
+    token = request.args.get('sel', '')
     group_by = request.args.get('group_by', 'upload_date')
     # Strip any path components that got appended accidentally
     if '/' in group_by:
@@ -939,11 +867,51 @@ def bulk_edit_photos(page):
     if group_by not in ['upload_date', 'date_taken']:
       group_by = 'upload_date'
 
+    if not token:
+      ids = request.args.get('ids', '')
+      photo_ids = [int(id) for id in ids.split(',') if id.strip().isdigit()]
+      if not photo_ids:
+        flash('No photos selected')
+        return redirect(url_for('photostream'))
+      token = selection.create_selection({'ids': photo_ids}, current_user.id)
+      return redirect(url_for('bulk_edit_photos', page=page, sel=token, group_by=group_by))
+
+    spec = selection.get_selection_spec(token, current_user.id)
+    if spec is None:
+      flash('Selection not found or expired')
+      return redirect(url_for('photostream'))
+    logger.info(f'Bulk edit: selection {token} spec={spec}')
+
+    # Resolve the selection lazily: only the current page is loaded
+    visible_levels = get_visible_privacy_levels(current_user)
+    photos_query = (selection.selection_query(spec)
+                    .where((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))
+                    .order_by(Photo.ts.desc()))
+    per_page = 100
+    total_photos = photos_query.count()
+
+    # Prepare photo data for the current page: tags, roles and file dates are
+    # fetched once for the page rather than per photo
+    paginated_photos = attach_tag_lists(photos_query.paginate(page, per_page))
+    can_edit = photo_edit_checker(current_user)
+    for photo in paginated_photos:
+      (sha1Path, filename) = getSha1Path(photo.sha1)
+      photo.uri = sha1Path + '/' + filename
+      photo.can_edit = can_edit(photo)
+
+    # File dates stand in for a missing EXIF date when grouping by date taken
+    file_dates = {}
+    undated_ids = [photo.id for photo in paginated_photos if not photo.datetaken]
+    if group_by == 'date_taken' and undated_ids:
+      file_dates = dict(ImportMeta
+                        .select(ImportMeta.photo, ImportMeta.filedate)
+                        .where(ImportMeta.photo.in_(undated_ids))
+                        .tuples())
+
     # Group photos by chosen method
     from collections import defaultdict
-    grouped_photos = defaultdict(list)
-
-    for photo in editable_photos:
+    grouped_photos_paginated = defaultdict(list)
+    for photo in paginated_photos:
       if group_by == 'date_taken':
         # Try to use date taken from EXIF
         if photo.datetaken:
@@ -951,12 +919,12 @@ def bulk_edit_photos(page):
           group_label = photo.datetaken.strftime('%Y-%m-%d')
         else:
           # Fall back to file date from ImportMeta
-          import_meta = ImportMeta.select().where(ImportMeta.photo == photo.id).first()
-          if import_meta and import_meta.filedate:
+          filedate = file_dates.get(photo.id)
+          if filedate:
             # Parse filedate if it's a string
-            if isinstance(import_meta.filedate, str):
+            if isinstance(filedate, str):
               try:
-                filedate_obj = datetime.datetime.strptime(import_meta.filedate, '%Y-%m-%d %H:%M:%S')
+                filedate_obj = datetime.datetime.strptime(filedate, '%Y-%m-%d %H:%M:%S')
                 group_key = filedate_obj.date()
                 group_label = filedate_obj.strftime('%Y-%m-%d') + ' (file date)'
               except ValueError:
@@ -964,8 +932,8 @@ def bulk_edit_photos(page):
                 group_key = datetime.date(1970, 1, 1)
                 group_label = 'Unknown Date'
             else:
-              group_key = import_meta.filedate.date()
-              group_label = import_meta.filedate.strftime('%Y-%m-%d') + ' (file date)'
+              group_key = filedate.date()
+              group_label = filedate.strftime('%Y-%m-%d') + ' (file date)'
           else:
             # No date info available
             group_key = datetime.date(1970, 1, 1)  # Sort to bottom
@@ -975,57 +943,18 @@ def bulk_edit_photos(page):
         group_key = photo.ts.date()
         group_label = photo.ts.strftime('%Y-%m-%d')
 
-      grouped_photos[(group_key, group_label)].append(photo)
+      grouped_photos_paginated[(group_key, group_label)].append(photo)
 
     # Convert to sorted list of ((date, label), photos) tuples
-    photo_groups = sorted(grouped_photos.items(), key=lambda x: x[0][0], reverse=True)
+    photo_groups_paginated = sorted(grouped_photos_paginated.items(), key=lambda x: x[0][0], reverse=True)
 
     # Get all photosets for dropdown
     photosets = Photoset.select().order_by(Photoset.title)
 
-    # Paginate the editable_photos list
-    per_page = 100
-    total_photos = len(editable_photos)
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    paginated_photos = editable_photos[start_idx:end_idx]
-
-    # Re-group only the paginated photos
-    grouped_photos_paginated = defaultdict(list)
-    for photo in paginated_photos:
-      if group_by == 'date_taken':
-        if photo.datetaken:
-          group_key = photo.datetaken.date()
-          group_label = photo.datetaken.strftime('%Y-%m-%d')
-        else:
-          import_meta = ImportMeta.select().where(ImportMeta.photo == photo.id).first()
-          if import_meta and import_meta.filedate:
-            if isinstance(import_meta.filedate, str):
-              try:
-                filedate_obj = datetime.datetime.strptime(import_meta.filedate, '%Y-%m-%d %H:%M:%S')
-                group_key = filedate_obj.date()
-                group_label = filedate_obj.strftime('%Y-%m-%d') + ' (file date)'
-              except ValueError:
-                group_key = datetime.date(1970, 1, 1)
-                group_label = 'Unknown Date'
-            else:
-              group_key = import_meta.filedate.date()
-              group_label = import_meta.filedate.strftime('%Y-%m-%d') + ' (file date)'
-          else:
-            group_key = datetime.date(1970, 1, 1)
-            group_label = 'Unknown Date'
-      else:
-        group_key = photo.ts.date()
-        group_label = photo.ts.strftime('%Y-%m-%d')
-
-      grouped_photos_paginated[(group_key, group_label)].append(photo)
-
-    photo_groups_paginated = sorted(grouped_photos_paginated.items(), key=lambda x: x[0][0], reverse=True)
-
     # Pagination metadata
     total_pages = (total_photos + per_page - 1) // per_page
     # Build pagination URLs correctly (query params separate from path)
-    query_params = f'ids={ids}&group_by={group_by}'
+    query_params = f'sel={token}&group_by={group_by}'
 
     # Build URLs for all pages
     page_urls = {}
@@ -1050,15 +979,12 @@ def bulk_edit_photos(page):
     }
     baseurl = f'{get_base_url()}/photos/bulk-edit?{query_params}'
 
-    # Get all existing tags for autocomplete
-    all_tags = Tag.select().order_by(Tag.name)
-
     return render_template('bulk_edit.html',
                           photo_groups=photo_groups_paginated,
-                          photo_ids=','.join(str(id) for id in photo_ids),
+                          photo_ids=','.join(str(photo.id) for photo in paginated_photos),
+                          selection_token=token,
                           total_photos=total_photos,
                           photosets=photosets,
-                          all_tags=all_tags,
                           group_by=group_by,
                           pagination=pagination,
                           baseurl=baseurl)
@@ -1067,31 +993,85 @@ def bulk_edit_photos(page):
     flash(f'Error loading bulk edit page')
     return redirect(url_for('photostream'))
 
+@app.route('/photos/bulk-edit/select', methods=['GET', 'POST'])
+@login_required
+def select_photos_for_bulk_edit():
+  """Save a selection and open the bulk editor on it
+
+  GET takes a listing spec (tags, photoset, date, privacy) so list views can
+  link here without enumerating ids; POST takes an explicit ids list.
+  """
+  if request.method == 'POST':
+    ids = request.form.get('ids', '')
+    spec = {'ids': [int(id) for id in re.split(r'[,\s]+', ids) if id.isdigit()]}
+  else:
+    spec = selection.spec_from_args(request.args)
+
+  try:
+    token = selection.create_selection(spec, current_user.id)
+  except ValueError:
+    flash('No photos selected')
+    return redirect(url_for('photostream'))
+  return redirect(url_for('bulk_edit_photos', sel=token))
+
 @app.route('/tags')
 @require_access(pow=True)
+@cache.conditional_page
 def show_tags():
   # Filter tags to only show counts for photos user can see (treat NULL as public)
   visible_levels = get_visible_privacy_levels(current_user)
-  tags = (Tag
-         .select(Tag, fn.COUNT(fn.DISTINCT(Photo.id)).alias('count'))
-         .join(PhotoTag)
-         .join(Photo)
-         .where((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))
-         .group_by(Tag))
-
-  # Get total unique photo count (not sum of tag counts)
-  total_photos = (Photo
-                 .select()
-                 .join(PhotoTag)
-                 .where((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))
-                 .distinct()
-                 .count())
+  tags = stats.tag_counts(visible_levels)
+
+  # Total unique photo count (not sum of tag counts)
+  total_photos = stats.tagged_photo_count(visible_levels)
 
   return render_template('tag_cloud.html', tags=tags, total_photos=total_photos)
 
+@app.route('/api/tags/suggest')
+@login_required
+def suggest_tags():
+  """Tag names starting with ?q=, most used first, for tag input autocomplete"""
+  q = request.args.get('q', '').strip().lower()
+  limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+  suggestions = tagsuggest.suggest(q, limit)
+  response = jsonify({'query': q,
+                      'tags': [{'name': name, 'count': count} for name, count in suggestions]})
+  response.headers['Cache-Control'] = 'private, max-age=30'
+  return response
+
+@app.route('/search')
+@require_access(pow=True)
+def search_form():
+  """Redirect ?q= searches to the pageable /search/<q> URL"""
+  q = request.args.get('q', '').strip()
+  if not q:
+    return redirect(url_for('photostream'))
+  return redirect(url_for('search_photos', q=q))
+
+@app.route('/search/<path:q>', defaults={'page': 1})
+@app.route('/search/<path:q>/page/<int:page>')
+@require_access(pow=True)
+@cache.conditional_page
+def search_photos(q, page):
+  """Ranked full-text search over tags, photoset titles/descriptions and file names"""
+  baseurl = '%s/search/%s' % (get_base_url(), quote(q))
+  visible_levels = get_visible_privacy_levels(current_user)
+
+  total, photos = fulltext.search_photos(q, visible_levels, page, app.config['PER_PAGE'])
+  pagination = get_pagination_data(None, page, app.config['PER_PAGE'], total=total)
+  for photo in photos:
+    (sha1Path,filename) = getSha1Path(photo.sha1)
+    photo.uri = sha1Path + '/' + filename
+
+  return render_template('photostream.html', photos=photos, pagination=pagination,
+                        baseurl=baseurl, page_title=f'Search: {q}',
+                        search_query=q, in_context=f'search:{q}')
+
 @app.route('/tags/<string:tag>', defaults={'page': 1})
 @app.route('/tags/<string:tag>/page/<int:page>')
 @require_access(pow=True)
+@cache.conditional_page
+@cache.cached_page
 def show_taged_photos(tag,page):
   # Parse comma-separated tags for multi-tag filtering
   tags_list = [t.strip() for t in tag.split(',') if t.strip()]
@@ -1121,47 +1101,46 @@ def show_taged_photos(tag,page):
                     .having(fn.COUNT(fn.DISTINCT(Tag.id)) == len(tags_list))
                     .order_by(Photo.id.desc()))
 
-  # Get pagination metadata
-  pagination = get_pagination_data(photos_query, page, app.config['PER_PAGE'])
-
-  # Get paginated results
-  photos = photos_query.paginate(page, app.config['PER_PAGE'])
-  for photo in photos:
-    (sha1Path,filename) = getSha1Path(photo.sha1)
-    photo.uri = sha1Path + '/' + filename
+  # Answer from the bitmap index when it is warm, otherwise from SQL
+  index = tagindex.get_index()
+  if index:
+    matches = index.match(tags_list, visible_levels)
+    pagination = get_pagination_data(photos_query, page, app.config['PER_PAGE'], total=len(matches))
+    photos = photo_cards(Photo.select()
+                         .where(Photo.id.in_(matches.page(page, app.config['PER_PAGE'])))
+                         .order_by(Photo.id.desc()))
+  else:
+    pagination = get_pagination_data(photos_query, page, app.config['PER_PAGE'], visible_levels)
+    photos = photo_cards(photos_query.paginate(page, app.config['PER_PAGE']))
 
   # Verify all tags exist
   tag_objs = list(Tag.select().where(Tag.name.in_(tags_list)))
   if len(tag_objs) != len(tags_list):
     abort(404)
 
-  # Get total photo count
-  photo_count = photos_query.count()
   can_manage = can_manage_tags(current_user)
 
-  # Get all photo IDs for bulk edit link (not just current page)
-  all_photo_ids = [str(p.id) for p in photos_query]
-  photo_ids_str = ','.join(all_photo_ids)
-
-  # Get related tags (other tags on photos that have ALL current tags)
-  photo_ids_subquery = photos_query.select(Photo.id)
-
-  # Exclude current tags from related tags
+  # Get related tags (other tags on photos that have ALL current tags) from the
+  # co-occurrence table; several tags need the bitmap index for exact counts
   current_tag_ids = [t.id for t in tag_objs]
-  related_tags = (Tag
-    .select(Tag.name, fn.COUNT(PhotoTag.id).alias('co_occurrence'))
-    .join(PhotoTag)
-    .where((PhotoTag.photo.in_(photo_ids_subquery)) & (~Tag.id.in_(current_tag_ids)))
-    .group_by(Tag.id, Tag.name)
-    .order_by(fn.COUNT(PhotoTag.id).desc())
-    .limit(15))
+  count_with = (lambda tag_id: index.count_in(matches, tag_id)) if index else None
+  related_tags = stats.related_tags(current_tag_ids, visible_levels, count_with=count_with)
+  if related_tags is None:
+    photo_ids_subquery = photos_query.select(Photo.id)
+    related_tags = (Tag
+      .select(Tag.name, fn.COUNT(fn.DISTINCT(PhotoTag.photo)).alias('co_occurrence'))
+      .join(PhotoTag)
+      .where((PhotoTag.photo.in_(photo_ids_subquery)) & (~Tag.id.in_(current_tag_ids)))
+      .group_by(Tag.id, Tag.name)
+      .order_by(fn.COUNT(fn.DISTINCT(PhotoTag.photo)).desc())
+      .limit(15))
 
   # Include page number in context for breadcrumb navigation
   in_context = f'tags:{tag}:page:{page}' if page > 1 else f'tags:{tag}'
   return render_template('tag.html', photos=photos, tags=tag_objs,
-                        tags_str=tag, photo_count=photo_count,
-                        pagination=pagination, baseurl=baseurl,
-                        can_manage=can_manage, photo_ids=photo_ids_str,
+                        tags_str=tag, pagination=pagination, baseurl=baseurl,
+                        can_manage=can_manage,
+                        bulk_edit_url=url_for('select_photos_for_bulk_edit', tags=tag),
                         in_context=in_context, related_tags=related_tags)
 
 
@@ -1185,16 +1164,11 @@ def rename_tag_inline(tag):
     flash('Tag name unchanged')
     return redirect(url_for('show_taged_photos', tag=tag, page=1))
 
-  # Check if target tag already exists
-  existing = Tag.select().where(Tag.name == new_name).first()
-  if existing:
+  # Rename the tag unless the target name already exists
+  if not tagops.rename(tag_obj, new_name):
     flash(f'Tag "{new_name}" already exists. Use merge instead.')
     return redirect(url_for('show_taged_photos', tag=tag, page=1))
 
-  # Rename the tag
-  tag_obj.name = new_name
-  tag_obj.save()
-
   flash(f'Tag renamed to "{new_name}"')
   return redirect(url_for('show_taged_photos', tag=new_name, page=1))
 
@@ -1215,67 +1189,78 @@ def merge_tag_inline(tag):
     flash('Target tag name required')
     return redirect(url_for('show_taged_photos', tag=tag, page=1))
 
-  # Get or create target tag
-  target_tag, created = Tag.get_or_create(name=target_tag_name)
-
-  if target_tag.id == source_tag.id:
+  if target_tag_name == source_tag.name:
     flash('Cannot merge tag into itself')
     return redirect(url_for('show_taged_photos', tag=tag, page=1))
 
-  # Move all photos from source tag to target tag
-  photo_tags = PhotoTag.select().where(PhotoTag.tag == source_tag)
-  count = 0
-  for pt in photo_tags:
-    # Check if photo already has target tag
-    existing = PhotoTag.select().where(
-      (PhotoTag.photo == pt.photo) & (PhotoTag.tag == target_tag)
-    ).first()
-
-    if not existing:
-      # Create new relationship with target tag
-      PhotoTag.create(photo=pt.photo, tag=target_tag)
-
-    # Delete old relationship
-    pt.delete_instance()
-    count += 1
+  # Preview only: report what the merge would touch
+  if request.form.get('dry_run'):
+    flash(merge_preview_message(tag, target_tag_name, tagops.merge(source_tag, target_tag_name, dry_run=True)))
+    return redirect(url_for('show_taged_photos', tag=tag, page=1))
 
-  # Delete source tag
-  source_tag.delete_instance()
+  # Move all photos from source tag to target tag and delete source tag
+  counts = tagops.merge(source_tag, target_tag_name)
 
-  flash(f'Merged "{tag}" into "{target_tag_name}" ({count} photos moved)')
+  flash(f'Merged "{tag}" into "{target_tag_name}" ({counts.photos} photos moved)')
   return redirect(url_for('show_taged_photos', tag=target_tag_name, page=1))
 
 @app.route('/date/<string:date>', defaults={'page': 1})
 @app.route('/date/<string:date>/page/<int:page>')
 @require_access(pow=True)
+@cache.conditional_page
+@cache.cached_page
 def show_date_photos(date,page):
   baseurl = '%s/date/%s' % (get_base_url(),date)
   visible_levels = get_visible_privacy_levels(current_user)
   photos_query = (Photo.select()
-                  .where((Photo.datetaken.startswith(date)) & ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels))))
+                  .where((archive.datetaken_startswith(date)) & ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels))))
                   .order_by(Photo.datetaken.desc()))
 
-  # Get pagination metadata
-  pagination = get_pagination_data(photos_query, page, app.config['PER_PAGE'])
+  # Get pagination metadata (year/month/day totals come from the per-day counts)
+  pagination = get_pagination_data(photos_query, page, app.config['PER_PAGE'], visible_levels,
+                                   total=archive.count_for_prefix(date, visible_levels))
 
   # Get paginated results
-  photos = photos_query.paginate(page, app.config['PER_PAGE'])
-  for photo in photos:
-    (sha1Path,filename) = getSha1Path(photo.sha1)
-    photo.uri = sha1Path + '/' + filename
-
-  # Get photo count and IDs for bulk edit
-  photo_count = photos_query.count()
-  all_photo_ids = [str(p.id) for p in photos_query]
-  photo_ids_str = ','.join(all_photo_ids)
+  photos = photo_cards(photos_query.paginate(page, app.config['PER_PAGE']))
 
   # Include page number in context for breadcrumb navigation
   in_context = f'date:{date}:page:{page}' if page > 1 else f'date:{date}'
   return render_template('photostream.html', photos=photos, pagination=pagination,
                         baseurl=baseurl, page_title=f'Photos from {date}',
-                        photo_count=photo_count, photo_ids=photo_ids_str,
+                        bulk_edit_url=url_for('select_photos_for_bulk_edit', date=date),
                         in_context=in_context)
 
+@app.route('/archive')
+@require_access(pow=True)
+@cache.conditional_page
+def show_archive():
+  """Years with photo counts"""
+  visible_levels = get_visible_privacy_levels(current_user)
+  years = archive.year_counts(visible_levels)
+  return render_template('archive.html', years=years)
+
+@app.route('/archive/<int:year>')
+@app.route('/archive/<int:year>/<int:month>')
+@require_access(pow=True)
+@cache.conditional_page
+def show_archive_calendar(year, month=None):
+  """Calendar of photo counts per day for a year or a single month"""
+  if not 1 <= year <= 9999 or (month is not None and not 1 <= month <= 12):
+    abort(404)
+  visible_levels = get_visible_privacy_levels(current_user)
+  month_totals, day_totals = archive.month_counts(year, visible_levels)
+
+  cal = calendar.Calendar(firstweekday=6)
+  months = []
+  for m in ([month] if month else range(1, 13)):
+    weeks = [[(day, day_totals.get(year * 10000 + m * 100 + day, 0) if day else 0) for day in week]
+             for week in cal.monthdayscalendar(year, m)]
+    months.append({'month': m, 'name': calendar.month_name[m],
+                   'count': month_totals.get(m, 0), 'weeks': weeks})
+
+  return render_template('archive.html', year=year, month=month, months=months,
+                        year_count=sum(month_totals.values()))
+
 @app.route('/privacy/<int:level>', defaults={'page': 1})
 @app.route('/privacy/<int:level>/page/<int:page>')
 @roles_required('admin')
@@ -1303,21 +1288,13 @@ def show_privacy_photos(level, page):
   pagination = get_pagination_data(photos_query, page, app.config['PER_PAGE'])
 
   # Get paginated results
-  photos = photos_query.paginate(page, app.config['PER_PAGE'])
-  for photo in photos:
-    (sha1Path, filename) = getSha1Path(photo.sha1)
-    photo.uri = sha1Path + '/' + filename
-
-  # Get photo count and IDs for bulk edit
-  photo_count = photos_query.count()
-  all_photo_ids = [str(p.id) for p in photos_query]
-  photo_ids_str = ','.join(all_photo_ids)
+  photos = photo_cards(photos_query.paginate(page, app.config['PER_PAGE']))
 
   # Include page number in context for breadcrumb navigation
   in_context = f'privacy:{level}:page:{page}' if page > 1 else f'privacy:{level}'
   return render_template('photostream.html', photos=photos, pagination=pagination,
                         baseurl=baseurl, page_title=page_title,
-                        photo_count=photo_count, photo_ids=photo_ids_str,
+                        bulk_edit_url=url_for('select_photos_for_bulk_edit', privacy=level),
                         in_context=in_context)
 
 @app.route('/tags/<string:tag>/delete')
@@ -1326,15 +1303,14 @@ def delete_tag(tag):
   # Check permission
   if not can_manage_tags(current_user):
     abort(403)
-  # get tag id since delete() doesn't support joins
-  deleteTag = Tag.select().where(Tag.name == tag)
-  deleteTag = deleteTag.get()
-  # delete relationship to photos
-  deleteTags = PhotoTag.delete().where(PhotoTag.tag == deleteTag.id)
-  deleteTags.execute()
-  # delete tag from db
-  deletedTag = Tag.delete().where(Tag.name == tag)
-  deletedTag.execute()
+  deleteTag = Tag.select().where(Tag.name == tag).get()
+  # Preview only: report how many photos would lose the tag
+  if request.args.get('dry_run'):
+    counts = tagops.delete(deleteTag, dry_run=True)
+    flash(f'Deleting "{tag}" would remove it from {counts.photos} photo{"s" if counts.photos != 1 else ""}. Nothing was changed.')
+    return redirect(url_for('show_taged_photos', tag=tag, page=1))
+  # delete relationship to photos and the tag itself
+  tagops.delete(deleteTag)
   flash('Tag deleted')
   return redirect(url_for('show_tags'))
 
@@ -1392,92 +1368,47 @@ def delete_photo(photo_id):
 @app.route('/photosets', defaults={'page': 1})
 @app.route('/photosets/page/<int:page>')
 @require_access(pow=True)
+@cache.conditional_page
+@cache.cached_page
 def show_photosets(page):
   thumbCount = 2
   baseurl = '%s/photosets' % (get_base_url())
   visible_levels = get_visible_privacy_levels(current_user)
 
-  # Get photoset IDs that have at least one visible photo (single efficient query)
-  photosets_with_visible_photos = (
-    Photoset.select(Photoset.id)
-    .join(PhotoPhotoset)
-    .join(Photo)
-    .where((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))
-    .group_by(Photoset.id)
+  # Photosets with at least one visible photo, from photoset_stats
+  photosets_query = (
+    Photoset.select()
+    .where(Photoset.id.in_(stats.visible_photoset_ids(visible_levels)))
+    .order_by(Photoset.ts.desc())
   )
 
-  # Extract IDs into a list
-  visible_photoset_ids = [ps.id for ps in photosets_with_visible_photos]
-
-  # Filter photosets to only those with visible photos
-  if visible_photoset_ids:
-    photosets_query = (
-      Photoset.select()
-      .where(Photoset.id.in_(visible_photoset_ids))
-      .order_by(Photoset.ts.desc())
-    )
-  else:
-    # No visible photosets, return empty query
-    photosets_query = Photoset.select().where(Photoset.id == -1)
-
   # Get pagination metadata
-  pagination = get_pagination_data(photosets_query, page, app.config['PER_PAGE'])
+  pagination = get_pagination_data(photosets_query, page, app.config['PER_PAGE'], visible_levels)
 
   # Get paginated results
   photosets = list(photosets_query.paginate(page, app.config['PER_PAGE']))
 
+  privacy_counts = {}
   if photosets:
-    # Fetch all thumbnails for all photosets in a single query
+    # Fetch the first thumbCount visible photos of every photoset in a single query
     photoset_ids = [ps.id for ps in photosets]
-    all_thumbs = (
-      Photo.select(Photo, PhotoPhotoset.photoset)
-      .join(PhotoPhotoset)
-      .where(
-        (PhotoPhotoset.photoset.in_(photoset_ids)) &
-        ((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))
-      )
-      .order_by(Photo.datetaken.asc())
-    )
-
-    # Group thumbnails by photoset_id in Python
-    thumbs_by_photoset = {}
-    for thumb in all_thumbs:
-      photoset_id = thumb.photophotoset.photoset_id
-      if photoset_id not in thumbs_by_photoset:
-        thumbs_by_photoset[photoset_id] = []
-      if len(thumbs_by_photoset[photoset_id]) < thumbCount:
+    thumbs_by_photoset = stats.photoset_covers(photoset_ids, visible_levels, thumbCount)
+    gallery_size = app.config.get('GALLERY_THUMBNAIL_SIZE', 'n')
+    for thumbs in thumbs_by_photoset.values():
+      for thumb in thumbs:
         (sha1Path, filename) = getSha1Path(thumb.sha1)
-        gallery_size = app.config.get('GALLERY_THUMBNAIL_SIZE', 'n')
         thumb.uri = f'{sha1Path}/{filename}_{gallery_size}.jpg'
-        thumbs_by_photoset[photoset_id].append(thumb)
 
     # Attach thumbnails to photosets
     for photoset in photosets:
       photoset.thumbs = thumbs_by_photoset.get(photoset.id, [])
 
     # Get privacy counts for each photoset (admin only)
-    privacy_counts = {}
+    # Build dict: {photoset_id: {0: count, 1: count, ...}}
     if current_user.is_authenticated and can_manage_photosets(current_user):
-      # Query all photos in visible photosets with their privacy levels
-      privacy_query = (
-        Photo.select(
-          PhotoPhotoset.photoset,
-          fn.COALESCE(Photo.privacy, 0).alias('privacy_level'),
-          fn.COUNT(Photo.id).alias('count')
-        )
-        .join(PhotoPhotoset)
-        .where(PhotoPhotoset.photoset.in_(photoset_ids))
-        .group_by(PhotoPhotoset.photoset, fn.COALESCE(Photo.privacy, 0))
-      )
-
-      # Build dict: {photoset_id: {0: count, 1: count, ...}}
-      for row in privacy_query:
-        photoset_id = row.photophotoset.photoset_id
-        privacy_level = row.privacy_level
-        count = row.count
-        if photoset_id not in privacy_counts:
-          privacy_counts[photoset_id] = {}
-        privacy_counts[photoset_id][privacy_level] = count
+      summaries = stats.photoset_summaries(photoset_ids)
+      privacy_counts = dict((photoset_id, summary['privacy_counts'])
+                            for photoset_id, summary in summaries.items())
 
   return render_template('photosets.html', photosets=photosets, pagination=pagination,
                          baseurl=baseurl, privacy_counts=privacy_counts)
@@ -1485,6 +1416,8 @@ def show_photosets(page):
 @app.route('/photosets/<int:photoset_id>', defaults={'page': 1})
 @app.route('/photosets/<int:photoset_id>/page/<int:page>')
 @require_access(pow=True)
+@cache.conditional_page
+@cache.cached_page
 def show_photoset(photoset_id,page):
   baseurl = '%s/photosets/%s' % (get_base_url(), photoset_id)
   visible_levels = get_visible_privacy_levels(current_user)
@@ -1501,7 +1434,7 @@ def show_photoset(photoset_id,page):
                   .join(PhotoPhotoset)
                   .join(Photoset)
                   .where(Photoset.id == photoset_id)
-                  .order_by(Photo.datetaken.asc()))
+                  .order_by(Photo.datetaken.asc(), Photo.id.asc()))
 
   # Apply privacy filtering
   if privacy_filter is not None and current_user.is_authenticated and can_manage_photosets(current_user):
@@ -1514,35 +1447,32 @@ def show_photoset(photoset_id,page):
     # Normal visibility filtering
     photos_query = photos_query.where((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))
 
+  # Count and date range of the visible photos, from photoset_stats
+  summary = stats.photoset_summaries([photoset_id], visible_levels).get(photoset_id)
+  if summary is None:
+    total = 0
+  elif privacy_label:
+    total = summary['privacy_counts'].get(privacy_filter, 0)
+  else:
+    total = summary['count']
+
   # Get pagination metadata
-  pagination = get_pagination_data(photos_query, page, app.config['PER_PAGE'])
+  pagination = get_pagination_data(photos_query, page, app.config['PER_PAGE'], visible_levels, total=total)
 
   # Get paginated results
-  photos = photos_query.paginate(page, app.config['PER_PAGE'])
-  for photo in photos:
-    (sha1Path,filename) = getSha1Path(photo.sha1)
-    photo.uri = sha1Path + '/' + filename
+  photos = photo_cards(photos_query.paginate(page, app.config['PER_PAGE']))
 
   photoset = Photoset.select().where(Photoset.id == photoset_id).get()
   can_manage = can_manage_photosets(current_user)
-
-  # Get all photo IDs for bulk edit link (not just current page)
-  all_photo_ids = [str(p.id) for p in photos_query]
-  photo_ids_str = ','.join(all_photo_ids)
+  bulk_edit_url = url_for('select_photos_for_bulk_edit', photoset=photoset_id,
+                          privacy=privacy_filter if privacy_label else None)
 
   # Get date range for photos in this photoset
-  date_range_query = (Photo.select(fn.MIN(Photo.datetaken).alias('min_date'),
-                                    fn.MAX(Photo.datetaken).alias('max_date'))
-                      .join(PhotoPhotoset)
-                      .where(PhotoPhotoset.photoset == photoset_id))
-  date_range_result = date_range_query.first()
   date_range = None
-  if date_range_result and date_range_result.min_date:
-    min_date = date_range_result.min_date
-    max_date = date_range_result.max_date
+  if summary and summary['min_datetaken']:
     # Compare only date parts, not time
-    min_date_str = min_date.strftime('%Y-%m-%d')
-    max_date_str = max_date.strftime('%Y-%m-%d')
+    min_date_str = summary['min_datetaken'].strftime('%Y-%m-%d')
+    max_date_str = summary['max_datetaken'].strftime('%Y-%m-%d')
     if min_date_str == max_date_str:
       date_range = min_date_str
     else:
@@ -1560,7 +1490,7 @@ def show_photoset(photoset_id,page):
   in_context = f'photoset:{photoset_id}:page:{page}' if page > 1 else f'photoset:{photoset_id}'
   return render_template('photoset.html', photos=photos, photoset=photoset,
                         pagination=pagination, baseurl=baseurl, can_manage=can_manage,
-                        photo_ids=photo_ids_str, date_range=date_range,
+                        bulk_edit_url=bulk_edit_url, date_range=date_range,
                         unique_tags=unique_tags, in_context=in_context,
                         privacy_label=privacy_label)
 
@@ -1639,6 +1569,9 @@ def list_photoset_shares(photoset_id):
   if not can_manage_photosets(current_user):
     abort(403)
 
+  # Write pending views so the counts below are current
+  shareviews.flush()
+
   shares = ShareToken.select().where(
     (ShareToken.photoset == photoset_id) &
     (ShareToken.share_type == 'photoset')
@@ -1874,20 +1807,16 @@ def admin_dashboard():
     'total_tags': Tag.select().count(),
     'total_photosets': Photoset.select().count(),
     'total_users': User.select().count(),
-    'recent_photos': Photo.select().order_by(Photo.ts.desc()).limit(10),
+    'recent_photos': photo_cards(Photo.select().order_by(Photo.ts.desc()).limit(10)),
     'privacy_breakdown': {
       'public': Photo.select().where((Photo.privacy == 0) | (Photo.privacy.is_null())).count(),
       'friends': Photo.select().where(Photo.privacy == 1).count(),
       'family': Photo.select().where(Photo.privacy == 2).count(),
       'private': Photo.select().where(Photo.privacy == 3).count(),
-    }
+    },
+    'page_cache': cache.page_cache_stats(),
   }
 
-  # Add URI to recent photos
-  for photo in stats['recent_photos']:
-    (sha1Path, filename) = getSha1Path(photo.sha1)
-    photo.uri = sha1Path + '/' + filename
-
   return render_template('admin/dashboard.html', stats=stats)
 
 
@@ -1899,13 +1828,11 @@ def admin_photos(page):
   baseurl = '%s/admin/photos' % (get_base_url())
 
   # Optional search filter
-  search = request.args.get('search', '')
+  search = request.args.get('search', '').strip()
 
   if search:
-    # Search by ID or SHA1
-    photos_query = Photo.select().where(
-      (Photo.id == search) | (Photo.sha1.contains(search))
-    ).order_by(Photo.id.desc())
+    # Search by ID, SHA1 prefix (range scan on the sha1 index) or full-text
+    photos_query = Photo.select().where(fulltext.admin_photo_filter(search)).order_by(Photo.id.desc())
   else:
     photos_query = Photo.select().order_by(Photo.id.desc())
 
@@ -1913,12 +1840,7 @@ def admin_photos(page):
   pagination = get_pagination_data(photos_query, page, app.config['PER_PAGE'])
 
   # Get paginated results
-  photos = photos_query.paginate(page, app.config['PER_PAGE'])
-  for photo in photos:
-    (sha1Path, filename) = getSha1Path(photo.sha1)
-    photo.uri = sha1Path + '/' + filename
-    # Get tags for each photo
-    photo.tag_list = list(Tag.select().join(PhotoTag).where(PhotoTag.photo == photo.id))
+  photos = attach_tag_lists(photo_cards(photos_query.paginate(page, app.config['PER_PAGE'])))
 
   return render_template('admin/photos.html', photos=photos, pagination=pagination,
                         baseurl=baseurl, search=search)
@@ -1931,29 +1853,28 @@ def admin_edit_photo(photo_id):
   photo = Photo.select().where(Photo.id == photo_id).get()
 
   if request.method == 'POST':
+    # Validate before changing anything, so a bad date doesn't half-apply the form
+    datetaken = request.form.get('datetaken', '').strip()
+    if datetaken:
+      parsed = archive.parse_datetaken(datetaken)
+      if parsed is None:
+        flash(f'Invalid date taken "{datetaken}": use YYYY-MM-DD HH:MM:SS', 'error')
+        return redirect(url_for('admin_edit_photo', photo_id=photo_id))
+      photo.datetaken = parsed
+
     # Update photo metadata
     privacy = request.form.get('privacy')
     if privacy:
       photo.privacy = int(privacy) if privacy != 'null' else None
 
-    datetaken = request.form.get('datetaken')
-    if datetaken:
-      photo.datetaken = datetaken
-
     photo.save()
 
     # Handle tags
     tags_input = request.form.get('tags', '')
     if tags_input:
-      # Remove existing tags
-      PhotoTag.delete().where(PhotoTag.photo == photo_id).execute()
-
-      # Add new tags
-      # Split on both comma and space to support CLI and web UI
-      tag_names = [t.strip().lower() for t in re.split(r'[,\s]+', tags_input) if t.strip()]
-      for tag_name in tag_names:
-        tag, created = Tag.get_or_create(name=tag_name)
-        PhotoTag.create(photo=photo, tag=tag)
+      # Replace existing tags
+      with bulk.transaction():
+        bulk.replace_tags({photo.id: bulk.parse_tags(tags_input)})
 
     flash('Photo updated successfully')
     return redirect(url_for('admin_photos'))
@@ -1964,10 +1885,7 @@ def admin_edit_photo(photo_id):
   tags = Tag.select().join(PhotoTag).where(PhotoTag.photo == photo_id)
   tag_names = ' '.join([tag.name for tag in tags])
 
-  # Get all tags for autocomplete
-  all_tags = Tag.select().order_by(Tag.name)
-
-  return render_template('admin/edit_photo.html', photo=photo, tag_names=tag_names, all_tags=all_tags)
+  return render_template('admin/edit_photo.html', photo=photo, tag_names=tag_names)
 
 
 @app.route('/admin/tags')
@@ -1980,22 +1898,10 @@ def admin_tags(page=1):
   # Optional search filter
   search = request.args.get('search', '')
 
+  tags_query = stats.all_tag_counts()
   if search:
     # Search by tag name
-    tags_query = (Tag
-           .select(Tag, fn.COUNT(fn.DISTINCT(Photo.id)).alias('count'))
-           .join(PhotoTag, JOIN.LEFT_OUTER)
-           .join(Photo, JOIN.LEFT_OUTER)
-           .where(Tag.name.contains(search))
-           .group_by(Tag)
-           .order_by(fn.COUNT(fn.DISTINCT(Photo.id)).desc()))
-  else:
-    tags_query = (Tag
-           .select(Tag, fn.COUNT(fn.DISTINCT(Photo.id)).alias('count'))
-           .join(PhotoTag, JOIN.LEFT_OUTER)
-           .join(Photo, JOIN.LEFT_OUTER)
-           .group_by(Tag)
-           .order_by(fn.COUNT(fn.DISTINCT(Photo.id)).desc()))
+    tags_query = tags_query.where(Tag.id.in_(fulltext.matching_ids('tag', search)))
 
   # Calculate pagination
   pagination = get_pagination_data(tags_query, page, per_page)
@@ -2019,13 +1925,10 @@ def admin_edit_tag(tag_id):
   if request.method == 'POST':
     new_name = request.form.get('name')
     if new_name and new_name != tag.name:
-      # Check if tag with new name already exists
-      existing = Tag.select().where(Tag.name == new_name).first()
-      if existing:
+      # Rename unless a tag with the new name already exists
+      if not tagops.rename(tag, new_name):
         flash('Tag with that name already exists')
       else:
-        tag.name = new_name
-        tag.save()
         flash('Tag renamed successfully')
         return redirect(url_for('admin_tags'))
 
@@ -2043,32 +1946,19 @@ def admin_merge_tag(tag_id):
     flash('Target tag name required')
     return redirect(url_for('admin_tags'))
 
-  # Get or create target tag
-  target_tag, created = Tag.get_or_create(name=target_tag_name)
-
-  if target_tag.id == source_tag.id:
+  if target_tag_name == source_tag.name:
     flash('Cannot merge tag into itself')
     return redirect(url_for('admin_tags'))
 
-  # Move all photos from source tag to target tag
-  photo_tags = PhotoTag.select().where(PhotoTag.tag == source_tag)
-  for pt in photo_tags:
-    # Check if photo already has target tag
-    existing = PhotoTag.select().where(
-      (PhotoTag.photo == pt.photo) & (PhotoTag.tag == target_tag)
-    ).first()
-
-    if not existing:
-      # Create new relationship with target tag
-      PhotoTag.create(photo=pt.photo, tag=target_tag)
-
-    # Delete old relationship
-    pt.delete_instance()
+  # Preview only: report what the merge would touch
+  if request.form.get('dry_run'):
+    flash(merge_preview_message(source_tag.name, target_tag_name, tagops.merge(source_tag, target_tag_name, dry_run=True)))
+    return redirect(url_for('admin_tags'))
 
-  # Delete source tag
-  source_tag.delete_instance()
+  # Move all photos from source tag to target tag and delete source tag
+  tagops.merge(source_tag, target_tag_name)
 
-  flash(f'Tag "{source_tag.name}" merged into "{target_tag.name}"')
+  flash(f'Tag "{source_tag.name}" merged into "{target_tag_name}"')
   return redirect(url_for('admin_tags'))
 
 
@@ -2085,8 +1975,7 @@ def admin_photosets(page=1):
   if search:
     # Search by photoset title or description
     photosets_query = (Photoset.select()
-                      .where((Photoset.title.contains(search)) |
-                            (Photoset.description.contains(search)))
+                      .where(Photoset.id.in_(fulltext.matching_ids('photoset', search)))
                       .order_by(Photoset.ts.desc()))
   else:
     photosets_query = Photoset.select().order_by(Photoset.ts.desc())
@@ -2095,21 +1984,20 @@ def admin_photosets(page=1):
   pagination = get_pagination_data(photosets_query, page, per_page)
 
   # Get photosets for current page
-  photosets = photosets_query.paginate(page, per_page)
+  photosets = list(photosets_query.paginate(page, per_page))
 
   # Add photo count and thumbnail for each photoset
+  summaries = stats.photoset_summaries([photoset.id for photoset in photosets])
+  covers = dict((photo.id, photo) for photo in Photo.select(Photo.id, Photo.sha1).where(
+    Photo.id.in_([summary['cover_id'] for summary in summaries.values()])))
   for photoset in photosets:
-    photoset.photo_count = Photo.select().join(PhotoPhotoset).where(
-      PhotoPhotoset.photoset == photoset
-    ).count()
+    summary = summaries.get(photoset.id)
+    photoset.photo_count = summary['count'] if summary else 0
 
-    # Get first photo as thumbnail
-    first_photo = Photo.select().join(PhotoPhotoset).where(
-      PhotoPhotoset.photoset == photoset
-    ).order_by(Photo.datetaken.asc()).first()
-
-    if first_photo:
-      (sha1Path, filename) = getSha1Path(first_photo.sha1)
+    # First photo as thumbnail
+    cover = covers.get(summary['cover_id']) if summary else None
+    if cover:
+      (sha1Path, filename) = getSha1Path(cover.sha1)
       photoset.thumb_uri = f'{sha1Path}/{filename}'
     else:
       photoset.thumb_uri = None
@@ -2178,21 +2066,15 @@ def admin_users(page=1):
 
   if search:
     # Search by email
-    users_query = User.select().where(User.email.contains(search)).order_by(User.ts.desc())
+    users_query = User.select().where(User.id.in_(fulltext.matching_ids('user', search))).order_by(User.ts.desc())
   else:
     users_query = User.select().order_by(User.ts.desc())
 
   # Calculate pagination
   pagination = get_pagination_data(users_query, page, per_page)
 
-  # Get paginated results
-  users = users_query.paginate(page, per_page)
-
-  # Add role information to each user
-  for user in users:
-    user.role_list = []
-    for role in user.roles:
-      user.role_list.append(role.name)
+  # Get paginated results with their role names
+  users = attach_role_lists(users_query.paginate(page, per_page))
 
   return render_template('admin/users.html',
                         users=users,
@@ -2301,6 +2183,9 @@ def list_photo_shares(photo_id):
   if not can_view_photo(current_user, photo):
     abort(403)
 
+  # Write pending views so the counts below are current
+  shareviews.flush()
+
   shares = ShareToken.select().where(
     (ShareToken.photo == photo_id) &
     (ShareToken.share_type == 'photo')
@@ -2367,14 +2252,10 @@ def view_shared_photo(token):
   if share_token.expires_at and share_token.expires_at < datetime.datetime.now():
     return render_template('shared/expired.html'), 410
 
-  # Check if max views reached
-  if share_token.max_views and share_token.views >= share_token.max_views:
+  # Count the view (write-behind, shared by all workers); refused once max views are used up
+  if not shareviews.record_view(share_token):
     return render_template('shared/limit_reached.html', share_token=share_token), 410
 
-  # Increment view count
-  share_token.views += 1
-  share_token.save()
-
   logger.info('SHARE_VIEW share_id=%d photo_id=%d views=%d/%s ip=%s',
               share_token.id, share_token.photo.id, share_token.views,
               share_token.max_views or 'unlimited', request.remote_addr)
@@ -2410,7 +2291,7 @@ def download_shared_photo(token):
   # Check expiration and view limits
   if share_token.expires_at and share_token.expires_at < datetime.datetime.now():
     abort(410)
-  if share_token.max_views and share_token.views >= share_token.max_views:
+  if shareviews.limit_reached(share_token):
     abort(410)
 
   # Log download (not tracked in DB, only in logs)
@@ -2446,29 +2327,28 @@ def view_shared_photoset(token):
   if share_token.expires_at and share_token.expires_at < datetime.datetime.now():
     return render_template('shared/expired.html'), 410
 
-  # Check if max views reached
-  if share_token.max_views and share_token.views >= share_token.max_views:
-    return render_template('shared/limit_reached.html', share_token=share_token), 410
+  # Count the view (write-behind, shared by all workers); refused once max views are used up.
+  # Further pages (?after=) belong to the same view: they carry the view ticket the first
+  # page issued, and only check the limit without one
+  if request.args.get('after'):
+    ticket = request.args.get('ticket')
+    if not sharedsets.ticket_valid(ticket, share_token.id):
+      ticket = None
+      if shareviews.limit_reached(share_token):
+        return render_template('shared/limit_reached.html', share_token=share_token), 410
+  else:
+    if not shareviews.record_view(share_token):
+      return render_template('shared/limit_reached.html', share_token=share_token), 410
+    ticket = sharedsets.issue_ticket(share_token.id)
 
-  # Increment view count
-  share_token.views += 1
-  share_token.save()
+    logger.info('SHARE_VIEW share_id=%d photoset_id=%d views=%d/%s ip=%s',
+                share_token.id, share_token.photoset.id, share_token.views,
+                share_token.max_views or 'unlimited', request.remote_addr)
 
-  logger.info('SHARE_VIEW share_id=%d photoset_id=%d views=%d/%s ip=%s',
-              share_token.id, share_token.photoset.id, share_token.views,
-              share_token.max_views or 'unlimited', request.remote_addr)
-
-  # Get photoset and all photos (bypass privacy - share grants access)
+  # One cursor page of the set (bypass privacy - share grants access); the grid's
+  # signed URLs are fetched in batches from shared_photoset_urls
   photoset = share_token.photoset
-  photos = (Photo.select()
-            .join(PhotoPhotoset)
-            .where(PhotoPhotoset.photoset == photoset)
-            .order_by(Photo.datetaken.asc()))
-
-  # Add URIs for thumbnails
-  for photo in photos:
-    (sha1Path, filename) = getSha1Path(photo.sha1)
-    photo.uri = f"{sha1Path}/{filename}"
+  photos_page = sharedsets.page(photoset.id, request.args.get('after', type=int))
 
   # Get date range for photos in this photoset
   date_range_query = (Photo.select(fn.MIN(Photo.datetaken).alias('min_date'),
@@ -2487,8 +2367,44 @@ def view_shared_photoset(token):
     else:
       date_range = f"{min_date_str} to {max_date_str}"
 
-  return render_template('shared/photoset.html', photoset=photoset, photos=photos,
-                        share_token=share_token, date_range=date_range)
+  return render_template('shared/photoset.html', photoset=photoset, photos_page=photos_page,
+                        share_token=share_token, date_range=date_range,
+                        url_batch=sharedsets.batch_limit(), ticket=ticket)
+
+
+@app.route('/shared/photoset/<string:token>/urls')
+def shared_photoset_urls(token):
+  """Signed grid thumbnail URLs for ?ids=1,2,3 of a shared photoset (lazy-loading.js batches)"""
+  try:
+    share_token = ShareToken.select().where(ShareToken.token == token).get()
+  except ShareToken.DoesNotExist:
+    abort(404)
+
+  # Check if share type is correct
+  if share_token.share_type != 'photoset':
+    abort(404)
+
+  # Check expiration and view limits: fetching URLs is part of a view already counted,
+  # so a valid view ticket from its page is enough even if that view was the last one
+  if share_token.expires_at and share_token.expires_at < datetime.datetime.now():
+    return jsonify({'error': 'Share link expired'}), 410
+  if not sharedsets.ticket_valid(request.args.get('ticket'), share_token.id) and \
+      shareviews.limit_reached(share_token):
+    return jsonify({'error': 'View limit reached'}), 410
+
+  try:
+    photo_ids = [int(photo_id) for photo_id in request.args.get('ids', '').split(',') if photo_id]
+  except ValueError:
+    return jsonify({'error': 'ids must be comma-separated photo ids'}), 400
+  if len(photo_ids) > sharedsets.batch_limit():
+    return jsonify({'error': f'At most {sharedsets.batch_limit()} ids per request'}), 400
+
+  # Ids outside the shared set are left out
+  urls = sharedsets.signed_urls(share_token.photoset_id, photo_ids)
+  response = jsonify({'urls': {str(photo_id): url for photo_id, url in urls.items()},
+                      'expires_in': app.config.get('S3_SIGNED_URL_EXPIRY', 3600)})
+  response.headers['Cache-Control'] = 'private, no-store'
+  return response
 
 
 @app.route('/shared/photoset/<string:token>/photo/<int:photo_id>')
@@ -2507,8 +2423,8 @@ def view_shared_photoset_photo(token, photo_id):
   if share_token.expires_at and share_token.expires_at < datetime.datetime.now():
     return render_template('shared/expired.html'), 410
 
-  # Check if max views reached
-  if share_token.max_views and share_token.views >= share_token.max_views:
+  # Check if max views reached (including views not flushed yet)
+  if shareviews.limit_reached(share_token):
     return render_template('shared/limit_reached.html', share_token=share_token), 410
 
   # Verify photo is in photoset
@@ -2525,36 +2441,42 @@ def view_shared_photoset_photo(token, photo_id):
   (sha1Path, filename) = getSha1Path(photo.sha1)
   photo.uri = f"{sha1Path}/{filename}"
 
-  # Base query for photos in this photoset (ordered by datetaken)
-  base_query = (Photo.select()
-                .join(PhotoPhotoset)
-                .where(PhotoPhotoset.photoset == share_token.photoset))
-
-  # Get current photo's datetaken for comparison
-  current_datetaken = photo.datetaken
-
-  # Next photo: later date, or same date but higher ID
-  next_photo = (base_query
-                .where((Photo.datetaken > current_datetaken) |
-                       ((Photo.datetaken == current_datetaken) & (Photo.id > photo_id)))
-                .order_by(Photo.datetaken.asc(), Photo.id.asc())
-                .limit(1)
-                .first())
-
-  # Previous photo: earlier date, or same date but lower ID
-  prev_photo = (base_query
-                .where((Photo.datetaken < current_datetaken) |
-                       ((Photo.datetaken == current_datetaken) & (Photo.id < photo_id)))
-                .order_by(Photo.datetaken.desc(), Photo.id.desc())
-                .limit(1)
-                .first())
-
-  # Get total photos count and current position for display
-  total_photos = base_query.count()
-  current_pos = (base_query
-                 .where((Photo.datetaken < current_datetaken) |
-                        ((Photo.datetaken == current_datetaken) & (Photo.id <= photo_id)))
-                 .count())
+  # Neighbours, position and total from the photoset's ordered id array
+  found = neighbors.find(neighbors.photoset(share_token.photoset_id), photo.id)
+  if found:
+    prev_photo, next_photo = found.prev, found.next
+    current_pos, total_photos = found.position, found.total
+  else:
+    # Base query for photos in this photoset (ordered by datetaken)
+    base_query = (Photo.select()
+                  .join(PhotoPhotoset)
+                  .where(PhotoPhotoset.photoset == share_token.photoset))
+
+    # Get current photo's datetaken for comparison
+    current_datetaken = photo.datetaken
+
+    # Next photo: later date, or same date but higher ID
+    next_photo = (base_query
+                  .where((Photo.datetaken > current_datetaken) |
+                         ((Photo.datetaken == current_datetaken) & (Photo.id > photo_id)))
+                  .order_by(Photo.datetaken.asc(), Photo.id.asc())
+                  .limit(1)
+                  .first())
+
+    # Previous photo: earlier date, or same date but lower ID
+    prev_photo = (base_query
+                  .where((Photo.datetaken < current_datetaken) |
+                         ((Photo.datetaken == current_datetaken) & (Photo.id < photo_id)))
+                  .order_by(Photo.datetaken.desc(), Photo.id.desc())
+                  .limit(1)
+                  .first())
+
+    # Get total photos count and current position for display
+    total_photos = base_query.count()
+    current_pos = (base_query
+                   .where((Photo.datetaken < current_datetaken) |
+                          ((Photo.datetaken == current_datetaken) & (Photo.id <= photo_id)))
+                   .count())
 
   # Get tags for this photo
   tags = Tag.select().join(PhotoTag).where(PhotoTag.photo == photo.id)
@@ -2588,7 +2510,7 @@ def download_shared_photoset_photo(token, photo_id):
   # Check expiration and view limits
   if share_token.expires_at and share_token.expires_at < datetime.datetime.now():
     abort(410)
-  if share_token.max_views and share_token.views >= share_token.max_views:
+  if shareviews.limit_reached(share_token):
     abort(410)
 
   # Verify photo is in photoset
@@ -2617,6 +2539,95 @@ def download_shared_photoset_photo(token, photo_id):
     abort(404)
 
 
+def zip_response(stream, filename):
+  """Send a ZipStream as an attachment; single Range requests resume it when its size is known"""
+  headers = {'Content-Disposition': f'attachment; filename="{filename}"',
+             'Cache-Control': 'private',
+             'X-Accel-Buffering': 'no'}
+  total = stream.size()
+  if total is None:
+    # Some originals are only on S3: sizes are learned while streaming
+    headers['Accept-Ranges'] = 'none'
+    return Response(stream.chunks(), mimetype='application/zip', headers=headers, direct_passthrough=True)
+
+  etag = stream.etag()
+  headers['Accept-Ranges'] = 'bytes'
+  headers['ETag'] = f'"{etag}"'
+  # A Range is only honoured for the same archive (If-Range with our ETag, or none at all)
+  if request.range and request.if_range.date is None and request.if_range.etag in (None, etag):
+    byte_range = request.range.range_for_length(total)
+    if byte_range is None:
+      headers['Content-Range'] = f'bytes */{total}'
+      return Response(status=416, headers=headers)
+    start, stop = byte_range
+    headers['Content-Range'] = f'bytes {start}-{stop - 1}/{total}'
+    headers['Content-Length'] = str(stop - start)
+    return Response(stream.chunks(start, stop), status=206, mimetype='application/zip', headers=headers,
+                    direct_passthrough=True)
+
+  headers['Content-Length'] = str(total)
+  return Response(stream.chunks(), mimetype='application/zip', headers=headers, direct_passthrough=True)
+
+
+@app.route('/shared/photoset/<string:token>/download.zip')
+def download_shared_photoset_zip(token):
+  """Download every original of a shared photoset as one streamed ZIP"""
+  try:
+    share_token = ShareToken.select().where(ShareToken.token == token).get()
+  except ShareToken.DoesNotExist:
+    abort(404)
+
+  # Check if share type is correct
+  if share_token.share_type != 'photoset':
+    abort(404)
+
+  # Check if downloads are allowed
+  if not share_token.allow_download:
+    abort(403)
+
+  # Check expiration and view limits
+  if share_token.expires_at and share_token.expires_at < datetime.datetime.now():
+    abort(410)
+  if shareviews.limit_reached(share_token):
+    abort(410)
+
+  photoset = share_token.photoset
+  rows = (Photo.select(Photo.id, Photo.sha1, Photo.filetype, Photo.datetaken)
+          .join(PhotoPhotoset)
+          .where(PhotoPhotoset.photoset == photoset)
+          .order_by(Photo.datetaken.asc(), Photo.id.asc())
+          .tuples())
+  folder = secure_filename(photoset.title) or f'photoset-{photoset.id}'
+  stream = zipstream.ZipStream(zipstream.photo_entries(rows, folder))
+
+  logger.info('SHARE_DOWNLOAD_ZIP share_id=%d photoset_id=%d photos=%d range=%s comment=%s ip=%s user_agent=%s',
+              share_token.id, photoset.id, len(stream.entries), request.headers.get('Range', 'none'),
+              share_token.comment or 'none', request.remote_addr, request.user_agent.string)
+  return zip_response(stream, f'{folder}.zip')
+
+
+@app.route('/photos/selection/<string:token>/download.zip')
+@login_required
+def download_selection_zip(token):
+  """Download the originals of a saved selection (see selection.py) that the user can see"""
+  spec = selection.get_selection_spec(token, current_user.id)
+  if spec is None:
+    abort(404)
+
+  visible_levels = get_visible_privacy_levels(current_user)
+  rows = (selection.selection_query(spec)
+          .select(Photo.id, Photo.sha1, Photo.filetype, Photo.datetaken)
+          .where((Photo.privacy.is_null()) | (Photo.privacy.in_(visible_levels)))
+          .order_by(Photo.ts.desc())
+          .tuples())
+  folder = f'selection-{token}'
+  stream = zipstream.ZipStream(zipstream.photo_entries(rows, folder))
+
+  logger.info('SELECTION_DOWNLOAD_ZIP user=%s selection=%s photos=%d range=%s',
+              current_user.email, token, len(stream.entries), request.headers.get('Range', 'none'))
+  return zip_response(stream, f'{folder}.zip')
+
+
 @app.route('/admin/shares')
 @app.route('/admin/shares/page/<int:page>')
 @roles_required('admin')
@@ -2624,6 +2635,9 @@ def admin_shares(page=1):
   """Manage share links (photos and photosets)"""
   per_page = app.config['PER_PAGE']
 
+  # Write pending views so the counts listed are current
+  shareviews.flush()
+
   # Optional search filter
   search = request.args.get('search', '')
 
@@ -3068,28 +3082,11 @@ def pow_challenge():
   if not app.config.get('POW_ENABLED', False):
     return jsonify({'error': 'PoW not enabled'}), 503
 
-  # Generate random challenge
-  challenge = secrets.token_hex(16)  # 32-char hex string
-  difficulty = app.config.get('POW_DIFFICULTY', 4)
+  # Signed challenge at the current (load-adaptive) difficulty; nothing is stored until it is solved
+  difficulty = powauth.challenge_difficulty()
   expiry_seconds = app.config.get('POW_CHALLENGE_EXPIRY', 300)
-
-  # Store challenge in database with expiry
-  expires_at = datetime.datetime.now() + datetime.timedelta(seconds=expiry_seconds)
-  try:
-    PowChallenge.create(
-      challenge=challenge,
-      expires_at=expires_at
-    )
-  except IntegrityError:
-    # Challenge collision (extremely rare), try once more
-    challenge = secrets.token_hex(16)
-    PowChallenge.create(
-      challenge=challenge,
-      expires_at=expires_at
-    )
-  except Exception as e:
-    logger.error(f'PoW challenge creation failed: {e}')
-    return jsonify({'error': 'Database error - run migration script'}), 500
+  challenge = powauth.issue_challenge(difficulty)
+  powauth.record_load('issued')
 
   logger.info(f'PoW challenge generated: {challenge[:8]}... (difficulty={difficulty})')
 
@@ -3110,51 +3107,28 @@ def pow_verify():
   if not data or 'challenge' not in data or 'nonce' not in data:
     return jsonify({'error': 'Missing challenge or nonce'}), 400
 
-  challenge = data['challenge']
+  challenge = str(data['challenge'])
   nonce = data['nonce']
-  difficulty = app.config.get('POW_DIFFICULTY', 4)
 
-  # Check if challenge exists and is not expired
-  try:
-    pow_challenge = PowChallenge.get(PowChallenge.challenge == challenge)
-  except PowChallenge.DoesNotExist:
-    logger.warning(f'PoW verification failed: challenge {challenge[:8]}... not found')
+  # Check signature, age and solution, then record it in the replay filter (single-use)
+  _, reason = powauth.verify_solution(challenge, nonce)
+  if reason == 'invalid':
+    logger.warning(f'PoW verification failed: challenge {challenge[:8]}... not issued by us')
     return jsonify({'error': 'Invalid or expired challenge'}), 400
-  except Exception as e:
-    logger.error(f'PoW verification database error: {e}')
-    return jsonify({'error': 'Database error - tables may not exist'}), 500
-
-  # Check expiry
-  if pow_challenge.expires_at < datetime.datetime.now():
-    PowChallenge.delete().where(PowChallenge.challenge == challenge).execute()
+  if reason == 'expired':
     logger.warning(f'PoW verification failed: challenge expired')
     return jsonify({'error': 'Challenge expired'}), 400
-
-  # Verify the solution
-  hash_input = (challenge + str(nonce)).encode('utf-8')
-  result_hash = hashlib.sha256(hash_input).hexdigest()
-  target = '0' * difficulty
-
-  if not result_hash.startswith(target):
-    logger.warning(f'PoW verification failed: invalid solution (hash={result_hash[:12]}...)')
+  if reason == 'wrong':
+    logger.warning(f'PoW verification failed: invalid solution for {challenge[:8]}...')
     return jsonify({'error': 'Invalid solution'}), 400
+  if reason == 'replayed':
+    logger.warning(f'PoW verification failed: challenge {challenge[:8]}... already used')
+    return jsonify({'error': 'Challenge already used'}), 400
 
-  # Solution is valid! Delete challenge (single-use)
-  PowChallenge.delete().where(PowChallenge.challenge == challenge).execute()
-
-  # Generate token with request tracking
-  token = secrets.token_urlsafe(32)
+  # Issue a signed token; its request budget lives in the shared budget table, not the database
+  powauth.record_load('verified')
+  token, _ = powauth.issue_token(request.remote_addr)
   token_expiry_minutes = app.config.get('POW_TOKEN_EXPIRY_MINUTES', 15)
-  expires_at = datetime.datetime.now() + datetime.timedelta(minutes=token_expiry_minutes)
-
-  # Store token in database with initial request tracking
-  PowToken.create(
-    token=token,
-    ip_address=request.remote_addr,
-    expires_at=expires_at,
-    request_count=0,  # Initialize counter
-    last_request_at=None  # Will be set on first use
-  )
 
   logger.info(f'PoW verification SUCCESS: token issued for IP {request.remote_addr} (expires in {token_expiry_minutes} minutes)')
 
@@ -3169,7 +3143,7 @@ def pow_verify():
   is_secure = request.is_secure or request.headers.get('X-Forwarded-Proto') == 'https'
 
   response.set_cookie(
-    'pow_token',
+    powauth.COOKIE_NAME,
     token,
     max_age=token_expiry_minutes * 60,  # minutes to seconds
     path='/',  # Important: works with subpath deployment
@@ -3185,49 +3159,36 @@ def pow_verify():
 @login_required
 @roles_required('admin')
 def pow_cleanup():
-  """Admin endpoint: Clean up expired challenges and tokens"""
+  """Admin endpoint: Clean up legacy challenge and token rows and expired token budgets"""
   now = datetime.datetime.now()
 
   expired_challenges = PowChallenge.delete().where(PowChallenge.expires_at < now).execute()
   expired_tokens = PowToken.delete().where(PowToken.expires_at < now).execute()
+  expired_budgets = powauth.budgets().compact()
 
-  logger.info(f'PoW cleanup: deleted {expired_challenges} challenges, {expired_tokens} tokens')
+  logger.info(f'PoW cleanup: deleted {expired_challenges} challenges, {expired_tokens} tokens, '
+              f'{expired_budgets} budgets')
 
   return jsonify({
     'deleted_challenges': expired_challenges,
-    'deleted_tokens': expired_tokens
+    'deleted_tokens': expired_tokens,
+    'compacted_budgets': expired_budgets
   })
 
 
 @app.route('/pow/debug')
 def pow_debug():
-  """Debug endpoint: Check PoW configuration and database status"""
+  """Debug endpoint: Check PoW configuration, token budgets and the replay filter"""
   try:
-    # Check if tables exist
-    tables_exist = False
-    challenge_count = 0
-    token_count = 0
-
-    try:
-      challenge_count = PowChallenge.select().count()
-      token_count = PowToken.select().count()
-      tables_exist = True
-    except Exception as e:
-      tables_exist = False
-
-    # Check cookie presence
-    has_cookie = request.cookies.get('pow_token') is not None
-    cookie_valid = False
-
-    if has_cookie:
-      try:
-        token = PowToken.get(
-          (PowToken.token == request.cookies.get('pow_token')) &
-          (PowToken.expires_at > datetime.datetime.now())
-        )
-        cookie_valid = True
-      except:
-        pass
+    # Check the cookie without spending a request of its budget
+    has_cookie = request.cookies.get(powauth.COOKIE_NAME) is not None
+    check = powauth.check_request(consume=False)
+    token_budget = {}
+    if check.valid:
+      token_budget = {
+        'requests_used': powauth.budgets().used(bytes.fromhex(check.token.token_id)),
+        'expires_in_sec': check.token.expires_at - int(datetime.datetime.now().timestamp())
+      }
 
     # Check HTTPS detection
     is_secure = request.is_secure or request.headers.get('X-Forwarded-Proto') == 'https'
@@ -3242,16 +3203,16 @@ def pow_debug():
         'token_max_requests': app.config.get('POW_TOKEN_MAX_REQUESTS', 50),
         'require_auth': app.config.get('REQUIRE_AUTH_FOR_PHOTOS', False)
       },
-      'database': {
-        'tables_exist': tables_exist,
-        'challenge_count': challenge_count,
-        'token_count': token_count
-      },
+      'difficulty': powauth.difficulty_state(),
+      'replay_filter': powauth.replay_filter().stats(),
+      'token_budgets': powauth.budgets().stats(),
       'request': {
         'path': request.path,
         'is_https': is_secure,
         'has_pow_cookie': has_cookie,
-        'cookie_valid': cookie_valid,
+        'cookie_valid': check.valid,
+        'cookie_status': check.reason,
+        'cookie_budget': token_budget,
         'is_authenticated': current_user.is_authenticated,
         'forwarded_proto': request.headers.get('X-Forwarded-Proto'),
         'remote_addr': request.remote_addr
@@ -0,0 +1,271 @@
+#! /usr/bin/env python
+
+"""streamed ZIP64 downloads of shared photosets and selections
+
+Downloading a shared photoset meant one redirect per photo through
+download_shared_photoset_photo. A ZipStream instead writes one archive on the
+fly: each original goes in as a stored (uncompressed, photos don't deflate)
+entry followed by a data descriptor with its CRC, and the central directory
+comes last, in ZIP64 form once the archive outgrows the 32-bit fields.
+Nothing is staged on disk and memory stays at a chunk or two per download.
+
+Originals are read from LOCALARCHIVEPATH when they are there and from S3
+otherwise, through a thread that fetches ahead of the response by at most
+ZIP_READAHEAD_CHUNKS chunks. When every original is local the archive's
+layout is known up front, so a download gets a Content-Length and can be
+resumed with a Range request; entries wholly before the range are not even
+read unless the range reaches the central directory (which needs their CRCs).
+"""
+
+import collections, datetime, hashlib, logging, os, queue, struct, threading, zlib
+
+from app import app
+import aws
+import util
+
+# set up logging
+logger = logging.getLogger('cigarbox')
+
+CHUNK_SIZE = 1 << 20
+
+# name is the path inside the archive; path is the local original (or None) and key its
+# S3 key; size is known for local files only; dos_time is (time, date) in MS-DOS format
+Entry = collections.namedtuple('Entry', 'name path key size dos_time')
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+ZIP64_END = struct.Struct('<IQHHIIQQQQ')
+ZIP64_LOCATOR = struct.Struct('<IIQI')
+END = struct.Struct('<IHHHHIIH')
+
+VERSION = 45  # 4.5: ZIP64
+FLAGS = 0x0808  # sizes and CRC in a data descriptor, UTF-8 names
+# fields at or over these limits hold 0xFFFF... and the value moves to a ZIP64 field
+LIMIT_32 = 0xFFFFFFFF
+LIMIT_16 = 0xFFFF
+
+
+def _field_32(value):
+  return value if value < LIMIT_32 else 0xFFFFFFFF
+
+
+def _field_16(value):
+  return value if value < LIMIT_16 else 0xFFFF
+
+
+def _dos_time(when):
+  """(time, date) of a datetime in MS-DOS format, clamped to what it can hold"""
+  if when is None or when.year < 1980:
+    when = datetime.datetime(1980, 1, 1)
+  elif when.year > 2107:
+    when = datetime.datetime(2107, 12, 31, 23, 59, 58)
+  return (when.hour << 11 | when.minute << 5 | when.second // 2,
+          (when.year - 1980) << 9 | when.month << 5 | when.day)
+
+
+def photo_entries(rows, folder):
+  """Entries for (id, sha1, filetype, datetaken) rows, named folder/<datetaken>_<id>.<filetype>"""
+  archive_path = app.config['LOCALARCHIVEPATH']
+  entries = []
+  for photo_id, sha1, filetype, datetaken in rows:
+    (sha1Path, filename) = util.getSha1Path(sha1)
+    key = f'{sha1Path}/{filename}.{filetype}'
+    path = f'{archive_path}/{key}'
+    try:
+      size = os.stat(path).st_size
+    except OSError:
+      path = size = None
+    prefix = datetaken.strftime('%Y-%m-%d_%H%M%S_') if datetaken else ''
+    entries.append(Entry(f'{folder}/{prefix}{photo_id}.{filetype}', path, key, size, _dos_time(datetaken)))
+  return entries
+
+
+def _local_header(entry, size):
+  name = entry.name.encode('utf-8')
+  # The sizes are in the descriptor; the extra only announces 8-byte ones there
+  extra = struct.pack('<HHQQ', 1, 16, 0, 0) if size >= LIMIT_32 else b''
+  return LOCAL_HEADER.pack(0x04034b50, VERSION, FLAGS, 0, entry.dos_time[0], entry.dos_time[1],
+                           0, 0, 0, len(name), len(extra)) + name + extra
+
+
+def _descriptor(crc, size):
+  if size >= LIMIT_32:
+    return struct.pack('<IIQQ', 0x08074b50, crc, size, size)
+  return struct.pack('<IIII', 0x08074b50, crc, size, size)
+
+
+def _central_header(entry, crc, size, offset):
+  name = entry.name.encode('utf-8')
+  zip64 = [value for value in (size, size, offset) if value >= LIMIT_32]
+  extra = struct.pack(f'<HH{len(zip64)}Q', 1, 8 * len(zip64), *zip64) if zip64 else b''
+  return CENTRAL_HEADER.pack(0x02014b50, 3 << 8 | VERSION, VERSION, FLAGS, 0,
+                             entry.dos_time[0], entry.dos_time[1], crc,
+                             _field_32(size), _field_32(size), len(name), len(extra), 0, 0, 0,
+                             0o100644 << 16, _field_32(offset)) + name + extra
+
+
+def _end(count, directory_offset, directory_size):
+  """End of central directory records (ZIP64 ones first when a field overflows)"""
+  records = b''
+  if count >= LIMIT_16 or directory_offset >= LIMIT_32 or directory_size >= LIMIT_32:
+    zip64_offset = directory_offset + directory_size
+    records = (ZIP64_END.pack(0x06064b50, ZIP64_END.size - 12, 3 << 8 | VERSION, VERSION, 0, 0,
+                              count, count, directory_size, directory_offset) +
+               ZIP64_LOCATOR.pack(0x07064b50, 0, zip64_offset, 1))
+  return records + END.pack(0x06054b50, 0, 0, _field_16(count), _field_16(count),
+                            _field_32(directory_size), _field_32(directory_offset), 0)
+
+
+def _read_file(path):
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+      yield chunk
+
+
+class ReadAhead(object):
+  """Fetches S3 objects in order on a background thread, at most depth chunks ahead
+
+  The consumer calls next_object() once per key, in the same order, and
+  drains its chunks before the next; close() stops the thread early.
+  """
+  def __init__(self, keys, depth=None):
+    self.queue = queue.Queue(depth or app.config.get('ZIP_READAHEAD_CHUNKS', 8))
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self._run, args=(list(keys),), daemon=True)
+    self.thread.start()
+
+  def _put(self, item):
+    """Queue item unless stopped while waiting for room; False once stopped"""
+    while not self.stopped.is_set():
+      try:
+        self.queue.put(item, timeout=1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def _run(self, keys):
+    try:
+      s3 = aws.get_s3_client(app.config)
+      for key in keys:
+        response = s3.get_object(Bucket=app.config['S3_BUCKET_NAME'], Key=key)
+        body = response['Body']
+        try:
+          if not self._put(response['ContentLength']):
+            return
+          for chunk in iter(lambda: body.read(CHUNK_SIZE), b''):
+            if not self._put(chunk):
+              return
+        finally:
+          body.close()
+        if not self._put(None):
+          return
+    except Exception as e:
+      self._put(e)
+
+  def _get(self):
+    item = self.queue.get()
+    if isinstance(item, Exception):
+      raise item
+    return item
+
+  def next_object(self):
+    """(size, chunk iterator) of the next object"""
+    size = self._get()
+    def chunks():
+      while True:
+        chunk = self._get()
+        if chunk is None:
+          return
+        yield chunk
+    return size, chunks()
+
+  def close(self):
+    self.stopped.set()
+
+
+class ZipStream(object):
+  """A ZIP64 archive of stored entries, produced as a stream of chunks"""
+
+  def __init__(self, entries):
+    self.entries = entries
+
+  def size(self):
+    """The archive's length in bytes, or None if an entry's size is only known from S3"""
+    layout = self._layout()
+    return layout[1] if layout else None
+
+  def etag(self):
+    """A validator for Range resumes: changes with any entry's name, source or size"""
+    digest = hashlib.sha1()
+    for entry in self.entries:
+      digest.update(f'{entry.name}\0{entry.key}\0{entry.size}\0{entry.dos_time}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+  def _layout(self):
+    """([(local header offset, end of descriptor)], total length), or None with S3 entries"""
+    if any(entry.size is None for entry in self.entries):
+      return None
+    spans = []
+    offset = 0
+    directory_size = 0
+    for entry in self.entries:
+      end = offset + len(_local_header(entry, entry.size)) + entry.size + len(_descriptor(0, entry.size))
+      spans.append((offset, end))
+      directory_size += len(_central_header(entry, 0, entry.size, offset))
+      offset = end
+    return spans, offset + directory_size + len(_end(len(self.entries), offset, directory_size))
+
+  def chunks(self, start=0, stop=None):
+    """The archive's bytes from start up to (not including) stop"""
+    layout = self._layout() if start or stop is not None else None
+    directory_offset = layout[0][-1][1] if layout and layout[0] else 0
+    # Entries ending before the range needn't be read unless the directory (their CRCs) is wanted
+    can_skip = layout is not None and stop is not None and stop <= directory_offset
+
+    remote = [entry.key for entry in self.entries if entry.path is None]
+    readahead = ReadAhead(remote) if remote else None
+    position = 0
+
+    def emit(data):
+      nonlocal position
+      begin = position
+      position += len(data)
+      if position > start and (stop is None or begin < stop):
+        yield data[max(start - begin, 0):len(data) if stop is None else stop - begin]
+
+    try:
+      directory = []
+      for index, entry in enumerate(self.entries):
+        if stop is not None and position >= stop:
+          return
+        if can_skip and layout[0][index][1] <= start:
+          position = layout[0][index][1]
+          continue
+
+        if entry.path is not None:
+          size, data = entry.size, _read_file(entry.path)
+        else:
+          size, data = readahead.next_object()
+        offset = position
+        yield from emit(_local_header(entry, size))
+        crc = 0
+        written = 0
+        for chunk in data:
+          crc = zlib.crc32(chunk, crc)
+          written += len(chunk)
+          yield from emit(chunk)
+          if stop is not None and position >= stop:
+            return
+        if written != size:
+          raise IOError(f'{entry.name}: read {written} bytes, expected {size}')
+        yield from emit(_descriptor(crc, size))
+        directory.append(_central_header(entry, crc, size, offset))
+
+      directory_offset = position
+      for header in directory:
+        yield from emit(header)
+      yield from emit(_end(len(directory), directory_offset, position - directory_offset))
+    finally:
+      if readahead:
+        readahead.close()